@@ -0,0 +1,206 @@
+"""
+admission.py - Admission control, load shedding and per-sender flood throttling
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("whatsapp_bot")
+
+# Degradation ladder, from best to worst service
+LEVEL_FULL = 'full'            # LLM slots available
+LEVEL_QUEUED = 'queued'        # LLM work waits in the bounded queue
+LEVEL_LOCAL_ONLY = 'local_only'  # Only menu/cached answers; everything else gets the busy reply
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity` stored."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self, tokens=1):
+        """Take tokens if available. Returns True if the caller may proceed."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class AdmissionController:
+    """
+    Gatekeeper in front of the reply pipeline.
+
+    - Per-sender token buckets drop floods from a single sender.
+    - A global cap limits concurrent LLM calls; extra LLM work waits in a
+      bounded queue (deferral) and is shed once the queue is full or the wait
+      times out, so the caller can fall back to a local answer.
+
+    Menu and cached answers never take an LLM slot, so under saturation the
+    bot keeps serving them and only free-text questions get the busy reply.
+
+    With a shared bucket table the sender limits hold across every worker on
+    the host instead of per worker; the LLM cap stays per worker (it sizes
+    the worker's own thread use).
+    """
+
+    def __init__(self, sender_rate_per_min=12, sender_burst=6, max_in_flight=8,
+                 max_queue=16, queue_timeout=10.0, max_tracked_senders=10000,
+                 shared_buckets=None, shared_counters=None):
+        """
+        Initialize the admission controller.
+
+        Args:
+            sender_rate_per_min: Sustained messages per minute allowed per sender
+            sender_burst: Messages a sender may send back to back
+            max_in_flight: Maximum concurrent LLM calls
+            max_queue: Maximum LLM requests waiting for a slot
+            queue_timeout: Seconds a queued request waits before being shed
+            max_tracked_senders: Token buckets kept (least recently used are evicted)
+            shared_buckets: Optional SharedTable (2 fields) holding the senders'
+                token buckets for every worker on the host
+            shared_counters: Optional SharedCounters for host-wide admitted/throttled totals
+        """
+        self.sender_rate = sender_rate_per_min / 60.0
+        self.sender_burst = sender_burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_tracked_senders = max_tracked_senders
+        self.shared_buckets = shared_buckets
+        self.shared_counters = shared_counters
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        # Tickets of the callers waiting for a slot, oldest first
+        self._queue = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {
+            'admitted': 0,
+            'throttled': 0,
+            'deferred': 0,
+            'shed': 0,
+        }
+
+    def allow_sender(self, sender):
+        """
+        Charge one message to the sender's token bucket.
+
+        Returns:
+            True if the message should be processed, False if the sender is flooding
+        """
+        if self.shared_buckets is not None:
+            allowed = self.shared_buckets.update(sender, self._consume_shared)
+        else:
+            with self._lock:
+                bucket = self._buckets.get(sender)
+                if bucket is None:
+                    bucket = self._buckets[sender] = TokenBucket(self.sender_rate, self.sender_burst)
+                    if len(self._buckets) > self.max_tracked_senders:
+                        self._buckets.popitem(last=False)
+                else:
+                    self._buckets.move_to_end(sender)
+                allowed = bucket.consume()
+
+        outcome = 'admitted' if allowed else 'throttled'
+        with self._lock:
+            self.stats[outcome] += 1
+        if self.shared_counters is not None:
+            self.shared_counters.inc(outcome)
+        if not allowed:
+            logger.warning(f"Throttling {sender}: message rate limit exceeded")
+        return allowed
+
+    def _consume_shared(self, values):
+        # Same refill as TokenBucket, on wall-clock time since the bucket is shared between processes
+        now = time.time()
+        if values is None:
+            tokens = self.sender_burst
+        else:
+            tokens = min(self.sender_burst, values[0] + max(0.0, now - values[1]) * self.sender_rate)
+        if tokens >= 1:
+            return (tokens - 1, now), True
+        return (tokens, now), False
+
+    def level(self):
+        """Return the current degradation level."""
+        with self._lock:
+            if self.in_flight < self.max_in_flight:
+                return LEVEL_FULL
+            if self.waiting < self.max_queue:
+                return LEVEL_QUEUED
+            return LEVEL_LOCAL_ONLY
+
+    def _wait_for_slot(self):
+        """Take a slot, queueing behind earlier callers; slots go to waiters in arrival order."""
+        with self._slot_freed:
+            # A newcomer only skips the queue when nobody is waiting in it
+            if not self._queue and self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                return False
+            ticket = object()
+            self._queue.append(ticket)
+            self.waiting += 1
+            self.stats['deferred'] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._queue[0] is not ticket or self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._slot_freed.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self._queue.remove(ticket)
+                self.waiting -= 1
+                # The next ticket may now be at the head (or a slot is still free for it)
+                self._slot_freed.notify_all()
+
+    def record_shed(self):
+        """Count a request shed for lack of capacity (here or by a full lane queue upstream)."""
+        with self._lock:
+            self.stats['shed'] += 1
+        logger.warning("LLM capacity saturated; shedding request")
+
+    @contextmanager
+    def llm_slot(self):
+        """
+        Reserve one of the global LLM slots, waiting in the bounded queue if needed.
+
+        Yields:
+            True if a slot was granted, False if the request was shed
+        """
+        granted = self._wait_for_slot()
+        if not granted:
+            self.record_shed()
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            with self._slot_freed:
+                self.in_flight -= 1
+                self._slot_freed.notify_all()
+
+    def snapshot(self):
+        """Return counters and current load for status endpoints."""
+        level = self.level()
+        with self._lock:
+            snapshot = dict(self.stats, in_flight=self.in_flight, waiting=self.waiting, level=level)
+        if self.shared_counters is not None:
+            snapshot['host'] = self.shared_counters.values(('admitted', 'throttled'))
+        return snapshot
@@ -0,0 +1,196 @@
+"""
+affinity.py - Consistent-hash sender affinity across bot nodes
+
+With several bot nodes behind a load balancer, every sender is owned by one
+node: the node's per-user caches, burst coalescing, ordering and outbox
+then see all of that customer's messages. A node that receives a webhook
+for a sender it doesn't own forwards the event to the owner over HTTP; the
+forwarded request carries a hop header so it is never forwarded again.
+
+Owners are picked on a hash ring with virtual nodes, so adding or removing
+a node only moves the senders that node gains or loses. Membership comes
+from a static list or a file (one node URL per line) that is re-read when
+it changes; a node that can't be reached is ejected from the ring for a
+while, and its senders are handled by the next node on the ring meanwhile.
+"""
+
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from lazy import LazyModule, LazyProxy
+
+logger = logging.getLogger("whatsapp_bot")
+
+requests = LazyModule('requests')
+
+HOP_HEADER = 'X-Affinity-Hop'
+
+
+def _position(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def normalize_node(url):
+    return url.strip().rstrip('/')
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes through virtual nodes."""
+
+    def __init__(self, nodes, vnodes=64):
+        """
+        Args:
+            nodes: Node names (here, base URLs)
+            vnodes: Points each node gets on the ring; more points spread keys more evenly
+        """
+        self.nodes = tuple(sorted(set(nodes)))
+        points = sorted((_position(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._positions = [position for position, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        """The node owning key (None for an empty ring)."""
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._positions, _position(key)) % len(self._positions)
+        return self._owners[index]
+
+
+class SenderAffinity:
+    """Ring membership, ejection of unreachable nodes and forwarding to owners."""
+
+    def __init__(self, self_url, nodes=(), nodes_file=None, vnodes=64, forward_timeout=30.0,
+                 eject_seconds=30.0, check_interval=5.0):
+        """
+        Args:
+            self_url: This node's base URL, as it appears in the membership
+            nodes: Static list of node base URLs
+            nodes_file: Optional file listing node URLs (one per line), re-read when it changes
+            vnodes: Virtual nodes per node
+            forward_timeout: Seconds to wait for the owner to answer a forwarded webhook
+            eject_seconds: How long an unreachable node stays out of the ring
+            check_interval: Minimum seconds between checks of nodes_file
+        """
+        self.self_url = normalize_node(self_url)
+        self.static_nodes = [normalize_node(node) for node in nodes if node.strip()]
+        self.nodes_file = nodes_file
+        self.vnodes = vnodes
+        self.forward_timeout = forward_timeout
+        self.eject_seconds = eject_seconds
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._members = list(self.static_nodes)
+        self._file_signature = None
+        self._checked_at = 0.0
+        self._ejected = {}
+        self._ring = None
+        self._session = LazyProxy(lambda: requests.Session(), 'affinity_session')
+        self.stats = {'local': 0, 'forwarded': 0, 'forward_timeouts': 0, 'fallbacks': 0, 'rebalances': 0}
+        self.refresh(force=True)
+        if self.self_url not in self._members:
+            logger.warning(f"This node ({self.self_url}) is not in the affinity membership; it forwards every sender")
+
+    def _read_nodes_file(self):
+        try:
+            stat_result = os.stat(self.nodes_file)
+        except OSError as e:
+            logger.error(f"Cannot read affinity nodes file {self.nodes_file}: {e}")
+            return None
+        signature = (stat_result.st_mtime_ns, stat_result.st_size)
+        if signature == self._file_signature:
+            return None
+        with open(self.nodes_file, 'r', encoding='utf-8') as f:
+            nodes = [normalize_node(line) for line in f if line.strip() and not line.lstrip().startswith('#')]
+        self._file_signature = signature
+        return nodes
+
+    def refresh(self, force=False):
+        """Re-read the nodes file if it changed, return ejected nodes whose time is up and rebuild the ring."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            if self.nodes_file:
+                nodes = self._read_nodes_file()
+                if nodes is not None:
+                    self._members = sorted(set(self.static_nodes + nodes))
+            for node, until in list(self._ejected.items()):
+                if until <= now or node not in self._members:
+                    del self._ejected[node]
+            self._rebuild()
+
+    def _rebuild(self):
+        active = [node for node in self._members if node not in self._ejected] or list(self._members)
+        if self._ring is not None and self._ring.nodes == tuple(sorted(set(active))):
+            return
+        if self._ring is not None:
+            self.stats['rebalances'] += 1
+            logger.info(f"Affinity ring rebalanced: {len(active)} active node(s) {active}")
+        self._ring = HashRing(active, self.vnodes)
+
+    def owner(self, sender):
+        """The node URL owning sender (this node when there is no membership)."""
+        self.refresh()
+        with self._lock:
+            return self._ring.owner(sender) or self.self_url
+
+    def is_local(self, sender):
+        return self.owner(sender) == self.self_url
+
+    def eject(self, node):
+        """Take an unreachable node out of the ring for eject_seconds."""
+        with self._lock:
+            self._ejected[node] = time.monotonic() + self.eject_seconds
+            self._rebuild()
+        logger.warning(f"Affinity: ejected unreachable node {node} for {self.eject_seconds:.0f}s")
+
+    def record_local(self):
+        with self._lock:
+            self.stats['local'] += 1
+
+    def forward(self, owner, body, content_type='application/json'):
+        """
+        Post a webhook body to its owner's /webhook.
+
+        Returns:
+            (content, status, content_type) of the owner's answer, a 200 if the
+            owner accepted the request but is still processing it, or None if the
+            owner could not be reached or is draining (it is ejected and the
+            caller handles the event itself)
+        """
+        try:
+            response = self._session.post(f"{owner}/webhook", data=body,
+                                          headers={'Content-Type': content_type, HOP_HEADER: self.self_url},
+                                          timeout=(2.0, self.forward_timeout))
+        except requests.exceptions.ReadTimeout:
+            # The owner has the event and is still answering; handling it here too would reply twice
+            with self._lock:
+                self.stats['forward_timeouts'] += 1
+            logger.warning(f"Affinity: {owner} is still processing a forwarded webhook after {self.forward_timeout:.0f}s")
+            return '{"status": "success", "message": "Forwarded to owner"}', 200, 'application/json'
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                self.stats['fallbacks'] += 1
+            logger.error(f"Affinity: cannot forward webhook to {owner}: {e}")
+            self.eject(owner)
+            return None
+        if response.status_code == 503:
+            # Draining for a restart; its senders move to the next node on the ring meanwhile
+            with self._lock:
+                self.stats['fallbacks'] += 1
+            self.eject(owner)
+            return None
+        with self._lock:
+            self.stats['forwarded'] += 1
+        return response.content, response.status_code, response.headers.get('Content-Type', content_type)
+
+    def snapshot(self):
+        """Membership and forwarding counters, for /status."""
+        with self._lock:
+            return dict(self.stats, self=self.self_url, members=list(self._members),
+                        active=list(self._ring.nodes), ejected=sorted(self._ejected))
@@ -0,0 +1,133 @@
+"""
+bench_hot_paths.py - Microbenchmarks for the bot's per-message hot paths
+
+Covers greeting/menu detection, few-shot history building, conversation
+history load (from disk and from the cache)/save/add_exchange at several
+history sizes and a full
+/webhook request (menu reply and Gemini reply) with WaSender and Gemini
+mocked out and the pacing delay between chunks skipped.
+
+Usage:
+    python benchmarks/bench_hot_paths.py          # compare with baseline
+    python benchmarks/bench_hot_paths.py --save   # record a new baseline
+
+run_benchmarks.py runs this suite with the others and fails on regressions.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from unittest.mock import MagicMock, patch
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep script.py quiet and fast while it is benchmarked
+os.environ.setdefault('LOG_FILE', '')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('WASENDER_API_TOKEN', 'benchmark')
+os.environ.setdefault('OUTBOX_DIR', tempfile.mkdtemp(prefix='bench_outbox_'))
+
+import script
+from persona_manager import compile_keyword_matcher
+from run_benchmarks import load_baseline, save_baseline
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'hot_paths.json')
+
+HISTORY_SIZES = (10, 100, 1000)
+MESSAGES = ("oi", "Bom dia! Tudo bem?", "3", "Quanto custa para fazer a declaração do imposto de renda?",
+            "queria falar com um consultor sobre a abertura da minha empresa")
+REPLY = "Olá! Aqui no escritório cuidamos de declarações e abertura de empresas.\nPosso ajudar em algo mais?"
+
+
+def best_time(fn, repeat=5):
+    """Return the best per-call time (seconds) of fn()."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def webhook_payload(text):
+    return json.dumps({
+        'event': 'messages.upsert',
+        'data': {'messages': {
+            'key': {'remoteJid': '5581999990001@s.whatsapp.net', 'fromMe': False, 'id': 'BENCH'},
+            'message': {'conversation': text},
+        }},
+    })
+
+
+def history(size):
+    return [{'role': 'user' if i % 2 == 0 else 'model', 'parts': [REPLY]} for i in range(size)]
+
+
+def run():
+    """Run every case and return a dict of name -> seconds per call."""
+    results = {}
+    menu_config = script.persona_manager.current.menu_config
+    keywords = menu_config.get('greeting_keywords', [])
+    matcher = compile_keyword_matcher(keywords)
+    options = menu_config.get('menu_options', {})
+
+    results['is_greeting_keywords'] = best_time(lambda: [script.is_greeting(m, keywords) for m in MESSAGES])
+    results['is_greeting_matcher'] = best_time(lambda: [script.is_greeting(m, keywords, matcher) for m in MESSAGES])
+    results['is_menu_option'] = best_time(lambda: [script.is_menu_option(m, options) for m in MESSAGES])
+
+    examples = [{'input': message, 'output': REPLY} for message in MESSAGES] * 10
+    results['build_few_shot_history_50'] = best_time(lambda: script.build_few_shot_history(examples))
+
+    storage_dir = tempfile.mkdtemp(prefix='bench_conversations_')
+    try:
+        manager = script.ConversationManager(storage_dir, max_history=max(HISTORY_SIZES))
+        for size in HISTORY_SIZES:
+            user_id = f"user_{size}"
+            manager.save(user_id, history(size))
+            results[f'history_load_{size}'] = best_time(lambda: manager.load(user_id))
+            cached = script.ConversationManager(storage_dir, max_history=max(HISTORY_SIZES), cache_size=1)
+            results[f'history_load_cached_{size}'] = best_time(lambda: cached.load(user_id))
+            messages = history(size)
+            results[f'history_save_{size}'] = best_time(lambda: manager.save(user_id, messages))
+            # load() trims back to `size` messages, so the history stays the same size between calls
+            trimming = script.ConversationManager(storage_dir, max_history=size // 2)
+            results[f'add_exchange_{size}'] = best_time(lambda: trimming.add_exchange(user_id, MESSAGES[3], REPLY))
+
+        client = script.app.test_client()
+        with patch('script.wasender_client', MagicMock()), \
+             patch('script.get_gemini_response', return_value=REPLY), \
+             patch('script.time.sleep'), \
+             patch('script.conversation_manager', script.ConversationManager(storage_dir, max_history=20)):
+            for name, text in (('webhook_menu', '1'), ('webhook_gemini', MESSAGES[3])):
+                body = webhook_payload(text)
+                results[name] = best_time(
+                    lambda: client.post('/webhook', data=body, content_type='application/json'))
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's hot paths")
+    parser.add_argument("--save", action="store_true", help="Save results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline(BASELINE_FILE)
+    results = run()
+
+    print(f"{'case':<28} {'current':>14} {'baseline':>14} {'speedup':>8}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        base_text = f"{base * 1e6:11.1f} us" if base else f"{'-':>14}"
+        speedup = f"{base / seconds:7.2f}x" if base else f"{'-':>8}"
+        print(f"{name:<28} {seconds * 1e6:11.1f} us {base_text} {speedup}")
+
+    if args.save:
+        save_baseline(BASELINE_FILE, results)
+        print(f"\nBaseline saved to {BASELINE_FILE}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+bench_log_analytics.py - log_analytics.py versus a naive readline scan
+
+Usage:
+    python benchmarks/bench_log_analytics.py                 # 64 MB synthetic log
+    python benchmarks/bench_log_analytics.py --size-mb 512 --workers 8
+
+The synthetic log repeats whatsapp_bot.log until it reaches the requested
+size. Both scanners must produce the same summary; the benchmark fails if
+they don't.
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_analytics
+from log_analytics import analyze, summarize, merge_results, DIGITS_RE, CHUNK_SENT, CHUNK_FAILED, _timestamp
+
+SOURCE_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'whatsapp_bot.log')
+
+LINE_RE = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d):\d\d:\d\d,\d{3} - ([A-Z]+) - ([^\n]*?) - ([^\n]*)')
+GROUP_ID_RE = re.compile(rb'\d{15,25}@g\.us')
+GEMINI_REPLY_RE = re.compile(rb'^(?:Gemini response received in (\d+) ms|Sending \d+ message chunks)')
+
+
+def analyze_naive(path):
+    """Line-by-line scan in the style of the older helper scripts."""
+    per_hour = {}
+    levels = Counter()
+    error_messages = Counter()
+    group_ids = set()
+    latencies = []
+    chunks_sent = chunks_failed = 0
+    pending = None
+
+    with open(path, 'rb') as f:
+        for line in f:
+            chunks_sent += line.count(CHUNK_SENT)
+            chunks_failed += line.count(CHUNK_FAILED)
+            for group_id in GROUP_ID_RE.findall(line):
+                group_ids.add(group_id.decode('ascii'))
+
+            match = LINE_RE.match(line)
+            if not match:
+                continue
+            hour, level, _, message = match.groups()
+            hour = hour.decode('ascii')
+            levels[level.decode('ascii')] += 1
+            bucket = per_hour.setdefault(hour, Counter())
+            bucket['records'] += 1
+            if level in (b'ERROR', b'CRITICAL'):
+                bucket['errors'] += 1
+                error_messages[DIGITS_RE.sub('#', message[:80].decode('utf-8', 'replace'))] += 1
+            elif level == b'WARNING':
+                bucket['warnings'] += 1
+            if message.startswith(b'=== WEBHOOK CALLED ==='):
+                bucket['webhooks'] += 1
+
+            if message.startswith(b'Sending prompt to Gemini'):
+                pending = line[:23]
+                continue
+            reply = GEMINI_REPLY_RE.match(message)
+            if reply:
+                if reply.group(1):
+                    latencies.append(float(reply.group(1)))
+                    pending = None
+                elif pending is not None:
+                    latencies.append((_timestamp(line[:23]) - _timestamp(pending)) * 1000)
+                    pending = None
+
+    partial = {
+        'per_hour': per_hour,
+        'levels': levels,
+        'chunks_sent': chunks_sent,
+        'chunks_failed': chunks_failed,
+        'group_ids': group_ids,
+        'error_messages': error_messages,
+        'gemini_latencies_ms': latencies,
+        'leading': None,
+        'trailing_prompt': None,
+        'saw_prompt': False,
+    }
+    return merge_results([partial])
+
+
+def build_log(size_mb):
+    """Write a synthetic log of about size_mb megabytes and return its path."""
+    with open(SOURCE_LOG, 'rb') as f:
+        sample = f.read()
+    if not sample.endswith(b'\n'):
+        sample += b'\n'
+    target = size_mb * 1024 * 1024
+    fd, path = tempfile.mkstemp(prefix='bench_log_', suffix='.log')
+    with os.fdopen(fd, 'wb') as f:
+        written = 0
+        while written < target:
+            f.write(sample)
+            written += len(sample)
+    return path
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark log_analytics against a readline scan")
+    parser.add_argument("--size-mb", type=int, default=64, help="Synthetic log size in MB")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    path = build_log(args.size_mb)
+    try:
+        # Warm the page cache so both scanners read from memory
+        timed(analyze, path, workers=1)
+
+        naive_time, naive = timed(analyze_naive, path)
+        single_time, single = timed(analyze, path, workers=1)
+        workers = args.workers or os.cpu_count() or 1
+        parallel_time, parallel = timed(analyze, path, workers=workers)
+
+        expected = summarize(naive)
+        for name, result in (('single', single), ('parallel', parallel)):
+            if summarize(result) != expected:
+                print(f"❌ {name} scan disagrees with the naive scan")
+                return 1
+
+        size = os.path.getsize(path) / (1024 * 1024)
+        print(f"Log size: {size:.0f} MB, {expected['records']} records "
+              f"(min chunk {log_analytics.MIN_CHUNK_SIZE // (1024 * 1024)} MB)")
+        print(f"{'scanner':<22} {'seconds':>8} {'MB/s':>8} {'speedup':>8}")
+        for name, seconds in (('naive readline', naive_time),
+                              ('mmap, 1 worker', single_time),
+                              (f'mmap, {workers} workers', parallel_time)):
+            print(f"{name:<22} {seconds:8.2f} {size / seconds:8.0f} {naive_time / seconds:7.2f}x")
+    finally:
+        os.unlink(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+bench_message_splitter.py - Microbenchmarks for split_message
+
+Usage:
+    python benchmarks/bench_message_splitter.py          # compare with baseline
+    python benchmarks/bench_message_splitter.py --save   # record a new baseline
+
+The committed baseline was recorded with the current single-pass splitter,
+so run_benchmarks.py (which runs this suite too) gates on regressions from it.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+# Add the project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_splitter import split_message
+from run_benchmarks import load_baseline, save_baseline
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'message_splitter.json')
+
+TYPICAL_REPLY = (
+    "Olá! Que bom falar com você 😊\\n"
+    "Para fazer o orçamento das suas lentes, preciso de algumas informações: "
+    "qual é o grau da sua receita, se você já tem armação ou quer escolher uma nova na loja, "
+    "e se prefere lentes com antirreflexo, filtro de luz azul ou fotossensíveis.\\n\\n"
+    "Nosso horário é de segunda a sexta das 9h às 18h e sábado das 9h às 12h.\\n"
+    "Posso pedir para um consultor entrar em contato com você para agendar um exame de vista?"
+)
+
+CASES = {
+    'short': "Olá! Como posso ajudar?",
+    'typical': TYPICAL_REPLY,
+    'long_paragraphs': "\n\n".join([TYPICAL_REPLY.replace('\\n', ' ')] * 20),
+    'single_word_100kb': "x" * 100_000,
+    'blank_lines_5000': "start" + "\n" * 5000 + "end",
+    'blank_lines_backslash': "start" + "\n" * 5000 + "\\",
+    'many_words_100kb': ("palavra " * 12_500).strip(),
+}
+
+
+def bench_case(text, repeat=5, min_time=0.2):
+    """Return the best per-call time (seconds) for split_message(text)."""
+    timer = timeit.Timer(lambda: split_message(text))
+    number, _ = timer.autorange()
+    # autorange targets ~0.2s; scale if the caller wants longer runs
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(cases=CASES):
+    """Run every case and return a dict of name -> seconds per call."""
+    return {name: bench_case(text) for name, text in cases.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark split_message")
+    parser.add_argument("--save", action="store_true", help="Save results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline(BASELINE_FILE)
+    results = run()
+
+    print(f"{'case':<20} {'current':>14} {'baseline':>14} {'speedup':>8}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        base_text = f"{base * 1e6:11.1f} us" if base else f"{'-':>14}"
+        speedup = f"{base / seconds:7.2f}x" if base else f"{'-':>8}"
+        print(f"{name:<20} {seconds * 1e6:11.1f} us {base_text} {speedup}")
+
+    if args.save:
+        save_baseline(BASELINE_FILE, results)
+        print(f"\nBaseline saved to {BASELINE_FILE}")
+
+
+if __name__ == '__main__':
+    main()
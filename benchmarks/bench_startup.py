@@ -0,0 +1,113 @@
+"""
+bench_startup.py - Import time and time-to-first-request of script.py
+
+Each case runs in a fresh interpreter (best of several runs):
+- import_script: `import script`
+- first_health: import, create the app and answer GET /health
+- first_webhook: import, create the app and answer a menu-option webhook,
+  with WaSender served by the loadtest stand-in in this process and the
+  pacing delay between chunks skipped
+
+Usage:
+    python benchmarks/bench_startup.py          # compare with baseline
+    python benchmarks/bench_startup.py --save   # record a new baseline
+
+The committed baseline was recorded before script.py imported its SDKs lazily.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Add the project root directory to Python path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from loadtest.fake_wasender import FakeWaSender
+from loadtest.harness import ServerThread
+from run_benchmarks import load_baseline, save_baseline
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'startup.json')
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import script
+imported = time.perf_counter()
+app = script.create_app() if hasattr(script, 'create_app') else script.app
+client = app.test_client()
+stage = sys.argv[1]
+if stage == 'first_health':
+    assert client.get('/health').status_code == 200
+elif stage == 'first_webhook':
+    script.time.sleep = lambda seconds: None
+    payload = {'event': 'messages.upsert', 'data': {'messages': {
+        'key': {'remoteJid': '5581999990001@s.whatsapp.net', 'fromMe': False, 'id': 'STARTUP'},
+        'message': {'conversation': '1'}}}}
+    assert client.post('/webhook', json=payload).status_code == 200
+finished = time.perf_counter()
+print(json.dumps({'import_script': imported - started, stage: finished - started}))
+"""
+
+RUNS = 5
+
+
+def run_child(stage, env):
+    output = subprocess.run([sys.executable, '-c', CHILD, stage], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run():
+    """Run every case and return a dict of name -> seconds (best of RUNS fresh processes)."""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    wasender = FakeWaSender()
+    server = ServerThread(wasender.app).start()
+    conversations_dir = os.path.join(ROOT, 'conversations')
+    env = dict(os.environ, LOG_FILE='', LOG_LEVEL='ERROR', WASENDER_API_TOKEN='benchmark',
+               GEMINI_API_KEY='benchmark', WASENDER_BASE_URL=server.url, PERSONA_RELOAD_INTERVAL='0',
+               CONVERSATIONS_DIR=os.environ.get('BENCH_CONVERSATIONS_DIR', conversations_dir),
+               OUTBOX_DIR=tempfile.mkdtemp(prefix='bench_outbox_'))
+    results = {}
+    try:
+        for stage in ('first_health', 'first_webhook'):
+            for _ in range(RUNS):
+                for name, seconds in run_child(stage, env).items():
+                    results[name] = min(seconds, results.get(name, seconds))
+    finally:
+        server.stop()
+        shutil.rmtree(env['OUTBOX_DIR'], ignore_errors=True)
+        # The webhook case stores a conversation; don't leave it behind
+        leftover = os.path.join(conversations_dir, '5581999990001_s_whatsapp_net.json')
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return {name: results[name] for name in ('import_script', 'first_health', 'first_webhook')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark script.py startup")
+    parser.add_argument("--save", action="store_true", help="Save results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline(BASELINE_FILE)
+    results = run()
+
+    print(f"{'case':<16} {'current':>10} {'baseline':>10} {'speedup':>8}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        base_text = f"{base * 1000:7.0f} ms" if base else f"{'-':>10}"
+        speedup = f"{base / seconds:7.2f}x" if base else f"{'-':>8}"
+        print(f"{name:<16} {seconds * 1000:7.0f} ms {base_text} {speedup}")
+
+    if args.save:
+        save_baseline(BASELINE_FILE, results)
+        print(f"\nBaseline saved to {BASELINE_FILE}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+burst_coalescer.py - Per-sender debounce that merges rapid consecutive messages
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("whatsapp_bot")
+
+
+class _Burst:
+    """Messages buffered for one sender while their debounce window is open."""
+
+    def __init__(self, context):
+        self.context = context
+        self.messages = []
+        self.first_at = time.monotonic()
+        self.timer = None
+
+
+class BurstCoalescer:
+    """
+    Collects messages from the same sender that arrive close together and hands
+    them to a processing callback as a single burst.
+
+    Every new message resets the sender's window, and the window grows with
+    the number of messages already buffered (people who type in bursts keep
+    typing), capped by max_wait so a continuous typer still gets an answer.
+    Bursts from the same sender are processed one at a time and in order.
+    """
+
+    def __init__(self, process, window_ms=1500, max_wait_ms=6000, growth=0.5):
+        """
+        Initialize the coalescer.
+
+        Args:
+            process: Callable(sender, messages, context) run for each burst
+            window_ms: Base debounce window in milliseconds
+            max_wait_ms: Maximum time a message can wait since the burst started
+            growth: Fraction of window_ms added per extra buffered message
+        """
+        self.process = process
+        self.window = window_ms / 1000.0
+        self.max_wait = max_wait_ms / 1000.0
+        self.growth = growth
+        self._bursts = {}
+        # sender -> [lock, threads using it]; dropped when no burst of the sender is processing
+        self._sender_locks = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'messages_received': 0,
+            'bursts_processed': 0,
+            'messages_coalesced': 0,
+        }
+
+    def _delay_for(self, burst):
+        extra = self.growth * (len(burst.messages) - 1)
+        delay = self.window * (1 + extra)
+        remaining = self.max_wait - (time.monotonic() - burst.first_at)
+        return max(0.0, min(delay, remaining))
+
+    def submit(self, sender, message, context=None):
+        """
+        Buffer a message and (re)start the sender's debounce window.
+
+        Args:
+            sender: Sender identifier
+            message: Message text
+            context: Data passed through to the process callback; the value
+                from the first message of the burst is kept
+        """
+        with self._lock:
+            burst = self._bursts.get(sender)
+            if burst is None:
+                burst = self._bursts[sender] = _Burst(context)
+            burst.messages.append(message)
+            self.stats['messages_received'] += 1
+
+            if burst.timer:
+                burst.timer.cancel()
+            burst.timer = threading.Timer(self._delay_for(burst), self._flush, args=(sender, burst))
+            burst.timer.daemon = True
+            burst.timer.start()
+
+    def _take(self, sender, burst):
+        """Remove a burst from the buffer (caller holds self._lock)."""
+        del self._bursts[sender]
+        self.stats['bursts_processed'] += 1
+        self.stats['messages_coalesced'] += len(burst.messages) - 1
+        if len(burst.messages) > 1:
+            logger.info(f"Coalesced {len(burst.messages)} messages from {sender} into one turn")
+
+    def _flush(self, sender, burst):
+        with self._lock:
+            # A stale timer (or take_all) may have taken this burst already
+            if self._bursts.get(sender) is not burst:
+                return
+            self._take(sender, burst)
+        self.process_now(sender, burst.messages, burst.context)
+
+    def process_now(self, sender, messages, context, **kwargs):
+        """
+        Run the process callback for a burst, after any burst of the same sender still being processed.
+
+        Args:
+            kwargs: Extra keyword arguments passed to the process callback
+        """
+        with self._lock:
+            slot = self._sender_locks.get(sender)
+            if slot is None:
+                slot = self._sender_locks[sender] = [threading.Lock(), 0]
+            slot[1] += 1
+        try:
+            # Only bursts of the same sender wait for each other
+            with slot[0]:
+                try:
+                    self.process(sender, messages, context, **kwargs)
+                except Exception as e:
+                    logger.error(f"Error processing message burst from {sender}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._sender_locks[sender]
+
+    def take_all(self):
+        """
+        Close every open window now without processing the bursts (e.g. on
+        shutdown, to run them elsewhere with process_now()).
+
+        Returns:
+            List of (sender, messages, context) tuples
+        """
+        with self._lock:
+            pending = list(self._bursts.items())
+            for sender, burst in pending:
+                if burst.timer:
+                    burst.timer.cancel()
+                self._take(sender, burst)
+        return [(sender, burst.messages, burst.context) for sender, burst in pending]
+
+    def flush_all(self):
+        """Process every pending burst immediately, one after another on the calling thread."""
+        for sender, messages, context in self.take_all():
+            self.process_now(sender, messages, context)
+
+    def pending(self):
+        """Return the number of senders with an open debounce window."""
+        with self._lock:
+            return len(self._bursts)
@@ -0,0 +1,162 @@
+"""
+cache_snapshot.py - Save in-memory caches to disk and restore them after a restart
+
+Each process writes its own gzip-compressed JSON file
+(<directory>/caches_<pid>.json.gz) on shutdown and, optionally, every
+interval seconds. On start a process restores from every snapshot file in
+the directory that is younger than max_age, so a new set of gunicorn
+workers inherits what the old set had warmed up. Each cache validates its
+own entries on restore (file signatures, TTLs), so merging snapshots from
+several workers is safe.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("whatsapp_bot")
+
+FORMAT_VERSION = 1
+
+
+class CacheSnapshot:
+    """Registry of caches that are snapshotted together."""
+
+    def __init__(self, directory, max_age=3600.0, interval=0.0):
+        """
+        Args:
+            directory: Where snapshot files are written (shared by the workers)
+            max_age: Snapshot files older than this many seconds are ignored and pruned
+            interval: Seconds between periodic saves (0 = only on shutdown)
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.interval = interval
+        self._sections = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_saved = None
+        self.last_restore = {}
+
+    def register(self, name, dump, restore):
+        """
+        Add a cache to the snapshot.
+
+        Args:
+            name: Section name in the snapshot file
+            dump: Callable() returning the cache contents as JSON-serialisable data
+            restore: Callable(data, age_seconds) loading those contents back;
+                returns the number of entries restored
+        """
+        self._sections[name] = (dump, restore)
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"caches_{os.getpid()}.json.gz")
+
+    def save(self):
+        """
+        Write this process's snapshot atomically and prune expired snapshot files.
+
+        Returns:
+            The snapshot path, or None if every cache was empty or writing failed
+        """
+        sections = {}
+        for name, (dump, _) in self._sections.items():
+            try:
+                sections[name] = dump()
+            except Exception as e:
+                logger.error(f"Error dumping cache '{name}' for snapshot: {e}", exc_info=True)
+        if not any(sections.values()):
+            # Nothing warm (e.g. a gunicorn master); don't shadow the workers' snapshots
+            return None
+        snapshot = {'format': FORMAT_VERSION, 'written_at': time.time(), 'sections': sections}
+
+        path = self.path
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # One dumps() + compress() is much faster than streaming through GzipFile
+            data = json.dumps(snapshot, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=1))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error writing cache snapshot {path}: {e}")
+            return None
+        self.last_saved = snapshot['written_at']
+        self._prune()
+        return path
+
+    def _prune(self):
+        cutoff = time.time() - self.max_age
+        for path in glob.glob(os.path.join(self.directory, 'caches_*.json.gz')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def restore(self):
+        """
+        Load every valid snapshot file in the directory, newest first.
+
+        Returns:
+            Dict of section name -> entries restored
+        """
+        restored = {name: 0 for name in self._sections}
+        paths = glob.glob(os.path.join(self.directory, 'caches_*.json.gz'))
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0, reverse=True)
+        now = time.time()
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    snapshot = json.loads(gzip.decompress(f.read()))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache snapshot {path}: {e}")
+                continue
+            if snapshot.get('format') != FORMAT_VERSION:
+                logger.warning(f"Ignoring cache snapshot {path} with format {snapshot.get('format')}")
+                continue
+            age = now - snapshot.get('written_at', 0)
+            if age > self.max_age:
+                continue
+            for name, data in snapshot.get('sections', {}).items():
+                section = self._sections.get(name)
+                if section is None:
+                    continue
+                try:
+                    restored[name] += section[1](data, age) or 0
+                except Exception as e:
+                    logger.error(f"Error restoring cache '{name}' from {path}: {e}", exc_info=True)
+        self.last_restore = restored
+        logger.info(f"Restored caches from {len(paths)} snapshot file(s): {restored}")
+        return restored
+
+    def start(self):
+        """Start the periodic save thread (no-op when interval is 0 or it is running)."""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.save()
+
+    def snapshot(self):
+        """Summary for /status."""
+        return {
+            'directory': self.directory,
+            'sections': list(self._sections),
+            'last_saved': self.last_saved,
+            'last_restore': self.last_restore,
+        }
@@ -0,0 +1,286 @@
+"""
+drain.py - Graceful drain on shutdown with hand-off of unfinished replies
+
+On SIGTERM a worker stops taking new webhooks and gives the turns it is
+already working on until a deadline to finish. A turn that cannot finish in
+time is handed off:
+
+- once its reply is planned, the reply sits in the outbox (outbox.py) with
+  its delivery progress; the turn just stops sending and the next worker
+  recovers the outbox entry
+- before that (e.g. still waiting on Gemini) the user's messages are
+  appended to a hand-off file in a directory shared by the workers; the
+  next worker claims the file and answers them from scratch
+
+Each hand-off is written to a file of its own and renamed into place when
+complete, so workers that are still serving can claim hand-off files at any
+time (the outbox retry loop does, next to its orphan scan), not only at
+warm-up: in a rolling reload the new workers are up before the old ones drain.
+
+A turn is registered when it is accepted, not when a thread starts on it,
+so turns still waiting in a lane queue are waited for and handed off like
+running ones; a handed-off turn that a worker picks up later is skipped.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("whatsapp_bot")
+
+KIND_TURN = 'turn'
+
+
+class TurnState:
+    """Progress of one in-flight turn, updated by the thread answering it."""
+
+    def __init__(self, sender_number, safe_sender_id, messages):
+        self.sender_number = sender_number
+        self.safe_sender_id = safe_sender_id
+        self.messages = list(messages)
+        self.accepted_at = time.time()  # when the turn was accepted, for time-to-first-send
+        self.replied = False  # the reply is in the outbox
+        self.handed_off = False
+        self.done = False
+
+    def to_item(self):
+        """The hand-off record for a turn that has no reply yet."""
+        return {'kind': KIND_TURN, 'sender_number': self.sender_number, 'safe_sender_id': self.safe_sender_id,
+                'messages': self.messages, 'created_at': time.time()}
+
+
+class Drainer:
+    """Tracks in-flight turns and hands off the unfinished ones when draining."""
+
+    def __init__(self, handoff_dir, timeout=25.0):
+        """
+        Args:
+            handoff_dir: Directory shared by the workers for hand-off files ('' = no hand-off)
+            timeout: Seconds a drain waits for in-flight turns before handing them off
+        """
+        self.handoff_dir = handoff_dir
+        self.timeout = timeout
+        self._turns = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._draining = threading.Event()
+        self._drained = threading.Event()
+        self._deadline = None
+        self.stats = {'drains': 0, 'completed_during_drain': 0, 'handed_off': 0, 'resumed': 0}
+
+    @property
+    def draining(self):
+        return self._draining.is_set()
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len(self._turns)
+
+    def remaining(self):
+        """Seconds left before the drain deadline (None when not draining)."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def reset(self):
+        """Forget the parent's state in a forked worker."""
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._turns = set()
+        self._draining = threading.Event()
+        self._drained = threading.Event()
+        self._deadline = None
+
+    def track(self, sender_number, safe_sender_id, messages):
+        """
+        Register a turn as in flight before it runs (e.g. when it is queued); end it with finish().
+
+        Returns:
+            The turn's TurnState
+        """
+        state = TurnState(sender_number, safe_sender_id, messages)
+        with self._lock:
+            self._turns.add(state)
+        return state
+
+    def finish(self, state):
+        """Mark a tracked turn as done (no-op if it already is)."""
+        with self._lock:
+            if state.done:
+                return
+            state.done = True
+            self._turns.discard(state)
+            if self.draining and not state.handed_off:
+                self.stats['completed_during_drain'] += 1
+            self._idle.notify_all()
+
+    @contextmanager
+    def turn(self, sender_number, safe_sender_id, messages, state=None):
+        """
+        Keep a turn in flight for the duration of the block; yields its TurnState.
+
+        Args:
+            state: TurnState registered earlier with track(); a new one is
+                registered when not given
+        """
+        if state is None:
+            state = self.track(sender_number, safe_sender_id, messages)
+        try:
+            yield state
+        finally:
+            self.finish(state)
+
+    def begin_reply(self, state):
+        """
+        Mark the turn as replied (its reply goes to the outbox), unless the
+        drain already handed it off.
+
+        Returns:
+            False if the turn was handed off and must not reply
+        """
+        with self._lock:
+            if state.handed_off:
+                return False
+            state.replied = True
+            return True
+
+    def should_hand_off(self, state, next_wait):
+        """
+        Whether the turn should stop before waiting next_wait seconds.
+
+        True once the turn was handed off, or when draining and the wait would
+        run past the deadline (the turn is handed off then).
+        """
+        if state.handed_off:
+            return True
+        if not self.draining:
+            return False
+        if self.remaining() < next_wait + 1.0:
+            self.hand_off([state])
+            return True
+        return False
+
+    def hand_off(self, states):
+        """
+        Stop each turn; the ones without a planned reply are written to a new
+        hand-off file of this process (the others are resumed from the outbox).
+
+        Returns:
+            Number of turns handed off
+        """
+        items = []
+        replied = 0
+        with self._lock:
+            for state in states:
+                if state.handed_off or state.done:
+                    continue
+                state.handed_off = True
+                if not state.replied:
+                    items.append(state.to_item())
+                else:
+                    replied += 1
+            self.stats['handed_off'] += replied
+        if replied:
+            logger.warning(f"Stopped {replied} reply(ies) mid-delivery; they stay in the outbox for the next worker")
+        if not items:
+            return replied
+        if not self.handoff_dir:
+            logger.error(f"Dropping {len(items)} unanswered turn(s) on shutdown (no HANDOFF_DIR configured)")
+            return replied
+        path = os.path.join(self.handoff_dir, f"handoff_{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        try:
+            os.makedirs(self.handoff_dir, exist_ok=True)
+            # Written aside and renamed: a claimed file is always complete
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.error(f"Error writing hand-off file {path}: {e}")
+            return replied
+        self.stats['handed_off'] += len(items)
+        logger.warning(f"Handed off {len(items)} unanswered turn(s) to {path}")
+        return replied + len(items)
+
+    def drain(self, before_wait=None):
+        """
+        Stop taking new turns, wait for in-flight ones until the deadline, hand off the rest.
+
+        Args:
+            before_wait: Optional callable run once draining has started
+                (e.g. flushing buffered bursts into turns)
+
+        Returns:
+            Dict with the number of turns that finished and that were handed off,
+            or None if a drain had already started (after waiting for it to end)
+        """
+        with self._lock:
+            already_draining = self.draining
+            if not already_draining:
+                self._deadline = time.monotonic() + self.timeout
+                self._draining.set()
+        if already_draining:
+            self._drained.wait(self.timeout + 1.0)
+            return None
+        self.stats['drains'] += 1
+        logger.info(f"Draining: waiting up to {self.timeout:.0f}s for {self.in_flight} in-flight turn(s)")
+        if before_wait:
+            try:
+                before_wait()
+            except Exception as e:
+                logger.error(f"Error while starting drain: {e}", exc_info=True)
+
+        with self._lock:
+            while self._turns and self.remaining() > 0:
+                self._idle.wait(timeout=min(0.5, self.remaining()))
+            leftovers = list(self._turns)
+        self.hand_off(leftovers)
+        summary = {'completed': self.stats['completed_during_drain'], 'handed_off': self.stats['handed_off']}
+        logger.info(f"Drain finished: {summary}")
+        self._drained.set()
+        return summary
+
+    def claim_handoffs(self):
+        """
+        Take every other process's hand-off files and return their items
+        (nothing while this process is draining itself).
+
+        A file is claimed by renaming it, so each one is picked up by a single
+        worker; it is deleted once read.
+        """
+        if not self.handoff_dir or self.draining:
+            return []
+        items = []
+        own_prefix = f"handoff_{os.getpid()}-"
+        for path in sorted(glob.glob(os.path.join(self.handoff_dir, 'handoff_*.jsonl'))):
+            if os.path.basename(path).startswith(own_prefix):
+                continue
+            claimed = f"{path}.claimed-{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue  # another worker got it first
+            try:
+                with open(claimed, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            items.append(json.loads(line))
+                os.remove(claimed)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading hand-off file {claimed}: {e}")
+        self.stats['resumed'] += len(items)
+        return items
+
+    def snapshot(self):
+        """Drain state for /status."""
+        return dict(self.stats, draining=self.draining, in_flight=self.in_flight,
+                    remaining_s=round(self.remaining(), 1) if self.remaining() is not None else None)
@@ -1,14 +1,18 @@
 """
 Sistema de Notificação via Grupo de WhatsApp - GGDISK Ótica
 Envia notificações para grupo com Jailson e Josimar quando clientes solicitam atendimento.
+
+Consome o fluxo de eventos estruturados gerado pelo bot (NOTIFICATION_DELIVERY=events)
+a partir de um offset salvo em checkpoint, em vez de ler o whatsapp_bot.log.
+Cada evento é notificado uma única vez: se o processo cair no meio de um envio,
+o evento fica marcado no checkpoint e não é reenviado ao reiniciar.
 """
 
 import os
-import re
 import time
-from datetime import datetime
 from dotenv import load_dotenv
 from wasenderapi import create_sync_wasender
+from notification_events import EventConsumer, EVENT_TURN_PROCESSED, format_group_notification
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -16,7 +20,9 @@ load_dotenv()
 # Configurações
 WASENDER_API_TOKEN = os.getenv('WASENDER_API_TOKEN')
 NOTIFICATION_GROUP_ID = os.getenv('NOTIFICATION_GROUP_ID')  # ID do grupo (formato: 120363xxxxx@g.us)
-LOG_FILE = 'whatsapp_bot.log'
+EVENTS_FILE = os.getenv('NOTIFICATION_EVENTS_FILE', 'notification_events.jsonl')
+CHECKPOINT_FILE = os.getenv('NOTIFICATION_CHECKPOINT_FILE', f'{EVENTS_FILE}.grupo_notificador.offset')
+POLL_INTERVAL = float(os.getenv('NOTIFICATION_POLL_INTERVAL', '0.1'))
 
 # Palavras-chave que disparam notificação
 KEYWORDS = [
@@ -37,7 +43,8 @@ print("  Sistema de Notificação via Grupo - GGDISK Ótica")
 print("=" * 60)
 print(f"Grupo ID: {NOTIFICATION_GROUP_ID}")
 print(f"Palavras-chave: {', '.join(KEYWORDS)}")
-print(f"Monitorando: {LOG_FILE}")
+print(f"Eventos: {EVENTS_FILE}")
+print(f"Checkpoint: {CHECKPOINT_FILE}")
 print("=" * 60)
 
 # Inicializar cliente WaSender
@@ -48,55 +55,22 @@ except Exception as e:
     print(f"❌ Erro ao conectar WaSender: {e}")
     exit(1)
 
-def extrair_numero_cliente(linha):
-    """Extrai número do cliente da linha de log."""
-    # Procura por padrões de número de telefone
-    match = re.search(r'(\d{12,13})@s\.whatsapp\.net', linha)
-    if match:
-        return match.group(1)
-    
-    match = re.search(r'from (\d{12,13})', linha)
-    if match:
-        return match.group(1)
-    
-    return None
-
-def extrair_mensagem(linha):
-    """Extrai a mensagem do cliente da linha de log."""
-    # Procura por padrões de mensagem no log
-    match = re.search(r"message: '(.+?)'", linha)
-    if match:
-        return match.group(1)
-    
-    match = re.search(r'Processing text message: \'(.+?)\' from', linha)
-    if match:
-        return match.group(1)
-    
-    return None
-
-def deve_notificar(linha):
-    """Verifica se a linha contém palavras-chave para notificação."""
-    linha_lower = linha.lower()
-    return any(keyword in linha_lower for keyword in KEYWORDS)
+def deve_notificar(evento):
+    """Verifica se o evento pede notificação (decisão do bot ou palavra-chave na mensagem)."""
+    if evento.get('type') != EVENT_TURN_PROCESSED:
+        return False
+    if evento.get('notify'):
+        return True
+    mensagem = (evento.get('message') or '').lower()
+    return any(keyword in mensagem for keyword in KEYWORDS)
 
-def enviar_notificacao_grupo(numero_cliente, mensagem):
+def enviar_notificacao_grupo(numero_cliente, mensagem, opcao_menu=None):
     """Envia notificação para o grupo."""
     if not NOTIFICATION_GROUP_ID:
         print("⚠️  NOTIFICATION_GROUP_ID não configurado no .env")
         return False
     
-    timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M')
-    
-    notificacao = f"""🔔 *NOVA SOLICITAÇÃO DE ATENDIMENTO*
-
-👤 *Cliente:* {numero_cliente}
-⏰ *Horário:* {timestamp}
-
-📝 *Mensagem:*
-{mensagem}
-
----
-_Atender o cliente iniciando conversa com o número dele_"""
+    notificacao = format_group_notification(numero_cliente, mensagem, opcao_menu)
     
     try:
         wasender.send_text(
@@ -111,37 +85,49 @@ _Atender o cliente iniciando conversa com o número dele_"""
         print(f"❌ Erro ao enviar notificação: {e}\n")
         return False
 
-def monitorar_log():
-    """Monitora o arquivo de log em tempo real."""
-    print("🔍 Iniciando monitoramento do log...\n")
+def consumir_eventos():
+    """Consome o fluxo de eventos do bot a partir do último offset confirmado."""
+    consumidor = EventConsumer(EVENTS_FILE, CHECKPOINT_FILE)
+    
+    # Na primeira execução, começa do fim (não reenvia o histórico)
+    if not consumidor.has_checkpoint():
+        consumidor.seek_to_end()
+    
+    print(f"🔍 Consumindo eventos a partir do offset {consumidor.offset}...\n")
     
-    # Vai para o final do arquivo
-    with open(LOG_FILE, 'r', encoding='utf-8') as f:
-        f.seek(0, 2)  # Vai para o final
+    while True:
+        eventos = consumidor.poll()
         
-        while True:
-            linha = f.readline()
-            
-            if not linha:
-                time.sleep(0.5)  # Aguarda novas linhas
-                continue
-            
-            # Verifica se deve notificar
-            if deve_notificar(linha):
-                numero = extrair_numero_cliente(linha)
-                mensagem = extrair_mensagem(linha)
+        if not eventos:
+            time.sleep(POLL_INTERVAL)  # Aguarda novos eventos
+            continue
+        
+        for offset, evento in eventos:
+            if deve_notificar(evento):
+                numero = evento.get('customer', '')
+                mensagem = evento.get('message', '')
                 
-                if numero and mensagem:
+                if consumidor.interrupted(evento):
+                    # A execução anterior caiu durante este envio: ele pode ter chegado ao grupo,
+                    # então não é reenviado (cada evento é notificado no máximo uma vez)
+                    print(f"⚠️  Envio interrompido do evento {evento.get('id')} ({numero}); confira o grupo, não será reenviado")
+                else:
                     print(f"🎯 Detectado: {mensagem[:50]}... de {numero}")
-                    enviar_notificacao_grupo(numero, mensagem)
+                    
+                    # O id fica no checkpoint durante o envio; o offset só é confirmado depois
+                    consumidor.begin(evento.get('id'))
+                    if not enviar_notificacao_grupo(numero, mensagem, evento.get('menu_option')):
+                        # Falhou: não chegou ao grupo, tenta de novo
+                        consumidor.cancel()
+                        time.sleep(5)
+                        break
+            
+            consumidor.commit(offset)
 
 if __name__ == '__main__':
     try:
-        monitorar_log()
+        consumir_eventos()
     except KeyboardInterrupt:
         print("\n\n⏹️  Monitoramento interrompido pelo usuário.")
-    except FileNotFoundError:
-        print(f"\n❌ Arquivo {LOG_FILE} não encontrado!")
-        print("   Certifique-se de que o bot está rodando e gerando logs.")
     except Exception as e:
         print(f"\n❌ Erro: {e}")
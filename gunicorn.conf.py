@@ -0,0 +1,42 @@
+"""
+gunicorn.conf.py - Gunicorn settings picked up automatically from the project directory
+
+Only what the bot needs for graceful shutdown and metrics cleanup; pass
+everything else (workers, bind, ...) on the command line.
+"""
+
+import os
+import signal
+import threading
+
+# Longer than DRAIN_TIMEOUT so the drain can finish before the master kills the worker
+graceful_timeout = int(float(os.getenv('DRAIN_TIMEOUT', '25'))) + 5
+
+
+def post_worker_init(worker):
+    """Start draining as soon as the worker gets SIGTERM, not only once its current request ends."""
+    import script
+    stop_accepting = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        stop_accepting(signum, frame)
+        threading.Thread(target=script.drain, name="drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+def worker_exit(server, worker):
+    """Runs in the worker after its last request: finish the drain before exiting."""
+    # The master also calls this hook for workers that died on their own
+    if worker.pid != os.getpid():
+        return
+    import script
+    script.drain()
+
+
+def child_exit(server, worker):
+    """Runs in the master when a worker exits: fold its metrics snapshot into the archive (its gauges are dropped)."""
+    metrics_dir = os.getenv('METRICS_DIR', '')
+    if metrics_dir:
+        from metrics import mark_process_dead
+        mark_process_dead(metrics_dir, worker.pid)
@@ -0,0 +1,135 @@
+"""
+lanes.py - Separately sized worker lanes with per-lane latency SLOs
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("whatsapp_bot")
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of a list of numbers (None if empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Lane:
+    """
+    A named worker pool with its own size, latency SLO and latency stats.
+
+    Local answers (menu, greeting, cache hits) and LLM work run in different
+    lanes so a quick menu reply never waits behind slow Gemini calls. With
+    max_queue set, work beyond that many waiting items is refused instead of
+    piling up, so the caller can shed it while the customer is still there.
+    """
+
+    def __init__(self, name, workers, slo_ms, sample_size=1000, max_queue=None):
+        """
+        Initialize the lane.
+
+        Args:
+            name: Lane name used in logs and metrics
+            workers: Number of worker threads
+            slo_ms: Target queue wait (enqueue -> start) and time to first send
+                (turn accepted -> first reply chunk accepted) in milliseconds
+            sample_size: Number of recent latency samples kept for percentiles
+            max_queue: Maximum items waiting for a worker (None for no limit)
+        """
+        self.name = name
+        self.workers = workers
+        self.slo = slo_ms / 1000.0
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self._lock = threading.Lock()
+        self._queue_waits = deque(maxlen=sample_size)
+        self._durations = deque(maxlen=sample_size)
+        self._first_sends = deque(maxlen=sample_size)
+        self.queued = 0
+        self.active = 0
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'slo_breaches': 0,
+            'first_send_slo_breaches': 0,
+        }
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) on this lane.
+
+        Returns:
+            The Future, or None if the lane's queue is full (nothing was queued)
+        """
+        enqueued_at = time.monotonic()
+        with self._lock:
+            # Queued items that no worker picked up yet; running ones don't count
+            if self.max_queue is not None and self.queued - max(0, self.workers - self.active) >= self.max_queue:
+                self.stats['rejected'] += 1
+                return None
+            self.stats['submitted'] += 1
+            self.queued += 1
+        return self._executor.submit(self._run, enqueued_at, fn, args, kwargs)
+
+    def _run(self, enqueued_at, fn, args, kwargs):
+        started_at = time.monotonic()
+        queue_wait = started_at - enqueued_at
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self._queue_waits.append(queue_wait)
+            if queue_wait > self.slo:
+                self.stats['slo_breaches'] += 1
+        if queue_wait > self.slo:
+            logger.warning(f"Lane '{self.name}' queue wait {queue_wait * 1000:.0f} ms exceeds SLO of {self.slo * 1000:.0f} ms")
+
+        outcome = 'failed'
+        try:
+            result = fn(*args, **kwargs)
+            outcome = 'completed'
+            return result
+        except Exception as e:
+            logger.error(f"Error in lane '{self.name}': {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.stats[outcome] += 1
+                self._durations.append(time.monotonic() - started_at)
+
+    def record_first_send(self, seconds):
+        """
+        Record the time from accepting a turn of this lane to its first reply
+        chunk being sent, which is what the customer waits for (it includes
+        queue wait, the answer itself and any wait for a delivery thread).
+        """
+        with self._lock:
+            self._first_sends.append(seconds)
+            if seconds > self.slo:
+                self.stats['first_send_slo_breaches'] += 1
+
+    def snapshot(self):
+        """Return counters, queue depth and latency percentiles (ms)."""
+        with self._lock:
+            waits = list(self._queue_waits)
+            durations = list(self._durations)
+            first_sends = list(self._first_sends)
+            snapshot = dict(self.stats, workers=self.workers, queued=self.queued, active=self.active,
+                            slo_ms=self.slo * 1000)
+
+        for label, samples in (('queue_wait', waits), ('duration', durations), ('first_send', first_sends)):
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                value = percentile(samples, fraction)
+                snapshot[f'{label}_{name}_ms'] = round(value * 1000, 1) if value is not None else None
+        return snapshot
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and optionally wait for queued work to finish."""
+        self._executor.shutdown(wait=wait)
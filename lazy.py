@@ -0,0 +1,107 @@
+"""
+lazy.py - Deferred imports and deferred client construction
+
+The Gemini and WaSender SDKs take most of script.py's import time, and grpc
+state created before a fork is not safe to use in the child. LazyModule
+imports a module on first attribute access; LazyProxy builds an object on
+first attribute access and forgets it in forked children, so every worker
+creates its own. A proxy is truthy only when its object can be built (see
+configured), so `if not client:` guards keep working without building it.
+"""
+
+import importlib
+import os
+import threading
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        """
+        Args:
+            name: Dotted module name, e.g. 'google.generativeai'
+        """
+        self._name = name
+        self._module = None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Import the module (once) and return it."""
+        module = self._module
+        if module is None:
+            # importlib serialises concurrent imports of the same module
+            module = self._module = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+class LazyProxy:
+    """Object stand-in that calls factory() on first attribute access, once per process."""
+
+    def __init__(self, factory, name, configured=None):
+        """
+        Args:
+            factory: Zero-argument callable building the real object
+            name: Label used in repr() and log messages
+            configured: Optional zero-argument callable telling whether factory()
+                has what it needs (e.g. an API key); checked without building
+        """
+        self._factory = factory
+        self._name = name
+        self._configured = configured
+        self._lock = threading.Lock()
+        self._target = None
+        # A forked worker must not reuse the parent's connections
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def resolved(self):
+        return self._target is not None
+
+    @property
+    def configured(self):
+        """Whether the object can be built, without building it."""
+        return self._configured is None or bool(self._configured())
+
+    def __bool__(self):
+        return self.configured
+
+    def resolve(self):
+        """
+        Build the object if needed and return it.
+
+        Raises:
+            Whatever factory() raises; the next call tries again
+        """
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    def reset(self):
+        """Drop the built object so the next access builds a new one."""
+        with self._lock:
+            self._target = None
+
+    def _after_fork(self):
+        # The parent may have held the lock while forking
+        self._lock = threading.Lock()
+        self._target = None
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        return f"<LazyProxy {self._name!r} ({'resolved' if self.resolved else 'not resolved'})>"
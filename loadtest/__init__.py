@@ -0,0 +1,12 @@
+"""
+loadtest - Offline load testing for the bot
+
+Stand-in WaSender and Gemini servers (fake_wasender.py, fake_gemini.py), a
+generator of realistic messages.upsert traffic (traffic.py) and a harness
+that drives it all and reports throughput, reply latency and error rates
+(harness.py). Nothing here touches the network beyond 127.0.0.1.
+
+Usage:
+    python -m loadtest --users 20 --duration 60
+    python -m loadtest --help
+"""
@@ -0,0 +1,5 @@
+import sys
+
+from loadtest.harness import main
+
+sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+fake_gemini.py - Stand-in for the Gemini generateContent REST endpoint
+
+google.generativeai talks to it when configured with transport='rest' and
+client_options={'api_endpoint': 'http://127.0.0.1:<port>'} (what the bot does
+when GEMINI_API_ENDPOINT is set). Replies are canned Portuguese paragraphs of
+a configurable length, sent after a configurable latency; errors can be
+injected at random.
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+from loadtest.latency import LatencyModel
+
+REPLY_SENTENCES = (
+    "Olá! Aqui é o Pedro, da GGDISK Ótica 😊",
+    "Temos armações de diversos modelos e valores, e fazemos lentes de grau, multifocais e com antirreflexo.",
+    "Para um orçamento personalizado de óculos, vou encaminhar você para um dos nossos consultores especializados.",
+    "Prefere falar com o Jailson (99750-7161) ou com o Josimar (99974-5545)?",
+    "Estamos na Av. Conselheiro Aguiar, 1472 - Loja 61, em Boa Viagem, de segunda a sexta das 9h às 18h e aos sábados das 9h às 12h.",
+    "Aceitamos PIX, dinheiro e cartões de crédito e débito, com parcelamento disponível.",
+    "Ajustes e reparos são feitos na loja, e nossos especialistas avaliam a armação na hora.",
+    "Posso ajudar com mais alguma coisa?",
+)
+
+
+class FakeGemini:
+    """Serves generateContent; serve .app with any WSGI server."""
+
+    def __init__(self, latency=None, error_rate=0.0, reply_sentences=4, rng=None, deterministic=False):
+        """
+        Initialize the stand-in.
+
+        Args:
+            latency: LatencyModel for each call (default: no delay)
+            error_rate: Fraction of calls answered with 429 RESOURCE_EXHAUSTED
+            reply_sentences: Sentences per reply (one per line)
+            rng: Optional random.Random, for reproducible runs
+            deterministic: Derive each reply from the prompt, so the same
+                prompt always gets the same reply (used by replay comparisons)
+        """
+        self.deterministic = deterministic
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.reply_sentences = reply_sentences
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.app = self._build_app()
+
+    def reply_text(self, prompt=''):
+        if self.deterministic:
+            rng = random.Random(prompt)
+            sentences = [rng.choice(REPLY_SENTENCES) for _ in range(self.reply_sentences)]
+        else:
+            with self._lock:
+                sentences = [self._rng.choice(REPLY_SENTENCES) for _ in range(self.reply_sentences)]
+        return "\n".join(sentences)
+
+    def _build_app(self):
+        app = Flask('fake_gemini')
+
+        @app.route('/<version>/models/<path:target>', methods=['POST'])
+        def generate_content(version, target):
+            model, _, method = target.partition(':')
+            if method not in ('generateContent', 'streamGenerateContent'):
+                return jsonify({'error': {'code': 404, 'message': f'Method {method} not found', 'status': 'NOT_FOUND'}}), 404
+            time.sleep(self.latency.sample())
+            with self._lock:
+                failed = self._rng.random() < self.error_rate
+                self.counts['errors' if failed else 'calls'] += 1
+            if failed:
+                return jsonify({'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).',
+                                          'status': 'RESOURCE_EXHAUSTED'}}), 429
+
+            body = request.get_json(silent=True) or {}
+            contents = body.get('contents', [])
+            prompt_chars = sum(len(part.get('text', '')) for content in contents for part in content.get('parts', []))
+            last_parts = contents[-1].get('parts', []) if contents else []
+            text = self.reply_text(''.join(part.get('text', '') for part in last_parts))
+            return jsonify({
+                'candidates': [{
+                    'content': {'parts': [{'text': text}], 'role': 'model'},
+                    'finishReason': 'STOP',
+                    'index': 0,
+                }],
+                'usageMetadata': {
+                    'promptTokenCount': prompt_chars // 4,
+                    'candidatesTokenCount': len(text) // 4,
+                    'totalTokenCount': (prompt_chars + len(text)) // 4,
+                },
+                'modelVersion': model,
+            })
+
+        return app
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
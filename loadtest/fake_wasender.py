@@ -0,0 +1,118 @@
+"""
+fake_wasender.py - Stand-in for the WaSender /send-message API
+
+Accepts the requests the wasenderapi SDK makes, answers after a configurable
+latency, enforces a token-bucket rate limit with the real X-RateLimit-*
+headers and can inject 429s at random. Every accepted message is recorded
+so the harness can measure when replies reach each recipient.
+"""
+
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+from loadtest.latency import LatencyModel
+
+
+class FakeWaSender:
+    """Records delivered messages; serve .app with any WSGI server."""
+
+    def __init__(self, latency=None, rate_per_minute=0, burst=None, reject_rate=0.0, rng=None):
+        """
+        Initialize the stand-in.
+
+        Args:
+            latency: LatencyModel for each request (default: no delay)
+            rate_per_minute: Sustained requests per minute before 429s (0 = unlimited)
+            burst: Token bucket size (default: one minute's worth)
+            reject_rate: Fraction of requests rejected with 429 regardless of the limit
+            rng: Optional random.Random, for reproducible runs
+        """
+        self.latency = latency or LatencyModel()
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst if burst is not None else max(1, int(rate_per_minute))
+        self.reject_rate = reject_rate
+        self._rng = rng or random.Random()
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._ids = itertools.count(1)
+        self._deliveries = {}
+        self._condition = threading.Condition()
+        self.counts = Counter()
+        self.app = self._build_app()
+
+    def _take_token(self):
+        """Return (allowed, remaining, reset_epoch) for the token bucket; call with the condition held."""
+        if not self.rate_per_minute:
+            return True, None, None
+        now = time.monotonic()
+        rate = self.rate_per_minute / 60.0
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+        reset = int(time.time() + (self.burst - self._tokens) / rate) + 1
+        if self._tokens < 1:
+            return False, 0, reset
+        self._tokens -= 1
+        return True, int(self._tokens), reset
+
+    def _build_app(self):
+        app = Flask('fake_wasender')
+
+        @app.route('/send-message', methods=['POST'])
+        def send_message():
+            time.sleep(self.latency.sample())
+            payload = request.get_json(silent=True) or {}
+            with self._condition:
+                allowed, remaining, reset = self._take_token()
+                injected = allowed and self._rng.random() < self.reject_rate
+                headers = {}
+                if remaining is not None:
+                    headers = {'X-RateLimit-Limit': str(self.burst), 'X-RateLimit-Remaining': str(remaining),
+                               'X-RateLimit-Reset': str(reset)}
+                if not allowed or injected:
+                    self.counts['injected_429' if injected else 'rate_limited'] += 1
+                    headers['Retry-After'] = '1'
+                    return jsonify({'success': False, 'message': 'Too many requests', 'retry_after': 1}), 429, headers
+                if not payload.get('to'):
+                    self.counts['invalid'] += 1
+                    return jsonify({'success': False, 'message': 'The to field is required.'}), 422
+                self.counts['delivered'] += 1
+                self._deliveries.setdefault(str(payload['to']), []).append((time.monotonic(), payload.get('text', '')))
+                self._condition.notify_all()
+                message_id = next(self._ids)
+            return jsonify({'success': True, 'data': {'msgId': message_id, 'jid': payload['to'], 'status': 'in_progress'}}), \
+                200, headers
+
+        return app
+
+    def deliveries(self, to):
+        """Return [(monotonic time, text), ...] delivered to a recipient."""
+        with self._condition:
+            return list(self._deliveries.get(str(to), []))
+
+    def wait_for_delivery(self, to, after, timeout):
+        """
+        Block until a message to `to` arrives after monotonic time `after`.
+
+        Returns:
+            Monotonic arrival time of the first such message, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        to = str(to)
+        with self._condition:
+            while True:
+                for arrived_at, _ in self._deliveries.get(to, []):
+                    if arrived_at >= after:
+                        return arrived_at
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def stats(self):
+        with self._condition:
+            return dict(self.counts)
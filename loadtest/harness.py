@@ -0,0 +1,252 @@
+"""
+harness.py - Drives load against /webhook and reports reply latency
+
+By default the bot runs in this process (script.py is imported after its
+WaSender and Gemini endpoints are pointed at the stand-ins), so a run needs
+nothing but the repository. With --target the load goes to an already
+running bot instead; start it with the WASENDER_BASE_URL and
+GEMINI_API_ENDPOINT values printed at startup.
+
+Reply latency is measured per turn, from the moment the user's last message
+is posted until the first reply chunk reaches the stand-in WaSender.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+from werkzeug.serving import make_server
+
+from lanes import percentile
+from loadtest.fake_gemini import FakeGemini
+from loadtest.fake_wasender import FakeWaSender
+from loadtest.latency import LatencyModel
+from loadtest.traffic import TrafficGenerator, build_payload, parse_mix, DEFAULT_MIX
+
+
+class ServerThread:
+    """Serves a WSGI app on 127.0.0.1 from a daemon thread."""
+
+    def __init__(self, app, port=0):
+        self._server = make_server('127.0.0.1', port, app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"serve-{app.name}", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def start_bot_in_process(wasender_url, gemini_url):
+    """
+    Import script.py wired to the stand-ins and serve it.
+
+    Returns:
+        The ServerThread serving the bot
+    """
+    os.environ.update({
+        'WASENDER_BASE_URL': wasender_url,
+        'GEMINI_API_ENDPOINT': gemini_url,
+        'WASENDER_API_TOKEN': 'loadtest',
+        'GEMINI_API_KEY': 'loadtest',
+    })
+    os.environ.setdefault('CONVERSATIONS_DIR', tempfile.mkdtemp(prefix='loadtest_conversations_'))
+    os.environ.setdefault('NOTIFICATION_EVENTS_FILE', os.path.join(os.environ['CONVERSATIONS_DIR'], 'events.jsonl'))
+    os.environ.setdefault('OUTBOX_DIR', os.path.join(os.environ['CONVERSATIONS_DIR'], 'outbox'))
+    os.environ.setdefault('LOG_FILE', '')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import script
+    return ServerThread(script.app).start()
+
+
+class LoadRun:
+    """Closed-loop virtual users: send a turn, wait for the reply, think, repeat."""
+
+    def __init__(self, target_url, wasender, generator, users=10, duration=30.0, think_time=None,
+                 reply_timeout=30.0):
+        """
+        Initialize the run.
+
+        Args:
+            target_url: Base URL of the bot (its /webhook receives the traffic)
+            wasender: The FakeWaSender the bot delivers replies to
+            generator: TrafficGenerator choosing each turn
+            users: Concurrent virtual users
+            duration: Seconds to keep starting new turns
+            think_time: LatencyModel for the pause between a reply and the next turn
+            reply_timeout: Seconds to wait for a reply before counting a timeout
+        """
+        self.webhook_url = f"{target_url.rstrip('/')}/webhook"
+        self.wasender = wasender
+        self.generator = generator
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time or LatencyModel.parse('uniform:500:2000')
+        self.reply_timeout = reply_timeout
+        self._lock = threading.Lock()
+        self.turns = []
+        self.webhook_latencies = []
+        self.counts = Counter()
+
+    def _post(self, session, sender, text):
+        started = time.monotonic()
+        try:
+            response = session.post(self.webhook_url, json=build_payload(sender, text), timeout=self.reply_timeout)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        with self._lock:
+            self.webhook_latencies.append(time.monotonic() - started)
+            self.counts['webhook_requests'] += 1
+            if not ok:
+                self.counts['webhook_errors'] += 1
+        return started
+
+    def _user(self, index, deadline):
+        sender = self.generator.sender(index)
+        recipient = sender.split('@')[0]
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                kind, messages = self.generator.turn()
+                last_posted = None
+                for delay, text in messages:
+                    time.sleep(delay)
+                    last_posted = self._post(session, sender, text)
+                replied_at = self.wasender.wait_for_delivery(recipient, last_posted, self.reply_timeout)
+                with self._lock:
+                    self.turns.append((kind, None if replied_at is None else replied_at - last_posted))
+                time.sleep(self.think_time.sample())
+
+    def run(self):
+        """Run every virtual user to completion and return summary()."""
+        started = time.monotonic()
+        deadline = started + self.duration
+        threads = [threading.Thread(target=self._user, args=(i, deadline), name=f"vu-{i}", daemon=True)
+                   for i in range(self.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.summary(time.monotonic() - started)
+
+    def summary(self, elapsed):
+        """Throughput, latency percentiles (ms) and error rates of the run."""
+        def ms(samples):
+            return {name: round(percentile(samples, fraction) * 1000, 1) if samples else None
+                    for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))}
+
+        with self._lock:
+            turns = list(self.turns)
+            webhook_latencies = list(self.webhook_latencies)
+            counts = Counter(self.counts)
+        replied = [latency for _, latency in turns if latency is not None]
+        by_kind = {}
+        for kind in sorted({kind for kind, _ in turns}):
+            samples = [latency for turn_kind, latency in turns if turn_kind == kind and latency is not None]
+            by_kind[kind] = dict(ms(samples), turns=sum(1 for turn_kind, _ in turns if turn_kind == kind))
+        requests_sent = counts['webhook_requests']
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'users': self.users,
+            'turns': len(turns),
+            'turns_per_s': round(len(turns) / elapsed, 2) if elapsed else 0.0,
+            'webhook_requests': requests_sent,
+            'webhook_error_rate': round(counts['webhook_errors'] / requests_sent, 4) if requests_sent else 0.0,
+            'webhook_ms': ms(webhook_latencies),
+            'reply_timeouts': len(turns) - len(replied),
+            'reply_timeout_rate': round((len(turns) - len(replied)) / len(turns), 4) if turns else 0.0,
+            'reply_ms': ms(replied),
+            'reply_ms_by_kind': by_kind,
+        }
+
+
+def format_report(summary):
+    """Render a run summary as a plain-text report."""
+    def row(name, values):
+        cells = ' '.join(f"{'-' if values.get(k) is None else values[k]:>10}" for k in ('p50', 'p95', 'p99'))
+        return f"  {name:<18} {cells}"
+
+    lines = [
+        f"Load test: {summary['users']} users for {summary['elapsed_s']} s",
+        f"  turns              {summary['turns']} ({summary['turns_per_s']}/s)",
+        f"  webhook requests   {summary['webhook_requests']} (error rate {summary['webhook_error_rate']:.2%})",
+        f"  reply timeouts     {summary['reply_timeouts']} ({summary['reply_timeout_rate']:.2%})",
+        "",
+        f"  {'latency (ms)':<18} {'p50':>10} {'p95':>10} {'p99':>10}",
+        row('reply', summary['reply_ms']),
+        row('webhook', summary['webhook_ms']),
+    ]
+    for kind, values in summary['reply_ms_by_kind'].items():
+        lines.append(row(f"reply/{kind} ({values['turns']})", values))
+    for name in ('wasender', 'gemini'):
+        if name in summary:
+            stats = ', '.join(f"{key}={value}" for key, value in sorted(summary[name].items())) or 'no calls'
+            lines.append(f"  {name + ' stand-in':<18} {stats}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description="Offline end-to-end load test of /webhook")
+    parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds to keep starting turns")
+    parser.add_argument('--think', default='uniform:500:2000', help="Pause between turns (latency spec, ms)")
+    parser.add_argument('--reply-timeout', type=float, default=30.0, help="Seconds to wait for each reply")
+    parser.add_argument('--mix', default=','.join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="Turn mix, e.g. greeting=0.2,menu=0.3,free_text=0.4,burst=0.1")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for reproducible traffic")
+    parser.add_argument('--wasender-latency', default='lognormal:150:0.4', help="WaSender latency spec (ms)")
+    parser.add_argument('--wasender-rate', type=float, default=0, help="WaSender requests/minute before 429s (0 = unlimited)")
+    parser.add_argument('--wasender-burst', type=int, default=None, help="WaSender token bucket size")
+    parser.add_argument('--wasender-429-rate', type=float, default=0.0, help="Fraction of sends rejected with 429")
+    parser.add_argument('--gemini-latency', default='lognormal:900:0.5', help="Gemini latency spec (ms)")
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help="Fraction of Gemini calls failing with 429")
+    parser.add_argument('--reply-sentences', type=int, default=4, help="Sentences per Gemini reply")
+    parser.add_argument('--target', default=None, help="Base URL of an already running bot (default: run it in-process)")
+    parser.add_argument('--wasender-port', type=int, default=0, help="Port for the WaSender stand-in (0 = any)")
+    parser.add_argument('--gemini-port', type=int, default=0, help="Port for the Gemini stand-in (0 = any)")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    wasender = FakeWaSender(LatencyModel.parse(args.wasender_latency, rng), rate_per_minute=args.wasender_rate,
+                            burst=args.wasender_burst, reject_rate=args.wasender_429_rate, rng=rng)
+    gemini = FakeGemini(LatencyModel.parse(args.gemini_latency, rng), error_rate=args.gemini_error_rate,
+                        reply_sentences=args.reply_sentences, rng=rng)
+    servers = [ServerThread(wasender.app, args.wasender_port).start(), ServerThread(gemini.app, args.gemini_port).start()]
+    wasender_url, gemini_url = servers[0].url, servers[1].url
+    print(f"WaSender stand-in: WASENDER_BASE_URL={wasender_url}", file=sys.stderr)
+    print(f"Gemini stand-in:   GEMINI_API_ENDPOINT={gemini_url}", file=sys.stderr)
+
+    try:
+        if args.target:
+            target = args.target
+        else:
+            servers.append(start_bot_in_process(wasender_url, gemini_url))
+            target = servers[-1].url
+        run = LoadRun(target, wasender, TrafficGenerator(parse_mix(args.mix), rng=rng), users=args.users,
+                      duration=args.duration, think_time=LatencyModel.parse(args.think, rng),
+                      reply_timeout=args.reply_timeout)
+        summary = run.run()
+        summary['wasender'] = wasender.stats()
+        summary['gemini'] = gemini.stats()
+    finally:
+        for server in servers:
+            server.stop()
+
+    print(json.dumps(summary, indent=2) if args.json else format_report(summary))
+    return 0 if summary['turns'] else 1
@@ -0,0 +1,64 @@
+"""
+latency.py - Latency distributions for the stand-in servers
+"""
+
+import math
+import random
+
+
+class LatencyModel:
+    """
+    A latency distribution parsed from a short spec (all values in ms):
+
+        "0"                   no delay
+        "120"                 fixed 120 ms
+        "uniform:50:300"      uniform between 50 and 300 ms
+        "lognormal:800:0.6"   log-normal with an 800 ms median and sigma 0.6
+        "exp:200"             exponential with a 200 ms mean
+    """
+
+    KINDS = ('fixed', 'uniform', 'lognormal', 'exp')
+
+    def __init__(self, kind='fixed', params=(0.0,), rng=None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}' (expected one of {', '.join(self.KINDS)})")
+        self.kind = kind
+        self.params = tuple(float(p) for p in params)
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec, rng=None):
+        """
+        Build a model from a spec string.
+
+        Args:
+            spec: Distribution spec (see the class docstring)
+            rng: Optional random.Random, for reproducible runs
+
+        Returns:
+            A LatencyModel
+        """
+        parts = str(spec).strip().split(':')
+        if len(parts) == 1:
+            return cls('fixed', (parts[0],), rng)
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2, 'exp': 1}
+        kind, params = parts[0], parts[1:]
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        return cls(kind, params, rng)
+
+    def sample(self):
+        """Return one delay in seconds."""
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = self._rng.uniform(*self.params)
+        elif self.kind == 'lognormal':
+            median, sigma = self.params
+            ms = self._rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        else:
+            ms = self._rng.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+        return max(0.0, ms) / 1000.0
+
+    def __repr__(self):
+        return f"LatencyModel({':'.join([self.kind] + [f'{p:g}' for p in self.params])})"
@@ -0,0 +1,385 @@
+"""
+replay.py - Replays recorded webhook traffic against the bot
+
+The payload logger records every inbound webhook as
+"Received webhook data: {...}" (a Python repr, in text or JSON log format,
+plain or gzip-rotated). This tool extracts those events and posts them to
+/webhook again, keeping their original inter-arrival times (or compressing
+them with --speed), with the bot talking to the loadtest stand-ins.
+
+Each run can be saved with --output and compared with an earlier run with
+--compare. The comparison reports latency changes, events answered with a
+different HTTP status and conversations that diverged: a different number of
+reply chunks, different reply text or the same replies in another order.
+Gemini replies are derived from the prompt, so two runs of the same traffic
+are expected to agree.
+
+Usage:
+    python -m loadtest.replay whatsapp_bot.log --speed 10 --max-gap 30 --output before.json
+    python -m loadtest.replay whatsapp_bot.log --speed 10 --max-gap 30 --compare before.json
+"""
+
+import argparse
+import ast
+import gzip
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from lanes import percentile
+from loadtest.fake_gemini import FakeGemini
+from loadtest.fake_wasender import FakeWaSender
+from loadtest.harness import ServerThread, start_bot_in_process
+from loadtest.latency import LatencyModel
+
+PAYLOAD_MARKER = 'Received webhook data: '
+TEXT_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+
+
+def _open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def _parse_line(line):
+    """Return (epoch seconds, payload) for a payload log line, or None."""
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        message = record.get('message', '')
+        if not isinstance(message, str) or not message.startswith(PAYLOAD_MARKER):
+            return None
+        at = datetime.fromisoformat(record['ts']).timestamp()
+        raw = message[len(PAYLOAD_MARKER):]
+    else:
+        index = line.find(PAYLOAD_MARKER)
+        if index < 0:
+            return None
+        try:
+            at = datetime.strptime(line[:23], TEXT_TIMESTAMP_FORMAT).timestamp()
+        except ValueError:
+            return None
+        raw = line[index + len(PAYLOAD_MARKER):]
+    try:
+        payload = ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        return None
+    return (at, payload) if isinstance(payload, dict) else None
+
+
+def extract_events(paths, event_types=None):
+    """
+    Extract recorded webhook payloads from log files.
+
+    Args:
+        paths: Log files (text or JSON format, optionally .gz)
+        event_types: Only keep these 'event' values (None keeps every event)
+
+    Returns:
+        List of (epoch seconds, payload) sorted by time
+    """
+    events = []
+    for path in paths:
+        with _open_log(path) as f:
+            for line in f:
+                if PAYLOAD_MARKER not in line:
+                    continue
+                parsed = _parse_line(line)
+                if parsed and (not event_types or parsed[1].get('event') in event_types):
+                    events.append(parsed)
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def event_key(index, payload):
+    """Stable identity of an event across runs (the WhatsApp message id when there is one)."""
+    messages = (payload.get('data') or {}).get('messages')
+    if isinstance(messages, dict) and messages.get('key', {}).get('id'):
+        return f"{payload.get('event')}:{messages['key']['id']}"
+    return f"{payload.get('event')}#{index}"
+
+
+def recipient_of(payload):
+    """Return the WaSender 'to' a reply to this event would use, or None."""
+    messages = (payload.get('data') or {}).get('messages')
+    if not isinstance(messages, dict):
+        return None
+    jid = messages.get('key', {}).get('remoteJid')
+    if not jid:
+        return None
+    return jid.split('@')[0] if jid.endswith('@s.whatsapp.net') else jid
+
+
+class Replayer:
+    """Posts recorded events on their original schedule and collects the outcome."""
+
+    def __init__(self, target_url, wasender, speed=1.0, max_in_flight=64, timeout=60.0, max_gap=None):
+        """
+        Initialize the replayer.
+
+        Args:
+            target_url: Base URL of the bot
+            wasender: FakeWaSender the bot delivers replies to
+            speed: Time compression (2 = twice as fast; 0 = no waiting between events)
+            max_in_flight: Concurrent webhook requests
+            timeout: Per-request timeout in seconds
+            max_gap: Cap on the recorded gap between consecutive events, in
+                seconds before speed is applied (skips quiet nights in long logs)
+        """
+        self.webhook_url = f"{target_url.rstrip('/')}/webhook"
+        self.wasender = wasender
+        self.speed = speed
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_gap = max_gap
+        self._local = threading.local()
+
+    def _post(self, record, payload):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        record['posted_at'] = time.monotonic()
+        try:
+            response = session.post(self.webhook_url, json=payload, timeout=self.timeout)
+            record['status'] = response.status_code
+        except requests.RequestException as e:
+            record['status'] = None
+            record['error'] = type(e).__name__
+        record['webhook_ms'] = round((time.monotonic() - record['posted_at']) * 1000, 1)
+
+    def replay(self, events, drain=2.0):
+        """
+        Replay events and return one record per event.
+
+        Args:
+            events: List of (epoch seconds, payload) from extract_events
+            drain: Seconds to wait after the last response for late replies
+
+        Returns:
+            List of per-event dicts (key, event, recipient, offset_s, lag_ms,
+            status, webhook_ms, reply_ms)
+        """
+        records = []
+        if not events:
+            return records
+        recorded_offset = 0.0
+        previous_at = events[0][0]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='replay') as pool:
+            for index, (at, payload) in enumerate(events):
+                gap = at - previous_at
+                previous_at = at
+                recorded_offset += min(gap, self.max_gap) if self.max_gap is not None else gap
+                offset = recorded_offset / self.speed if self.speed else 0.0
+                delay = started + offset - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                record = {
+                    'key': event_key(index, payload),
+                    'event': payload.get('event'),
+                    'recipient': recipient_of(payload),
+                    'offset_s': round(offset, 3),
+                    'lag_ms': round(max(0.0, -delay) * 1000, 1),
+                }
+                records.append(record)
+                pool.submit(self._post, record, payload)
+        time.sleep(drain)
+        self._attach_replies(records)
+        for record in records:
+            record.pop('posted_at', None)
+        return records
+
+    def _attach_replies(self, records):
+        """Set reply_ms: time to the first reply before the recipient's next event."""
+        by_recipient = {}
+        for record in records:
+            if record['recipient'] and 'posted_at' in record:
+                by_recipient.setdefault(record['recipient'], []).append(record)
+        for recipient, recipient_records in by_recipient.items():
+            deliveries = self.wasender.deliveries(recipient)
+            recipient_records.sort(key=lambda record: record['posted_at'])
+            for position, record in enumerate(recipient_records):
+                ends_at = recipient_records[position + 1]['posted_at'] if position + 1 < len(recipient_records) else None
+                replies = [(at, text) for at, text in deliveries
+                           if at >= record['posted_at'] and (ends_at is None or at < ends_at)][:1]
+                record['reply_ms'] = round((replies[0][0] - record['posted_at']) * 1000, 1) if replies else None
+
+    def conversations(self, records):
+        """Return {recipient: [reply texts in delivery order]} for every replayed recipient."""
+        recipients = sorted({record['recipient'] for record in records if record['recipient']})
+        return {recipient: [text for _, text in self.wasender.deliveries(recipient)] for recipient in recipients}
+
+
+def summarize(records, elapsed=None):
+    """Latency percentiles (ms), error and reply counts of a replay."""
+    def ms(values):
+        return {name: percentile(values, fraction) for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))}
+
+    webhook = [record['webhook_ms'] for record in records if record.get('webhook_ms') is not None]
+    replies = [record['reply_ms'] for record in records if record.get('reply_ms') is not None]
+    errors = sum(1 for record in records if record.get('status') is None or record['status'] >= 400)
+    summary = {
+        'events': len(records),
+        'errors': errors,
+        'replied': len(replies),
+        'max_lag_ms': max((record['lag_ms'] for record in records), default=0.0),
+        'webhook_ms': ms(webhook),
+        'reply_ms': ms(replies),
+    }
+    if elapsed:
+        summary['elapsed_s'] = round(elapsed, 2)
+        summary['events_per_s'] = round(len(records) / elapsed, 2)
+    return summary
+
+
+def compare_runs(current, previous):
+    """
+    Compare two saved runs of the same traffic.
+
+    Args:
+        current: Run dict ({'records': [...], 'conversations': {...}, 'summary': {...}})
+        previous: Run dict to compare against
+
+    Returns:
+        Dict with per-percentile latency deltas (ms), counts of diverged
+        events/conversations by reason and a few example keys per reason
+    """
+    previous_records = {record['key']: record for record in previous['records']}
+    current_records = {record['key']: record for record in current['records']}
+    divergence = {'status': [], 'reply_count': [], 'reply_text': [], 'reply_order': [],
+                  'missing': sorted(set(previous_records) - set(current_records)),
+                  'new': sorted(set(current_records) - set(previous_records))}
+    for key, record in current_records.items():
+        before = previous_records.get(key)
+        if before is not None and record.get('status') != before.get('status'):
+            divergence['status'].append(key)
+
+    previous_conversations = previous.get('conversations', {})
+    for recipient, replies in current.get('conversations', {}).items():
+        before = previous_conversations.get(recipient, [])
+        if len(replies) != len(before):
+            divergence['reply_count'].append(recipient)
+        elif sorted(replies) != sorted(before):
+            divergence['reply_text'].append(recipient)
+        elif replies != before:
+            divergence['reply_order'].append(recipient)
+
+    latency = {}
+    for metric in ('webhook_ms', 'reply_ms'):
+        for name, value in current['summary'][metric].items():
+            before = previous['summary'][metric].get(name)
+            latency[f"{metric}.{name}"] = {
+                'before': before, 'after': value,
+                'change': round(value / before - 1, 4) if value is not None and before else None,
+            }
+    return {
+        'latency': latency,
+        'diverged': {reason: len(keys) for reason, keys in divergence.items()},
+        'examples': {reason: keys[:5] for reason, keys in divergence.items() if keys},
+    }
+
+
+def format_report(summary, comparison=None):
+    """Render a replay summary (and optional comparison) as text."""
+    def fmt(value):
+        return '-' if value is None else f"{value:.1f}"
+
+    lines = [
+        f"Replayed {summary['events']} events"
+        + (f" in {summary['elapsed_s']} s ({summary['events_per_s']}/s)" if 'elapsed_s' in summary else ''),
+        f"  errors {summary['errors']}, replied {summary['replied']}, max schedule lag {summary['max_lag_ms']} ms",
+        f"  {'latency (ms)':<14} {'p50':>9} {'p95':>9} {'p99':>9}",
+    ]
+    for metric in ('reply_ms', 'webhook_ms'):
+        values = summary[metric]
+        lines.append(f"  {metric[:-3]:<14} {fmt(values['p50']):>9} {fmt(values['p95']):>9} {fmt(values['p99']):>9}")
+    if comparison:
+        lines.append("")
+        lines.append("Compared with the previous run:")
+        for name, values in comparison['latency'].items():
+            change = '-' if values['change'] is None else f"{values['change']:+.1%}"
+            lines.append(f"  {name:<16} {fmt(values['before']):>9} -> {fmt(values['after']):>9} ({change})")
+        diverged = ', '.join(f"{reason}={count}" for reason, count in comparison['diverged'].items())
+        lines.append(f"  diverged: {diverged}")
+        for reason, keys in comparison['examples'].items():
+            lines.append(f"    {reason}: {', '.join(keys)}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest.replay', description="Replay logged webhook traffic")
+    parser.add_argument('logs', nargs='+', help="Log files containing 'Received webhook data' lines (.gz allowed)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Time compression (2 = twice as fast, 0 = no gaps)")
+    parser.add_argument('--max-gap', type=float, default=None,
+                        help="Cap recorded gaps between events at this many seconds (before --speed)")
+    parser.add_argument('--event', action='append', help="Only replay this event type (repeatable)")
+    parser.add_argument('--limit', type=int, default=None, help="Replay at most this many events")
+    parser.add_argument('--max-in-flight', type=int, default=64, help="Concurrent webhook requests")
+    parser.add_argument('--drain', type=float, default=2.0, help="Seconds to wait for late replies")
+    parser.add_argument('--wasender-latency', default='lognormal:150:0.4', help="WaSender latency spec (ms)")
+    parser.add_argument('--gemini-latency', default='lognormal:900:0.5', help="Gemini latency spec (ms)")
+    parser.add_argument('--target', default=None, help="Base URL of an already running bot (default: run it in-process)")
+    parser.add_argument('--wasender-port', type=int, default=0, help="Port for the WaSender stand-in (0 = any)")
+    parser.add_argument('--gemini-port', type=int, default=0, help="Port for the Gemini stand-in (0 = any)")
+    parser.add_argument('--output', help="Save this run (records and summary) as JSON")
+    parser.add_argument('--compare', help="A run saved with --output to compare against")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    events = extract_events(args.logs, args.event)[:args.limit]
+    if not events:
+        print("No recorded webhook payloads found", file=sys.stderr)
+        return 1
+    print(f"Replaying {len(events)} events at {args.speed:g}x", file=sys.stderr)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    wasender = FakeWaSender(LatencyModel.parse(args.wasender_latency))
+    gemini = FakeGemini(LatencyModel.parse(args.gemini_latency), deterministic=True)
+    servers = [ServerThread(wasender.app, args.wasender_port).start(), ServerThread(gemini.app, args.gemini_port).start()]
+    print(f"WaSender stand-in: WASENDER_BASE_URL={servers[0].url}", file=sys.stderr)
+    print(f"Gemini stand-in:   GEMINI_API_ENDPOINT={servers[1].url}", file=sys.stderr)
+    try:
+        if args.target:
+            target = args.target
+        else:
+            servers.append(start_bot_in_process(servers[0].url, servers[1].url))
+            target = servers[-1].url
+        started = time.monotonic()
+        replayer = Replayer(target, wasender, speed=args.speed, max_in_flight=args.max_in_flight,
+                            max_gap=args.max_gap)
+        records = replayer.replay(events, drain=args.drain)
+        summary = summarize(records, time.monotonic() - started)
+        conversations = replayer.conversations(records)
+    finally:
+        for server in servers:
+            server.stop()
+
+    run = {'logs': args.logs, 'speed': args.speed, 'max_gap': args.max_gap, 'summary': summary,
+           'records': records, 'conversations': conversations}
+    comparison = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            comparison = compare_runs(run, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, ensure_ascii=False, indent=1)
+
+    if args.json:
+        print(json.dumps({'summary': summary, 'comparison': comparison}, indent=2))
+    else:
+        print(format_report(summary, comparison))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+traffic.py - Realistic messages.upsert traffic for /webhook
+
+Each virtual user is a WhatsApp sender that takes turns: a greeting, a menu
+digit, a free-text question, or a burst of several short messages sent in
+quick succession (the way people actually type on WhatsApp).
+"""
+
+import itertools
+import random
+
+GREETINGS = ('oi', 'olá', 'bom dia', 'boa tarde', 'boa noite', 'oie', 'menu')
+MENU_DIGITS = ('1', '2', '3', '4', '5', '6', '7')
+FREE_TEXT = (
+    "Quanto custa uma armação de grau?",
+    "Vocês fazem lentes multifocais? Quanto fica?",
+    "Quero fazer um orçamento de óculos com lente antirreflexo",
+    "Meus óculos estão com a haste frouxa, vocês ajustam?",
+    "Preciso agendar um exame de vista para sábado",
+    "Qual o prazo para ficar pronta uma lente de grau?",
+    "Vocês trabalham com lentes de contato?",
+    "Queria falar com um consultor sobre lentes para computador",
+    "Dá para parcelar no cartão de crédito?",
+    "Posso levar a receita do oftalmologista e fazer as lentes aí?",
+    "Onde fica a loja? É perto da Domingos Ferreira?",
+    "Preciso de um especialista para ver a armação que quebrou",
+)
+BURST_FRAGMENTS = ("oi pedro", "tudo bem?", "queria uma informação", "sobre lentes de grau",
+                   "minha receita é nova", "quanto fica?", "obrigado")
+
+# Turn kind -> relative weight
+DEFAULT_MIX = {'greeting': 0.2, 'menu': 0.3, 'free_text': 0.4, 'burst': 0.1}
+
+_message_ids = itertools.count(1)
+
+
+def build_payload(sender_jid, text, push_name='Cliente'):
+    """
+    Build a WaSender messages.upsert webhook payload.
+
+    Args:
+        sender_jid: Sender JID (e.g. '5581999990001@s.whatsapp.net')
+        text: Message text
+        push_name: Display name of the sender
+
+    Returns:
+        The payload dict to POST to /webhook
+    """
+    return {
+        'event': 'messages.upsert',
+        'data': {
+            'messages': {
+                'key': {'remoteJid': sender_jid, 'fromMe': False, 'id': f"LOADTEST{next(_message_ids):010d}"},
+                'pushName': push_name,
+                'message': {'conversation': text},
+            }
+        }
+    }
+
+
+def parse_mix(value):
+    """Parse "greeting=0.2,menu=0.3,..." into a turn mix (unknown kinds are rejected)."""
+    mix = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"Unknown turn kind '{kind}' (expected one of {', '.join(DEFAULT_MIX)})")
+        mix[kind] = float(weight)
+    return mix
+
+
+class TrafficGenerator:
+    """Chooses senders and the messages of each turn."""
+
+    def __init__(self, mix=None, burst_size=(2, 4), burst_gap=(0.1, 0.4), rng=None):
+        """
+        Initialize the generator.
+
+        Args:
+            mix: Dict of turn kind -> weight (default DEFAULT_MIX)
+            burst_size: (min, max) messages in a burst turn
+            burst_gap: (min, max) seconds between messages of a burst
+            rng: Optional random.Random, for reproducible runs
+        """
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.burst_size = burst_size
+        self.burst_gap = burst_gap
+        self._rng = rng or random.Random()
+
+    def sender(self, index):
+        """Return a stable, distinct Brazilian mobile JID for virtual user `index`."""
+        return f"55819{index:08d}@s.whatsapp.net"
+
+    def turn(self):
+        """
+        Pick the next turn.
+
+        Returns:
+            (kind, [(delay_before_seconds, text), ...])
+        """
+        kind = self._rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if kind == 'greeting':
+            return kind, [(0.0, self._rng.choice(GREETINGS))]
+        if kind == 'menu':
+            return kind, [(0.0, self._rng.choice(MENU_DIGITS))]
+        if kind == 'free_text':
+            return kind, [(0.0, self._rng.choice(FREE_TEXT))]
+        count = self._rng.randint(*self.burst_size)
+        return kind, [(0.0 if i == 0 else self._rng.uniform(*self.burst_gap), self._rng.choice(BURST_FRAGMENTS))
+                      for i in range(count)]
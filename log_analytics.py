@@ -0,0 +1,337 @@
+"""
+log_analytics.py - Fast structured analytics over whatsapp_bot.log
+
+Memory-maps the log, splits it on line boundaries and scans the pieces in a
+process pool. Each piece is scanned with a handful of compiled regexes over
+the raw bytes instead of a Python loop per line, and the partial results are
+merged in file order.
+
+Usage:
+    python log_analytics.py                       # analyze whatsapp_bot.log
+    python log_analytics.py bot.log bot.log.1     # several files
+    python log_analytics.py --json --workers 8
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from lanes import percentile
+
+DEFAULT_LOG_FILE = 'whatsapp_bot.log'
+
+# Pieces smaller than this are not worth shipping to another process
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Every log record starts with "YYYY-MM-DD HH:MM:SS,mmm - LEVEL - logger - ".
+# Patterns start with a literal (here the newline before the record) so the
+# regex engine can skip ahead with a fast search instead of trying every byte.
+RECORD = rb'(\d{4}-\d\d-\d\d \d\d):\d\d:\d\d,\d{3} - ([A-Z]+) - '
+RECORD_RE = re.compile(rb'\n' + RECORD)
+FIRST_RECORD_RE = re.compile(RECORD)
+# A record up to the first character of its message
+MESSAGE_START_RE = re.compile(RECORD + rb'[^\n]*? - ')
+
+WEBHOOK_RE = re.compile(re.escape(b'=== WEBHOOK CALLED ==='))
+ERROR_LEVELS = (b'ERROR', b'CRITICAL')
+ERROR_RES = [re.compile(re.escape(b' - ' + level + b' - ')) for level in ERROR_LEVELS]
+GROUP_SUFFIX_RE = re.compile(re.escape(b'@g.us'))
+DIGITS_RE = re.compile(r'\d+')
+CHUNK_SENT = b' - Successfully sent chunk '
+CHUNK_FAILED = b' - Failed to send message chunk '
+
+# Gemini latency: the explicit "received in N ms" line, or (for logs written
+# before it existed) the gap between the prompt and the first chunk send
+GEMINI_PROMPT_RE = re.compile(re.escape(b'Sending prompt to Gemini'))
+GEMINI_EXPLICIT_RE = re.compile(rb'Gemini response received in (\d+) ms')
+GEMINI_REPLY_RE = re.compile(rb'Sending \d+ message chunks')
+
+
+def _timestamp(raw):
+    """Convert b'YYYY-MM-DD HH:MM:SS,mmm' to epoch seconds."""
+    return datetime(int(raw[0:4]), int(raw[5:7]), int(raw[8:10]), int(raw[11:13]),
+                    int(raw[14:16]), int(raw[17:19]), int(raw[20:23]) * 1000).timestamp()
+
+
+def chunk_boundaries(path, pieces):
+    """
+    Split a file into about `pieces` byte ranges that start and end on line boundaries.
+
+    Returns:
+        List of (start, end) offsets
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    pieces = max(1, min(pieces, size // MIN_CHUNK_SIZE or 1))
+    step = size // pieces
+
+    boundaries = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        for _ in range(pieces - 1):
+            newline = mm.find(b'\n', max(start, start + step - 1))
+            if newline == -1:
+                break
+            boundaries.append((start, newline + 1))
+            start = newline + 1
+        if start < size:
+            boundaries.append((start, size))
+    return boundaries
+
+
+def _message_records(data, marker_re):
+    """Yield (record, marker) matches for markers found at the start of a record's message."""
+    for marker in marker_re.finditer(data):
+        line_start = data.rfind(b'\n', 0, marker.start()) + 1
+        record = MESSAGE_START_RE.match(data, line_start)
+        if record and record.end() == marker.start():
+            yield record, marker
+
+
+def _group_ids(data):
+    """Return the group JIDs (15-25 digits followed by @g.us) in data."""
+    group_ids = set()
+    for suffix in GROUP_SUFFIX_RE.finditer(data):
+        end = start = suffix.start()
+        while start > 0 and end - start < 25 and 48 <= data[start - 1] <= 57:
+            start -= 1
+        if end - start >= 15:
+            group_ids.add(data[start:suffix.end()].decode('ascii'))
+    return group_ids
+
+
+def scan_chunk(path, start, end):
+    """
+    Scan one byte range of a log file.
+
+    Returns:
+        A partial result; combine partial results in file order with merge_results()
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+
+    records = Counter(RECORD_RE.findall(data))
+    first = FIRST_RECORD_RE.match(data)
+    if first:
+        records[first.groups()] += 1
+
+    levels = Counter()
+    per_hour = {}
+    for (hour, level), count in records.items():
+        levels[level.decode('ascii')] += count
+        bucket = per_hour.setdefault(hour.decode('ascii'), Counter())
+        bucket['records'] += count
+        if level in ERROR_LEVELS:
+            bucket['errors'] += count
+        elif level == b'WARNING':
+            bucket['warnings'] += count
+    for record, _ in _message_records(data, WEBHOOK_RE):
+        per_hour[record.group(1).decode('ascii')]['webhooks'] += 1
+
+    error_messages = Counter()
+    for marker_re in ERROR_RES:
+        for marker in marker_re.finditer(data):
+            line_start = data.rfind(b'\n', 0, marker.start()) + 1
+            record = MESSAGE_START_RE.match(data, line_start)
+            if not record or record.start(2) != marker.start() + 3:
+                continue
+            line_end = data.find(b'\n', record.end())
+            message = data[record.end():line_end if line_end != -1 else len(data)][:80]
+            error_messages[DIGITS_RE.sub('#', message.decode('utf-8', 'replace'))] += 1
+
+    # Pair prompts with replies inside the range; the first reply before any
+    # prompt and the prompt still open at the end are stitched across ranges
+    gemini_events = sorted(
+        (marker.start(), kind, record, marker)
+        for kind, marker_re in (('prompt', GEMINI_PROMPT_RE), ('explicit', GEMINI_EXPLICIT_RE), ('reply', GEMINI_REPLY_RE))
+        for record, marker in _message_records(data, marker_re)
+    )
+    latencies = []
+    pending = None
+    leading = None
+    saw_prompt = False
+    for _, kind, record, marker in gemini_events:
+        raw_ts = data[record.start():record.start() + 23]
+        if kind == 'prompt':
+            pending = raw_ts
+            saw_prompt = True
+            continue
+        if kind == 'explicit':
+            latencies.append(float(marker.group(1)))
+        if not saw_prompt and leading is None:
+            leading = (kind, raw_ts)
+            continue
+        if kind == 'explicit':
+            pending = None
+        elif pending is not None:
+            latencies.append((_timestamp(raw_ts) - _timestamp(pending)) * 1000)
+            pending = None
+
+    return {
+        'per_hour': per_hour,
+        'levels': levels,
+        'chunks_sent': data.count(CHUNK_SENT),
+        'chunks_failed': data.count(CHUNK_FAILED),
+        'group_ids': _group_ids(data),
+        'error_messages': error_messages,
+        'gemini_latencies_ms': latencies,
+        'leading': leading,
+        'trailing_prompt': pending,
+        'saw_prompt': saw_prompt,
+    }
+
+
+def merge_results(partials):
+    """Combine partial results (in file order) into one aggregate."""
+    total = {
+        'per_hour': {},
+        'levels': Counter(),
+        'chunks_sent': 0,
+        'chunks_failed': 0,
+        'group_ids': set(),
+        'error_messages': Counter(),
+        'gemini_latencies_ms': [],
+    }
+    pending = None
+    for partial in partials:
+        for hour, counts in partial['per_hour'].items():
+            total['per_hour'].setdefault(hour, Counter()).update(counts)
+        total['levels'].update(partial['levels'])
+        total['chunks_sent'] += partial['chunks_sent']
+        total['chunks_failed'] += partial['chunks_failed']
+        total['group_ids'] |= partial['group_ids']
+        total['error_messages'].update(partial['error_messages'])
+
+        if partial['leading'] is not None:
+            kind, raw_ts = partial['leading']
+            if kind == 'reply' and pending is not None:
+                total['gemini_latencies_ms'].append((_timestamp(raw_ts) - _timestamp(pending)) * 1000)
+            pending = None
+        total['gemini_latencies_ms'].extend(partial['gemini_latencies_ms'])
+        if partial['saw_prompt']:
+            pending = partial['trailing_prompt']
+    return total
+
+
+def analyze(paths, workers=None):
+    """
+    Analyze one or more log files.
+
+    Args:
+        paths: Log file path or list of paths (scanned in the given order)
+        workers: Worker processes (defaults to the CPU count; 1 scans in-process)
+
+    Returns:
+        Aggregate result (see summarize() for a JSON-friendly view)
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    workers = workers or os.cpu_count() or 1
+
+    tasks = []
+    for path in paths:
+        tasks.extend((path, start, end) for start, end in chunk_boundaries(path, workers * 4))
+
+    if workers == 1 or len(tasks) <= 1:
+        partials = [scan_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            partials = list(pool.map(scan_chunk, *zip(*tasks)))
+    return merge_results(partials)
+
+
+def summarize(result, top_errors=10):
+    """Turn an aggregate into JSON-serializable report data."""
+    records = sum(result['levels'].values())
+    errors = result['levels'].get('ERROR', 0) + result['levels'].get('CRITICAL', 0)
+    latencies = result['gemini_latencies_ms']
+
+    per_hour = []
+    for hour in sorted(result['per_hour']):
+        counts = result['per_hour'][hour]
+        per_hour.append({
+            'hour': hour,
+            'records': counts['records'],
+            'webhooks': counts['webhooks'],
+            'errors': counts['errors'],
+            'warnings': counts['warnings'],
+            'error_rate': round(counts['errors'] / counts['records'], 4) if counts['records'] else 0.0,
+        })
+
+    return {
+        'records': records,
+        'levels': dict(result['levels']),
+        'error_rate': round(errors / records, 4) if records else 0.0,
+        'webhooks': sum(hour['webhooks'] for hour in per_hour),
+        'chunks_sent': result['chunks_sent'],
+        'chunks_failed': result['chunks_failed'],
+        'gemini_latency_ms': {
+            'count': len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        },
+        'group_ids': sorted(result['group_ids']),
+        'top_errors': result['error_messages'].most_common(top_errors),
+        'per_hour': per_hour,
+    }
+
+
+def print_report(summary):
+    """Print a human-readable report."""
+    print(f"Records: {summary['records']}  (error rate {summary['error_rate']:.2%})")
+    print(f"Levels: {', '.join(f'{level}={count}' for level, count in sorted(summary['levels'].items()))}")
+    print(f"Webhooks: {summary['webhooks']}")
+    print(f"Chunks sent: {summary['chunks_sent']}  failed: {summary['chunks_failed']}")
+
+    latency = summary['gemini_latency_ms']
+    if latency['count']:
+        print(f"Gemini latency (ms, n={latency['count']}): p50={latency['p50']:.0f} "
+              f"p95={latency['p95']:.0f} p99={latency['p99']:.0f} max={latency['max']:.0f}")
+    else:
+        print("Gemini latency: no samples")
+
+    if summary['group_ids']:
+        print(f"Group IDs: {', '.join(summary['group_ids'])}")
+
+    if summary['top_errors']:
+        print("\nTop errors:")
+        for message, count in summary['top_errors']:
+            print(f"  {count:>6}  {message}")
+
+    print(f"\n{'hour':<14} {'records':>8} {'webhooks':>9} {'errors':>7} {'err%':>6}")
+    for hour in summary['per_hour']:
+        print(f"{hour['hour']:<14} {hour['records']:>8} {hour['webhooks']:>9} {hour['errors']:>7} "
+              f"{hour['error_rate']:>6.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze WhatsApp bot log files")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_LOG_FILE], help="Log files, oldest first")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        print(f"Log file not found: {', '.join(missing)}", file=sys.stderr)
+        return 1
+
+    summary = summarize(analyze(args.paths, workers=args.workers))
+    if args.json:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+    else:
+        print_report(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+logging_setup.py - Queue-backed, optionally rotating and JSON logging with per-category sampling
+
+Request threads only put records on an in-memory queue; a listener thread
+formats them and does the console/file I/O. Hot-path categories (raw
+webhook payloads, per-chunk sends) log through child loggers of
+"whatsapp_bot" so each can get its own level and sampling rate:
+
+    LOG_CATEGORY_LEVELS=payload=WARNING,chunks=INFO
+    LOG_SAMPLE_RATES=payload=0.01
+
+Call sites use %-style arguments, so a record that is below its level or
+sampled out is never formatted.
+
+Rotation is opt-in. Every gunicorn worker appends to the same LOG_FILE, and
+workers rotating a shared file rename and compress each other's open file,
+losing or duplicating lines. By default the file is opened with a
+WatchedFileHandler, which reopens it after an external logrotate moves it;
+LOG_ROTATE_BYTES / LOG_ROTATE_WHEN are only safe for a single process (or a
+LOG_FILE per worker).
+"""
+
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import threading
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Hot-path log categories, as children of the "whatsapp_bot" logger
+CATEGORY_PAYLOAD = 'payload'
+CATEGORY_CHUNKS = 'chunks'
+
+_listener = None
+_installed_handlers = []
+_lock = threading.Lock()
+
+
+def get_category_logger(category):
+    """Return the logger for a hot-path category (e.g. 'payload')."""
+    return logging.getLogger(f"whatsapp_bot.{category}")
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that merges args into the message but leaves formatting to the listener."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_namer(name):
+    return f"{name}.gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def parse_category_settings(value, cast):
+    """
+    Parse "name=value,name=value" settings.
+
+    Args:
+        value: The raw setting string (may be empty)
+        cast: Callable applied to each value
+
+    Returns:
+        Dict of category name -> cast value
+    """
+    settings = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        name, raw = item.split('=', 1)
+        settings[name.strip()] = cast(raw.strip())
+    return settings
+
+
+def build_file_handler(path, max_bytes=0, when='', backup_count=7, compress=True):
+    """
+    Create the log file handler.
+
+    Args:
+        path: Log file path
+        max_bytes: Rotate when the file reaches this size (0: no rotation here; the
+            file is reopened when rotated externally, e.g. by logrotate)
+        when: TimedRotatingFileHandler interval (e.g. 'midnight'); takes precedence over max_bytes
+        backup_count: Rotated files to keep
+        compress: Gzip rotated files
+
+    Returns:
+        A logging.Handler
+    """
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count,
+                                                            encoding='utf-8')
+    elif max_bytes > 0:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+    else:
+        return logging.handlers.WatchedFileHandler(path, encoding='utf-8')
+
+    if compress:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+def configure_logging(env=None):
+    """
+    Configure the root logger from LOG_* settings.
+
+    Safe to call more than once; the handlers installed by the previous call
+    are replaced and its queue listener is stopped.
+
+    Args:
+        env: Mapping to read settings from (defaults to os.environ)
+
+    Returns:
+        The QueueListener doing the I/O, or None when LOG_ASYNC is false
+    """
+    global _listener
+    env = os.environ if env is None else env
+
+    level = getattr(logging, env.get('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    formatter = JsonFormatter() if env.get('LOG_FORMAT', 'text').lower() == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    log_file = env.get('LOG_FILE', 'whatsapp_bot.log')
+    if log_file:
+        handlers.append(build_file_handler(
+            log_file,
+            max_bytes=int(env.get('LOG_ROTATE_BYTES', '0')),
+            when=env.get('LOG_ROTATE_WHEN', ''),
+            backup_count=int(env.get('LOG_BACKUP_COUNT', '7')),
+            compress=env.get('LOG_COMPRESS', 'true').lower() == 'true'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    with _lock:
+        if _listener:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+        for handler in _installed_handlers:
+            root.removeHandler(handler)
+            handler.close()
+        _installed_handlers.clear()
+
+        root.setLevel(level)
+        if env.get('LOG_ASYNC', 'true').lower() == 'true':
+            log_queue = queue.SimpleQueue()
+            _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            _installed_handlers.append(_QueueHandler(log_queue))
+        else:
+            _installed_handlers.extend(handlers)
+        for handler in _installed_handlers:
+            root.addHandler(handler)
+
+    levels = parse_category_settings(env.get('LOG_CATEGORY_LEVELS'), str.upper)
+    rates = parse_category_settings(env.get('LOG_SAMPLE_RATES'), float)
+    for category in (CATEGORY_PAYLOAD, CATEGORY_CHUNKS):
+        category_logger = get_category_logger(category)
+        category_logger.setLevel(getattr(logging, levels.get(category, ''), logging.NOTSET))
+        for existing in [f for f in category_logger.filters if isinstance(f, SamplingFilter)]:
+            category_logger.removeFilter(existing)
+        rate = rates.get(category, 1.0)
+        if rate < 1.0:
+            category_logger.addFilter(SamplingFilter(rate))
+
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener:
+            _listener.stop()
+            _listener = None
+
+
+def _restart_listener_after_fork():
+    # A forked worker inherits the queue handler but not the listener thread,
+    # so without a new listener its records would never be written
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener:
+        _listener = logging.handlers.QueueListener(_listener.queue, *_listener.handlers,
+                                                   respect_handler_level=True)
+        _listener.start()
+
+
+atexit.register(shutdown_logging)
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
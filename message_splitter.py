@@ -1,5 +1,3 @@
-import re
-
 """
 message_splitter.py - Implementation of the message splitting functionality
 """
@@ -11,141 +9,236 @@ def split_message(text, max_lines=3, max_chars_per_line=100):
     """
     return split_message_impl(text, max_lines, max_chars_per_line)
 
+def _whitespace_end(text, index):
+    """Return the index of the first non-whitespace character at or after index."""
+    length = len(text)
+    while index < length and text[index].isspace():
+        index += 1
+    return index
+
+def _remove_backslash_lines(text):
+    """
+    Remove lines that only contain a backslash.
+
+    Linear-time equivalent of applying, in order:
+        re.sub(r'\\n\\s*\\\\\\s*\\n', '\\n', text)
+        re.sub(r'^\\s*\\\\\\s*\\n', '', text)
+        re.sub(r'\\n\\s*\\\\\\s*$', '', text)
+    The regexes rescan whitespace runs from every newline, which is quadratic
+    on inputs with long runs of blank lines.
+    """
+    # Backslash lines in the middle: "\n<ws>\\<ws>\n" -> "\n"
+    pieces = []
+    pos = 0
+    backslash = text.find('\\')
+    while backslash != -1:
+        # Whitespace before the backslash must contain a newline...
+        run_start = backslash
+        while run_start > pos and text[run_start - 1].isspace():
+            run_start -= 1
+        first_newline = text.find('\n', run_start, backslash)
+        if first_newline != -1:
+            # ...and so must the whitespace after it; the match ends at its last newline
+            last_newline = text.rfind('\n', backslash + 1, _whitespace_end(text, backslash + 1))
+            if last_newline != -1:
+                pieces.append(text[pos:first_newline + 1])
+                pos = last_newline + 1
+                backslash = text.find('\\', pos)
+                continue
+        backslash = text.find('\\', backslash + 1)
+    if pieces:
+        pieces.append(text[pos:])
+        text = ''.join(pieces)
+
+    # Backslash line at the start
+    first = len(text) - len(text.lstrip())
+    if first < len(text) and text[first] == '\\':
+        last_newline = text.rfind('\n', first + 1, _whitespace_end(text, first + 1))
+        if last_newline != -1:
+            text = text[last_newline + 1:]
+
+    # Backslash line at the end
+    body = text.rstrip()
+    if body.endswith('\\'):
+        backslash = len(body) - 1
+        first_newline = text.find('\n', len(body[:backslash].rstrip()), backslash)
+        if first_newline != -1:
+            text = text[:first_newline]
+
+    return text
+
+def _normalize(text):
+    """Convert escaped newlines, normalize line endings and drop backslash lines."""
+    normalized_text = text.replace('\\n', '\n').replace('\r\n', '\n')
+
+    # Remove standalone backslashes (only possible if one is left)
+    if '\\' in normalized_text:
+        normalized_text = _remove_backslash_lines(normalized_text)
+
+    return normalized_text
+
+def _wrap_paragraph(paragraph, max_chars_per_line, lines):
+    """
+    Word-wrap a paragraph longer than max_chars_per_line into lines.
+    Words longer than a line are hard-split into max_chars_per_line slices.
+    """
+    current_line = []
+    current_length = 0
+
+    for word in paragraph.split():
+        word_length = len(word)
+
+        if word_length > max_chars_per_line:
+            # Flush accumulated words, then emit the long word in slices
+            if current_line:
+                lines.append(' '.join(current_line))
+                current_line = []
+                current_length = 0
+            lines.extend(word[i:i + max_chars_per_line] for i in range(0, word_length, max_chars_per_line))
+
+        elif not current_line:
+            current_line.append(word)
+            current_length = word_length
+
+        elif current_length + 1 + word_length > max_chars_per_line:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+            current_length = word_length
+
+        else:
+            current_line.append(word)
+            current_length += 1 + word_length
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
 def split_message_impl(text, max_lines=3, max_chars_per_line=100):
     """
     Split a long message into smaller chunks for better WhatsApp readability.
     This improved implementation properly handles long lines without newlines.
-    
+
+    Works in a single pass: every paragraph is turned into output lines, and
+    the lines are then grouped max_lines at a time.
+
     Args:
         text: The text to split
         max_lines: Maximum lines per message chunk
         max_chars_per_line: Maximum characters per line
-        
+
     Returns:
         List of message chunks ready to send
     """
     if not text:
         return []
-    
-    # Convert escaped newlines and normalize line endings
-    normalized_text = text.replace('\\n', '\n').replace('\r\n', '\n')
-    
-    # Remove standalone backslashes using regex
-    normalized_text = re.sub(r'\n\s*\\\s*\n', '\n', normalized_text)
-    normalized_text = re.sub(r'^\s*\\\s*\n', '', normalized_text)
-    normalized_text = re.sub(r'\n\s*\\\s*$', '', normalized_text)
-    
-    # Split by existing newlines
-    paragraphs = normalized_text.split('\n')
-    chunks = []
-    current_chunk = []
-    current_line_count = 0
-    
+
+    lines = []
+    for paragraph in _normalize(text).split('\n'):
+        if len(paragraph) <= max_chars_per_line:
+            # Blank paragraphs become empty lines
+            lines.append(paragraph if paragraph.strip() else '')
+        elif not paragraph.strip():
+            lines.append('')
+        else:
+            _wrap_paragraph(paragraph, max_chars_per_line, lines)
+
+    if max_lines <= 0:
+        # Degenerate config: one line per chunk and blank lines are dropped
+        return [line for line in lines if line]
+
+    return ['\n'.join(lines[i:i + max_lines]) for i in range(0, len(lines), max_lines)]
+
+def _paragraph_blocks(text, max_message_chars):
+    """
+    Break normalized text into (separator, block) pairs no longer than
+    max_message_chars. Paragraphs are kept whole when they fit; longer ones
+    are packed line by line (word-wrapping lines that are themselves too long).
+    """
+    paragraphs = []
+    current = []
+    for line in text.split('\n'):
+        line = line.rstrip()
+        if line.strip():
+            current.append(line)
+        elif current:
+            paragraphs.append(current)
+            current = []
+    if current:
+        paragraphs.append(current)
+
+    blocks = []
     for paragraph in paragraphs:
-        # Handle empty paragraphs
-        if not paragraph.strip():
-            if current_line_count >= max_lines:
-                if current_chunk:
-                    chunks.append('\n'.join(current_chunk))
-                    current_chunk = []
-                    current_line_count = 0
-            
-            if current_line_count < max_lines:
-                current_chunk.append('')
-                current_line_count += 1
+        separator = '\n\n'
+        joined = '\n'.join(paragraph)
+        if len(joined) <= max_message_chars:
+            blocks.append((separator, joined))
             continue
-        
-        # For paragraphs longer than max_chars_per_line, break them up
-        if len(paragraph) > max_chars_per_line:
-            words = paragraph.split()
-            
-            # Special case: single very long word
-            if len(words) == 1:
-                word = words[0]
-                for i in range(0, len(word), max_chars_per_line):
-                    if current_line_count >= max_lines:
-                        if current_chunk:
-                            chunks.append('\n'.join(current_chunk))
-                        current_chunk = []
-                        current_line_count = 0
-                    current_chunk.append(word[i:i+max_chars_per_line])
-                    current_line_count += 1
-                continue
-            
-            # Regular case: paragraph with multiple words
-            current_line = []
-            current_length = 0
-            
-            for word in words:
-                # Handle very long words
-                if len(word) > max_chars_per_line:
-                    # Add accumulated words first
-                    if current_line:
-                        if current_line_count >= max_lines:
-                            if current_chunk:
-                                chunks.append('\n'.join(current_chunk))
-                            current_chunk = []
-                            current_line_count = 0
-                        current_chunk.append(' '.join(current_line))
-                        current_line_count += 1
-                        current_line = []
-                        current_length = 0
-                    
-                    # Split the long word
-                    for i in range(0, len(word), max_chars_per_line):
-                        if current_line_count >= max_lines:
-                            if current_chunk:
-                                chunks.append('\n'.join(current_chunk))
-                            current_chunk = []
-                            current_line_count = 0
-                        current_chunk.append(word[i:i+max_chars_per_line])
-                        current_line_count += 1
-                
-                # Normal word handling
-                elif current_length + len(word) + (1 if current_line else 0) > max_chars_per_line:
-                    # Finalize current line
-                    if current_line:
-                        if current_line_count >= max_lines:
-                            if current_chunk:
-                                chunks.append('\n'.join(current_chunk))
-                            current_chunk = []
-                            current_line_count = 0
-                        current_chunk.append(' '.join(current_line))
-                        current_line_count += 1
-                    
-                    # Start new line with this word
-                    current_line = [word]
-                    current_length = len(word)
-                
-                else:
-                    # Word fits on current line
-                    if current_line:
-                        current_length += 1  # space
-                    current_line.append(word)
-                    current_length += len(word)
-            
-            # Add the last line if it exists
-            if current_line:
-                if current_line_count >= max_lines:
-                    if current_chunk:
-                        chunks.append('\n'.join(current_chunk))
-                    current_chunk = []
-                    current_line_count = 0
-                current_chunk.append(' '.join(current_line))
-                current_line_count += 1
-        
+
+        lines = []
+        for line in paragraph:
+            if len(line) <= max_message_chars:
+                lines.append(line)
+            else:
+                _wrap_paragraph(line, max_message_chars, lines)
+        for line in lines:
+            blocks.append((separator, line))
+            separator = '\n'
+    return blocks
+
+def _pack_blocks(blocks, capacity):
+    """Greedily pack blocks into groups whose joined length fits capacity."""
+    groups = []
+    current = []
+    current_length = 0
+    for separator, block in blocks:
+        if current and current_length + len(separator) + len(block) <= capacity:
+            current.append(separator)
+            current.append(block)
+            current_length += len(separator) + len(block)
         else:
-            # Paragraph fits on one line
-            if current_line_count >= max_lines:
-                if current_chunk:
-                    chunks.append('\n'.join(current_chunk))
-                current_chunk = []
-                current_line_count = 0
-            current_chunk.append(paragraph)
-            current_line_count += 1
-    
-    # Add the final chunk
-    if current_chunk:
-        chunks.append('\n'.join(current_chunk))
-    
-    return chunks
\ No newline at end of file
+            if current:
+                groups.append(''.join(current))
+            current = [block]
+            current_length = len(block)
+    if current:
+        groups.append(''.join(current))
+    return groups
+
+def plan_message(text, max_message_chars=1000):
+    """
+    Split a message into as few chunks as possible, with balanced sizes.
+
+    Every chunk is a separate API call with its own pacing delay, so the
+    number of messages is the cost to minimise. Paragraph boundaries are
+    respected whenever a paragraph fits in a message, and chunk sizes are
+    balanced so the reply never ends with a short trailing fragment.
+
+    Args:
+        text: The text to split
+        max_message_chars: Maximum characters per message
+
+    Returns:
+        List of message chunks ready to send
+    """
+    if max_message_chars < 1:
+        raise ValueError("max_message_chars must be positive")
+    if not text:
+        return []
+
+    blocks = _paragraph_blocks(_normalize(text), max_message_chars)
+    if not blocks:
+        return []
+
+    # Greedy packing gives the minimum number of messages for ordered blocks
+    minimum = len(_pack_blocks(blocks, max_message_chars))
+
+    # Find the smallest capacity that still needs only that many messages
+    low = max(len(block) for _, block in blocks)
+    high = max_message_chars
+    while low < high:
+        middle = (low + high) // 2
+        if len(_pack_blocks(blocks, middle)) <= minimum:
+            high = middle
+        else:
+            low = middle + 1
+
+    return _pack_blocks(blocks, low)
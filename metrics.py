@@ -0,0 +1,439 @@
+"""
+metrics.py - Minimal Prometheus-style metrics registry
+
+Counters, gauges and histograms keep plain Python numbers behind a lock, so
+recording a sample costs a dict update. render() produces the Prometheus
+text exposition format.
+
+Multiple worker processes (e.g. gunicorn) are supported by giving the
+registry a shared directory: each process periodically writes a JSON
+snapshot of its metrics there, and render() merges every snapshot. Counters
+and histograms from exited workers are folded into an archive snapshot
+(archive.json) so totals never go backwards, which Prometheus would read as
+a reset; gauges from exited workers are dropped.
+"""
+
+import bisect
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("whatsapp_bot")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    """Common parts of every metric type."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        """Drop every recorded value (used after a fork)."""
+        with self._lock:
+            self._values = {}
+
+    def family(self):
+        """Return this metric's samples as a JSON-serializable dict."""
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {'type': self.type_name, 'help': self.documentation,
+                'labelnames': list(self.labelnames), 'samples': samples}
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add amount (default 1) to the counter for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+
+    multiprocess_mode decides how values from several workers combine:
+    'sum' (e.g. queue depth) or 'max' (e.g. a value every worker computes
+    from shared state).
+    """
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, multiprocess_mode='sum'):
+        super().__init__(name, documentation, labelnames, registry)
+        self.multiprocess_mode = multiprocess_mode
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Compute the value with function() each time metrics are collected."""
+        self._functions[self._key(labels)] = function
+
+    def family(self):
+        for key, function in list(self._functions.items()):
+            try:
+                value = function()
+            except Exception as e:
+                logger.error(f"Error computing gauge {self.name}: {e}")
+                continue
+            with self._lock:
+                self._values[key] = value
+        family = super().family()
+        family['multiprocess_mode'] = self.multiprocess_mode
+        return family
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record one observation."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block (also usable as a decorator)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def family(self):
+        with self._lock:
+            samples = [[list(key), [list(state[0]), state[1]]] for key, state in self._values.items()]
+        return {'type': self.type_name, 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets), 'samples': samples}
+
+
+def merge_families(snapshots):
+    """
+    Merge metric families from several processes.
+
+    Args:
+        snapshots: List of families dicts (name -> family), one per process
+
+    Returns:
+        Dict of metric name -> merged family
+    """
+    merged = {}
+    for families in snapshots:
+        for name, family in families.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(family, samples={})
+            for labelvalues, value in family['samples']:
+                key = tuple(labelvalues)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = [list(value[0]), value[1]] if family['type'] == 'histogram' else value
+                elif family['type'] == 'histogram':
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                elif family['type'] == 'gauge' and family.get('multiprocess_mode') == 'max':
+                    target['samples'][key] = max(current, value)
+                else:
+                    target['samples'][key] = current + value
+    return merged
+
+
+def render_families(families):
+    """Render merged families in the Prometheus text format."""
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        labelnames = family['labelnames']
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for key in sorted(family['samples']):
+            value = family['samples'][key]
+            if family['type'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(family['buckets']) + [math.inf], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labelnames, key)} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+ARCHIVE_FILE = 'archive.json'
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+@contextmanager
+def _archive_locked(directory, exclusive=False):
+    """Hold the archive lock: shared to read the snapshots, exclusive to fold one into the archive."""
+    with open(os.path.join(directory, 'archive.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def _without_gauges(families):
+    return {name: family for name, family in families.items() if family['type'] != 'gauge'}
+
+
+def read_archive(directory):
+    """Counters and histograms of every exited worker, merged (empty dict if none)."""
+    try:
+        archive = _read_json(os.path.join(directory, ARCHIVE_FILE))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping unreadable metrics archive in {directory}: {e}")
+        return {}
+    return (archive or {}).get('metrics', {})
+
+
+def mark_process_dead(directory, pid):
+    """
+    Retire an exited worker's snapshot (gunicorn's child_exit hook, or a
+    scrape finding a dead pid): its counters and histograms are folded into
+    the archive, so the totals don't drop, and its gauges are discarded.
+
+    Runs under an exclusive lock on the archive, and the snapshot is only
+    removed under that lock, so a snapshot is folded in once.
+    """
+    path = os.path.join(directory, f"metrics_{pid}.json")
+    with _archive_locked(directory, exclusive=True):
+        try:
+            snapshot = _read_json(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable metrics snapshot {path}: {e}")
+            snapshot = None
+        if snapshot is not None:
+            merged = merge_families([read_archive(directory), _without_gauges(snapshot.get('metrics', {}))])
+            archive = {name: dict(family, samples=[[list(key), value] for key, value in family['samples'].items()])
+                       for name, family in merged.items()}
+            _write_json(os.path.join(directory, ARCHIVE_FILE), {'written_at': time.time(), 'metrics': archive})
+        for leftover in (path, f"{path}.tmp"):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+
+class Registry:
+    """Holds the process's metrics and, optionally, shares them with other workers."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = None
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(name, documentation, labelnames, registry=self)
+
+    def gauge(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        return Gauge(name, documentation, labelnames, registry=self, multiprocess_mode=multiprocess_mode)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(name, documentation, labelnames, registry=self, buckets=buckets)
+
+    def collect(self):
+        """Return this process's metric families."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.family() for metric in metrics}
+
+    def enable_multiprocess(self, directory, flush_interval=5.0):
+        """
+        Share metrics through snapshot files in directory.
+
+        Args:
+            directory: Directory shared by every worker
+            flush_interval: Seconds between background snapshot writes
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._start_flusher()
+        # A forked worker starts from zero and needs its own flusher thread
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_flusher(self):
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _after_fork(self):
+        if not self.directory:
+            return
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+        # Replace any file left under our pid by an earlier process that had it, before anyone reads it
+        try:
+            self.write_snapshot()
+        except Exception as e:
+            logger.error(f"Error writing metrics snapshot: {e}")
+        self._start_flusher()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Error writing metrics snapshot: {e}")
+
+    def write_snapshot(self, families=None):
+        """Write this process's metrics to the shared directory (atomically)."""
+        families = self.collect() if families is None else families
+        pid = os.getpid()
+        path = os.path.join(self.directory, f"metrics_{pid}.json")
+        _write_json(path, {'pid': pid, 'written_at': time.time(), 'metrics': families})
+
+    def _read_snapshots(self):
+        snapshots = []
+        dead = []
+        own_pid = os.getpid()
+        # Shared lock: a worker being folded into the archive is counted exactly once
+        with _archive_locked(self.directory):
+            snapshots.append(read_archive(self.directory))
+            for entry in os.scandir(self.directory):
+                if not (entry.name.startswith('metrics_') and entry.name.endswith('.json')):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable metrics snapshot {entry.path}: {e}")
+                    continue
+                if snapshot['pid'] == own_pid:
+                    continue
+                if not _pid_alive(snapshot['pid']):
+                    # Left by a worker that died without its exit hook running; counted as archived
+                    snapshots.append(_without_gauges(snapshot['metrics']))
+                    dead.append(snapshot['pid'])
+                    continue
+                snapshots.append(snapshot['metrics'])
+        for pid in dead:
+            mark_process_dead(self.directory, pid)
+        return snapshots
+
+    def render(self):
+        """Return every metric (merged across workers when shared) in the text format."""
+        families = self.collect()
+        snapshots = [families]
+        if self.directory:
+            self.write_snapshot(families)
+            snapshots.extend(self._read_snapshots())
+        return render_families(merge_families(snapshots))
+
+    def stop(self):
+        """Stop the background flusher after writing a final snapshot."""
+        self._stop.set()
+        if self.directory:
+            self.write_snapshot()
+
+
+REGISTRY = Registry()
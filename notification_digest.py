@@ -0,0 +1,242 @@
+"""
+notification_digest.py - Per-customer dedup and digesting of consultant group notifications
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from notification_events import format_group_notification
+
+logger = logging.getLogger("whatsapp_bot")
+
+
+def format_group_digest(entries):
+    """
+    Build one group message covering several pending notifications.
+
+    Args:
+        entries: List of dicts with customer, messages, menu_options and
+            first_at (epoch seconds), in arrival order
+
+    Returns:
+        The digest text
+    """
+    if len(entries) == 1:
+        entry = entries[0]
+        return format_group_notification(
+            entry['customer'],
+            "\n".join(entry['messages']),
+            ", ".join(entry['menu_options']) or None,
+            timestamp=datetime.fromtimestamp(entry['first_at'])
+        )
+
+    parts = [f"🔔 *{len(entries)} NOVAS SOLICITAÇÕES DE ATENDIMENTO*", ""]
+    for entry in entries:
+        display_number = entry['customer'].replace('@s.whatsapp.net', '').replace('@g.us', '')
+        timestamp = datetime.fromtimestamp(entry['first_at']).strftime('%H:%M')
+        parts.append(f"👤 *Cliente:* {display_number} ({timestamp})")
+        if entry['menu_options']:
+            parts.append(f"📋 *Opção do menu:* {', '.join(entry['menu_options'])}")
+        parts.extend(f"📝 {message}" for message in entry['messages'])
+        parts.append("")
+
+    parts.extend([
+        "---",
+        "_Atender os clientes iniciando conversa com o número de cada um_"
+    ])
+    return "\n".join(parts)
+
+
+class NotificationDigest:
+    """
+    Buffers group notifications and sends them as one digest per flush window.
+
+    - Notifications for a customer already waiting in the digest are merged
+      into that customer's entry.
+    - Notifications for a customer who was announced less than dedup_seconds
+      ago are dropped; the consultants already know about them.
+    - Pending notifications are flushed by a timer window_seconds after the
+      first one arrives, so a burst costs a single WaSender call.
+    """
+
+    def __init__(self, send, window_seconds=30.0, dedup_seconds=600.0, dedup_table=None):
+        """
+        Initialize the digest.
+
+        Args:
+            send: Callable(text) that posts a message to the group; returns truthy on success
+            window_seconds: Time pending notifications wait before being flushed
+            dedup_seconds: Time after a customer's notification during which
+                further notifications for them are suppressed
+            dedup_table: Optional SharedTable (1 field) holding when each customer
+                was last announced, so a customer announced by any worker on the
+                host is suppressed by all of them
+        """
+        self.send = send
+        self.window = window_seconds
+        self.dedup_window = dedup_seconds
+        self.dedup_table = dedup_table
+        self._pending = {}
+        self._last_sent = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stats = {
+            'received': 0,
+            'merged': 0,
+            'suppressed': 0,
+            'digests_sent': 0,
+            'send_failures': 0,
+            'api_calls_saved': 0,
+        }
+
+    def export_dedup(self):
+        """Dedup index as {customer: epoch seconds of their last notification}, expired entries left out."""
+        cutoff = time.time() - self.dedup_window
+        with self._lock:
+            return {customer: sent_at for customer, sent_at in self._last_sent.items() if sent_at >= cutoff}
+
+    def import_dedup(self, last_sent):
+        """
+        Restore a dedup index from export_dedup(), e.g. after a restart.
+
+        Args:
+            last_sent: Dict of customer -> epoch seconds
+
+        Returns:
+            Number of customers still within the dedup window
+        """
+        cutoff = time.time() - self.dedup_window
+        restored = 0
+        with self._lock:
+            for customer, sent_at in last_sent.items():
+                if sent_at >= cutoff and sent_at > self._last_sent.get(customer, 0):
+                    self._last_sent[customer] = sent_at
+                    self._share_last_sent(customer, sent_at)
+                    restored += 1
+        return restored
+
+    def _share_last_sent(self, customer, sent_at):
+        if self.dedup_table is not None:
+            self.dedup_table.update(customer, lambda values: (
+                (sent_at,) if values is None or values[0] < sent_at else None, None))
+
+    def _recently_announced(self, customer, now):
+        last_sent = self._last_sent.get(customer)
+        if self.dedup_table is not None:
+            shared = self.dedup_table.get(customer)
+            if shared is not None and (last_sent is None or shared[0] > last_sent):
+                last_sent = shared[0]
+        return last_sent is not None and now - last_sent < self.dedup_window
+
+    def add(self, customer_number, customer_message, menu_option=None):
+        """
+        Queue a notification for the next digest.
+
+        Args:
+            customer_number: The customer's phone number or JID
+            customer_message: The message from the customer
+            menu_option: Optional menu option selected by the customer
+
+        Returns:
+            True if the notification was queued or merged, False if it was suppressed
+        """
+        now = time.time()
+        with self._lock:
+            self.stats['received'] += 1
+            if self._recently_announced(customer_number, now):
+                self.stats['suppressed'] += 1
+                self.stats['api_calls_saved'] += 1
+                logger.info(f"Suppressed duplicate group notification for {customer_number}")
+                return False
+
+            entry = self._pending.get(customer_number)
+            if entry is None:
+                entry = self._pending[customer_number] = {
+                    'customer': customer_number,
+                    'messages': [],
+                    'menu_options': [],
+                    'first_at': now,
+                    'count': 0,
+                }
+            else:
+                self.stats['merged'] += 1
+            entry['count'] += 1
+            if customer_message not in entry['messages']:
+                entry['messages'].append(customer_message)
+            if menu_option and menu_option not in entry['menu_options']:
+                entry['menu_options'].append(menu_option)
+
+            self._arm_timer()
+        return True
+
+    def _arm_timer(self):
+        # Called with self._lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _merge_back(self, entries):
+        """Return a batch that failed to send to the pending set (called with self._lock held)."""
+        for entry in entries:
+            newer = self._pending.get(entry['customer'])
+            if newer is not None:
+                # The customer wrote again while the batch was out; keep their oldest message first
+                entry['count'] += newer['count']
+                entry['messages'] += [message for message in newer['messages'] if message not in entry['messages']]
+                entry['menu_options'] += [option for option in newer['menu_options']
+                                          if option not in entry['menu_options']]
+            self._pending[entry['customer']] = entry
+        self._arm_timer()
+
+    def flush(self):
+        """
+        Send every pending notification as one digest message now.
+
+        Returns:
+            Number of customers included in the digest (0 if nothing was pending
+            or the send failed; a failed batch goes back to pending for the next flush)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                entries = sorted(self._pending.values(), key=lambda entry: entry['first_at'])
+                self._pending = {}
+            if not entries:
+                return 0
+
+            try:
+                sent = self.send(format_group_digest(entries))
+            except Exception as e:
+                logger.error(f"❌ Error sending notification digest to group: {e}")
+                sent = False
+
+            now = time.time()
+            with self._lock:
+                if not sent:
+                    self.stats['send_failures'] += 1
+                    self._merge_back(entries)
+                    logger.warning(f"Notification digest kept for retry ({len(entries)} customers)")
+                    return 0
+                notifications = sum(entry['count'] for entry in entries)
+                self.stats['digests_sent'] += 1
+                self.stats['api_calls_saved'] += notifications - 1
+                for entry in entries:
+                    self._last_sent[entry['customer']] = now
+                    self._share_last_sent(entry['customer'], now)
+                # Forget customers whose dedup window has passed
+                self._last_sent = {customer: sent_at for customer, sent_at in self._last_sent.items()
+                                   if now - sent_at < self.dedup_window}
+
+        logger.info(f"✅ Notification digest sent to group ({len(entries)} customers, {notifications} notifications)")
+        return len(entries)
+
+    def snapshot(self):
+        """Return counters and the number of pending customers."""
+        with self._lock:
+            return dict(self.stats, pending=len(self._pending))
@@ -0,0 +1,222 @@
+"""
+notification_events.py - Structured notification event stream
+
+The bot appends one JSON line per event to an append-only file. Consumers
+(such as grupo_notificador.py) read it from a checkpointed byte offset, so
+nobody has to tail and regex-parse the human-readable log anymore.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger("whatsapp_bot")
+
+EVENT_TURN_PROCESSED = 'turn_processed'
+
+
+def format_group_notification(customer_number, customer_message, menu_option=None, timestamp=None):
+    """
+    Build the text posted to the consultants' group for a customer request.
+
+    Args:
+        customer_number: The customer's phone number or JID
+        customer_message: The message from the customer
+        menu_option: Optional menu option selected by the customer
+        timestamp: Optional datetime of the request (defaults to now)
+
+    Returns:
+        The notification text
+    """
+    # Format customer number for display (remove @s.whatsapp.net)
+    display_number = customer_number.replace('@s.whatsapp.net', '').replace('@g.us', '')
+    timestamp = (timestamp or datetime.now()).strftime('%d/%m/%Y às %H:%M')
+
+    notification_parts = [
+        "🔔 *NOVA SOLICITAÇÃO DE ATENDIMENTO*",
+        "",
+        f"👤 *Cliente:* {display_number}",
+        f"⏰ *Horário:* {timestamp}",
+        ""
+    ]
+
+    if menu_option:
+        notification_parts.append(f"📋 *Opção do menu:* {menu_option}")
+        notification_parts.append("")
+
+    notification_parts.extend([
+        "📝 *Mensagem:*",
+        customer_message,
+        "",
+        "---",
+        "_Atender o cliente iniciando conversa com o número dele_"
+    ])
+
+    return "\n".join(notification_parts)
+
+
+class EventLog:
+    """Append-only JSON-lines event file shared by every worker process."""
+
+    def __init__(self, path):
+        """
+        Initialize the event log.
+
+        Args:
+            path: Path of the event file (created on first append)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, event_type, **payload):
+        """
+        Append an event.
+
+        Each event is written with a single O_APPEND write, so lines from
+        concurrent workers never interleave.
+
+        Args:
+            event_type: Event type name
+            **payload: Event fields
+
+        Returns:
+            The event dict that was written
+        """
+        event = {
+            'id': uuid.uuid4().hex,
+            'type': event_type,
+            'ts': time.time(),
+        }
+        event.update(payload)
+        line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        return event
+
+
+class EventConsumer:
+    """
+    Reads events after a checkpointed offset.
+
+    Call commit() after an event has been handled; the checkpoint is written
+    atomically (temp file + rename), so a restart resumes right after the last
+    handled event.
+
+    For a side effect that must not happen twice (a group message), call
+    begin(event_id) before it: the id is saved in the checkpoint until the
+    event is committed (or cancel() is called when the side effect failed).
+    After a crash in between, interrupted(event) is True for that event on
+    restart, and the consumer skips it instead of repeating it.
+    """
+
+    def __init__(self, path, checkpoint_path):
+        """
+        Initialize the consumer.
+
+        Args:
+            path: Path of the event file
+            checkpoint_path: Path of this consumer's checkpoint file
+        """
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.offset, self.in_flight = self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            return int(checkpoint.get('offset', 0)), checkpoint.get('in_flight')
+        except FileNotFoundError:
+            return 0, None
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Invalid checkpoint {self.checkpoint_path}: {e}. Starting from the beginning.")
+            return 0, None
+
+    def seek_to_end(self):
+        """Skip every event already in the file (used on first start)."""
+        try:
+            self.offset = os.path.getsize(self.path)
+        except OSError:
+            self.offset = 0
+        self.commit(self.offset)
+
+    def has_checkpoint(self):
+        """Return True if this consumer has committed an offset before."""
+        return os.path.exists(self.checkpoint_path)
+
+    def poll(self, max_events=100):
+        """
+        Read complete events after the current offset.
+
+        Returns:
+            List of (next_offset, event) tuples; pass next_offset to commit()
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            logger.warning(f"Event file {self.path} shrank; restarting from the beginning")
+            self.offset = 0
+        if size == self.offset:
+            return []
+
+        events = []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            offset = self.offset
+            for raw_line in f:
+                # A line without its newline is still being written
+                if not raw_line.endswith(b'\n'):
+                    break
+                offset += len(raw_line)
+                try:
+                    events.append((offset, json.loads(raw_line)))
+                except ValueError:
+                    logger.error(f"Skipping malformed event at offset {offset - len(raw_line)} in {self.path}")
+                    if not events:
+                        self.offset = offset
+                if len(events) >= max_events:
+                    break
+        return events
+
+    def begin(self, event_id):
+        """Persist that the event with this id is being handled (before its side effect)."""
+        self._write_checkpoint(self.offset, event_id)
+
+    def cancel(self):
+        """Forget the event passed to begin(); its side effect failed and may be retried."""
+        self._write_checkpoint(self.offset, None)
+
+    def interrupted(self, event):
+        """Return True if a previous run crashed while handling this event."""
+        return self.in_flight is not None and event.get('id') == self.in_flight
+
+    def commit(self, offset):
+        """Persist offset as the position after the last handled event."""
+        self._write_checkpoint(offset, None)
+
+    def _write_checkpoint(self, offset, in_flight):
+        self.offset = offset
+        self.in_flight = in_flight
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'offset': offset, 'in_flight': in_flight, 'updated_at': time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
@@ -0,0 +1,461 @@
+"""
+outbox.py - Durable outbox for reply chunks with resumable delivery
+
+Every reply is written to disk as a planned sequence of chunks before its
+first chunk is sent (<directory>/pending/<id>.json). The entry records how
+many chunks WaSender has acknowledged, so delivery resumes from the first
+unacknowledged chunk, whether it is interrupted by a failed send (retried
+with exponential backoff) or by the process exiting (the entry is recovered
+by the next process). After max_attempts failed attempts an entry is moved
+to <directory>/dead/ for an operator to inspect and retry.
+
+Entries are owned by the process that created them, identified by host
+name and pid. A process only delivers its own entries and the ones it
+recovered from processes that are gone; replies to the same recipient are
+delivered in the order they were planned. The directory may be shared by
+several nodes, where a pid says nothing about liveness, so each owner holds
+an fcntl lock on <directory>/owners/<host>-<pid>.lock for as long as it
+runs: the kernel (or the NFS lock manager) drops the lock when the process
+dies, and an owner whose lock can be taken is gone.
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("whatsapp_bot")
+
+STATUS_DELIVERED = 'delivered'
+STATUS_RETRY = 'retry'
+STATUS_DEAD = 'dead'
+STATUS_STOPPED = 'stopped'
+STATUS_QUEUED = 'queued'
+
+
+HOSTNAME = socket.gethostname()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists but belongs to someone else
+    return True
+
+
+class Outbox:
+    """Reply chunk sequences persisted until every chunk is delivered."""
+
+    def __init__(self, directory, max_attempts=5, retry_delay=5.0, max_retry_delay=300.0, on_delivered=None):
+        """
+        Args:
+            directory: Where pending and dead-lettered entries are kept
+            max_attempts: Failed delivery attempts before an entry is dead-lettered
+            retry_delay: Seconds before the first retry; doubles on every failure
+            max_retry_delay: Upper bound for the retry delay
+            on_delivered: Optional callable(entry) run once an entry is fully delivered
+        """
+        self.directory = directory
+        self.pending_dir = os.path.join(directory, 'pending')
+        self.dead_dir = os.path.join(directory, 'dead')
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.on_delivered = on_delivered
+        self.stats = {'enqueued': 0, 'delivered': 0, 'failed_attempts': 0, 'dead_lettered': 0,
+                      'recovered': 0, 'requeued': 0}
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        """Forget the parent's entries and locks in a forked worker (they are recovered as orphans)."""
+        # fcntl locks are not inherited across fork; the child takes its own owner lock
+        if getattr(self, '_owner_fd', None) is not None:
+            os.close(self._owner_fd)
+        self._owner_fd = None
+        self.owner_id = f"{HOSTNAME}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._delivering = set()
+        self._recipient_locks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Storage
+
+    def _path(self, entry_id, dead=False):
+        return os.path.join(self.dead_dir if dead else self.pending_dir, f"{entry_id}.json")
+
+    def _write(self, entry, dead=False):
+        path = self._path(entry['id'], dead)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable outbox entry {path}: {e}")
+            return None
+
+    def _list(self, dead=False):
+        directory = self.dead_dir if dead else self.pending_dir
+        return sorted(glob.glob(os.path.join(directory, '*.json')))
+
+    # Ownership
+
+    def _owner_lock_path(self, owner_id):
+        return os.path.join(self.directory, 'owners', f"{owner_id}.lock")
+
+    def _hold_owner_lock(self):
+        """Take this process's owner lock (once) before it owns any entry."""
+        with self._lock:
+            if self._owner_fd is not None:
+                return
+            path = self._owner_lock_path(self.owner_id)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                logger.error(f"Cannot lock outbox owner file {path}: {e}")
+                return
+            self._owner_fd = fd
+
+    def _own(self, entry):
+        """Make this process the entry's owner."""
+        self._hold_owner_lock()
+        entry['owner'] = os.getpid()
+        entry['owner_host'] = HOSTNAME
+
+    def _owner_gone(self, entry):
+        """Whether the process owning the entry has exited (on any host sharing the directory)."""
+        owner = entry.get('owner')
+        if owner is None:
+            return True
+        host = entry.get('owner_host')
+        if host is None:
+            # Written before owners were scoped by host: only the pid is known
+            return not _process_alive(owner)
+        owner_id = f"{host}-{owner}"
+        if owner_id == self.owner_id:
+            # Ours by id but not known to us: left by an earlier process that had our pid
+            return True
+        path = self._owner_lock_path(owner_id)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False  # still held: the owner is running
+        finally:
+            os.close(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return True
+
+    # Delivery
+
+    def enqueue(self, recipient, chunks, **meta):
+        """
+        Persist a planned reply before any of it is sent.
+
+        Args:
+            recipient: WhatsApp JID the chunks go to
+            chunks: The reply's chunks, in order
+            **meta: JSON-serialisable details kept with the entry (e.g. what to
+                save to the conversation history once it is delivered)
+
+        Returns:
+            The entry dict, owned by this process
+        """
+        now = time.time()
+        entry = {
+            # Time-ordered ids, so sorting file names gives planning order
+            'id': f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}",
+            'recipient': recipient,
+            'chunks': list(chunks),
+            'sent': 0,
+            'attempts': 0,
+            'created_at': now,
+            # The caller delivers it right away; the retry thread only picks it up if that fails
+            'next_attempt_at': now + self.retry_delay,
+            'last_error': None,
+            'meta': meta,
+        }
+        self._own(entry)
+        self._write(entry)
+        with self._lock:
+            self._entries[entry['id']] = entry
+            self.stats['enqueued'] += 1
+        return entry
+
+    def _recipient_lock(self, recipient):
+        with self._lock:
+            lock = self._recipient_locks.get(recipient)
+            if lock is None:
+                lock = self._recipient_locks[recipient] = threading.Lock()
+            return lock
+
+    def _has_earlier(self, entry):
+        with self._lock:
+            return any(other['recipient'] == entry['recipient'] and other['id'] < entry['id']
+                       for other in self._entries.values())
+
+    def deliver(self, entry, send, pause=None):
+        """
+        Send the entry's unacknowledged chunks, recording progress after each one.
+
+        Args:
+            entry: An entry owned by this process
+            send: Callable(index, chunk) returning True once WaSender accepted the chunk
+            pause: Optional callable(index) run between chunks; returning False
+                stops delivery (the entry stays pending, e.g. while shutting down)
+
+        Returns:
+            STATUS_DELIVERED, STATUS_RETRY (a send failed; retried later),
+            STATUS_DEAD (dead-lettered), STATUS_STOPPED or STATUS_QUEUED (an
+            earlier reply to the same recipient is still pending)
+        """
+        with self._recipient_lock(entry['recipient']):
+            if entry['id'] not in self._entries:
+                # Finished or dead-lettered by another thread while we waited for the lock
+                return STATUS_DELIVERED if entry['sent'] >= len(entry['chunks']) else STATUS_DEAD
+            if self._has_earlier(entry):
+                return STATUS_QUEUED
+            with self._lock:
+                self._delivering.add(entry['id'])
+            try:
+                chunks = entry['chunks']
+                while entry['sent'] < len(chunks):
+                    index = entry['sent']
+                    if not send(index, chunks[index]):
+                        return self._fail(entry, f"chunk {index + 1}/{len(chunks)} was not accepted")
+                    entry['sent'] = index + 1
+                    entry['last_error'] = None
+                    if entry['sent'] < len(chunks):
+                        self._write(entry)
+                        if pause and pause(index) is False:
+                            return STATUS_STOPPED
+                self._finish(entry)
+            finally:
+                with self._lock:
+                    self._delivering.discard(entry['id'])
+        if self.on_delivered:
+            try:
+                self.on_delivered(entry)
+            except Exception as e:
+                logger.error(f"Error after delivering outbox entry {entry['id']}: {e}", exc_info=True)
+        return STATUS_DELIVERED
+
+    def _finish(self, entry):
+        # File first: once the id leaves _entries, recover() must not find it on disk
+        try:
+            os.remove(self._path(entry['id']))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._entries.pop(entry['id'], None)
+            self.stats['delivered'] += 1
+
+    def _fail(self, entry, error):
+        entry['attempts'] += 1
+        entry['last_error'] = error
+        with self._lock:
+            self.stats['failed_attempts'] += 1
+        if entry['attempts'] >= self.max_attempts:
+            entry['dead_at'] = time.time()
+            self._write(entry, dead=True)
+            try:
+                os.remove(self._path(entry['id']))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._entries.pop(entry['id'], None)
+                self.stats['dead_lettered'] += 1
+            logger.error(f"Outbox entry {entry['id']} for {entry['recipient']} dead-lettered after "
+                         f"{entry['attempts']} attempts ({entry['sent']}/{len(entry['chunks'])} chunks delivered): {error}")
+            return STATUS_DEAD
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (entry['attempts'] - 1))
+        entry['next_attempt_at'] = time.time() + delay
+        self._write(entry)
+        logger.warning(f"Outbox entry {entry['id']} for {entry['recipient']}: {error}; "
+                       f"attempt {entry['attempts']}/{self.max_attempts}, retrying in {delay:.0f}s")
+        return STATUS_RETRY
+
+    def due(self, now=None):
+        """This process's pending entries whose next attempt is due, oldest first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = [entry for entry in self._entries.values()
+                       if entry['next_attempt_at'] <= now and entry['id'] not in self._delivering]
+        return sorted(entries, key=lambda entry: entry['id'])
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._entries)
+
+    # Recovery and dead letters
+
+    def _claim(self, path):
+        """Take ownership of a pending entry file; None if another process got it first."""
+        claimed = f"{path}.claim-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        entry = self._read(claimed)
+        if entry is None:
+            return None
+        self._own(entry)
+        self._write(entry)
+        os.remove(claimed)
+        with self._lock:
+            self._entries[entry['id']] = entry
+        return entry
+
+    def recover(self):
+        """
+        Claim pending entries left behind by processes that are gone.
+
+        Returns:
+            The claimed entries, oldest first
+        """
+        recovered = []
+        for path in self._list():
+            entry_id = os.path.basename(path)[:-len('.json')]
+            with self._lock:
+                if entry_id in self._entries or entry_id in self._delivering:
+                    continue
+            entry = self._read(path)
+            if entry is None or not self._owner_gone(entry):
+                continue
+            entry = self._claim(path)
+            if entry is not None:
+                entry['next_attempt_at'] = min(entry['next_attempt_at'], time.time())
+                recovered.append(entry)
+        if recovered:
+            with self._lock:
+                self.stats['recovered'] += len(recovered)
+            logger.info(f"Recovered {len(recovered)} undelivered reply(ies) from the outbox")
+        return recovered
+
+    def list_entries(self, dead=False, limit=100):
+        """Pending or dead-lettered entries on disk (any owner), oldest first."""
+        entries = []
+        for path in self._list(dead)[:limit]:
+            entry = self._read(path)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def get(self, entry_id):
+        """An entry by id from the pending or dead-letter store (None if unknown)."""
+        if not entry_id.replace('-', '').isalnum():
+            return None
+        for dead in (False, True):
+            entry = self._read(self._path(entry_id, dead))
+            if entry is not None:
+                return dict(entry, state='dead' if dead else 'pending')
+        return None
+
+    def requeue(self, entry_id):
+        """
+        Move a dead-lettered entry back to pending, owned by this process,
+        with its attempts reset; delivery resumes from its first unsent chunk.
+
+        Returns:
+            The entry, or None if no such dead-lettered entry exists
+        """
+        if not entry_id.replace('-', '').isalnum():
+            return None
+        path = self._path(entry_id, dead=True)
+        claimed = f"{path}.claim-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        entry = self._read(claimed)
+        if entry is None:
+            return None
+        entry.update(attempts=0, next_attempt_at=time.time())
+        entry.pop('dead_at', None)
+        self._own(entry)
+        self._write(entry)
+        os.remove(claimed)
+        with self._lock:
+            self._entries[entry['id']] = entry
+            self.stats['requeued'] += 1
+        logger.info(f"Outbox entry {entry_id} for {entry['recipient']} requeued from the dead-letter store")
+        return entry
+
+    # Background retries
+
+    def start(self, deliver, interval=1.0, recover_every=30.0, on_recovery=None):
+        """
+        Start the retry thread (no-op when interval is 0 or it is running).
+
+        Args:
+            deliver: Callable(entry) delivering one due entry
+            interval: Seconds between scans for due entries
+            recover_every: Seconds between scans for orphaned entries
+            on_recovery: Optional callable run after each orphan scan (e.g.
+                picking up work other exited processes handed off)
+        """
+        if interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(deliver, interval, recover_every, on_recovery),
+                                        name="outbox-retry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, deliver, interval, recover_every, on_recovery=None):
+        last_recovery = time.monotonic()
+        while not self._stop.wait(interval):
+            if time.monotonic() - last_recovery >= recover_every:
+                last_recovery = time.monotonic()
+                self.recover()
+                if on_recovery:
+                    try:
+                        on_recovery()
+                    except Exception as e:
+                        logger.error(f"Error after outbox recovery scan: {e}", exc_info=True)
+            for entry in self.due():
+                if self._stop.is_set():
+                    break
+                try:
+                    deliver(entry)
+                except Exception as e:
+                    logger.error(f"Error delivering outbox entry {entry['id']}: {e}", exc_info=True)
+
+    def snapshot(self):
+        """Outbox state for /status."""
+        return dict(self.stats, directory=self.directory, pending=self.pending, dead=len(self._list(dead=True)))
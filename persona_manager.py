@@ -0,0 +1,221 @@
+"""
+persona_manager.py - Hot-reloadable persona with precompiled artifacts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger("whatsapp_bot")
+
+
+def compile_keyword_matcher(keywords):
+    """
+    Compile a list of keywords into a single case-insensitive substring matcher.
+
+    Args:
+        keywords: List of keywords (matched anywhere in the text)
+
+    Returns:
+        A compiled regex, or None when there are no keywords
+    """
+    if not keywords:
+        return None
+    # Longest first so overlapping keywords don't shadow each other
+    ordered = sorted({keyword.lower() for keyword in keywords}, key=len, reverse=True)
+    return re.compile('|'.join(re.escape(keyword) for keyword in ordered))
+
+
+class PersonaSnapshot:
+    """
+    One immutable persona version together with everything derived from it.
+
+    Snapshots are never mutated after they are published; a reload builds a new
+    snapshot and swaps the reference, so a request that grabbed a snapshot keeps
+    a consistent view even if a reload happens mid-request.
+    """
+
+    def __init__(self, version, description, name, few_shot_examples, menu_config, artifacts=None):
+        """
+        Initialize the snapshot.
+
+        Args:
+            version: Content hash identifying this persona version
+            description: Full system instruction (base prompt + description)
+            name: Persona display name
+            few_shot_examples: List of few-shot examples from persona.json
+            menu_config: Interactive menu configuration dict
+            artifacts: Dict of derived structures (name -> value)
+        """
+        self.version = version
+        self.description = description
+        self.name = name
+        self.few_shot_examples = few_shot_examples
+        self.menu_config = menu_config
+        self.artifacts = artifacts or {}
+        self.loaded_at = time.time()
+
+    def artifact(self, name, default=None):
+        """Return a derived artifact built for this version."""
+        return self.artifacts.get(name, default)
+
+
+class PersonaManager:
+    """
+    Loads persona.json, precompiles derived artifacts and hot-swaps new versions.
+
+    Change detection is a cheap ``os.stat`` (mtime + size) followed by a content
+    hash, so touching the file without changing it does not trigger a rebuild.
+    All derived artifacts are built before the swap, never on the request path.
+    Every gunicorn worker runs its own watcher, so all workers converge on the
+    new version within one check interval.
+    """
+
+    def __init__(self, file_path, loader, artifacts=None, check_interval=5.0):
+        """
+        Initialize the persona manager and load the first version.
+
+        Args:
+            file_path: Path to the persona JSON file
+            loader: Callable(file_path, raw) returning
+                (description, name, few_shot_examples, menu_config); raw is
+                the file content the version hash was computed from (None if
+                the file could not be read), so the loader must parse it
+                rather than reading the file again
+            artifacts: Optional dict of artifact name -> builder(snapshot)
+            check_interval: Seconds between change checks in the watcher thread
+        """
+        self.file_path = file_path
+        self.loader = loader
+        self.check_interval = check_interval
+        self._builders = dict(artifacts or {})
+        self._subscribers = []
+        self._reload_lock = threading.Lock()
+        self._stat_signature = None
+        self._watcher = None
+        self._stop_event = threading.Event()
+        self.reload_count = 0
+        signature = self._stat()
+        self.current = self._build_snapshot(self._read_raw(), signature)
+
+    def register_artifact(self, name, builder):
+        """
+        Register a derived artifact and rebuild the current snapshot with it.
+
+        Args:
+            name: Artifact name
+            builder: Callable(snapshot) returning the artifact value
+        """
+        self._builders[name] = builder
+        self.reload(force=True)
+
+    def subscribe(self, callback):
+        """Register a callback(snapshot) invoked after every swap."""
+        self._subscribers.append(callback)
+
+    def _stat(self):
+        try:
+            stat_result = os.stat(self.file_path)
+            return (stat_result.st_mtime_ns, stat_result.st_size)
+        except OSError:
+            return None
+
+    def _read_raw(self):
+        try:
+            with open(self.file_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _content_hash(raw):
+        if raw is None:
+            return 'default'
+        return hashlib.sha256(raw).hexdigest()[:16]
+
+    def _build_snapshot(self, raw, signature):
+        # The stat is taken before the read, so an edit after it is seen by the next check
+        self._stat_signature = signature
+        version = self._content_hash(raw)
+        description, name, few_shot_examples, menu_config = self.loader(self.file_path, raw)
+        snapshot = PersonaSnapshot(version, description, name, few_shot_examples, menu_config)
+        for artifact_name, builder in self._builders.items():
+            try:
+                snapshot.artifacts[artifact_name] = builder(snapshot)
+            except Exception as e:
+                logger.error(f"Error building persona artifact '{artifact_name}': {e}", exc_info=True)
+        return snapshot
+
+    def reload(self, force=False):
+        """
+        Rebuild and swap the persona if the file changed.
+
+        Args:
+            force: Rebuild even if the content hash did not change
+
+        Returns:
+            True if a new snapshot was published, False otherwise
+        """
+        with self._reload_lock:
+            signature = self._stat()
+            if not force and signature == self._stat_signature:
+                return False
+
+            raw = self._read_raw()
+            version = self._content_hash(raw)
+            if not force and version == self.current.version:
+                self._stat_signature = signature
+                return False
+
+            # An editor may still be writing (or replacing) the file; keep serving
+            # the current version instead of falling back to the default persona
+            if raw is None and not force:
+                logger.warning(f"Persona file {self.file_path} is missing; keeping version {self.current.version}")
+                return False
+            if raw is not None and not force:
+                try:
+                    json.loads(raw)
+                except ValueError:
+                    logger.warning(f"Persona file {self.file_path} is not valid JSON; keeping version {self.current.version}")
+                    return False
+
+            snapshot = self._build_snapshot(raw, signature)
+            previous = self.current
+            self.current = snapshot
+            self.reload_count += 1
+
+        if snapshot.version != previous.version:
+            logger.info(f"Persona reloaded: version {previous.version} -> {snapshot.version}")
+        for callback in self._subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Error in persona reload subscriber: {e}", exc_info=True)
+        return True
+
+    def start_watcher(self):
+        """Start a daemon thread that checks for persona changes periodically."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=self._watch, name="persona-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Persona watcher started (checking every {self.check_interval}s)")
+
+    def stop_watcher(self):
+        """Stop the watcher thread."""
+        self._stop_event.set()
+        if self._watcher:
+            self._watcher.join(timeout=self.check_interval + 1)
+            self._watcher = None
+
+    def _watch(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Error checking persona for changes: {e}", exc_info=True)
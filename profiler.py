@@ -0,0 +1,360 @@
+"""
+profiler.py - Statistical stack sampler and latency watchdog for live workers
+
+StackSampler wakes up every `interval` seconds, grabs the stack of every
+thread with sys._current_frames() and counts identical stacks. The result is
+collapsed-stack text ("thread;outer;inner count" per line) that flamegraph.pl,
+speedscope or inferno can render directly.
+
+Two views are produced from the same samples:
+- wall: every sample of every thread, so time spent waiting on Gemini,
+  WaSender or locks shows up.
+- cpu: samples weighted by the CPU time each thread actually used since the
+  previous sample (from /proc/self/task/<tid>/stat), so idle threads vanish.
+  Where /proc isn't available, threads whose top frame is a known blocking
+  call are treated as idle instead.
+
+Captures never run on a request thread: a sync gunicorn worker busy
+sampling for 30 s would stop serving webhooks and be killed by the worker
+timeout. ProfileJobs runs on-demand captures in the background and writes
+them to a directory, so any worker on the host can report their progress
+and serve the result.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from lanes import percentile
+
+logger = logging.getLogger("whatsapp_bot")
+
+# Top-of-stack functions that mean "blocked, not using CPU" (fallback CPU view)
+IDLE_FUNCTIONS = frozenset({
+    'wait', 'sleep', 'select', 'poll', 'accept', 'recv', 'recv_into', 'read', 'readinto',
+    'acquire', 'get', '_wait_for_tstate_lock', 'epoll', 'serve_forever',
+})
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_cpu_ticks(native_id):
+    """Return utime + stime (clock ticks) for a thread, or None if unavailable."""
+    try:
+        with open(f'/proc/self/task/{native_id}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces; fields after it are space separated
+    fields = stat[stat.rfind(b')') + 2:].split()
+    return int(fields[11]) + int(fields[12])
+
+
+class StackSampler:
+    """Samples every thread's stack at a fixed interval."""
+
+    def __init__(self, interval=0.01, max_depth=64):
+        """
+        Initialize the sampler.
+
+        Args:
+            interval: Seconds between samples
+            max_depth: Innermost frames kept per stack
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.wall = Counter()
+        self.cpu = Counter()  # stack -> CPU seconds
+        self.samples = 0
+        self._cpu_ticks = {}
+
+    def _sample(self, own_ident):
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            thread = threads.get(ident)
+            name = thread.name if thread else f"thread-{ident}"
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            top_function = stack[0].split(' ', 1)[0] if stack else ''
+            key = ';'.join([name] + stack[::-1])
+            self.wall[key] += 1
+
+            native_id = getattr(thread, 'native_id', None)
+            ticks = _thread_cpu_ticks(native_id) if native_id else None
+            if ticks is None:
+                if top_function not in IDLE_FUNCTIONS:
+                    self.cpu[key] += self.interval
+                continue
+            previous = self._cpu_ticks.get(ident)
+            self._cpu_ticks[ident] = ticks
+            if previous is not None and ticks > previous:
+                self.cpu[key] += (ticks - previous) / _CLOCK_TICKS
+        self.samples += 1
+
+    def run(self, seconds, stop_event=None):
+        """
+        Sample for `seconds` (or until stop_event is set) on the calling thread.
+
+        Returns:
+            self, with wall/cpu counters filled in
+        """
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            self._sample(own_ident)
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (e.g. GIL contention); don't try to catch up
+                next_sample = time.monotonic()
+        return self
+
+    def collapsed(self, view='wall'):
+        """
+        Return collapsed-stack text for 'wall' or 'cpu'.
+
+        CPU time is converted to sampling intervals so both views use the
+        same unit.
+        """
+        if view == 'cpu':
+            counts = {stack: max(1, round(seconds / self.interval)) for stack, seconds in self.cpu.items()}
+        else:
+            counts = self.wall
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(counts.items())) + ("\n" if counts else "")
+
+
+_profile_lock = threading.Lock()
+
+
+def profile(seconds, interval=0.01):
+    """
+    Profile the whole process; only one profile runs at a time.
+
+    Returns:
+        The finished StackSampler, or None if another profile is already running
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        logger.info(f"Sampling profiler started for {seconds:.0f}s ({interval * 1000:.0f} ms interval)")
+        return StackSampler(interval=interval).run(seconds)
+    finally:
+        _profile_lock.release()
+
+
+class ProfileJobs:
+    """On-demand profiles captured in the background, with their results kept in output_dir."""
+
+    _ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9a-f]{8}$')
+
+    def __init__(self, output_dir='profiles'):
+        """
+        Args:
+            output_dir: Directory the job state (<id>.json) and results
+                (<id>_wall.folded, <id>_cpu.folded) are written to
+        """
+        self.output_dir = output_dir
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.output_dir, f"{job_id}{suffix}")
+
+    def _write_state(self, job_id, state):
+        path = self._path(job_id, '.json')
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def start(self, seconds, interval=0.01):
+        """
+        Start a capture on a background thread.
+
+        Returns:
+            The job id, or None if another profile is already running in this process
+        """
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        try:
+            job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            state = {'id': job_id, 'state': 'running', 'pid': os.getpid(), 'seconds': seconds,
+                     'interval': interval, 'started_at': time.time()}
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._write_state(job_id, state)
+            threading.Thread(target=self._run, args=(state,), name="profile-job", daemon=True).start()
+        except Exception:
+            _profile_lock.release()
+            raise
+        logger.info(f"Sampling profiler job {job_id} started for {seconds:.0f}s ({interval * 1000:.0f} ms interval)")
+        return job_id
+
+    def _run(self, state):
+        try:
+            sampler = StackSampler(interval=state['interval']).run(state['seconds'])
+            for view in ('wall', 'cpu'):
+                with open(self._path(state['id'], f"_{view}.folded"), 'w', encoding='utf-8') as f:
+                    f.write(sampler.collapsed(view))
+            state.update(state='done', samples=sampler.samples, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Error in profiler job {state['id']}: {e}", exc_info=True)
+            state.update(state='failed', error=str(e))
+        try:
+            self._write_state(state['id'], state)
+        except OSError as e:
+            logger.error(f"Error recording profiler job {state['id']}: {e}")
+        finally:
+            _profile_lock.release()
+
+    def get(self, job_id):
+        """
+        A job's state: 'running', 'done' (with 'samples') or 'failed'; None if unknown.
+
+        A running job whose worker has exited is reported as failed.
+        """
+        if not self._ID.match(job_id or ''):
+            return None
+        try:
+            with open(self._path(job_id, '.json'), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['state'] == 'running':
+            try:
+                os.kill(state['pid'], 0)
+            except ProcessLookupError:
+                state.update(state='failed', error='the worker running the profile exited')
+            except OSError:
+                pass
+        return state
+
+    def read(self, job_id, view='wall'):
+        """Collapsed stacks of a finished job for 'wall' or 'cpu' (None if not available)."""
+        if not self._ID.match(job_id or '') or view not in ('wall', 'cpu'):
+            return None
+        try:
+            with open(self._path(job_id, f"_{view}.folded"), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+class ProfileWatchdog:
+    """
+    Captures a profile automatically when request latency degrades.
+
+    observe() is fed request durations; once the p99 of the recent window
+    exceeds the threshold, a profile is captured in the background and
+    written to output_dir as <timestamp>_wall.folded / <timestamp>_cpu.folded.
+    """
+
+    def __init__(self, threshold_ms, output_dir='profiles', seconds=10.0, cooldown=600.0,
+                 window=200, min_samples=20, interval=0.01):
+        """
+        Initialize the watchdog.
+
+        Args:
+            threshold_ms: p99 latency (ms) that triggers a capture (0 disables the watchdog)
+            output_dir: Directory the folded profiles are written to
+            seconds: Length of each capture
+            cooldown: Minimum seconds between captures
+            window: Number of recent durations the p99 is computed over
+            min_samples: Durations required before the p99 is trusted
+            interval: Sampling interval of the capture
+        """
+        self.threshold = threshold_ms / 1000.0
+        self.output_dir = output_dir
+        self.seconds = seconds
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self.interval = interval
+        self._durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._last_capture = None
+        self._capturing = False
+        self.captures = []
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def observe(self, seconds):
+        """Record one request duration and trigger a capture if needed."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._durations.append(seconds)
+            if self._capturing or len(self._durations) < self.min_samples:
+                return
+            if self._last_capture is not None and time.monotonic() - self._last_capture < self.cooldown:
+                return
+            p99 = percentile(list(self._durations), 0.99)
+            if p99 <= self.threshold:
+                return
+            self._capturing = True
+            self._last_capture = time.monotonic()
+
+        logger.warning(f"Webhook p99 {p99 * 1000:.0f} ms exceeds {self.threshold * 1000:.0f} ms; capturing a profile")
+        threading.Thread(target=self._capture, args=(p99,), name="profile-watchdog", daemon=True).start()
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a with-block (also usable as a decorator)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def _capture(self, p99):
+        try:
+            sampler = profile(self.seconds, self.interval)
+            if sampler is None:
+                logger.info("Profiler busy; skipping watchdog capture")
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            paths = {}
+            for view in ('wall', 'cpu'):
+                path = os.path.join(self.output_dir, f"{stamp}_{os.getpid()}_{view}.folded")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(sampler.collapsed(view))
+                paths[view] = path
+            self.captures.append({'at': stamp, 'p99_ms': round(p99 * 1000, 1), 'files': paths})
+            logger.warning(f"Watchdog profile written to {paths['wall']} and {paths['cpu']}")
+        except Exception as e:
+            logger.error(f"Error capturing watchdog profile: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._capturing = False
+
+    def snapshot(self):
+        """Return the watchdog state for status endpoints."""
+        with self._lock:
+            p99 = percentile(list(self._durations), 0.99)
+            return {
+                'enabled': self.enabled,
+                'threshold_ms': self.threshold * 1000,
+                'recent_p99_ms': round(p99 * 1000, 1) if p99 is not None else None,
+                'capturing': self._capturing,
+                'captures': list(self.captures[-5:]),
+            }
@@ -0,0 +1,137 @@
+"""
+run_benchmarks.py - Runs the benchmark suites and fails on performance regressions
+
+Every benchmarks/bench_*.py module that defines run() and BASELINE_FILE is a
+suite. Each case is compared with the committed baseline; the run fails when
+a case is slower than its baseline by more than the tolerance.
+
+Baselines depend on the machine, so record them (--save) on the machine that
+runs the gate, with the code as it is after the change being measured: the
+gate only catches regressions relative to what the baseline recorded. On a
+noisy machine use --runs to keep each case's best time over several runs,
+both when saving and when gating.
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+import time
+from colorama import init, Fore, Style
+
+# Initialize colorama for colored terminal output
+init()
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+def discover_suites():
+    """Return {suite name: module} for every benchmark module with a baseline."""
+    sys.path.insert(0, BENCHMARKS_DIR)
+    suites = {}
+    for path in sorted(glob.glob(os.path.join(BENCHMARKS_DIR, 'bench_*.py'))):
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        module = importlib.import_module(module_name)
+        if hasattr(module, 'run') and hasattr(module, 'BASELINE_FILE'):
+            suites[module_name[len('bench_'):]] = module
+    return suites
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def compare(results, baseline, tolerance):
+    """
+    Compare one suite's results with its baseline.
+
+    Args:
+        results: Dict of case -> seconds per call
+        baseline: Dict of case -> baseline seconds per call
+        tolerance: Allowed slowdown as a fraction (0.25 = 25% slower)
+
+    Returns:
+        List of (case, seconds, baseline seconds or None, status) with status
+        'ok', 'regressed' or 'new'
+    """
+    rows = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if not base:
+            status = 'new'
+        elif seconds > base * (1 + tolerance):
+            status = 'regressed'
+        else:
+            status = 'ok'
+        rows.append((name, seconds, base, status))
+    return rows
+
+def best_of_runs(module, runs):
+    """Run a suite runs times and keep each case's fastest time."""
+    best = {}
+    for _ in range(runs):
+        for name, seconds in module.run().items():
+            best[name] = min(seconds, best.get(name, seconds))
+    return best
+
+def print_suite(suite, rows):
+    """Print a suite's comparison table."""
+    colors = {'ok': Fore.GREEN, 'regressed': Fore.RED, 'new': Fore.YELLOW}
+    print(f"\n{Fore.BLUE}{suite}{Style.RESET_ALL}")
+    print(f"  {'case':<28} {'current':>14} {'baseline':>14} {'change':>8}")
+    for name, seconds, base, status in rows:
+        base_text = f"{base * 1e6:11.1f} us" if base else f"{'-':>14}"
+        change = f"{(seconds / base - 1) * 100:+7.1f}%" if base else f"{'new':>8}"
+        print(f"  {colors[status]}{name:<28} {seconds * 1e6:11.1f} us {base_text} {change}{Style.RESET_ALL}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suites and gate on regressions")
+    parser.add_argument("--suite", action="append", help="Only run this suite (repeatable)")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv('BENCH_TOLERANCE', '0.25')),
+                        help="Allowed slowdown before failing, as a fraction (default 0.25)")
+    parser.add_argument("--runs", type=int, default=int(os.getenv('BENCH_RUNS', '1')),
+                        help="Run each suite this many times and keep each case's best time (default 1)")
+    parser.add_argument("--save", action="store_true", help="Record the results as the new baselines")
+    parser.add_argument("--list", action="store_true", help="List the available suites")
+    args = parser.parse_args()
+
+    suites = discover_suites()
+    if args.list:
+        print("\n".join(suites))
+        return 0
+
+    selected = args.suite or list(suites)
+    unknown = [name for name in selected if name not in suites]
+    if unknown:
+        print(f"{Fore.RED}Unknown suite(s): {', '.join(unknown)} (available: {', '.join(suites)}){Style.RESET_ALL}")
+        return 2
+
+    regressions = []
+    start_time = time.time()
+    for suite in selected:
+        module = suites[suite]
+        results = best_of_runs(module, max(1, args.runs))
+        rows = compare(results, load_baseline(module.BASELINE_FILE), args.tolerance)
+        print_suite(suite, rows)
+        regressions.extend(f"{suite}.{name}" for name, _, _, status in rows if status == 'regressed')
+        if args.save:
+            save_baseline(module.BASELINE_FILE, results)
+            print(f"  Baseline saved to {os.path.relpath(module.BASELINE_FILE)}")
+    elapsed_time = time.time() - start_time
+
+    if regressions and not args.save:
+        print(f"\n{Fore.RED}❌ {len(regressions)} case(s) slower than baseline by more than "
+              f"{args.tolerance:.0%}: {', '.join(regressions)} ({elapsed_time:.1f} seconds){Style.RESET_ALL}")
+        return 1
+    print(f"\n{Fore.GREEN}✅ No regressions beyond {args.tolerance:.0%} ({elapsed_time:.1f} seconds){Style.RESET_ALL}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,43 @@
 import os
+import sys
+import atexit
+import signal
 import logging
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
-import google.generativeai as genai
 import json
-from wasenderapi import create_sync_wasender, WasenderSyncClient
-from wasenderapi.errors import WasenderAPIError
-from wasenderapi.webhook import WasenderWebhookEvent
-from wasenderapi.models import RetryConfig
-import asyncio
+import hmac
+import threading
+from collections import OrderedDict
+import random
 import time
 from functools import wraps
-from message_splitter import split_message
+from contextlib import contextmanager
+from message_splitter import split_message, plan_message
+from persona_manager import PersonaManager, compile_keyword_matcher
+from burst_coalescer import BurstCoalescer
+from admission import AdmissionController
+from lanes import Lane
+from notification_events import EventLog, EVENT_TURN_PROCESSED, format_group_notification
+from notification_digest import NotificationDigest
+from logging_setup import configure_logging, get_category_logger, CATEGORY_PAYLOAD, CATEGORY_CHUNKS
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import Tracer, STATUS_ERROR
+from warmup import WarmUp
+from cache_snapshot import CacheSnapshot
+from drain import Drainer
+from outbox import Outbox
+from shared_state import SharedTable, SharedCounters
+from affinity import SenderAffinity, HOP_HEADER
+from user_locks import UserLocks
+import profiler
+from lazy import LazyModule, LazyProxy
+
+# The SDKs are imported on first use (see lazy.py); together they are most of the import time
+genai = LazyModule('google.generativeai')
+wasenderapi = LazyModule('wasenderapi')
+wasender_errors = LazyModule('wasenderapi.errors')
+wasender_models = LazyModule('wasenderapi.models')
 
 # Load environment variables
 load_dotenv()
@@ -19,16 +45,11 @@ load_dotenv()
 # Flask application setup
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('whatsapp_bot.log')
-    ]
-)
+# Configure logging (queue-backed; see logging_setup.py for the LOG_* settings)
+configure_logging()
 logger = logging.getLogger("whatsapp_bot")
+payload_logger = get_category_logger(CATEGORY_PAYLOAD)
+chunk_logger = get_category_logger(CATEGORY_CHUNKS)
 
 # Application configuration
 CONFIG = {
@@ -37,44 +58,195 @@ CONFIG = {
     "WASENDER_API_TOKEN": os.getenv('WASENDER_API_TOKEN'),
     "GEMINI_MODEL": os.getenv('GEMINI_MODEL', 'gemini-2.0-flash'),
     "WEBHOOK_SECRET": os.getenv('WEBHOOK_SECRET'),
+    "WASENDER_BASE_URL": os.getenv('WASENDER_BASE_URL', ''),
+    "GEMINI_API_ENDPOINT": os.getenv('GEMINI_API_ENDPOINT', ''),
     "MAX_RETRIES": int(os.getenv('MAX_RETRIES', '3')),
     "MESSAGE_CHUNK_MAX_LINES": int(os.getenv('MESSAGE_CHUNK_MAX_LINES', '3')),
     "MESSAGE_CHUNK_MAX_CHARS": int(os.getenv('MESSAGE_CHUNK_MAX_CHARS', '100')),
+    "MESSAGE_SPLIT_STRATEGY": os.getenv('MESSAGE_SPLIT_STRATEGY', 'lines'),
+    "MESSAGE_MAX_CHARS": int(os.getenv('MESSAGE_MAX_CHARS', '1000')),
     "MESSAGE_DELAY_MIN": float(os.getenv('MESSAGE_DELAY_MIN', '0.55')),
     "MESSAGE_DELAY_MAX": float(os.getenv('MESSAGE_DELAY_MAX', '1.5')),
     "NOTIFICATION_GROUP_ID": os.getenv('NOTIFICATION_GROUP_ID'),
+    "NOTIFICATION_DELIVERY": os.getenv('NOTIFICATION_DELIVERY', 'inline'),
+    "NOTIFICATION_EVENTS_FILE": os.getenv('NOTIFICATION_EVENTS_FILE', 'notification_events.jsonl'),
+    "NOTIFICATION_DIGEST_WINDOW": float(os.getenv('NOTIFICATION_DIGEST_WINDOW', '0')),
+    "NOTIFICATION_DEDUP_WINDOW": float(os.getenv('NOTIFICATION_DEDUP_WINDOW', '600')),
+    "PERSONA_RELOAD_INTERVAL": float(os.getenv('PERSONA_RELOAD_INTERVAL', '5')),
+    "BURST_WINDOW_MS": int(os.getenv('BURST_WINDOW_MS', '0')),
+    "BURST_MAX_WAIT_MS": int(os.getenv('BURST_MAX_WAIT_MS', '6000')),
+    "SENDER_RATE_PER_MIN": float(os.getenv('SENDER_RATE_PER_MIN', '12')),
+    "SENDER_BURST": int(os.getenv('SENDER_BURST', '6')),
+    "LLM_MAX_IN_FLIGHT": int(os.getenv('LLM_MAX_IN_FLIGHT', '8')),
+    "LLM_QUEUE_SIZE": int(os.getenv('LLM_QUEUE_SIZE', '16')),
+    "LLM_QUEUE_TIMEOUT": float(os.getenv('LLM_QUEUE_TIMEOUT', '10')),
+    "BUSY_MESSAGE": os.getenv('BUSY_MESSAGE', "Estamos com muitas mensagens no momento 🙏 Já já te respondemos! Enquanto isso, digite *menu* para ver as opções."),
+    "PIPELINE_LANES": os.getenv('PIPELINE_LANES', 'false').lower() == 'true',
+    "FAST_LANE_WORKERS": int(os.getenv('FAST_LANE_WORKERS', '4')),
+    "FAST_LANE_SLO_MS": float(os.getenv('FAST_LANE_SLO_MS', '200')),
+    "LLM_LANE_WORKERS": int(os.getenv('LLM_LANE_WORKERS', '8')),
+    "LLM_LANE_SLO_MS": float(os.getenv('LLM_LANE_SLO_MS', '5000')),
+    "FAST_LANE_QUEUE": int(os.getenv('FAST_LANE_QUEUE', '256')),
+    "LLM_LANE_QUEUE": int(os.getenv('LLM_LANE_QUEUE', os.getenv('LLM_QUEUE_SIZE', '16'))),
+    "METRICS_DIR": os.getenv('METRICS_DIR', ''),
+    "METRICS_FLUSH_INTERVAL": float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+    "ACTIVE_CONVERSATION_WINDOW": float(os.getenv('ACTIVE_CONVERSATION_WINDOW', '1800')),
+    "TRACING_ENABLED": os.getenv('TRACING_ENABLED', 'true').lower() == 'true',
+    "TRACE_BUFFER_SIZE": int(os.getenv('TRACE_BUFFER_SIZE', '200')),
+    "TRACE_EXPORT_FILE": os.getenv('TRACE_EXPORT_FILE', ''),
+    "ADMIN_TOKEN": os.getenv('ADMIN_TOKEN', ''),
+    "PROFILE_MAX_SECONDS": float(os.getenv('PROFILE_MAX_SECONDS', '120')),
+    "PROFILE_WATCHDOG_P99_MS": float(os.getenv('PROFILE_WATCHDOG_P99_MS', '0')),
+    "PROFILE_WATCHDOG_SECONDS": float(os.getenv('PROFILE_WATCHDOG_SECONDS', '10')),
+    "PROFILE_WATCHDOG_COOLDOWN": float(os.getenv('PROFILE_WATCHDOG_COOLDOWN', '600')),
+    "PROFILE_DIR": os.getenv('PROFILE_DIR', 'profiles'),
+    "CONVERSATION_CACHE_SIZE": int(os.getenv('CONVERSATION_CACHE_SIZE', '256')),
+    "HISTORY_LOCK_TIMEOUT": float(os.getenv('HISTORY_LOCK_TIMEOUT', '5')),
+    "WARMUP_ENABLED": os.getenv('WARMUP_ENABLED', 'true').lower() == 'true',
+    "WARMUP_GEMINI_PROBE": os.getenv('WARMUP_GEMINI_PROBE', 'false').lower() == 'true',
+    "CACHE_SNAPSHOT_DIR": os.getenv('CACHE_SNAPSHOT_DIR', ''),
+    "CACHE_SNAPSHOT_INTERVAL": float(os.getenv('CACHE_SNAPSHOT_INTERVAL', '300')),
+    "CACHE_SNAPSHOT_MAX_AGE": float(os.getenv('CACHE_SNAPSHOT_MAX_AGE', '3600')),
+    "DRAIN_TIMEOUT": float(os.getenv('DRAIN_TIMEOUT', '25')),
+    "HANDOFF_DIR": os.getenv('HANDOFF_DIR', 'handoff'),
+    "OUTBOX_DIR": os.getenv('OUTBOX_DIR', 'outbox'),
+    "OUTBOX_DELIVERY": os.getenv('OUTBOX_DELIVERY', 'inline'),
+    "OUTBOX_WORKERS": int(os.getenv('OUTBOX_WORKERS', '4')),
+    "OUTBOX_MAX_ATTEMPTS": int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5')),
+    "OUTBOX_RETRY_DELAY": float(os.getenv('OUTBOX_RETRY_DELAY', '5')),
+    "OUTBOX_MAX_RETRY_DELAY": float(os.getenv('OUTBOX_MAX_RETRY_DELAY', '300')),
+    "OUTBOX_POLL_INTERVAL": float(os.getenv('OUTBOX_POLL_INTERVAL', '1')),
+    "SHARED_STATE_DIR": os.getenv('SHARED_STATE_DIR', ''),
+    "SHARED_STATE_SLOTS": int(os.getenv('SHARED_STATE_SLOTS', '16384')),
+    "AFFINITY_NODES": os.getenv('AFFINITY_NODES', ''),
+    "AFFINITY_NODES_FILE": os.getenv('AFFINITY_NODES_FILE', ''),
+    "AFFINITY_SELF_URL": os.getenv('AFFINITY_SELF_URL', ''),
+    "AFFINITY_VNODES": int(os.getenv('AFFINITY_VNODES', '64')),
+    "AFFINITY_FORWARD_TIMEOUT": float(os.getenv('AFFINITY_FORWARD_TIMEOUT', '30')),
+    "AFFINITY_EJECT_SECONDS": float(os.getenv('AFFINITY_EJECT_SECONDS', '30')),
 }
 
+# Metrics exposed on /metrics; with METRICS_DIR set, every worker shares its
+# metrics through that directory so any worker can serve the totals
+if CONFIG["METRICS_DIR"]:
+    REGISTRY.enable_multiprocess(CONFIG["METRICS_DIR"], CONFIG["METRICS_FLUSH_INTERVAL"])
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+webhook_duration = REGISTRY.histogram('whatsapp_webhook_duration_seconds', 'Time spent handling a webhook request')
+history_load_duration = REGISTRY.histogram('whatsapp_history_load_seconds', 'Time spent loading a conversation history')
+history_save_duration = REGISTRY.histogram('whatsapp_history_save_seconds', 'Time spent saving a conversation history')
+history_lock_wait = REGISTRY.histogram('whatsapp_history_lock_wait_seconds', 'Time spent waiting for a per-user history lock',
+                                       buckets=(0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0))
+history_lock_timeouts = REGISTRY.counter('whatsapp_history_lock_timeouts_total',
+                                         'History updates that gave up waiting for the per-user lock')
+gemini_latency = REGISTRY.histogram('whatsapp_gemini_latency_seconds', 'Gemini response latency', ['model'], buckets=LLM_BUCKETS)
+split_duration = REGISTRY.histogram('whatsapp_split_seconds', 'Time spent splitting a reply into chunks', buckets=FAST_BUCKETS)
+chunk_send_duration = REGISTRY.histogram('whatsapp_chunk_send_seconds', 'WaSender latency for one reply chunk')
+first_send_latency = REGISTRY.histogram('whatsapp_time_to_first_send_seconds',
+                                        'Time from accepting a turn to sending its first reply chunk', ['lane'],
+                                        buckets=LLM_BUCKETS)
+menu_hits = REGISTRY.counter('whatsapp_menu_hits_total', 'Turns answered from the menu', ['kind'])
+cache_hits = REGISTRY.counter('whatsapp_cache_hits_total', 'Cache lookups that hit', ['cache'])
+cache_misses = REGISTRY.counter('whatsapp_cache_misses_total', 'Cache lookups that missed', ['cache'])
+notifications_total = REGISTRY.counter('whatsapp_notifications_total', 'Group notifications by outcome', ['result'])
+rate_limited_total = REGISTRY.counter('whatsapp_wasender_rate_limited_total', 'WaSender requests rejected with HTTP 429')
+affinity_routes = REGISTRY.counter('whatsapp_affinity_routes_total', 'Webhooks by sender-affinity outcome', ['result'])
+outbox_deliveries = REGISTRY.counter('whatsapp_outbox_deliveries_total', 'Reply delivery attempts by outcome', ['result'])
+errors_total = REGISTRY.counter('whatsapp_errors_total', 'Errors by pipeline stage', ['stage'])
+queue_depth = REGISTRY.gauge('whatsapp_queue_depth', 'Work waiting in each queue', ['queue'])
+active_conversations = REGISTRY.gauge('whatsapp_active_conversations',
+                                      'Conversations updated within ACTIVE_CONVERSATION_WINDOW',
+                                      multiprocess_mode='max')
+
+# Per-message tracing, served from /debug/traces
+tracer = Tracer(
+    capacity=CONFIG["TRACE_BUFFER_SIZE"],
+    export_path=CONFIG["TRACE_EXPORT_FILE"] or None,
+    enabled=CONFIG["TRACING_ENABLED"]
+)
+
+# Captures a CPU profile when webhook p99 exceeds PROFILE_WATCHDOG_P99_MS (0 = off)
+# On-demand profiles (/debug/profile) run in the background; results go to PROFILE_DIR
+profile_jobs = profiler.ProfileJobs(CONFIG["PROFILE_DIR"])
+
+profile_watchdog = profiler.ProfileWatchdog(
+    CONFIG["PROFILE_WATCHDOG_P99_MS"],
+    output_dir=CONFIG["PROFILE_DIR"],
+    seconds=CONFIG["PROFILE_WATCHDOG_SECONDS"],
+    cooldown=CONFIG["PROFILE_WATCHDOG_COOLDOWN"]
+)
+
+# Graceful shutdown: in-flight turns get DRAIN_TIMEOUT seconds, the rest is handed off
+drainer = Drainer(CONFIG["HANDOFF_DIR"], timeout=CONFIG["DRAIN_TIMEOUT"])
+
 # Directory for storing conversations
 if not os.path.exists(CONFIG["CONVERSATIONS_DIR"]):
     os.makedirs(CONFIG["CONVERSATIONS_DIR"])
     logger.info(f"Created conversations directory at {CONFIG['CONVERSATIONS_DIR']}")
 
-# Configure retry options for WaSenderAPI
-retry_config = RetryConfig(
-    enabled=True,
-    max_retries=CONFIG["MAX_RETRIES"]
-)
-
-# Initialize WaSenderAPI client
-try:
-    wasender_client = create_sync_wasender(
+def create_wasender_client():
+    """Build the WaSenderAPI client with retry support (called on first use in each process)."""
+    retry_config = wasender_models.RetryConfig(
+        enabled=True,
+        max_retries=CONFIG["MAX_RETRIES"]
+    )
+    client = wasenderapi.create_sync_wasender(
         api_key=CONFIG["WASENDER_API_TOKEN"],
         webhook_secret=CONFIG["WEBHOOK_SECRET"],
-        retry_options=retry_config
+        retry_options=retry_config,
+        # Point at a stand-in server (e.g. loadtest/) instead of the real API
+        **({'base_url': CONFIG["WASENDER_BASE_URL"]} if CONFIG["WASENDER_BASE_URL"] else {})
     )
     logger.info("WaSenderAPI client initialized successfully with retry support")
-except Exception as e:
-    logger.error(f"Error initializing WaSenderAPI client: {e}", exc_info=True)
-    wasender_client = None
+    return client
 
-# Initialize Gemini client
-if CONFIG["GEMINI_API_KEY"]:
-    genai.configure(api_key=CONFIG["GEMINI_API_KEY"])
-    logger.info("Gemini API client initialized successfully")
-else:
+# WaSenderAPI client, built on first use (errors surface in send_whatsapp_message)
+wasender_client = LazyProxy(create_wasender_client, 'wasender_client',
+                            configured=lambda: bool(CONFIG["WASENDER_API_TOKEN"]))
+
+def gemini_transport_options():
+    """Extra genai.configure() arguments; GEMINI_API_ENDPOINT switches to REST against that endpoint."""
+    endpoint = CONFIG.get("GEMINI_API_ENDPOINT")
+    if not endpoint:
+        return {}
+    return {'transport': 'rest', 'client_options': {'api_endpoint': endpoint}}
+
+if not CONFIG["GEMINI_API_KEY"]:
     logger.error("GEMINI_API_KEY not found in environment variables. The application might not work correctly.")
 
+# Sender affinity across nodes: each sender is answered by the node that owns it
+# on a consistent-hash ring (AFFINITY_NODES / AFFINITY_NODES_FILE; off without them)
+affinity = None
+if CONFIG["AFFINITY_NODES"] or CONFIG["AFFINITY_NODES_FILE"]:
+    if CONFIG["AFFINITY_SELF_URL"]:
+        affinity = SenderAffinity(
+            CONFIG["AFFINITY_SELF_URL"],
+            nodes=CONFIG["AFFINITY_NODES"].split(','),
+            nodes_file=CONFIG["AFFINITY_NODES_FILE"] or None,
+            vnodes=CONFIG["AFFINITY_VNODES"],
+            forward_timeout=CONFIG["AFFINITY_FORWARD_TIMEOUT"],
+            eject_seconds=CONFIG["AFFINITY_EJECT_SECONDS"]
+        )
+        logger.info(f"Sender affinity enabled as {affinity.self_url} ({len(affinity.snapshot()['members'])} nodes)")
+    else:
+        logger.error("AFFINITY_NODES is set but AFFINITY_SELF_URL is not; sender affinity disabled")
+
+def require_admin(view):
+    """Reject requests without the ADMIN_TOKEN (X-Admin-Token or Bearer); 403 when no token is configured."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = CONFIG.get("ADMIN_TOKEN", '')
+        if not expected:
+            return jsonify({'status': 'error', 'message': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+        provided = request.headers.get('X-Admin-Token', '')
+        authorization = request.headers.get('Authorization', '')
+        if not provided and authorization.startswith('Bearer '):
+            provided = authorization[len('Bearer '):]
+        if not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+            return jsonify({'status': 'error', 'message': 'Invalid admin token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.errorhandler(Exception)
 def handle_global_exception(e):
     """Global handler for unhandled exceptions."""
@@ -90,7 +262,13 @@ def index():
         'endpoints': {
             '/': 'This page - Bot status',
             '/health': 'Health check endpoint',
+            '/health/live': 'Liveness probe',
+            '/health/ready': 'Readiness probe (503 until the warm-up has finished)',
             '/status': 'Detailed bot status',
+            '/metrics': 'Prometheus metrics',
+            '/debug/traces': 'Recent request traces (?sender=, ?min_ms=, ?limit=; admin only)',
+            '/debug/profile': 'Start a background sampling profile (?seconds=, ?interval_ms=; admin only)',
+            '/debug/profile/<id>': 'Profile progress, then collapsed stacks (?view=wall|cpu, ?format=json; admin only)',
             '/webhook': 'Webhook endpoint for WhatsApp messages (POST only)',
             '/clear_history/<user_id>': 'Clear conversation history for a user (POST only)'
         },
@@ -103,7 +281,7 @@ def health_check():
     """Health check endpoint for monitoring."""
     status = {
         'status': 'ok',
-        'wasender_client': wasender_client is not None,
+        'wasender_client': bool(wasender_client),
         'gemini_client': CONFIG["GEMINI_API_KEY"] is not None,
         'conversations_dir': os.path.exists(CONFIG["CONVERSATIONS_DIR"]),
         'timestamp': time.time()
@@ -111,7 +289,7 @@ def health_check():
     
     if not wasender_client:
         status['status'] = 'degraded'
-        status['issues'] = ['WaSender client not initialized']
+        status['issues'] = ['WaSender client not configured']
     
     if not CONFIG["GEMINI_API_KEY"]:
         status['status'] = 'degraded'
@@ -119,16 +297,35 @@ def health_check():
             status['issues'] = []
         status['issues'].append('Gemini API key not configured')
     
+    status['ready'] = warmup.ready
     status_code = 200 if status['status'] == 'ok' else 503
     return jsonify(status), status_code
 
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'timestamp': time.time()}), 200
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until this worker has finished its warm-up, and again once it is draining."""
+    snapshot = warmup.snapshot()
+    if drainer.draining:
+        return jsonify({'status': 'draining', 'pid': os.getpid(), 'warmup': snapshot}), 503
+    status = {'status': 'ready' if snapshot['ready'] else 'warming_up', 'pid': os.getpid(), 'warmup': snapshot}
+    return jsonify(status), 200 if snapshot['ready'] else 503
+
 
 
 # --- Load Persona ---
-def load_persona(file_path='persona.json'):
+def load_persona(file_path='persona.json', raw=None):
     """
     Load persona configuration from a JSON file.
     Returns a tuple of (persona_description, persona_name, few_shot_examples, menu_config).
+    
+    Args:
+        file_path: Path to the persona JSON file
+        raw: The file's content if already read (parsed instead of reading the file again)
     """
     default_name = "Assistant"
     default_description = "You are a helpful assistant."
@@ -146,12 +343,14 @@ def load_persona(file_path='persona.json'):
     }
 
     try:
-        if not os.path.exists(file_path):
+        if raw is not None:
+            persona_data = json.loads(raw)
+        elif not os.path.exists(file_path):
             logger.warning(f"Persona file not found at {file_path}. Using default persona.")
             return f"{default_base_prompt}\n\n{default_description}", default_name, [], default_menu_config
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            persona_data = json.load(f)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                persona_data = json.load(f)
             
         custom_description = persona_data.get('description', default_description)
         base_prompt = persona_data.get('base_prompt', default_base_prompt)
@@ -180,10 +379,6 @@ def load_persona(file_path='persona.json'):
         logger.error(f"An unexpected error occurred while loading persona: {e}. Using default persona.")
         return f"{default_base_prompt}\n\n{default_description}", default_name, [], default_menu_config
 
-# Load persona configuration
-PERSONA_FILE_PATH = os.getenv('PERSONA_FILE_PATH', 'persona.json')
-PERSONA_DESCRIPTION, PERSONA_NAME, FEW_SHOT_EXAMPLES, MENU_CONFIG = load_persona(PERSONA_FILE_PATH)
-logger.info(f"Using persona '{PERSONA_NAME}' with {len(FEW_SHOT_EXAMPLES)} training examples")
 # --- End Load Persona ---
 
 def build_few_shot_history(examples):
@@ -213,13 +408,14 @@ def build_few_shot_history(examples):
     logger.debug(f"Built few-shot history with {len(history)} messages ({len(history)//2} examples)")
     return history
 
-def is_greeting(message_text, greeting_keywords):
+def is_greeting(message_text, greeting_keywords, matcher=None):
     """
     Check if the message is a greeting or initial interaction.
     
     Args:
         message_text: The message to check
         greeting_keywords: List of greeting keywords
+        matcher: Optional precompiled matcher for greeting_keywords
         
     Returns:
         True if message is a greeting, False otherwise
@@ -229,6 +425,9 @@ def is_greeting(message_text, greeting_keywords):
     
     message_lower = message_text.lower().strip()
     
+    if matcher is not None:
+        return matcher.search(message_lower) is not None
+    
     # Check if message matches any greeting keyword
     for keyword in greeting_keywords:
         if keyword.lower() in message_lower:
@@ -286,20 +485,239 @@ def get_menu_response(option_key, menu_options):
     
     return None
 
+def get_chunking_config():
+    """
+    Return the settings used to split replies, as a hashable tuple of
+    (strategy, max_lines, max_chars_per_line, max_message_chars).
+    """
+    return (
+        CONFIG.get("MESSAGE_SPLIT_STRATEGY", "lines"),
+        CONFIG.get("MESSAGE_CHUNK_MAX_LINES", 3),
+        CONFIG.get("MESSAGE_CHUNK_MAX_CHARS", 100),
+        CONFIG.get("MESSAGE_MAX_CHARS", 1000)
+    )
+
+@split_duration.time()
+def split_reply(text, report=True):
+    """
+    Split a reply into chunks using the configured strategy.
+    
+    'lines' is the legacy splitter (max_lines x max_chars_per_line per chunk);
+    'planner' minimises the number of sends within MESSAGE_MAX_CHARS.
+    
+    Args:
+        text: The reply text
+        report: Log planned sends against the legacy splitter
+        
+    Returns:
+        List of message chunks ready to send
+    """
+    strategy, max_lines, max_chars, max_message_chars = get_chunking_config()
+    if strategy != 'planner':
+        return split_message(text, max_lines, max_chars)
+    
+    chunks = plan_message(text, max_message_chars)
+    if report:
+        legacy_count = len(split_message(text, max_lines, max_chars))
+        logger.info(f"Split plan: {len(chunks)} sends (legacy splitter: {legacy_count}, saved {legacy_count - len(chunks)})")
+    return chunks
+
+def build_menu_chunks(persona):
+    """
+    Pre-split the welcome message and every menu option response.
+    
+    Args:
+        persona: PersonaSnapshot being built
+        
+    Returns:
+        Dict with the chunking config the chunks were built for, the welcome
+        chunks and a dict of option key -> chunks
+    """
+    chunking = get_chunking_config()
+    menu_config = persona.menu_config
+    options = {}
+    for option_key, option in menu_config.get('menu_options', {}).items():
+        if option and option.get('response'):
+            options[option_key] = tuple(split_reply(option['response'], report=False))
+    
+    return {
+        'chunking': chunking,
+        'welcome': tuple(split_reply(menu_config.get('welcome_message', ''), report=False)),
+        'options': options
+    }
+
+def get_cached_menu_chunks(persona, option_key=None):
+    """
+    Get ready-to-send chunks for the welcome message or a menu option.
+    
+    Args:
+        persona: PersonaSnapshot to read the chunks from
+        option_key: Menu option key, or None for the welcome message
+        
+    Returns:
+        List of chunks, or None if they weren't built for the current chunking config
+    """
+    menu_chunks = persona.artifact('menu_chunks')
+    if not menu_chunks or menu_chunks['chunking'] != get_chunking_config():
+        cache_misses.inc(cache='menu_chunks')
+        return None
+    
+    chunks = menu_chunks['welcome'] if option_key is None else menu_chunks['options'].get(option_key)
+    if chunks is None:
+        cache_misses.inc(cache='menu_chunks')
+        return None
+    cache_hits.inc(cache='menu_chunks')
+    return list(chunks)
+
+# Load persona configuration
+PERSONA_FILE_PATH = os.getenv('PERSONA_FILE_PATH', 'persona.json')
+persona_manager = PersonaManager(
+    PERSONA_FILE_PATH,
+    loader=load_persona,
+    artifacts={
+        'few_shot_history': lambda persona: tuple(build_few_shot_history(persona.few_shot_examples)),
+        'greeting_matcher': lambda persona: compile_keyword_matcher(persona.menu_config.get('greeting_keywords', [])),
+        'menu_chunks': build_menu_chunks,
+    },
+    check_interval=CONFIG["PERSONA_RELOAD_INTERVAL"]
+)
+PERSONA_DESCRIPTION = persona_manager.current.description
+PERSONA_NAME = persona_manager.current.name
+FEW_SHOT_EXAMPLES = persona_manager.current.few_shot_examples
+MENU_CONFIG = persona_manager.current.menu_config
+logger.info(f"Using persona '{PERSONA_NAME}' with {len(FEW_SHOT_EXAMPLES)} training examples (version {persona_manager.current.version})")
+
 class ConversationManager:
     """Manages conversation history with context window management."""
     
-    def __init__(self, storage_dir, max_history=10):
+    def __init__(self, storage_dir, max_history=10, cache_size=0, lock_timeout=5.0):
         """
         Initialize the conversation manager.
         
         Args:
             storage_dir: Directory to store conversation histories
             max_history: Maximum number of message pairs to retain in history
+            cache_size: Number of histories kept in memory (0 disables the cache).
+                Entries are checked against the file's stat, so writes by other
+                workers are never missed.
+            lock_timeout: Maximum seconds an update waits for the user's lock,
+                held by another thread, worker or node sharing storage_dir
         """
         self.storage_dir = storage_dir
         self.max_history = max_history
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.locks = UserLocks(os.path.join(storage_dir, '.locks'), timeout=lock_timeout)
         
+    @staticmethod
+    def _signature(file_path):
+        stat = os.stat(file_path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
+    def _remember(self, user_id, signature, history):
+        with self._cache_lock:
+            self._cache[user_id] = (signature, history)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _cached(self, user_id, signature):
+        with self._cache_lock:
+            entry = self._cache.get(user_id)
+            if entry is None or entry[0] != signature:
+                return None
+            self._cache.move_to_end(user_id)
+            return entry[1]
+    
+    @contextmanager
+    def locked(self, user_id):
+        """Hold the user's history lock (bounded wait; see UserLocks.locked)."""
+        started = time.monotonic()
+        with self.locks.locked(user_id) as held:
+            history_lock_wait.observe(time.monotonic() - started)
+            if not held:
+                history_lock_timeouts.inc()
+            yield held
+    
+    @property
+    def cached_count(self):
+        return len(self._cache)
+        
+    def export_cache(self):
+        """Cached histories as [user_id, signature, history] lists, least recently used first."""
+        with self._cache_lock:
+            return [[user_id, list(signature), history] for user_id, (signature, history) in self._cache.items()]
+    
+    def import_cache(self, entries, max_idle=None):
+        """
+        Restore histories exported by export_cache(), possibly by another process.
+        
+        An entry is only used if the file still has the signature it was cached
+        with, so a history changed since the snapshot is read from disk instead.
+        
+        Args:
+            entries: Output of export_cache()
+            max_idle: Skip histories not updated within this many seconds
+            
+        Returns:
+            Number of histories restored
+        """
+        if not self.cache_size:
+            return 0
+        cutoff = time.time() - max_idle if max_idle else None
+        restored = 0
+        # Most recently used last, so they end up at the recent end of the LRU
+        for user_id, signature, history in entries[-self.cache_size:]:
+            signature = tuple(signature)
+            if user_id in self._cache:
+                continue
+            try:
+                current = self._signature(os.path.join(self.storage_dir, f"{user_id}.json"))
+            except OSError:
+                continue
+            if current != signature or (cutoff and signature[0] / 1e9 < cutoff):
+                continue
+            self._remember(user_id, signature, history)
+            restored += 1
+        return restored
+    
+    def recent_user_ids(self, window, limit):
+        """
+        List users whose history changed within the last window seconds.
+        
+        Args:
+            window: Age limit in seconds
+            limit: Maximum number of ids to return
+            
+        Returns:
+            User ids, most recently updated first
+        """
+        cutoff = time.time() - window
+        try:
+            with os.scandir(self.storage_dir) as entries:
+                recent = [(entry.stat().st_mtime, entry.name[:-len('.json')]) for entry in entries
+                          if entry.name.endswith('.json') and entry.stat().st_mtime >= cutoff]
+        except FileNotFoundError:
+            return []
+        recent.sort(reverse=True)
+        return [user_id for _, user_id in recent[:limit]]
+    
+    def preload(self, user_ids):
+        """
+        Load histories into the cache ahead of their next message.
+        
+        Args:
+            user_ids: Users to load, most important first
+            
+        Returns:
+            Number of histories now cached
+        """
+        for user_id in list(user_ids)[:self.cache_size]:
+            self.load(user_id)
+        return self.cached_count
+        
+    @history_load_duration.time()
     def load(self, user_id):
         """
         Load conversation history for a given user_id with context window management.
@@ -313,7 +731,15 @@ class ConversationManager:
         file_path = os.path.join(self.storage_dir, f"{user_id}.json")
         
         try:
-            if not os.path.exists(file_path):
+            if self.cache_size:
+                # A stat is much cheaper than reading and parsing the file
+                signature = self._signature(file_path)
+                history = self._cached(user_id, signature)
+                if history is not None:
+                    cache_hits.inc(cache='conversations')
+                    return list(history)
+                cache_misses.inc(cache='conversations')
+            elif not os.path.exists(file_path):
                 return []
                 
             with open(file_path, 'r') as f:
@@ -331,14 +757,19 @@ class ConversationManager:
                 logger.info(f"Trimming history for {user_id} to last {self.max_history} exchanges")
                 history = history[-self.max_history * 2:]
                 
+            if self.cache_size:
+                self._remember(user_id, signature, history)
+                return list(history)
             return history
                 
         except FileNotFoundError:
             return []
         except json.JSONDecodeError:
+            errors_total.inc(stage='history_load')
             logger.error(f"Error decoding JSON from {file_path}. Starting fresh.")
             return []
         except Exception as e:
+            errors_total.inc(stage='history_load')
             logger.error(f"Unexpected error loading history from {file_path}: {e}")
             return []
             
@@ -350,18 +781,41 @@ class ConversationManager:
             user_id: The user identifier
             history: The conversation history to save
         """
+        with self.locked(user_id):
+            self._write(user_id, history)
+    
+    @history_save_duration.time()
+    def _write(self, user_id, history):
         file_path = os.path.join(self.storage_dir, f"{user_id}.json")
+        # Unique per thread, so concurrent writers never share a temp file
+        temp_path = os.path.join(self.storage_dir, f".{user_id}.{os.getpid()}.{threading.get_ident()}.tmp")
         
         try:
             # Ensure the directory exists
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
-            # Save the history
-            with open(file_path, 'w') as f:
+            # Write a complete copy and rename it over the history, so readers
+            # see either the old or the new file and never a partial one
+            with open(temp_path, 'w') as f:
                 json.dump(history, f, indent=2)
+                if self.cache_size:
+                    # fstat of our own write (the rename keeps the inode), so a
+                    # concurrent writer can't be mistaken for us
+                    f.flush()
+                    stat = os.fstat(f.fileno())
+                    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            os.replace(temp_path, file_path)
+                    
+            if self.cache_size:
+                self._remember(user_id, signature, list(history[-self.max_history * 2:]))
                 
         except Exception as e:
+            errors_total.inc(stage='history_save')
             logger.error(f"Error saving conversation history to {file_path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
     
     def add_exchange(self, user_id, user_message, model_response):
         """
@@ -372,19 +826,26 @@ class ConversationManager:
             user_message: The message from the user
             model_response: The response from the model
         """
-        history = self.load(user_id)
-        
-        # Add the new exchange
-        history.append({'role': 'user', 'parts': [user_message]})
-        history.append({'role': 'model', 'parts': [model_response]})
-        
-        # Save the updated history
-        self.save(user_id, history)
+        # Held from the read to the write, so a concurrent exchange isn't overwritten
+        with self.locked(user_id):
+            history = self.load(user_id)
+            
+            # Add the new exchange
+            history.append({'role': 'user', 'parts': [user_message]})
+            history.append({'role': 'model', 'parts': [model_response]})
+            
+            # Save the updated history
+            self._write(user_id, history)
         
         return history
 
 # Initialize the conversation manager
-conversation_manager = ConversationManager(CONFIG["CONVERSATIONS_DIR"], max_history=20)
+conversation_manager = ConversationManager(
+    CONFIG["CONVERSATIONS_DIR"],
+    max_history=20,
+    cache_size=CONFIG["CONVERSATION_CACHE_SIZE"],
+    lock_timeout=CONFIG["HISTORY_LOCK_TIMEOUT"]
+)
 
 def load_conversation_history(user_id):
     """Loads conversation history for a given user_id."""
@@ -409,17 +870,70 @@ class GeminiClient:
         """
         self.api_key = api_key
         self.model_name = model_name
-        self.system_instruction = system_instruction
-        self.few_shot_examples = few_shot_examples or []
+        self.update_persona(system_instruction, few_shot_examples)
         
         if not api_key:
             logger.error("Gemini API key is not configured.")
             raise ValueError("Gemini API key is required")
             
-        genai.configure(api_key=api_key)
+        # genai is imported and configured on the first request of each process
+        # (a forked worker must not reuse the parent's grpc channel)
+        self._configured_pid = None
+        self._configure_lock = threading.Lock()
+        self._model = None
         logger.info(f"Gemini client initialized with model: {model_name}")
         logger.info(f"Few-shot learning: {'Enabled' if self.few_shot_examples else 'Disabled'} ({len(self.few_shot_examples)} examples)")
         
+    @property
+    def system_instruction(self):
+        return self._persona[0]
+    
+    @property
+    def few_shot_examples(self):
+        return self._persona[1]
+    
+    def update_persona(self, system_instruction, few_shot_examples=None, few_shot_history=None):
+        """
+        Atomically replace the persona used for new requests.
+        
+        Args:
+            system_instruction: System instruction for persona
+            few_shot_examples: List of example conversations for few-shot learning
+            few_shot_history: Optional prebuilt Gemini history for few_shot_examples
+        """
+        few_shot_examples = few_shot_examples or []
+        if few_shot_history is None:
+            few_shot_history = tuple(build_few_shot_history(few_shot_examples))
+        # Single reference assignment so in-flight requests never see a mixed persona
+        self._persona = (system_instruction, few_shot_examples, few_shot_history)
+        
+    def ensure_configured(self):
+        """Configure genai for this process if that has not happened yet."""
+        pid = os.getpid()
+        if self._configured_pid == pid:
+            return
+        with self._configure_lock:
+            if self._configured_pid != pid:
+                genai.configure(api_key=self.api_key, **gemini_transport_options())
+                self._configured_pid = pid
+        
+    def get_model(self, system_instruction=None):
+        """
+        Return the GenerativeModel for a system instruction, reusing the last one built.
+        
+        Args:
+            system_instruction: Defaults to the current persona's instruction
+        """
+        self.ensure_configured()
+        if system_instruction is None:
+            system_instruction = self.system_instruction
+        cached = self._model
+        if cached and cached[0] == self._configured_pid and cached[1] == system_instruction:
+            return cached[2]
+        model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+        self._model = (self._configured_pid, system_instruction, model)
+        return model
+        
     def generate_response(self, message_text, conversation_history=None):
         """
         Generate a response from Gemini using the provided message and optional history.
@@ -435,22 +949,22 @@ class GeminiClient:
             logger.error("Gemini API key is not configured.")
             return "Sorry, I'm having trouble connecting to my brain right now (API key issue)."
 
+        system_instruction, few_shot_examples, few_shot_history = self._persona
+
         try:
-            # Create model with system instruction for persona
-            model = genai.GenerativeModel(
-                self.model_name, 
-                system_instruction=self.system_instruction
-            )
+            # Model with system instruction for persona (rebuilt when the persona changes)
+            model = self.get_model(system_instruction)
             
-            logger.info(f"Sending prompt to Gemini (system persona active): {message_text[:200]}...")
+            # The marker line stays in the main log (log_analytics pairs it with the reply);
+            # the customer's text only goes to the payload category
+            logger.info("Sending prompt to Gemini (system persona active)")
+            payload_logger.info("Gemini prompt: %.200s", message_text)
+            started_at = time.monotonic()
 
             # Build complete history with few-shot examples
-            if conversation_history or self.few_shot_examples:
-                # Convert few-shot examples to history format
-                few_shot_history = build_few_shot_history(self.few_shot_examples)
-                
-                # Combine few-shot examples with actual conversation history
-                complete_history = few_shot_history.copy()
+            if conversation_history or few_shot_examples:
+                # Combine prebuilt few-shot prefix with actual conversation history
+                complete_history = list(few_shot_history)
                 if conversation_history:
                     complete_history.extend(conversation_history)
                 
@@ -463,6 +977,11 @@ class GeminiClient:
                 # For first message with no history and no examples
                 response = model.generate_content(message_text)
 
+            # Parsed by log_analytics.py for latency percentiles
+            elapsed = time.monotonic() - started_at
+            gemini_latency.observe(elapsed, model=self.model_name)
+            logger.info(f"Gemini response received in {elapsed * 1000:.0f} ms")
+
             # Extract the text from the response
             if response and hasattr(response, 'text') and response.text:
                 return response.text.strip()
@@ -478,6 +997,7 @@ class GeminiClient:
                 return "I received an empty or unexpected response from Gemini. Please try again."
 
         except Exception as e:
+            errors_total.inc(stage='gemini')
             logger.error(f"Error calling Gemini API: {e}", exc_info=True)
             return "I'm having trouble processing that request with my AI brain. Please try again later."
 
@@ -494,6 +1014,54 @@ if CONFIG["GEMINI_API_KEY"]:
     except Exception as e:
         logger.error(f"Failed to initialize Gemini client: {e}", exc_info=True)
 
+def apply_persona(persona):
+    """Publish a reloaded persona to the legacy globals and the Gemini client."""
+    global PERSONA_DESCRIPTION, PERSONA_NAME, FEW_SHOT_EXAMPLES, MENU_CONFIG
+    PERSONA_DESCRIPTION = persona.description
+    PERSONA_NAME = persona.name
+    FEW_SHOT_EXAMPLES = persona.few_shot_examples
+    MENU_CONFIG = persona.menu_config
+    if gemini_client:
+        gemini_client.update_persona(
+            persona.description,
+            persona.few_shot_examples,
+            few_shot_history=persona.artifact('few_shot_history')
+        )
+
+persona_manager.subscribe(apply_persona)
+
+# Admission control in front of the reply pipeline
+def open_shared_table(name, fields, slots=None):
+    """Open (or create) a table in SHARED_STATE_DIR; None, so the caller keeps per-worker state, if it can't."""
+    path = os.path.join(CONFIG["SHARED_STATE_DIR"], f"{name}.tbl")
+    try:
+        return SharedTable(path, slots=slots or CONFIG["SHARED_STATE_SLOTS"], fields=fields)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot open shared state table {path}, keeping {name} per worker: {e}")
+        return None
+
+# Host-wide state shared by every worker through memory-mapped tables
+# (SHARED_STATE_DIR, ideally on /dev/shm); without it each worker keeps its own
+shared_tables = {}
+if CONFIG["SHARED_STATE_DIR"]:
+    shared_tables = {
+        'sender_buckets': open_shared_table('sender_buckets', fields=2),
+        'notification_dedup': open_shared_table('notification_dedup', fields=1),
+        'counters': open_shared_table('counters', fields=1, slots=1024),
+    }
+    shared_tables = {name: table for name, table in shared_tables.items() if table is not None}
+    logger.info(f"Shared state in {CONFIG['SHARED_STATE_DIR']}: {', '.join(shared_tables) or 'none'}")
+
+admission_controller = AdmissionController(
+    sender_rate_per_min=CONFIG["SENDER_RATE_PER_MIN"],
+    sender_burst=CONFIG["SENDER_BURST"],
+    max_in_flight=CONFIG["LLM_MAX_IN_FLIGHT"],
+    max_queue=CONFIG["LLM_QUEUE_SIZE"],
+    queue_timeout=CONFIG["LLM_QUEUE_TIMEOUT"],
+    shared_buckets=shared_tables.get('sender_buckets'),
+    shared_counters=SharedCounters(shared_tables['counters'], prefix='admission.') if 'counters' in shared_tables else None
+)
+
 def get_gemini_response(message_text, conversation_history=None):
     """
     Generates a response from Gemini using the gemini_client.
@@ -505,10 +1073,51 @@ def get_gemini_response(message_text, conversation_history=None):
     
     return gemini_client.generate_response(message_text, conversation_history)
 
+# Structured event stream for out-of-process notification delivery (grupo_notificador.py)
+notification_events = None
+if CONFIG["NOTIFICATION_DELIVERY"] == 'events':
+    notification_events = EventLog(CONFIG["NOTIFICATION_EVENTS_FILE"])
+    logger.info(f"Group notifications delivered via event stream {CONFIG['NOTIFICATION_EVENTS_FILE']}")
+
+def post_to_notification_group(notification_message):
+    """
+    Posts a message to the notification group.
+    
+    Args:
+        notification_message: The text to post
+    
+    Returns:
+        True if the message was sent, False otherwise
+    """
+    try:
+        return send_whatsapp_message(
+            CONFIG["NOTIFICATION_GROUP_ID"],
+            notification_message,
+            message_type='text'
+        )
+    except Exception as e:
+        logger.error(f"❌ Error sending notification to group: {e}")
+        return False
+
+# Per-customer dedup and digesting of group notifications
+notification_digest = None
+if CONFIG.get("NOTIFICATION_DIGEST_WINDOW", 0) > 0:
+    notification_digest = NotificationDigest(
+        lambda text: post_to_notification_group(text),
+        window_seconds=CONFIG["NOTIFICATION_DIGEST_WINDOW"],
+        dedup_seconds=CONFIG["NOTIFICATION_DEDUP_WINDOW"],
+        dedup_table=shared_tables.get('notification_dedup')
+    )
+    logger.info(f"Group notification digest enabled ({CONFIG['NOTIFICATION_DIGEST_WINDOW']:.0f}s window, "
+                f"{CONFIG['NOTIFICATION_DEDUP_WINDOW']:.0f}s dedup)")
+
 def send_notification_to_group(customer_number, customer_message, menu_option=None):
     """
     Sends notification to the notification group when customer requests assistance.
     
+    With the digest enabled the notification is queued (or suppressed as a
+    duplicate) and sent later as part of a single digest message.
+    
     Args:
         customer_number: The customer's phone number
         customer_message: The message from the customer
@@ -518,47 +1127,22 @@ def send_notification_to_group(customer_number, customer_message, menu_option=No
         logger.warning("NOTIFICATION_GROUP_ID not configured. Skipping group notification.")
         return False
     
+    if notification_digest:
+        queued = notification_digest.add(customer_number, customer_message, menu_option)
+        notifications_total.inc(result='queued' if queued else 'suppressed')
+        return queued
+    
     # Format customer number for display (remove @s.whatsapp.net)
     display_number = customer_number.replace('@s.whatsapp.net', '').replace('@g.us', '')
     
     # Build notification message
-    from datetime import datetime
-    timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M')
-    
-    notification_parts = [
-        "🔔 *NOVA SOLICITAÇÃO DE ATENDIMENTO*",
-        "",
-        f"👤 *Cliente:* {display_number}",
-        f"⏰ *Horário:* {timestamp}",
-        ""
-    ]
-    
-    if menu_option:
-        notification_parts.append(f"📋 *Opção do menu:* {menu_option}")
-        notification_parts.append("")
-    
-    notification_parts.extend([
-        "📝 *Mensagem:*",
-        customer_message,
-        "",
-        "---",
-        "_Atender o cliente iniciando conversa com o número dele_"
-    ])
-    
-    notification_message = "\n".join(notification_parts)
+    notification_message = format_group_notification(customer_number, customer_message, menu_option)
     
-    try:
-        result = send_whatsapp_message(
-            CONFIG["NOTIFICATION_GROUP_ID"],
-            notification_message,
-            message_type='text'
-        )
-        if result:
-            logger.info(f"✅ Notification sent to group for customer {display_number}")
-        return result
-    except Exception as e:
-        logger.error(f"❌ Error sending notification to group: {e}")
-        return False
+    result = post_to_notification_group(notification_message)
+    notifications_total.inc(result='sent' if result else 'failed')
+    if result:
+        logger.info(f"✅ Notification sent to group for customer {display_number}")
+    return result
 
 def send_whatsapp_message(recipient_number, message_content, message_type='text', media_url=None):
     """Sends a message via WaSenderAPI SDK. Supports text and media messages."""
@@ -620,29 +1204,322 @@ def send_whatsapp_message(recipient_number, message_content, message_type='text'
                 return False
             logger.error(f"Unsupported message type or missing content/media_url: {message_type}")
             return False
-    except WasenderAPIError as e:
+    except wasender_errors.WasenderAPIError as e:
+        errors_total.inc(stage='send')
+        if e.status_code == 429:
+            rate_limited_total.inc()
         logger.error(f"WaSenderAPI Error sending {message_type} to {recipient_number}: {e.message} (Status: {e.status_code})")
         return False
     except Exception as e:
+        errors_total.inc(stage='send')
         logger.error(f"An unexpected error occurred while sending WhatsApp message: {e}")
         return False
 
+def route_message(messages, persona):
+    """
+    Decide how a user turn will be answered, without doing any of the work.
+    
+    Args:
+        messages: List of message texts making up the turn
+        persona: PersonaSnapshot to answer with
+        
+    Returns:
+        Dict with 'lane' ('fast' for local answers, 'llm' for Gemini), 'kind'
+        ('greeting', 'menu' or 'llm') and, for local answers, the reply text,
+        its pre-split chunks and the group notification details
+    """
+    menu_config = persona.menu_config
+    route = {
+        'lane': 'llm',
+        'kind': 'llm',
+        'response_text': None,
+        'message_chunks': None,
+        'notify_group': False,
+        'menu_option': None,
+    }
+    
+    # Check if interactive menu is enabled
+    if not menu_config.get('enabled', False):
+        return route
+    
+    # Check if it's a greeting (first interaction); a burst only counts if every message is one
+    if all(is_greeting(message, menu_config.get('greeting_keywords', []),
+                       matcher=persona.artifact('greeting_matcher')) for message in messages):
+        route.update(lane='fast', kind='greeting',
+                     response_text=menu_config.get('welcome_message', ''),
+                     message_chunks=get_cached_menu_chunks(persona))
+        
+    # Check if it's a menu option selection
+    elif len(messages) == 1 and is_menu_option(messages[0], menu_config.get('menu_options', {})):
+        option_key = is_menu_option(messages[0], menu_config.get('menu_options', {}))
+        route.update(lane='fast', kind='menu', option_key=option_key,
+                     response_text=get_menu_response(option_key, menu_config.get('menu_options', {})),
+                     message_chunks=get_cached_menu_chunks(persona, option_key))
+        
+        # Check if this option requires notification (options 2-6 need specialist)
+        if option_key in ['2', '3', '4', '6']:
+            option_title = menu_config.get('menu_options', {}).get(option_key, {}).get('title', f'Opção {option_key}')
+            route.update(notify_group=True, menu_option=f"{option_key} - {option_title}")
+    
+    # A menu entry without a response falls through to Gemini
+    if not route['response_text']:
+        route.update(lane='llm', kind='llm')
+    return route
+
+def busy_message():
+    return CONFIG.get("BUSY_MESSAGE") or "Estamos com muitas mensagens no momento. Já já te respondemos!"
+
+def busy_route():
+    """Route for a turn shed under overload: the busy reply, which is not saved to the history."""
+    return {
+        'lane': 'fast',
+        'kind': 'busy',
+        'response_text': busy_message(),
+        'message_chunks': None,
+        'notify_group': False,
+        'menu_option': None,
+    }
+
+def record_delivered_reply(entry):
+    """Save a fully delivered reply to the conversation history (busy replies are not part of the conversation)."""
+    meta = entry['meta']
+    if not meta.get('save_history'):
+        return
+    with tracer.span('history_save'):
+        conversation_manager.add_exchange(meta['safe_sender_id'], meta['user_message'], meta['response_text'])
+    logger.info(f"Saved conversation history for {meta['safe_sender_id']}")
+
+# Replies are planned into a durable outbox before the first chunk is sent;
+# failed sends are retried from the first unacknowledged chunk and dead-lettered
+# after OUTBOX_MAX_ATTEMPTS, and a restarted worker recovers what was left
+outbox = Outbox(
+    CONFIG["OUTBOX_DIR"],
+    max_attempts=CONFIG["OUTBOX_MAX_ATTEMPTS"],
+    retry_delay=CONFIG["OUTBOX_RETRY_DELAY"],
+    max_retry_delay=CONFIG["OUTBOX_MAX_RETRY_DELAY"],
+    on_delivered=record_delivered_reply
+)
+outbox_lane = None
+# With pipeline lanes, chunks are always paced from the outbox threads: a lane
+# worker sleeping between chunks would hold up the replies queued behind it
+if CONFIG["OUTBOX_DELIVERY"] == 'background' or CONFIG["PIPELINE_LANES"]:
+    outbox_lane = Lane('outbox', CONFIG["OUTBOX_WORKERS"], CONFIG["FAST_LANE_SLO_MS"])
+
+def record_first_send(entry):
+    """Observe the customer's wait for the first chunk of a reply, per lane."""
+    meta = entry['meta']
+    if meta.get('accepted_at') is None:
+        return
+    waited = max(0.0, time.time() - meta['accepted_at'])
+    lane_name = meta.get('lane') or 'inline'
+    first_send_latency.observe(waited, lane=lane_name)
+    if lanes and lane_name in lanes:
+        lanes[lane_name].record_first_send(waited)
+
+def deliver_reply(entry, turn=None):
+    """
+    Send an outbox entry's unsent chunks with a human-like pause between them.
+    
+    Args:
+        entry: The reply's outbox entry
+        turn: Optional TurnState; when a drain deadline would be missed the turn
+            is handed off and the rest of the reply stays in the outbox
+    
+    Returns:
+        The outbox delivery status
+    """
+    sender_number = entry['recipient']
+    message_chunks = entry['chunks']
+    logger.info(f"Sending {len(message_chunks) - entry['sent']} message chunks to {sender_number}")
+    
+    def send(i, chunk):
+        chunk_logger.info("Sending chunk %d/%d: %.50s...", i + 1, len(message_chunks), chunk)
+        with chunk_send_duration.time(), tracer.span('send', chunk=i + 1, chars=len(chunk)) as span:
+            send_result = send_whatsapp_message(sender_number, chunk, message_type='text')
+            if span and not send_result:
+                span.status = STATUS_ERROR
+        if not send_result:
+            logger.error(f"Failed to send message chunk {i+1} to {sender_number}")
+        else:
+            chunk_logger.info("Successfully sent chunk %d to %s", i + 1, sender_number)
+            if i == 0:
+                record_first_send(entry)
+        return send_result
+    
+    def pause(i):
+        # Delay between messages
+        delay = random.uniform(5, 7)
+        if turn and drainer.should_hand_off(turn, delay):
+            logger.info(f"Shutting down: {len(message_chunks) - i - 1} chunk(s) for {sender_number} left in the outbox")
+            return False
+        chunk_logger.info("Waiting %.1f seconds before next chunk...", delay)
+        with tracer.span('pacing'):
+            time.sleep(delay)
+        # Handed off by the drain while we were pausing; the next worker sends the rest
+        return not (turn and turn.handed_off)
+    
+    status = outbox.deliver(entry, send, pause)
+    outbox_deliveries.inc(result=status)
+    return status
+
+def deliver_tracked(entry):
+    """Deliver an outbox entry off the request thread, tracked for graceful drain."""
+    meta = entry['meta']
+    with drainer.turn(entry['recipient'], meta.get('safe_sender_id'), meta.get('messages', [])) as turn:
+        turn.replied = True
+        return deliver_reply(entry, turn)
+
+def deliver_in_order(entries):
+    """Deliver outbox entries for one recipient one after another."""
+    for entry in entries:
+        deliver_tracked(entry)
+
+def deliver_later(entry):
+    """Hand an outbox entry to the outbox lane, or a thread of its own without one."""
+    # Bound so the chunk sends and pacing stay in the turn's trace
+    if outbox_lane:
+        outbox_lane.submit(tracer.bind(deliver_tracked), entry)
+    else:
+        threading.Thread(target=tracer.bind(deliver_tracked), args=(entry,), name="outbox-deliver", daemon=True).start()
+
+def process_text_message(sender_number, safe_sender_id, messages, route=None, turn=None):
+    """
+    Generate and send the reply for one user turn (tracked for graceful drain).
+    
+    Args:
+        sender_number: The sender's WhatsApp JID
+        safe_sender_id: Sanitized sender id used for conversation storage
+        messages: List of message texts making up the turn (more than one when
+            a burst of rapid messages was coalesced)
+        route: Routing decision from route_message (computed if not given)
+        turn: TurnState registered with drainer.track() when the turn was
+            queued (registered here if not given)
+    """
+    with drainer.turn(sender_number, safe_sender_id, messages, state=turn) as turn:
+        if turn.handed_off:
+            # Handed off by a drain while waiting in a lane queue; the next worker answers it
+            logger.info(f"Skipping turn for {sender_number}: handed off before it started")
+            return
+        answer_turn(sender_number, safe_sender_id, messages, route, turn)
+
+def answer_turn(sender_number, safe_sender_id, messages, route, turn):
+    """
+    Generate and send the reply for one user turn.
+    
+    Args:
+        sender_number: The sender's WhatsApp JID
+        safe_sender_id: Sanitized sender id used for conversation storage
+        messages: List of message texts making up the turn (more than one when
+            a burst of rapid messages was coalesced)
+        route: Routing decision from route_message (computed if not given)
+        turn: TurnState tracking this turn for the drainer
+    """
+    incoming_message_text = "\n".join(messages)
+    logger.info(f"Processing text message from {sender_number}")
+    payload_logger.info("Text message from %s: %r", sender_number, incoming_message_text)
+    
+    # Grab the persona once so a hot reload can't change it mid-request
+    if route is None:
+        route = route_message(messages, persona_manager.current)
+    
+    with tracer.span('history_load'):
+        conversation_history = load_conversation_history(safe_sender_id)
+    logger.info(f"Loaded conversation history for {safe_sender_id}")
+    
+    response_text = route['response_text']
+    message_chunks = route['message_chunks']
+    should_notify_group = route['notify_group']
+    selected_menu_option = route['menu_option']
+    save_history = route['kind'] != 'busy'
+    
+    if route['kind'] == 'greeting':
+        menu_hits.inc(kind='greeting')
+        logger.info(f"Greeting detected, showing menu to {sender_number}")
+    elif route['kind'] == 'menu':
+        menu_hits.inc(kind='menu')
+        logger.info(f"Menu option {route['option_key']} selected by {sender_number}")
+    
+    # If no menu response, use Gemini AI (if there is capacity for it)
+    if not response_text:
+        with admission_controller.llm_slot() as granted:
+            if granted:
+                logger.info(f"Using Gemini AI for response")
+                with tracer.span('gemini', history_messages=len(conversation_history)):
+                    response_text = get_gemini_response(incoming_message_text, conversation_history)
+                payload_logger.info("Gemini reply for %s: %s", sender_number, response_text)
+                
+                # Check if AI response suggests contacting specialist
+                keywords_for_notification = ['jailson', 'josimar', 'consultor', 'especialista', 'atendimento']
+                if any(keyword in response_text.lower() for keyword in keywords_for_notification):
+                    should_notify_group = True
+            else:
+                logger.warning(f"LLM capacity saturated, sending busy reply to {sender_number}")
+                response_text = busy_message()
+                save_history = False
+    
+    if response_text:
+        if message_chunks is None:
+            with tracer.span('split', chars=len(response_text)):
+                message_chunks = split_reply(response_text)
+        if not drainer.begin_reply(turn):
+            # The drain deadline passed (e.g. during the Gemini call); another worker answers this turn
+            logger.info(f"Not sending reply to {sender_number}: turn was handed off")
+            return
+        # Persisted before the first send; the history is saved once every chunk is delivered
+        entry = outbox.enqueue(sender_number, message_chunks, safe_sender_id=safe_sender_id, messages=messages,
+                               user_message=incoming_message_text, response_text=response_text,
+                               save_history=save_history, accepted_at=turn.accepted_at,
+                               lane=route['lane'] if lanes else None)
+        if outbox_lane:
+            deliver_later(entry)
+        else:
+            deliver_reply(entry, turn)
+        
+        # Send notification to group if needed (or leave it to the event consumer)
+        if notification_events:
+            with tracer.span('notify_event'):
+                notification_events.append(
+                    EVENT_TURN_PROCESSED,
+                    customer=sender_number,
+                    message=incoming_message_text,
+                    menu_option=selected_menu_option,
+                    notify=should_notify_group,
+                    route=route['kind']
+                )
+        elif should_notify_group:
+            logger.info(f"Sending notification to group for {sender_number}")
+            with tracer.span('notify'):
+                send_notification_to_group(
+                    sender_number,
+                    incoming_message_text,
+                    menu_option=selected_menu_option
+                )
+    else:
+        logger.error("No reply generated")
+
 @app.route('/webhook', methods=['POST'])
+@webhook_duration.time()
+@profile_watchdog.time()
+@tracer.trace('webhook')
 def webhook():
     """Handles incoming WhatsApp messages via webhook using the WaSenderAPI SDK."""
     try:        
         logger.info("=== WEBHOOK CALLED ===")
         
+        if drainer.draining:
+            # Shutting down; WaSender redelivers to a worker that is still serving
+            return jsonify({'status': 'error', 'message': 'Shutting down'}), 503
+        
         if not wasender_client:
             logger.error("WaSender API client is not initialized. Cannot process webhook.")
             return jsonify({'status': 'error', 'message': 'WaSender client not initialized'}), 500
 
         data = request.json
-        logger.info(f"Received webhook data: {data}")
+        payload_logger.info("Received webhook data: %s", data)
         
         if data.get('event') == 'messages.upsert' and data.get('data') and data['data'].get('messages'):
             message_info = data['data']['messages']
-            logger.info(f"Processing message info: {message_info}")
+            payload_logger.info("Processing message info: %s", message_info)
             
             # Check if it's a message sent by the bot itself
             if message_info.get('key', {}).get('fromMe'):
@@ -651,6 +1528,23 @@ def webhook():
 
             sender_number = message_info.get('key', {}).get('remoteJid')
             logger.info(f"Sender number: {sender_number}")
+            tracer.annotate(sender=sender_number)
+            
+            # Multi-node: the node owning this sender answers; a forwarded request is never forwarded again
+            if affinity and sender_number and not request.headers.get(HOP_HEADER):
+                owner = affinity.owner(sender_number)
+                if owner != affinity.self_url:
+                    with tracer.span('affinity_forward', owner=owner):
+                        forwarded = affinity.forward(owner, request.get_data(), request.content_type or 'application/json')
+                    if forwarded is not None:
+                        affinity_routes.inc(result='forwarded')
+                        content, status_code, content_type = forwarded
+                        return content, status_code, {'Content-Type': content_type}
+                    affinity_routes.inc(result='fallback')
+                    logger.warning(f"Owner {owner} of {sender_number} unavailable, handling locally")
+                else:
+                    affinity_routes.inc(result='local')
+                    affinity.record_local()
             
             incoming_message_text = None
             message_type = 'unknown'
@@ -658,16 +1552,16 @@ def webhook():
             # Extract message content based on message structure
             if message_info.get('message'):
                 msg_content_obj = message_info['message']
-                logger.info(f"Message content object: {msg_content_obj}")
+                payload_logger.info("Message content object: %s", msg_content_obj)
                 
                 if 'conversation' in msg_content_obj:
                     incoming_message_text = msg_content_obj['conversation']
                     message_type = 'text'
-                    logger.info(f"Found conversation text: {incoming_message_text}")
+                    payload_logger.info("Found conversation text: %s", incoming_message_text)
                 elif 'extendedTextMessage' in msg_content_obj and 'text' in msg_content_obj['extendedTextMessage']:
                     incoming_message_text = msg_content_obj['extendedTextMessage']['text']
                     message_type = 'text'
-                    logger.info(f"Found extended text: {incoming_message_text}")
+                    payload_logger.info("Found extended text: %s", incoming_message_text)
 
             if not sender_number:
                 logger.warning("Webhook received message without sender information.")
@@ -678,79 +1572,18 @@ def webhook():
             
             # we should do this in queue in production if we take too long to respond the request will timeout
             if message_type == 'text' and incoming_message_text:
-                logger.info(f"Processing text message: '{incoming_message_text}' from {sender_number}")
-                
-                conversation_history = load_conversation_history(safe_sender_id)
-                logger.info(f"Loaded conversation history for {safe_sender_id}")
-                
-                response_text = None
-                should_notify_group = False
-                selected_menu_option = None
-                
-                # Check if interactive menu is enabled
-                if MENU_CONFIG.get('enabled', False):
-                    # Check if it's a greeting (first interaction)
-                    if is_greeting(incoming_message_text, MENU_CONFIG.get('greeting_keywords', [])):
-                        logger.info(f"Greeting detected, showing menu to {sender_number}")
-                        response_text = MENU_CONFIG.get('welcome_message', '')
-                    
-                    # Check if it's a menu option selection
-                    elif is_menu_option(incoming_message_text, MENU_CONFIG.get('menu_options', {})):
-                        option_key = is_menu_option(incoming_message_text, MENU_CONFIG.get('menu_options', {}))
-                        logger.info(f"Menu option {option_key} selected by {sender_number}")
-                        response_text = get_menu_response(option_key, MENU_CONFIG.get('menu_options', {}))
-                        
-                        # Check if this option requires notification (options 2-6 need specialist)
-                        if option_key in ['2', '3', '4', '6']:
-                            should_notify_group = True
-                            option_title = MENU_CONFIG.get('menu_options', {}).get(option_key, {}).get('title', f'Opção {option_key}')
-                            selected_menu_option = f"{option_key} - {option_title}"
-                
-                # If no menu response, use Gemini AI
-                if not response_text:
-                    logger.info(f"Using Gemini AI for response")
-                    response_text = get_gemini_response(incoming_message_text, conversation_history)
-                    logger.info(f"Gemini reply: {response_text}")
-                    
-                    # Check if AI response suggests contacting specialist
-                    keywords_for_notification = ['jailson', 'josimar', 'consultor', 'especialista', 'atendimento']
-                    if any(keyword in response_text.lower() for keyword in keywords_for_notification):
-                        should_notify_group = True
+                with tracer.span('admission'):
+                    allowed = admission_controller.allow_sender(safe_sender_id)
+                if not allowed:
+                    # 200 so WaSender doesn't retry the flood
+                    return jsonify({'status': 'success', 'message': 'Sender throttled'}), 200
                 
-                if response_text:
-                    message_chunks = split_message(response_text)
-                    logger.info(f"Sending {len(message_chunks)} message chunks to {sender_number}")
-                    for i, chunk in enumerate(message_chunks):
-                        logger.info(f"Sending chunk {i+1}/{len(message_chunks)}: {chunk[:50]}...")
-                        send_result = send_whatsapp_message(sender_number, chunk, message_type='text')
-                        if not send_result:
-                            logger.error(f"Failed to send message chunk {i+1} to {sender_number}")
-                            break
-                        else:
-                            logger.info(f"Successfully sent chunk {i+1} to {sender_number}")
-                        
-                        # Delay between messages
-                        import random
-                        import time
-                        if i < len(message_chunks) - 1:
-                            delay = random.uniform(5, 7)
-                            logger.info(f"Waiting {delay:.1f} seconds before next chunk...")
-                            time.sleep(delay)
-                    
-                    # Send notification to group if needed
-                    if should_notify_group:
-                        logger.info(f"Sending notification to group for {sender_number}")
-                        send_notification_to_group(
-                            sender_number,
-                            incoming_message_text,
-                            menu_option=selected_menu_option
-                        )
-                    
-                    # Save conversation history
-                    conversation_manager.add_exchange(safe_sender_id, incoming_message_text, response_text)
-                    logger.info(f"Saved conversation history for {safe_sender_id}")
+                if burst_coalescer:
+                    # Wait for the rest of the burst; the reply goes out when the window closes
+                    with tracer.span('burst_enqueue'):
+                        burst_coalescer.submit(safe_sender_id, incoming_message_text, context=sender_number)
                 else:
-                    logger.error("No reply generated")
+                    dispatch_text_message(sender_number, safe_sender_id, [incoming_message_text])
             else:
                 logger.warning(f"Message type '{message_type}' not supported or no text content")
         else:
@@ -760,9 +1593,186 @@ def webhook():
         return jsonify({'status': 'success'}), 200
             
     except Exception as e:
+        errors_total.inc(stage='webhook')
         logger.error(f"Error processing webhook: {e}")
         return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
+# Separate worker lanes for local answers and LLM work
+lanes = None
+if CONFIG["PIPELINE_LANES"]:
+    lanes = {
+        'fast': Lane('fast', CONFIG["FAST_LANE_WORKERS"], CONFIG["FAST_LANE_SLO_MS"],
+                     max_queue=CONFIG["FAST_LANE_QUEUE"]),
+        'llm': Lane('llm', CONFIG["LLM_LANE_WORKERS"], CONFIG["LLM_LANE_SLO_MS"],
+                    max_queue=CONFIG["LLM_LANE_QUEUE"]),
+    }
+    logger.info(f"Pipeline lanes enabled (fast: {CONFIG['FAST_LANE_WORKERS']} workers, llm: {CONFIG['LLM_LANE_WORKERS']} workers)")
+
+def dispatch_text_message(sender_number, safe_sender_id, messages, turn=None):
+    """
+    Route a user turn and run it inline or on its lane.
+    
+    Args:
+        sender_number: The sender's WhatsApp JID
+        safe_sender_id: Sanitized sender id used for conversation storage
+        messages: List of message texts making up the turn
+        turn: TurnState already registered with the drainer (registered here if not given)
+    """
+    if turn is None:
+        # Registered before queueing, so a drain waits for (or hands off) turns still in a lane queue
+        turn = drainer.track(sender_number, safe_sender_id, messages)
+    try:
+        with tracer.span('route') as span:
+            route = route_message(messages, persona_manager.current)
+            if span:
+                span.set_attribute('kind', route['kind'])
+        if lanes:
+            logger.info(f"Routing message from {sender_number} to the {route['lane']} lane")
+            if lanes[route['lane']].submit(tracer.bind(process_text_message), sender_number, safe_sender_id,
+                                           messages, route=route, turn=turn) is None:
+                # The lane's queue is full: shed now, while the customer is still waiting for an answer
+                admission_controller.record_shed()
+                logger.warning(f"The {route['lane']} lane is full, sending busy reply to {sender_number}")
+                process_text_message(sender_number, safe_sender_id, messages, route=busy_route(), turn=turn)
+        else:
+            process_text_message(sender_number, safe_sender_id, messages, route=route, turn=turn)
+    except Exception:
+        drainer.finish(turn)
+        raise
+
+# Coalesce rapid consecutive messages from the same sender into one turn
+burst_coalescer = None
+if CONFIG["BURST_WINDOW_MS"] > 0:
+    def process_burst(safe_sender_id, messages, sender_number, turn=None):
+        # Runs on the coalescer's timer thread, so the merged turn gets its own trace
+        with tracer.trace('turn', sender=sender_number, messages=len(messages)):
+            dispatch_text_message(sender_number, safe_sender_id, messages, turn=turn)
+    
+    burst_coalescer = BurstCoalescer(
+        process_burst,
+        window_ms=CONFIG["BURST_WINDOW_MS"],
+        max_wait_ms=CONFIG["BURST_MAX_WAIT_MS"]
+    )
+    logger.info(f"Burst coalescing enabled ({CONFIG['BURST_WINDOW_MS']} ms window)")
+
+def count_active_conversations():
+    """Count conversation files updated within ACTIVE_CONVERSATION_WINDOW."""
+    cutoff = time.time() - CONFIG.get("ACTIVE_CONVERSATION_WINDOW", 1800)
+    try:
+        with os.scandir(CONFIG["CONVERSATIONS_DIR"]) as entries:
+            return sum(1 for entry in entries if entry.name.endswith('.json') and entry.stat().st_mtime >= cutoff)
+    except FileNotFoundError:
+        return 0
+
+# Gauges computed when /metrics is scraped
+queue_depth.set_function(lambda: lanes['fast'].queued if lanes else 0, queue='fast_lane')
+queue_depth.set_function(lambda: lanes['llm'].queued if lanes else 0, queue='llm_lane')
+queue_depth.set_function(lambda: admission_controller.waiting, queue='llm_admission')
+queue_depth.set_function(lambda: burst_coalescer.pending() if burst_coalescer else 0, queue='burst')
+queue_depth.set_function(lambda: outbox.pending, queue='outbox')
+queue_depth.set_function(lambda: notification_digest.snapshot()['pending'] if notification_digest else 0,
+                         queue='notification_digest')
+active_conversations.set_function(count_active_conversations)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose metrics in the Prometheus text format."""
+    return REGISTRY.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+@app.route('/debug/traces', methods=['GET'])
+@require_admin
+def debug_traces():
+    """Recent traces, newest first; filter with ?sender=, ?min_ms= and ?limit=."""
+    try:
+        min_duration_ms = float(request.args['min_ms']) if 'min_ms' in request.args else None
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'min_ms and limit must be numbers'}), 400
+    traces = tracer.recent(sender=request.args.get('sender'), min_duration_ms=min_duration_ms, limit=limit)
+    return jsonify({'count': len(traces), 'traces': traces})
+
+@app.route('/debug/profile', methods=['GET'])
+@require_admin
+def debug_profile():
+    """Start sampling every thread for ?seconds= (default 30) in the background.
+
+    Returns 202 with the job id; the result is fetched from /debug/profile/<id>
+    once the capture has finished, from any worker on the host.
+    """
+    try:
+        seconds = float(request.args.get('seconds', 30))
+        interval = float(request.args.get('interval_ms', 10)) / 1000.0
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'seconds and interval_ms must be numbers'}), 400
+    max_seconds = CONFIG.get("PROFILE_MAX_SECONDS", 120)
+    if not 0 < seconds <= max_seconds or not 0.001 <= interval <= 1:
+        return jsonify({'status': 'error',
+                        'message': f'seconds must be in (0, {max_seconds:g}], interval_ms in [1, 1000]'}), 400
+
+    job_id = profile_jobs.start(seconds, interval)
+    if job_id is None:
+        return jsonify({'status': 'error', 'message': 'A profile is already running'}), 409
+    return jsonify({'status': 'running', 'id': job_id, 'seconds': seconds,
+                    'result': f"/debug/profile/{job_id}"}), 202
+
+@app.route('/debug/profile/<job_id>', methods=['GET'])
+@require_admin
+def debug_profile_result(job_id):
+    """A profile's collapsed stacks once finished (202 while it runs).
+
+    ?view=wall (default) counts every sample, ?view=cpu only time threads spent
+    on the CPU; ?format=json returns both views.
+    """
+    view = request.args.get('view', 'wall')
+    if view not in ('wall', 'cpu'):
+        return jsonify({'status': 'error', 'message': 'view must be wall or cpu'}), 400
+    state = profile_jobs.get(job_id)
+    if state is None:
+        return jsonify({'status': 'error', 'message': 'Unknown profile'}), 404
+    if state['state'] == 'running':
+        remaining = max(0.0, state['started_at'] + state['seconds'] - time.time())
+        return jsonify({'status': 'running', 'id': job_id, 'remaining_s': round(remaining, 1)}), 202
+    if state['state'] == 'failed':
+        return jsonify({'status': 'error', 'id': job_id, 'message': state.get('error', 'Profile failed')}), 500
+    if request.args.get('format') == 'json':
+        return jsonify({'id': job_id, 'seconds': state['seconds'], 'samples': state['samples'],
+                        'wall': profile_jobs.read(job_id, 'wall'), 'cpu': profile_jobs.read(job_id, 'cpu')})
+    return profile_jobs.read(job_id, view) or '', 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/admin/outbox', methods=['GET'])
+@require_admin
+def admin_outbox():
+    """Dead-lettered (default) or pending replies, oldest first; ?state=dead|pending, ?limit=."""
+    state = request.args.get('state', 'dead')
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit must be a number'}), 400
+    if state not in ('dead', 'pending'):
+        return jsonify({'status': 'error', 'message': 'state must be dead or pending'}), 400
+    entries = outbox.list_entries(dead=state == 'dead', limit=limit)
+    return jsonify({'state': state, 'count': len(entries), 'entries': entries, 'outbox': outbox.snapshot()})
+
+@app.route('/admin/outbox/<entry_id>', methods=['GET'])
+@require_admin
+def admin_outbox_entry(entry_id):
+    """One outbox entry, pending or dead-lettered."""
+    entry = outbox.get(entry_id)
+    if entry is None:
+        return jsonify({'status': 'error', 'message': f'No outbox entry {entry_id}'}), 404
+    return jsonify(entry)
+
+@app.route('/admin/outbox/<entry_id>/retry', methods=['POST'])
+@require_admin
+def admin_outbox_retry(entry_id):
+    """Requeue a dead-lettered reply; delivery resumes from its first unsent chunk."""
+    entry = outbox.requeue(entry_id)
+    if entry is None:
+        return jsonify({'status': 'error', 'message': f'No dead-lettered entry {entry_id}'}), 404
+    deliver_later(entry)
+    return jsonify({'status': 'success', 'id': entry_id,
+                    'remaining_chunks': len(entry['chunks']) - entry['sent']}), 202
+
 @app.route('/status', methods=['GET'])
 def status():
     """Get status information about the service."""
@@ -770,10 +1780,23 @@ def status():
         'status': 'active',
         'version': '1.0.0',
         'persona': PERSONA_NAME,
+        'persona_version': persona_manager.current.version,
         'services': {
-            'wasender': wasender_client is not None,
+            'wasender': bool(wasender_client),
             'gemini': gemini_client is not None,
         },
+        'burst_coalescing': burst_coalescer.stats if burst_coalescer else None,
+        'admission': admission_controller.snapshot(),
+        'lanes': {name: lane.snapshot() for name, lane in lanes.items()} if lanes else None,
+        'notification_digest': notification_digest.snapshot() if notification_digest else None,
+        'profile_watchdog': profile_watchdog.snapshot(),
+        'warmup': warmup.snapshot(),
+        'cache_snapshot': cache_snapshot.snapshot() if cache_snapshot else None,
+        'drain': drainer.snapshot(),
+        'outbox': outbox.snapshot(),
+        'affinity': affinity.snapshot() if affinity else None,
+        'shared_state': {name: table.snapshot() for name, table in shared_tables.items()} or None,
+        'history_locks': conversation_manager.locks.snapshot(),
         'config': {
             'conversation_dir': CONFIG["CONVERSATIONS_DIR"],
             'gemini_model': CONFIG["GEMINI_MODEL"],
@@ -788,17 +1811,201 @@ def clear_history(user_id):
         safe_user_id = "".join(c if c.isalnum() else '_' for c in user_id)
         file_path = os.path.join(CONFIG["CONVERSATIONS_DIR"], f"{safe_user_id}.json")
         
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"Cleared conversation history for {safe_user_id}")
-            return jsonify({'status': 'success', 'message': f'History cleared for {safe_user_id}'}), 200
-        else:
-            logger.info(f"No conversation history found for {safe_user_id}")
-            return jsonify({'status': 'success', 'message': f'No history found for {safe_user_id}'}), 200
+        with conversation_manager.locked(safe_user_id):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Cleared conversation history for {safe_user_id}")
+                return jsonify({'status': 'success', 'message': f'History cleared for {safe_user_id}'}), 200
+        logger.info(f"No conversation history found for {safe_user_id}")
+        return jsonify({'status': 'success', 'message': f'No history found for {safe_user_id}'}), 200
     except Exception as e:
         logger.error(f"Error clearing history for {user_id}: {e}")
         return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
+# Cache contents saved on shutdown (and every CACHE_SNAPSHOT_INTERVAL seconds)
+# and restored by the warm-up, so a deploy doesn't start cold
+cache_snapshot = None
+if CONFIG["CACHE_SNAPSHOT_DIR"]:
+    cache_snapshot = CacheSnapshot(
+        CONFIG["CACHE_SNAPSHOT_DIR"],
+        max_age=CONFIG["CACHE_SNAPSHOT_MAX_AGE"],
+        interval=CONFIG["CACHE_SNAPSHOT_INTERVAL"]
+    )
+    cache_snapshot.register(
+        'conversations',
+        conversation_manager.export_cache,
+        lambda entries, age: conversation_manager.import_cache(entries, max_idle=CONFIG["ACTIVE_CONVERSATION_WINDOW"])
+    )
+    if notification_digest:
+        cache_snapshot.register(
+            'notification_dedup',
+            notification_digest.export_dedup,
+            lambda last_sent, age: notification_digest.import_dedup(last_sent)
+        )
+    atexit.register(cache_snapshot.save)
+
+# Warm-up run by each serving process before it reports ready (/health/ready)
+warmup = WarmUp(enabled=CONFIG["WARMUP_ENABLED"])
+
+@warmup.step('wasender_client')
+def warm_wasender_client():
+    # The SDK opens a new connection per request, so there is no pool to fill;
+    # importing it and building the client is the cold cost
+    if isinstance(wasender_client, LazyProxy):
+        wasender_client.resolve()
+
+@warmup.step('gemini_model')
+def warm_gemini_model():
+    # Imports and configures genai and builds the model for the current persona
+    # (the few-shot prefix and keyword matchers are prebuilt by PersonaManager)
+    if gemini_client:
+        gemini_client.get_model()
+
+@warmup.step('cache_snapshot')
+def warm_from_snapshot():
+    # Before 'conversations' so preloading only reads what the snapshot lacked
+    if not cache_snapshot:
+        return 'disabled'
+    return cache_snapshot.restore()
+
+@warmup.step('conversations')
+def warm_conversations():
+    user_ids = conversation_manager.recent_user_ids(CONFIG.get("ACTIVE_CONVERSATION_WINDOW", 1800),
+                                                    conversation_manager.cache_size)
+    return conversation_manager.preload(user_ids)
+
+@warmup.step('gemini_probe')
+def warm_gemini_probe():
+    # Optional one-token call that opens the connection to Gemini
+    if not (CONFIG.get("WARMUP_GEMINI_PROBE") and gemini_client):
+        return 'skipped'
+    gemini_client.get_model().generate_content('ping', generation_config={'max_output_tokens': 1})
+
+@warmup.step('outbox')
+def warm_recover_outbox():
+    # Replies a previous process left undelivered; one thread per recipient keeps their order
+    by_recipient = {}
+    for entry in outbox.recover():
+        by_recipient.setdefault(entry['recipient'], []).append(entry)
+    for entries in by_recipient.values():
+        threading.Thread(target=deliver_in_order, args=(entries,), name="outbox-recover", daemon=True).start()
+    return sum(len(entries) for entries in by_recipient.values())
+
+def resume_handoffs():
+    """
+    Answer turns other (draining or exited) workers handed off, each on its
+    own thread. Runs at warm-up and after every outbox recovery scan.
+    
+    Returns:
+        Number of turns resumed
+    """
+    items = drainer.claim_handoffs()
+    for item in items:
+        logger.info(f"Answering handed-off turn for {item['sender_number']}")
+        threading.Thread(target=dispatch_text_message,
+                         args=(item['sender_number'], item['safe_sender_id'], item['messages']),
+                         name="handoff-resume", daemon=True).start()
+    return len(items)
+
+@warmup.step('handoff')
+def warm_resume_handoffs():
+    # Last, so the clients are warm
+    return resume_handoffs()
+
+def start_buffered_bursts():
+    """
+    Close every open burst window and start each burst as a tracked turn on
+    its own thread, so they run concurrently and the drain waits for (or
+    hands off) them like any other turn.
+    
+    Returns:
+        Number of bursts started
+    """
+    bursts = burst_coalescer.take_all() if burst_coalescer else []
+    for safe_sender_id, messages, sender_number in bursts:
+        # Registered before the thread starts, so the drain can't miss it
+        turn = drainer.track(sender_number, safe_sender_id, messages)
+        threading.Thread(target=burst_coalescer.process_now, args=(safe_sender_id, messages, sender_number),
+                         kwargs={'turn': turn}, name="drain-burst", daemon=True).start()
+    return len(bursts)
+
+def drain():
+    """
+    Graceful shutdown: stop taking webhooks and outbox retries, start buffered
+    bursts, let in-flight and queued turns finish until DRAIN_TIMEOUT, hand
+    off what is left for the next worker and send the pending notification
+    digest.
+    
+    Returns:
+        Drain summary, or None if a drain already ran
+    """
+    outbox.stop()
+    summary = drainer.drain(before_wait=start_buffered_bursts)
+    if summary is None:
+        return None
+    if notification_digest:
+        # Turns that finished during the drain may have queued notifications; the timer won't outlive us
+        notification_digest.flush()
+    if cache_snapshot:
+        cache_snapshot.save()
+    return summary
+
+_initialized_pid = None
+_initialize_lock = threading.Lock()
+
+def initialize():
+    """
+    Per-process setup kept out of import (the persona watcher, cache
+    snapshot and outbox retry threads). Runs again in a forked worker, whose threads did not survive the
+    fork. The API clients are built on first use.
+    """
+    global _initialized_pid, _initialize_lock
+    pid = os.getpid()
+    if _initialized_pid == pid:
+        return
+    if _initialized_pid is not None:
+        # Forked from an initialized parent; its lock and warm-up state are not ours
+        _initialize_lock = threading.Lock()
+        warmup.reset()
+        drainer.reset()
+        outbox.reset()
+    with _initialize_lock:
+        if _initialized_pid == pid:
+            return
+        if CONFIG.get("PERSONA_RELOAD_INTERVAL", 0) > 0:
+            persona_manager.start_watcher()
+        if cache_snapshot:
+            cache_snapshot.start()
+        # The retry loop also picks up turns handed off by workers draining after we started
+        outbox.start(deliver_tracked, interval=CONFIG.get("OUTBOX_POLL_INTERVAL", 1), on_recovery=resume_handoffs)
+        _initialized_pid = pid
+
+@app.before_request
+def ensure_initialized():
+    """
+    Run initialize() once per process for servers that load script:app directly,
+    and start the warm-up in the process that serves requests (a gunicorn
+    worker's first request is usually the load balancer's readiness probe).
+    """
+    if _initialized_pid != os.getpid():
+        initialize()
+    if warmup.pending:
+        warmup.start()
+
+def create_app():
+    """
+    Application factory: initialize this process and return the Flask app.
+
+    Safe with gunicorn --preload ('script:create_app()'): nothing created here
+    is shared with forked workers, which initialize themselves, build their
+    own API clients and run their warm-up from their first request.
+
+    Returns:
+        The Flask application
+    """
+    initialize()
+    return app
+
 if __name__ == '__main__':
     # Display startup information
     logger.info("======================================================")
@@ -807,12 +2014,19 @@ if __name__ == '__main__':
     logger.info(f"Persona: {PERSONA_NAME}")
     logger.info(f"Gemini Model: {CONFIG['GEMINI_MODEL']}")
     logger.info(f"Conversations Directory: {CONFIG['CONVERSATIONS_DIR']}")
-    logger.info(f"WaSender API Client: {'Initialized' if wasender_client else 'NOT INITIALIZED'}")
-    logger.info(f"Gemini API Client: {'Initialized' if gemini_client else 'NOT INITIALIZED'}")
+    logger.info(f"WaSender API Client: {'Configured (connects on first use)' if CONFIG['WASENDER_API_TOKEN'] else 'NOT CONFIGURED'}")
+    logger.info(f"Gemini API Client: {'Configured (connects on first use)' if gemini_client else 'NOT INITIALIZED'}")
     logger.info(f"Starting Flask server on port 5001...")
     logger.info("======================================================")
     
     # For development with webhook testing via ngrok
     port = int(os.getenv('PORT', '5001'))
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
-    app.run(debug=debug, port=port, host='0.0.0.0')
+    application = create_app()
+    warmup.start()
+    
+    def handle_sigterm(signum, frame):
+        drain()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    application.run(debug=debug, port=port, host='0.0.0.0')
@@ -0,0 +1,211 @@
+"""
+shared_state.py - Fixed-size hash tables shared by every worker on a host
+
+Each table is a file mapped into memory by every process that opens it (put
+it on a tmpfs such as /dev/shm so it never touches the disk). Keys are
+stored as 64-bit hashes; each slot holds the key hash, the time it was last
+written and a fixed number of float fields. The table never grows: a key
+is looked for in a short probe window and, when every slot there is taken,
+the least recently written one is reused, which suits state that expires
+anyway (token buckets, dedup timestamps).
+
+The slots are split into stripes, each guarded by a thread lock (threads of
+one process) plus an fcntl lock on one byte of the file (other processes),
+so every read-modify-write of a key is atomic host-wide while operations on
+different stripes don't wait for each other.
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("whatsapp_bot")
+
+MAGIC = b'WBST0001'
+HEADER = struct.Struct('<8sIII')  # magic, slots, fields, stripes
+HEADER_SIZE = 64
+
+
+def key_hash(key):
+    """64-bit hash of a key (0 marks an empty slot, so it is never returned)."""
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+class SharedTable:
+    """A fixed-size key -> float fields table in a memory-mapped file."""
+
+    def __init__(self, path, slots=16384, fields=1, stripes=64, probe=8):
+        """
+        Open the table at path, creating it if needed.
+
+        Args:
+            path: Table file; every process opening the same path shares the table
+            slots: Number of slots (rounded up to a multiple of stripes)
+            fields: Float fields stored per key
+            stripes: Number of independently locked slot ranges
+            probe: Slots searched for a key before the oldest one is reused
+
+        Raises:
+            ValueError: If the file exists with a different layout
+        """
+        self.path = path
+        self.stripes = stripes
+        self.stripe_slots = max(probe, -(-slots // stripes))
+        self.slots = self.stripe_slots * stripes
+        self.fields = fields
+        self.probe = probe
+        self._record = struct.Struct('<Qd' + 'd' * fields)
+        self._stats_lock = threading.Lock()
+        self.stats = {'operations': 0, 'contended': 0, 'evictions': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        size = HEADER_SIZE + self.slots * self._record.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Creation is serialised on the header so concurrent workers agree on the layout
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        mismatch = None
+        header = os.pread(self._fd, HEADER.size, 0)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            os.ftruncate(self._fd, size)
+            os.pwrite(self._fd, HEADER.pack(MAGIC, self.slots, fields, stripes), 0)
+        else:
+            _, existing_slots, existing_fields, existing_stripes = HEADER.unpack(header)
+            if (existing_slots, existing_fields, existing_stripes) != (self.slots, fields, stripes):
+                mismatch = (f"Shared table {path} has {existing_slots} slots x {existing_fields} fields in "
+                            f"{existing_stripes} stripes, expected {self.slots} x {fields} in {stripes}")
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+        if mismatch:
+            os.close(self._fd)
+            raise ValueError(mismatch)
+        # Stripe lock bytes lie past the end of the file, clear of the header lock
+        self._lock_base = size
+        self._mm = mmap.mmap(self._fd, size)
+        self._reset_locks()
+        # Thread locks held by other threads at fork time would never be released in the child
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+
+    @contextmanager
+    def _locked(self, stripe):
+        with self._locks[stripe]:
+            offset = self._lock_base + stripe
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            except OSError:
+                with self._stats_lock:
+                    self.stats['contended'] += 1
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def _find(self, hashed):
+        """Return (slot offset, found) for a key hash; an empty or the oldest slot when not found."""
+        stripe, index = divmod(hashed % self.slots, self.stripe_slots)
+        base = stripe * self.stripe_slots
+        victim = None
+        victim_written = None
+        for step in range(self.probe):
+            offset = HEADER_SIZE + (base + (index + step) % self.stripe_slots) * self._record.size
+            slot_hash, written = struct.unpack_from('<Qd', self._mm, offset)
+            if slot_hash == hashed:
+                return offset, True
+            if slot_hash == 0:
+                # Slots are never emptied, so the key can't be further along
+                return offset, False
+            if victim is None or written < victim_written:
+                victim, victim_written = offset, written
+        return victim, False
+
+    def update(self, key, func):
+        """
+        Atomically read-modify-write one key, host-wide.
+
+        Args:
+            key: The key (a string)
+            func: Callable(values) given the key's fields as a tuple (None if the
+                key is absent) and returning (new_values or None to leave the
+                slot unchanged, result)
+
+        Returns:
+            The result returned by func
+        """
+        hashed = key_hash(key)
+        stripe = (hashed % self.slots) // self.stripe_slots
+        with self._locked(stripe):
+            offset, found = self._find(hashed)
+            values = self._record.unpack_from(self._mm, offset)[2:] if found else None
+            new_values, result = func(values)
+            if new_values is not None:
+                if not found and struct.unpack_from('<Q', self._mm, offset)[0]:
+                    with self._stats_lock:
+                        self.stats['evictions'] += 1
+                self._record.pack_into(self._mm, offset, hashed, time.time(), *new_values)
+        with self._stats_lock:
+            self.stats['operations'] += 1
+        return result
+
+    def get(self, key):
+        """The key's fields as a tuple, or None if absent."""
+        return self.update(key, lambda values: (None, values))
+
+    def set(self, key, values):
+        """Store the key's fields."""
+        self.update(key, lambda _: (tuple(values), None))
+
+    def incr(self, key, amount=1.0):
+        """Add amount to the key's first field and return the new value."""
+        def add(values):
+            total = (values[0] if values else 0.0) + amount
+            return (total,) + (values[1:] if values else (0.0,) * (self.fields - 1)), total
+        return self.update(key, add)
+
+    def used(self):
+        """Number of occupied slots."""
+        return sum(1 for record in struct.iter_unpack(self._record.format, self._mm[HEADER_SIZE:]) if record[0])
+
+    def snapshot(self):
+        """Size, occupancy and lock contention, for /status."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, path=self.path, slots=self.slots, used=self.used())
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+
+class SharedCounters:
+    """Named host-wide counters kept in a SharedTable."""
+
+    def __init__(self, table, prefix=''):
+        """
+        Args:
+            table: SharedTable holding the counters (at least one field)
+            prefix: Prepended to every counter name, to share one table between components
+        """
+        self.table = table
+        self.prefix = prefix
+        self._names = set()
+
+    def inc(self, name, amount=1):
+        self._names.add(name)
+        return self.table.incr(self.prefix + name, amount)
+
+    def value(self, name):
+        values = self.table.get(self.prefix + name)
+        return values[0] if values else 0
+
+    def values(self, names=None):
+        """Dict of name -> host-wide value (the names incremented by this process by default)."""
+        return {name: int(self.value(name)) for name in sorted(names or self._names)}
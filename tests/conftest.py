@@ -6,7 +6,15 @@ import os
 import pytest
 import json
 import tempfile
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock
+
+# Keep test runs out of whatsapp_bot.log (console logging only)
+os.environ.setdefault('LOG_FILE', '')
+# No background warm-up (it would build real API clients); tests run it explicitly
+os.environ.setdefault('WARMUP_ENABLED', 'false')
+# Replies planned during tests go to a throwaway outbox, with no background retries
+os.environ.setdefault('OUTBOX_DIR', tempfile.mkdtemp(prefix='outbox-'))
+os.environ.setdefault('OUTBOX_POLL_INTERVAL', '0')
 
 @pytest.fixture
 def mock_env_vars(monkeypatch):
@@ -0,0 +1,185 @@
+"""
+test_admission.py - Tests for admission control and load shedding
+"""
+
+import json
+import threading
+from unittest.mock import patch
+from admission import AdmissionController, TokenBucket, LEVEL_FULL, LEVEL_QUEUED, LEVEL_LOCAL_ONLY
+from script import app, process_text_message
+
+class TestTokenBucket:
+    def test_burst_then_throttle(self):
+        """Test that a bucket allows its capacity and then refuses."""
+        # Arrange
+        bucket = TokenBucket(rate=0, capacity=3)
+        
+        # Act
+        results = [bucket.consume() for _ in range(4)]
+        
+        # Assert
+        assert results == [True, True, True, False]
+    
+    def test_refill(self):
+        """Test that tokens refill over time."""
+        # Arrange
+        bucket = TokenBucket(rate=1, capacity=1)
+        bucket.consume()
+        
+        # Act
+        bucket.updated_at -= 1.5  # Pretend 1.5 seconds passed
+        
+        # Assert
+        assert bucket.consume() is True
+
+class TestAdmissionController:
+    def test_sender_flood_is_throttled(self):
+        """Test that one flooding sender doesn't affect others."""
+        # Arrange
+        controller = AdmissionController(sender_rate_per_min=0, sender_burst=2)
+        
+        # Act
+        flood = [controller.allow_sender("spammer") for _ in range(5)]
+        other = controller.allow_sender("customer")
+        
+        # Assert
+        assert flood == [True, True, False, False, False]
+        assert other is True
+        assert controller.stats['throttled'] == 3
+    
+    def test_sender_buckets_are_bounded(self):
+        """Test that the least recently seen senders are evicted."""
+        # Arrange
+        controller = AdmissionController(max_tracked_senders=2)
+        
+        # Act
+        for sender in ["a", "b", "c"]:
+            controller.allow_sender(sender)
+        
+        # Assert
+        assert list(controller._buckets) == ["b", "c"]
+    
+    def test_shed_when_queue_full(self):
+        """Test that LLM work is shed when every slot is busy and the queue is full."""
+        # Arrange
+        controller = AdmissionController(max_in_flight=1, max_queue=0)
+        
+        # Act
+        with controller.llm_slot() as first:
+            level = controller.level()
+            with controller.llm_slot() as second:
+                pass
+        
+        # Assert
+        assert first is True
+        assert second is False
+        assert level == LEVEL_LOCAL_ONLY
+        assert controller.stats['shed'] == 1
+        assert controller.in_flight == 0
+    
+    def test_deferred_request_gets_slot(self):
+        """Test that a queued request proceeds once a slot is released."""
+        # Arrange
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+        holding = threading.Event()
+        release = threading.Event()
+        
+        def hold_slot():
+            with controller.llm_slot():
+                holding.set()
+                release.wait(5)
+        
+        worker = threading.Thread(target=hold_slot)
+        worker.start()
+        holding.wait(5)
+        
+        # Act
+        level = controller.level()
+        threading.Timer(0.05, release.set).start()
+        with controller.llm_slot() as granted:
+            pass
+        worker.join(5)
+        
+        # Assert
+        assert level == LEVEL_QUEUED
+        assert granted is True
+        assert controller.stats['deferred'] == 1
+        assert controller.level() == LEVEL_FULL
+
+    def test_newcomer_does_not_jump_the_queue(self):
+        """Test that a freed slot goes to the caller already waiting, not to one arriving at that moment."""
+        # Arrange
+        controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout=5)
+        order = []
+
+        def queued_caller():
+            with controller.llm_slot():
+                order.append('queued')
+                threading.Event().wait(0.05)
+
+        with controller.llm_slot():
+            waiter = threading.Thread(target=queued_caller)
+            waiter.start()
+            while controller.waiting == 0:
+                threading.Event().wait(0.001)
+
+        # Act
+        with controller.llm_slot() as granted:
+            order.append('newcomer')
+        waiter.join(5)
+
+        # Assert
+        assert granted is True
+        assert order == ['queued', 'newcomer']
+        assert controller.in_flight == 0
+
+class TestDegradedReplies:
+    def test_busy_reply_when_shed(self, mock_wasender_client):
+        """Test that a shed request gets the busy reply and isn't stored."""
+        # Arrange
+        saturated = AdmissionController(max_in_flight=1, max_queue=0)
+        
+        with patch('script.admission_controller', saturated), \
+             patch('script.wasender_client', mock_wasender_client), \
+             patch('script.get_gemini_response') as mock_get_gemini, \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+            
+            # Act
+            with saturated.llm_slot():
+                process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["quanto custa a lente?"])
+        
+        # Assert
+        assert mock_get_gemini.call_count == 0
+        assert mock_wasender_client.send_text.call_count >= 1
+        assert mock_conversation_manager.add_exchange.call_count == 0
+    
+    def test_webhook_throttles_flooding_sender(self, mock_wasender_client):
+        """Test that the webhook drops messages from a throttled sender."""
+        # Arrange
+        controller = AdmissionController(sender_rate_per_min=0, sender_burst=0)
+        webhook_payload = {
+            "event": "messages.upsert",
+            "data": {
+                "messages": {
+                    "key": {"remoteJid": "5581@s.whatsapp.net", "fromMe": False, "id": "flood_id"},
+                    "message": {"conversation": "spam"}
+                }
+            }
+        }
+        
+        with patch('script.admission_controller', controller), \
+             patch('script.wasender_client', mock_wasender_client), \
+             patch('script.process_text_message') as mock_process:
+            
+            # Act
+            with app.test_client() as client:
+                response = client.post('/webhook',
+                                       data=json.dumps(webhook_payload),
+                                       content_type='application/json')
+        
+        # Assert
+        assert response.status_code == 200
+        assert response.json['message'] == 'Sender throttled'
+        assert mock_process.call_count == 0
@@ -0,0 +1,145 @@
+"""
+test_affinity.py - Tests for consistent-hash sender affinity and webhook forwarding
+"""
+
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+from affinity import HashRing, SenderAffinity, HOP_HEADER
+from script import app
+
+NODES = ["http://10.0.0.1:5001", "http://10.0.0.2:5001", "http://10.0.0.3:5001"]
+SENDERS = [f"55819{i:08d}@s.whatsapp.net" for i in range(3000)]
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app."""
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def sender_owned_by(affinity, node):
+    return next(sender for sender in SENDERS if affinity.owner(sender) == node)
+
+def webhook_payload(sender):
+    return {'event': 'messages.upsert', 'data': {'messages': {
+        'key': {'remoteJid': sender, 'fromMe': False, 'id': 'ABC'},
+        'message': {'conversation': "qual o horário de funcionamento?"}}}}
+
+class TestHashRing:
+    def test_senders_spread_over_every_node(self):
+        """Test that virtual nodes give every node a fair share of the senders."""
+        # Arrange
+        ring = HashRing(NODES, vnodes=64)
+
+        # Act
+        owners = [ring.owner(sender) for sender in SENDERS]
+
+        # Assert
+        for node in NODES:
+            assert 0.2 < owners.count(node) / len(SENDERS) < 0.47
+
+    def test_adding_a_node_only_moves_senders_to_it(self):
+        """Test that a membership change moves roughly 1/N of the senders, all to the new node."""
+        # Arrange
+        before = HashRing(NODES)
+        after = HashRing(NODES + ["http://10.0.0.4:5001"])
+
+        # Act
+        moved = [sender for sender in SENDERS if before.owner(sender) != after.owner(sender)]
+
+        # Assert
+        assert {after.owner(sender) for sender in moved} == {"http://10.0.0.4:5001"}
+        assert 0.15 < len(moved) / len(SENDERS) < 0.35
+
+class TestMembership:
+    def test_nodes_file_change_rebalances(self, tmp_path):
+        """Test that editing the nodes file changes ownership after the next refresh."""
+        # Arrange
+        nodes_file = tmp_path / 'nodes.txt'
+        nodes_file.write_text("\n".join(NODES[:2]) + "\n")
+        affinity = SenderAffinity(NODES[0], nodes_file=str(nodes_file))
+        owners_before = {affinity.owner(sender) for sender in SENDERS[:300]}
+
+        # Act
+        nodes_file.write_text("# third node added\n" + "\n".join(NODES) + "\n")
+        affinity.refresh(force=True)
+        owners_after = {affinity.owner(sender) for sender in SENDERS[:300]}
+
+        # Assert
+        assert owners_before == set(NODES[:2])
+        assert owners_after == set(NODES)
+        assert affinity.snapshot()['rebalances'] == 1
+
+    def test_ejected_node_returns_after_eject_time(self):
+        """Test that an unreachable node leaves the ring and comes back once its ejection expires."""
+        # Arrange
+        affinity = SenderAffinity(NODES[0], nodes=NODES, eject_seconds=0)
+        sender = sender_owned_by(affinity, NODES[1])
+
+        # Act
+        with patch.object(affinity, 'refresh'):
+            affinity.eject(NODES[1])
+            owner_while_ejected = affinity.owner(sender)
+        affinity.refresh(force=True)
+
+        # Assert
+        assert owner_while_ejected != NODES[1]
+        assert affinity.owner(sender) == NODES[1]
+
+class TestForwarding:
+    def test_webhook_for_other_owner_is_forwarded(self, client):
+        """Test that a sender owned by another node is forwarded there and not processed locally."""
+        # Arrange
+        affinity = SenderAffinity(NODES[0], nodes=NODES)
+        sender = sender_owned_by(affinity, NODES[1])
+        session = MagicMock()
+        session.post.return_value = MagicMock(status_code=200, content=b'{"status": "success"}',
+                                              headers={'Content-Type': 'application/json'})
+        with patch('script.affinity', affinity), patch.object(affinity, '_session', session), \
+             patch('script.dispatch_text_message') as mock_dispatch:
+
+            # Act
+            response = client.post('/webhook', json=webhook_payload(sender))
+
+        # Assert
+        assert response.status_code == 200
+        mock_dispatch.assert_not_called()
+        url = session.post.call_args.args[0]
+        assert url == f"{NODES[1]}/webhook"
+        assert session.post.call_args.kwargs['headers'][HOP_HEADER] == NODES[0]
+
+    def test_forwarded_webhook_is_handled_locally(self, client):
+        """Test that a request that already made its hop is processed even if the ring disagrees."""
+        # Arrange
+        affinity = SenderAffinity(NODES[0], nodes=NODES)
+        sender = sender_owned_by(affinity, NODES[1])
+        with patch('script.affinity', affinity), patch.object(affinity, '_session') as session, \
+             patch('script.dispatch_text_message') as mock_dispatch:
+
+            # Act
+            response = client.post('/webhook', json=webhook_payload(sender), headers={HOP_HEADER: NODES[2]})
+
+        # Assert
+        assert response.status_code == 200
+        session.post.assert_not_called()
+        mock_dispatch.assert_called_once()
+
+    def test_unreachable_owner_is_ejected_and_handled_locally(self, client):
+        """Test that a failed forward ejects the owner and the event is answered here instead."""
+        # Arrange
+        affinity = SenderAffinity(NODES[0], nodes=NODES[:2])
+        sender = sender_owned_by(affinity, NODES[1])
+        session = MagicMock()
+        session.post.side_effect = requests.exceptions.ConnectionError("connection refused")
+        with patch('script.affinity', affinity), patch.object(affinity, '_session', session), \
+             patch('script.dispatch_text_message') as mock_dispatch:
+
+            # Act
+            response = client.post('/webhook', json=webhook_payload(sender))
+
+        # Assert
+        assert response.status_code == 200
+        mock_dispatch.assert_called_once()
+        assert affinity.snapshot()['ejected'] == [NODES[1]]
+        assert affinity.owner(sender) == NODES[0]
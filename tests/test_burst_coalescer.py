@@ -0,0 +1,138 @@
+"""
+test_burst_coalescer.py - Tests for coalescing rapid consecutive messages
+"""
+
+import threading
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+from burst_coalescer import BurstCoalescer
+from script import process_text_message
+
+class Recorder:
+    """Collects processed bursts and lets tests wait for them."""
+    
+    def __init__(self):
+        self.bursts = []
+        self.event = threading.Event()
+    
+    def __call__(self, sender, messages, context):
+        self.bursts.append((sender, list(messages), context))
+        self.event.set()
+
+class TestBurstCoalescer:
+    def test_burst_is_processed_once(self):
+        """Test that messages inside the window become a single burst."""
+        # Arrange
+        recorder = Recorder()
+        coalescer = BurstCoalescer(recorder, window_ms=50, max_wait_ms=1000)
+        
+        # Act
+        for text in ["oi", "quero saber", "o preço das lentes"]:
+            coalescer.submit("user1", text, context="user1@s.whatsapp.net")
+        recorder.event.wait(2)
+        
+        # Assert
+        assert recorder.bursts == [("user1", ["oi", "quero saber", "o preço das lentes"], "user1@s.whatsapp.net")]
+        assert coalescer.stats['messages_coalesced'] == 2
+        assert coalescer.pending() == 0
+    
+    def test_senders_are_independent(self):
+        """Test that different senders get separate bursts."""
+        # Arrange
+        recorder = Recorder()
+        coalescer = BurstCoalescer(recorder, window_ms=30)
+        
+        # Act
+        coalescer.submit("user1", "oi")
+        coalescer.submit("user2", "olá")
+        deadline = time.time() + 2
+        while len(recorder.bursts) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        
+        # Assert
+        assert sorted(burst[:2] for burst in recorder.bursts) == [("user1", ["oi"]), ("user2", ["olá"])]
+    
+    def test_window_grows_but_respects_max_wait(self):
+        """Test that the adaptive window never exceeds max_wait."""
+        # Arrange
+        coalescer = BurstCoalescer(MagicMock(), window_ms=1000, max_wait_ms=1500, growth=1.0)
+        
+        # Act
+        with patch('threading.Timer') as mock_timer:
+            for text in ["a", "b", "c"]:
+                coalescer.submit("user1", text)
+        delays = [call.args[0] for call in mock_timer.call_args_list]
+        
+        # Assert
+        assert delays[0] == pytest.approx(1.0)
+        assert all(delay <= 1.5 for delay in delays)
+    
+    def test_flush_all(self):
+        """Test that pending bursts can be flushed immediately."""
+        # Arrange
+        recorder = Recorder()
+        coalescer = BurstCoalescer(recorder, window_ms=10_000)
+        coalescer.submit("user1", "oi")
+        
+        # Act
+        coalescer.flush_all()
+        
+        # Assert
+        assert recorder.bursts == [("user1", ["oi"], None)]
+
+    def test_take_all_closes_windows_without_processing(self):
+        """Test that take_all returns pending bursts for the caller to run and their timers never fire."""
+        # Arrange
+        recorder = Recorder()
+        coalescer = BurstCoalescer(recorder, window_ms=50)
+        coalescer.submit("user1", "oi", context="ctx")
+        coalescer.submit("user1", "tudo bem?")
+
+        # Act
+        taken = coalescer.take_all()
+        time.sleep(0.1)
+
+        # Assert
+        assert taken == [("user1", ["oi", "tudo bem?"], "ctx")]
+        assert recorder.bursts == []
+        assert coalescer.pending() == 0
+
+    def test_only_the_same_sender_waits(self):
+        """Test that bursts of different senders are processed side by side and idle sender locks are dropped."""
+        # Arrange
+        both_running = threading.Barrier(2, timeout=2)
+        coalescer = BurstCoalescer(lambda sender, messages, context: both_running.wait())
+        threads = [threading.Thread(target=coalescer.process_now, args=(sender, ["oi"], None))
+                   for sender in ("user1", "user2")]
+
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        # Assert
+        assert not both_running.broken
+        assert coalescer._sender_locks == {}
+
+class TestProcessBurst:
+    def test_burst_is_one_gemini_call_and_one_exchange(self, mock_wasender_client):
+        """Test that a coalesced burst is answered and stored as one turn."""
+        # Arrange
+        with patch('script.wasender_client', mock_wasender_client), \
+             patch('script.get_gemini_response', return_value="As lentes custam a partir de R$ 200.") as mock_get_gemini, \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+            
+            # Act
+            process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net",
+                                 ["oi", "quero saber", "o preço das lentes"])
+        
+        # Assert
+        mock_get_gemini.assert_called_once()
+        assert mock_get_gemini.call_args.args[0] == "oi\nquero saber\no preço das lentes"
+        mock_conversation_manager.add_exchange.assert_called_once_with(
+            "5581_s_whatsapp_net", "oi\nquero saber\no preço das lentes", "As lentes custam a partir de R$ 200."
+        )
@@ -0,0 +1,101 @@
+"""
+test_cache_snapshot.py - Tests for saving and restoring caches across restarts
+"""
+
+import os
+import gzip
+import json
+import time
+from unittest.mock import MagicMock
+from cache_snapshot import CacheSnapshot
+from notification_digest import NotificationDigest
+from script import ConversationManager
+
+HISTORY = [{'role': 'user', 'parts': ["Oi"]}, {'role': 'model', 'parts': ["Olá! Como posso ajudar?"]}]
+
+def snapshot_for(directory, manager, **kwargs):
+    snapshot = CacheSnapshot(str(directory), **kwargs)
+    snapshot.register('conversations', manager.export_cache,
+                      lambda entries, age: manager.import_cache(entries, max_idle=1800))
+    return snapshot
+
+class TestCacheSnapshot:
+    def test_restart_restores_conversation_cache(self, tmp_path, mock_env_vars):
+        """Test that a new process starts with the histories the old one had cached."""
+        # Arrange
+        old_manager = ConversationManager(mock_env_vars, cache_size=8)
+        old_manager.save("5581", HISTORY)
+        saved = snapshot_for(tmp_path, old_manager).save()
+        new_manager = ConversationManager(mock_env_vars, cache_size=8)
+
+        # Act
+        restored = snapshot_for(tmp_path, new_manager).restore()
+
+        # Assert
+        assert saved.endswith('.json.gz')
+        assert restored == {'conversations': 1}
+        assert new_manager.cached_count == 1
+        assert new_manager.load("5581") == HISTORY
+
+    def test_history_changed_since_snapshot_is_not_restored(self, tmp_path, mock_env_vars):
+        """Test that an entry whose file was rewritten after the snapshot is dropped."""
+        # Arrange
+        old_manager = ConversationManager(mock_env_vars, cache_size=8)
+        old_manager.save("5581", HISTORY)
+        snapshot_for(tmp_path, old_manager).save()
+        ConversationManager(mock_env_vars).save("5581", HISTORY + HISTORY)
+        new_manager = ConversationManager(mock_env_vars, cache_size=8)
+
+        # Act
+        restored = snapshot_for(tmp_path, new_manager).restore()
+
+        # Assert
+        assert restored == {'conversations': 0}
+        assert new_manager.load("5581") == HISTORY + HISTORY
+
+    def test_expired_and_corrupt_snapshots_are_ignored(self, tmp_path, mock_env_vars):
+        """Test that snapshots older than max_age and unreadable files are skipped."""
+        # Arrange
+        manager = ConversationManager(mock_env_vars, cache_size=8)
+        manager.save("5581", HISTORY)
+        entries = manager.export_cache()
+        with gzip.open(tmp_path / 'caches_1.json.gz', 'wt') as f:
+            json.dump({'format': 1, 'written_at': time.time() - 7200, 'sections': {'conversations': entries}}, f)
+        with gzip.open(tmp_path / 'caches_2.json.gz', 'wt') as f:
+            f.write("{not json")
+        new_manager = ConversationManager(mock_env_vars, cache_size=8)
+
+        # Act
+        restored = snapshot_for(tmp_path, new_manager, max_age=3600).restore()
+
+        # Assert
+        assert restored == {'conversations': 0}
+        assert new_manager.cached_count == 0
+
+    def test_empty_caches_are_not_written(self, tmp_path, mock_env_vars):
+        """Test that a process with nothing cached leaves no snapshot behind."""
+        # Arrange
+        snapshot = snapshot_for(tmp_path, ConversationManager(mock_env_vars, cache_size=8))
+
+        # Act
+        path = snapshot.save()
+
+        # Assert
+        assert path is None
+        assert os.listdir(tmp_path) == []
+
+class TestDedupIndexSnapshot:
+    def test_only_entries_within_dedup_window_are_restored(self):
+        """Test that restored dedup entries respect the dedup window."""
+        # Arrange
+        digest = NotificationDigest(MagicMock(), dedup_seconds=600)
+        now = time.time()
+
+        # Act
+        restored = digest.import_dedup({'recent': now - 60, 'expired': now - 3600})
+
+        # Assert
+        assert restored == 1
+        assert digest.export_dedup() == {'recent': now - 60}
+        assert digest.add('recent', "Oi") is False
+        assert digest.add('expired', "Oi") is True
@@ -4,7 +4,10 @@ test_conversation_manager.py - Tests for the ConversationManager class
 
 import os
 import json
+import time
+import multiprocessing
 import pytest
+from unittest.mock import patch
 from script import ConversationManager
 
 class TestConversationManager:
@@ -147,3 +150,90 @@ class TestConversationManager:
         
         # Assert
         assert history == []
+
+class TestConversationCache:
+    def test_cache_hit_skips_reading_the_file(self, mock_env_vars):
+        """Test that a cached history is returned without opening the file."""
+        # Arrange
+        manager = ConversationManager(mock_env_vars, cache_size=4)
+        history = [{'role': 'user', 'parts': ["Oi"]}, {'role': 'model', 'parts': ["Olá!"]}]
+        manager.save("cached_user", history)
+
+        # Act
+        with patch('builtins.open', side_effect=AssertionError("file read")):
+            loaded = manager.load("cached_user")
+
+        # Assert
+        assert loaded == history
+
+    def test_write_by_another_process_invalidates(self, mock_env_vars):
+        """Test that a history rewritten outside this manager is re-read."""
+        # Arrange
+        manager = ConversationManager(mock_env_vars, cache_size=4)
+        manager.save("shared_user", [{'role': 'user', 'parts': ["Oi"]}])
+        other_worker = ConversationManager(mock_env_vars)
+        newer = [{'role': 'user', 'parts': ["Oi"]}, {'role': 'model', 'parts': ["Olá, tudo bem?"]}]
+
+        # Act
+        other_worker.save("shared_user", newer)
+        loaded = manager.load("shared_user")
+
+        # Assert
+        assert loaded == newer
+
+    def test_preload_recent_conversations(self, mock_env_vars):
+        """Test that recently updated histories are preloaded, newest first, up to the cache size."""
+        # Arrange
+        writer = ConversationManager(mock_env_vars)
+        for index, user_id in enumerate(["old", "recent", "newest"]):
+            writer.save(user_id, [{'role': 'user', 'parts': [user_id]}])
+            age = {0: 7200, 1: 60, 2: 0}[index]
+            path = os.path.join(mock_env_vars, f"{user_id}.json")
+            os.utime(path, (time.time() - age, time.time() - age))
+        manager = ConversationManager(mock_env_vars, cache_size=1)
+
+        # Act
+        user_ids = manager.recent_user_ids(window=1800, limit=10)
+        cached = manager.preload(user_ids)
+
+        # Assert
+        assert user_ids == ["newest", "recent"]
+        assert cached == 1
+
+def add_exchanges_in_child(storage_dir, count):
+    manager = ConversationManager(storage_dir, max_history=1000, cache_size=4)
+    for i in range(count):
+        manager.add_exchange("busy_user", f"pergunta {i}", f"resposta {i}")
+
+class TestConcurrentUpdates:
+    def test_exchanges_from_several_processes_are_all_kept(self, mock_env_vars):
+        """Test that workers updating the same history at once never drop each other's exchanges."""
+        # Arrange
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=add_exchanges_in_child, args=(mock_env_vars, 25)) for _ in range(4)]
+
+        # Act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        history = ConversationManager(mock_env_vars, max_history=1000).load("busy_user")
+
+        # Assert
+        assert [worker.exitcode for worker in workers] == [0, 0, 0, 0]
+        assert len(history) == 200
+
+    def test_failed_save_keeps_previous_history(self, mock_env_vars):
+        """Test that a save failing mid-write leaves the old history intact and no temp file behind."""
+        # Arrange
+        manager = ConversationManager(mock_env_vars)
+        original = [{'role': 'user', 'parts': ["Oi"]}, {'role': 'model', 'parts': ["Olá!"]}]
+        manager.save("test_user", original)
+
+        # Act
+        with patch('json.dump', side_effect=OSError("No space left on device")):
+            manager.save("test_user", original + [{'role': 'user', 'parts': ["Tudo bem?"]}])
+
+        # Assert
+        assert manager.load("test_user") == original
+        assert sorted(name for name in os.listdir(mock_env_vars) if name.endswith('.tmp')) == []
@@ -0,0 +1,216 @@
+"""
+test_drain.py - Tests for graceful drain and the hand-off of unfinished replies
+"""
+
+import os
+import json
+import threading
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+from burst_coalescer import BurstCoalescer
+from drain import Drainer, TurnState, KIND_TURN
+from lanes import Lane
+from outbox import Outbox
+from script import app, process_text_message, dispatch_text_message, record_delivered_reply, drain as drain_worker
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app."""
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def read_handoffs(directory):
+    items = []
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            items.extend(json.loads(line) for line in f)
+    return items
+
+class TestDrainer:
+    def test_waits_for_turns_that_finish_in_time(self, tmp_path):
+        """Test that a turn finishing before the deadline is not handed off."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=5)
+        release = threading.Event()
+
+        def answer():
+            with drainer.turn('5581@s.whatsapp.net', '5581', ['oi']):
+                release.wait(5)
+        worker = threading.Thread(target=answer)
+        worker.start()
+        threading.Timer(0.1, release.set).start()
+
+        # Act
+        summary = drainer.drain()
+        worker.join()
+
+        # Assert
+        assert summary == {'completed': 1, 'handed_off': 0}
+        assert os.listdir(tmp_path) == []
+
+    def test_unfinished_turn_is_handed_off_and_claimed_once(self, tmp_path):
+        """Test that a turn still waiting at the deadline is written out and claimed by exactly one worker."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=0.2)
+        release = threading.Event()
+
+        def answer():
+            with drainer.turn('5581@s.whatsapp.net', '5581', ['qual o preço?']):
+                release.wait(5)
+        worker = threading.Thread(target=answer)
+        worker.start()
+        time.sleep(0.05)
+
+        # Act
+        summary = drainer.drain()
+        release.set()
+        worker.join()
+        handoff_file = os.listdir(tmp_path)[0]
+        # Pretend the file came from a worker that has since exited
+        os.rename(tmp_path / handoff_file, tmp_path / 'handoff_1.jsonl')
+        claimed = Drainer(str(tmp_path)).claim_handoffs()
+        claimed_again = Drainer(str(tmp_path)).claim_handoffs()
+
+        # Assert
+        assert summary['handed_off'] == 1
+        assert [item['kind'] for item in claimed] == [KIND_TURN]
+        assert claimed[0]['messages'] == ['qual o preço?']
+        assert claimed_again == []
+        assert os.listdir(tmp_path) == []
+
+    def test_own_and_unfinished_handoff_files_are_not_claimed(self, tmp_path):
+        """Test that a worker leaves its own hand-off files and half-written ones alone."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=0.2)
+        drainer.hand_off([TurnState('5581@s.whatsapp.net', '5581', ['oi'])])
+        (tmp_path / 'handoff_1-0000abcd.jsonl.tmp').write_text('{"kind": ')
+
+        # Act
+        claimed = Drainer(str(tmp_path)).claim_handoffs()
+
+        # Assert
+        assert claimed == []
+        assert len(os.listdir(tmp_path)) == 2
+
+    def test_outbox_retry_loop_claims_handoffs_while_serving(self, tmp_path):
+        """Test that the outbox retry loop picks up hand-offs written after warm-up."""
+        # Arrange
+        outbox = Outbox(str(tmp_path / 'outbox'))
+        claimed = threading.Event()
+
+        # Act
+        outbox.start(MagicMock(), interval=0.01, recover_every=0.01, on_recovery=claimed.set)
+        seen = claimed.wait(2)
+        outbox.stop()
+
+        # Assert
+        assert seen
+
+class TestGracefulShutdown:
+    def test_reply_interrupted_by_drain_stays_in_outbox(self, tmp_path, mock_env_vars):
+        """Test that a reply interrupted by the drain deadline is left in the outbox after its last sent chunk."""
+        # Arrange
+        drainer = Drainer(str(tmp_path / 'handoff'), timeout=2)
+        outbox = Outbox(str(tmp_path / 'outbox'), on_delivered=record_delivered_reply)
+        chunks = ["primeira parte", "segunda parte", "terceira parte"]
+        route = {'lane': 'fast', 'kind': 'menu', 'option_key': '1', 'response_text': "\n".join(chunks),
+                 'message_chunks': chunks, 'notify_group': False, 'menu_option': None}
+        sent = []
+
+        def send(recipient, text, message_type='text'):
+            sent.append(text)
+            if not drainer.draining:
+                threading.Thread(target=drainer.drain).start()
+                while not drainer.draining:
+                    time.sleep(0.001)
+            return True
+
+        with patch('script.drainer', drainer), \
+             patch('script.outbox', outbox), \
+             patch('script.send_whatsapp_message', side_effect=send), \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+
+            # Act
+            process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["1"], route=route)
+
+        # Assert
+        assert sent == ["primeira parte"]
+        assert not os.path.exists(tmp_path / 'handoff')
+        [entry] = outbox.list_entries(dead=False)
+        assert entry['chunks'] == chunks
+        assert entry['sent'] == 1
+        # Not delivered yet, so not in the history yet
+        mock_conversation_manager.add_exchange.assert_not_called()
+
+    def test_turn_queued_in_a_lane_is_handed_off_and_skipped(self, tmp_path):
+        """Test that a turn still waiting for a lane worker at the deadline is handed off and not answered later."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=0.2)
+        lane = Lane('llm', workers=1, slo_ms=1000)
+        busy = threading.Event()
+        lane.submit(busy.wait, 5)
+
+        with patch('script.drainer', drainer), \
+             patch('script.lanes', {'fast': lane, 'llm': lane}), \
+             patch('script.answer_turn') as mock_answer_turn:
+            dispatch_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["qual o preço?"])
+
+            # Act
+            summary = drainer.drain()
+            busy.set()
+            lane.shutdown(wait=True)
+
+        # Assert
+        assert summary['handed_off'] == 1
+        assert [item['messages'] for item in read_handoffs(tmp_path)] == [["qual o preço?"]]
+        mock_answer_turn.assert_not_called()
+        assert drainer.in_flight == 0
+
+    def test_drain_runs_buffered_bursts_concurrently_and_sends_the_digest(self, tmp_path):
+        """Test that bursts still in their window are tracked turns running side by side, and the digest is flushed."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=5)
+        both_running = threading.Barrier(2, timeout=2)
+
+        def process(safe_sender_id, messages, sender_number, turn=None):
+            with drainer.turn(sender_number, safe_sender_id, messages, state=turn):
+                # Processed one after another on the drain thread, the first burst would never get past this
+                both_running.wait()
+        coalescer = BurstCoalescer(process, window_ms=60_000)
+        coalescer.submit("5581_s_whatsapp_net", "oi", context="5581@s.whatsapp.net")
+        coalescer.submit("5582_s_whatsapp_net", "preço?", context="5582@s.whatsapp.net")
+        digest = MagicMock()
+
+        with patch('script.drainer', drainer), \
+             patch('script.burst_coalescer', coalescer), \
+             patch('script.notification_digest', digest), \
+             patch('script.outbox'), \
+             patch('script.cache_snapshot', None):
+
+            # Act
+            summary = drain_worker()
+
+        # Assert
+        assert summary == {'completed': 2, 'handed_off': 0}
+        assert coalescer.pending() == 0
+        digest.flush.assert_called_once()
+
+    def test_webhook_and_readiness_refuse_while_draining(self, client, tmp_path):
+        """Test that a draining worker rejects webhooks and reports not ready."""
+        # Arrange
+        drainer = Drainer(str(tmp_path), timeout=0)
+        drainer.drain()
+        with patch('script.drainer', drainer):
+
+            # Act
+            webhook = client.post('/webhook', json={'event': 'messages.upsert'})
+            ready = client.get('/health/ready')
+
+        # Assert
+        assert webhook.status_code == 503
+        assert ready.status_code == 503
+        assert ready.json['status'] == 'draining'
@@ -0,0 +1,215 @@
+"""
+test_lanes.py - Tests for the fast/LLM processing lanes and message routing
+"""
+
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+from lanes import Lane, percentile
+from outbox import Outbox
+from persona_manager import PersonaSnapshot
+from script import route_message, dispatch_text_message, process_text_message
+
+@pytest.fixture
+def menu_persona():
+    menu_config = {
+        "enabled": True,
+        "welcome_message": "Olá! Escolha uma opção",
+        "menu_options": {
+            "1": {"title": "Endereço", "response": "Rua A, 1"},
+            "2": {"title": "Orçamento", "response": "Um consultor vai te chamar."}
+        },
+        "greeting_keywords": ["oi"]
+    }
+    return PersonaSnapshot("v1", "desc", "Bot", [], menu_config)
+
+class TestLane:
+    def test_runs_work_and_records_stats(self):
+        """Test that submitted work runs and is counted."""
+        # Arrange
+        lane = Lane('test', workers=2, slo_ms=1000)
+        
+        # Act
+        results = [lane.submit(lambda x: x * 2, i).result(timeout=5) for i in range(3)]
+        snapshot = lane.snapshot()
+        lane.shutdown()
+        
+        # Assert
+        assert results == [0, 2, 4]
+        assert snapshot['submitted'] == 3
+        assert snapshot['completed'] == 3
+        assert snapshot['queued'] == 0
+        assert snapshot['queue_wait_p50_ms'] is not None
+    
+    def test_failures_are_counted(self):
+        """Test that exceptions are logged and counted, not raised into the pool."""
+        # Arrange
+        lane = Lane('test', workers=1, slo_ms=1000)
+        
+        def boom():
+            raise RuntimeError("boom")
+        
+        # Act
+        lane.submit(boom).result(timeout=5)
+        lane.shutdown()
+        
+        # Assert
+        assert lane.stats['failed'] == 1
+    
+    def test_slo_breach(self):
+        """Test that queue waits above the SLO are counted."""
+        # Arrange
+        lane = Lane('test', workers=1, slo_ms=0)
+        release = threading.Event()
+        
+        # Act
+        lane.submit(release.wait, 5)
+        second = lane.submit(lambda: None)
+        release.set()
+        second.result(timeout=5)
+        lane.shutdown()
+        
+        # Assert
+        assert lane.stats['slo_breaches'] >= 1
+    
+    def test_full_queue_rejects_work(self):
+        """Test that a lane with max_queue refuses work once that many items wait for a worker."""
+        # Arrange
+        lane = Lane('test', workers=1, slo_ms=1000, max_queue=1)
+        release = threading.Event()
+        running = lane.submit(release.wait, 5)
+        while lane.active == 0:
+            release.wait(0.001)
+
+        # Act
+        queued = lane.submit(lambda: "queued")
+        rejected = lane.submit(lambda: "rejected")
+        release.set()
+        result = queued.result(timeout=5)
+        running.result(timeout=5)
+        lane.shutdown()
+
+        # Assert
+        assert result == "queued"
+        assert rejected is None
+        assert lane.stats['rejected'] == 1
+        assert lane.stats['submitted'] == 2
+
+    def test_base_exception_is_counted_and_propagates(self):
+        """Test that SystemExit in a task is recorded as a failure instead of masking it."""
+        # Arrange
+        lane = Lane('test', workers=1, slo_ms=1000)
+
+        def exit_now():
+            raise SystemExit(1)
+
+        # Act
+        future = lane.submit(exit_now)
+        with pytest.raises(SystemExit):
+            future.result(timeout=5)
+        lane.shutdown()
+
+        # Assert
+        assert lane.stats['failed'] == 1
+        assert lane.active == 0
+
+    def test_first_send_is_measured_against_the_slo(self):
+        """Test that time to first send gets its own percentiles and SLO breach count."""
+        # Arrange
+        lane = Lane('fast', workers=1, slo_ms=200)
+
+        # Act
+        lane.record_first_send(0.05)
+        lane.record_first_send(0.5)
+        snapshot = lane.snapshot()
+        lane.shutdown()
+
+        # Assert
+        assert snapshot['first_send_slo_breaches'] == 1
+        assert snapshot['first_send_p99_ms'] == 500.0
+        assert snapshot['slo_breaches'] == 0
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        assert percentile([], 0.5) is None
+        assert percentile([3, 1, 2, 4], 0.5) == 2
+        assert percentile(list(range(1, 101)), 0.99) == 99
+
+class TestRouting:
+    def test_greeting_goes_to_fast_lane(self, menu_persona):
+        """Test that greetings are answered locally."""
+        route = route_message(["oi"], menu_persona)
+        assert route['lane'] == 'fast'
+        assert route['kind'] == 'greeting'
+        assert route['response_text'] == "Olá! Escolha uma opção"
+    
+    def test_menu_option_goes_to_fast_lane(self, menu_persona):
+        """Test that menu selections are answered locally with notification details."""
+        route = route_message(["2"], menu_persona)
+        assert route['lane'] == 'fast'
+        assert route['notify_group'] is True
+        assert route['menu_option'] == "2 - Orçamento"
+    
+    def test_free_text_goes_to_llm_lane(self, menu_persona):
+        """Test that anything else needs Gemini."""
+        route = route_message(["quanto custa uma lente?"], menu_persona)
+        assert route['lane'] == 'llm'
+        assert route['response_text'] is None
+    
+    def test_dispatch_uses_lane(self, menu_persona):
+        """Test that dispatch enqueues the turn on the routed lane."""
+        # Arrange
+        lanes = {'fast': MagicMock(), 'llm': MagicMock()}
+        manager = MagicMock()
+        manager.current = menu_persona
+        
+        with patch('script.lanes', lanes), patch('script.persona_manager', manager):
+            # Act
+            dispatch_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["1"])
+            dispatch_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["qual o preço?"])
+        
+        # Assert
+        assert lanes['fast'].submit.call_count == 1
+        assert lanes['llm'].submit.call_count == 1
+        assert lanes['fast'].submit.call_args.kwargs['route']['kind'] == 'menu'
+
+    def test_full_lane_sends_busy_reply_immediately(self, menu_persona):
+        """Test that a turn refused by a full lane gets the busy reply right away instead of queueing."""
+        # Arrange
+        lanes = {'fast': MagicMock(), 'llm': MagicMock()}
+        lanes['llm'].submit.return_value = None
+        manager = MagicMock()
+        manager.current = menu_persona
+
+        with patch('script.lanes', lanes), patch('script.persona_manager', manager), \
+             patch('script.admission_controller') as mock_admission, \
+             patch('script.process_text_message') as mock_process:
+            # Act
+            dispatch_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["qual o preço?"])
+
+        # Assert
+        mock_admission.record_shed.assert_called_once()
+        route = mock_process.call_args.kwargs['route']
+        assert route['kind'] == 'busy'
+        assert route['response_text']
+
+    def test_reply_records_time_to_first_send_on_its_lane(self, menu_persona, tmp_path):
+        """Test that sending a lane turn's first chunk records the wait since the turn was accepted."""
+        # Arrange
+        lanes = {'fast': Lane('fast', workers=1, slo_ms=200), 'llm': Lane('llm', workers=1, slo_ms=5000)}
+        route = route_message(["1"], menu_persona)
+
+        with patch('script.lanes', lanes), \
+             patch('script.outbox', Outbox(str(tmp_path))), \
+             patch('script.outbox_lane', None), \
+             patch('script.send_whatsapp_message', return_value=True), \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+
+            # Act
+            process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["1"], route=route)
+
+        # Assert
+        assert lanes['fast'].snapshot()['first_send_p50_ms'] is not None
+        assert lanes['llm'].snapshot()['first_send_p50_ms'] is None
@@ -0,0 +1,142 @@
+"""
+test_lazy.py - Tests for deferred imports, lazy clients and the application factory
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+from unittest.mock import patch, MagicMock
+from lazy import LazyModule, LazyProxy
+
+class TestLazyModule:
+    def test_imports_on_first_attribute_access(self):
+        """Test that the module is imported only when an attribute is used."""
+        # Arrange
+        module = LazyModule('json')
+
+        # Act
+        before = module.loaded
+        encoded = module.dumps([1])
+
+        # Assert
+        assert before is False
+        assert module.loaded is True
+        assert encoded == '[1]'
+
+    def test_script_import_skips_the_sdks(self):
+        """Test that importing script.py does not import the Gemini or WaSender SDKs."""
+        # Arrange
+        code = ("import sys, script; "
+                "print(any(m.startswith(('google.generativeai', 'wasenderapi', 'grpc')) for m in sys.modules))")
+        env = dict(os.environ, LOG_FILE='', LOG_LEVEL='ERROR', PERSONA_RELOAD_INTERVAL='0')
+
+        # Act
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                env=env, check=True).stdout
+
+        # Assert
+        assert output.strip() == 'False'
+
+class TestLazyProxy:
+    def test_builds_once_and_delegates(self):
+        """Test that the factory runs once and attribute access reaches the real object."""
+        # Arrange
+        factory = MagicMock(return_value=MagicMock(send_text=MagicMock(return_value='sent')))
+        proxy = LazyProxy(factory, 'client')
+
+        # Act
+        first = proxy.send_text('oi')
+        second = proxy.send_text('oi')
+
+        # Assert
+        assert first == second == 'sent'
+        assert factory.call_count == 1
+        assert proxy.resolved is True
+
+    def test_factory_error_is_retried(self):
+        """Test that a failed build raises and the next access tries again."""
+        # Arrange
+        factory = MagicMock(side_effect=[RuntimeError('down'), MagicMock(ready=True)])
+        proxy = LazyProxy(factory, 'client')
+
+        # Act & Assert
+        with pytest.raises(RuntimeError):
+            proxy.ready
+        assert proxy.ready is True
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires os.fork")
+    def test_forked_child_builds_its_own(self):
+        """Test that a forked child does not reuse the parent's object."""
+        # Arrange
+        proxy = LazyProxy(object, 'client')
+        parent_target = proxy.resolve()
+        read_fd, write_fd = os.pipe()
+
+        # Act
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            unresolved = not proxy.resolved
+            fresh = proxy.resolve() is not parent_target
+            os.write(write_fd, b'1' if unresolved and fresh else b'0')
+            os._exit(0)
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+        # Assert
+        assert result == b'1'
+        assert proxy.resolve() is parent_target
+
+    def test_unconfigured_proxy_is_falsy(self):
+        """Test that truthiness follows the configured check and doesn't build the object."""
+        # Arrange
+        token = {'value': ''}
+        factory = MagicMock()
+        proxy = LazyProxy(factory, 'client', configured=lambda: bool(token['value']))
+
+        # Act
+        before = bool(proxy)
+        token['value'] = 'secret'
+        after = bool(proxy)
+
+        # Assert
+        assert before is False
+        assert after is True
+        assert factory.call_count == 0
+
+class TestApplicationFactory:
+    def test_create_app_initializes_once(self):
+        """Test that create_app() returns the app and starts the persona watcher once per process."""
+        # Arrange
+        import script
+        with patch('script._initialized_pid', None), \
+             patch('script.CONFIG', dict(script.CONFIG, PERSONA_RELOAD_INTERVAL=5)), \
+             patch('script.persona_manager') as mock_persona_manager:
+
+            # Act
+            first = script.create_app()
+            second = script.create_app()
+
+        # Assert
+        assert first is second is script.app
+        mock_persona_manager.start_watcher.assert_called_once()
+
+    def test_gemini_configured_on_first_request(self, mock_genai_response):
+        """Test that genai.configure runs on the first request, not in the constructor."""
+        # Arrange
+        from script import GeminiClient
+        with patch('script.genai') as mock_genai:
+            mock_genai.GenerativeModel.return_value.generate_content.return_value = mock_genai_response
+            client = GeminiClient("test_api_key", "test_model", "You are a test AI.")
+            configured_at_init = mock_genai.configure.called
+
+            # Act
+            client.generate_response("Hello")
+            client.generate_response("Hello again")
+
+        # Assert
+        assert configured_at_init is False
+        mock_genai.configure.assert_called_once()
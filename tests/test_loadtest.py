@@ -0,0 +1,163 @@
+"""
+test_loadtest.py - Tests for the load-test stand-ins and traffic generator
+"""
+
+import random
+import time
+import pytest
+from loadtest.latency import LatencyModel
+from loadtest.fake_wasender import FakeWaSender
+from loadtest.fake_gemini import FakeGemini
+from loadtest.traffic import TrafficGenerator, build_payload, parse_mix
+from loadtest.harness import LoadRun
+
+class TestLatencyModel:
+    @pytest.mark.parametrize("spec, low, high", [
+        ("0", 0.0, 0.0),
+        ("120", 0.12, 0.12),
+        ("uniform:50:300", 0.05, 0.3),
+        ("lognormal:800:0.6", 0.0, 100.0),
+        ("exp:200", 0.0, 100.0),
+    ])
+    def test_samples_within_range(self, spec, low, high):
+        """Test parsing each distribution and sampling from it."""
+        # Arrange
+        model = LatencyModel.parse(spec, random.Random(1))
+
+        # Act
+        samples = [model.sample() for _ in range(200)]
+
+        # Assert
+        assert all(low <= sample <= high for sample in samples)
+
+    def test_rejects_invalid_spec(self):
+        """Test that malformed specs raise ValueError."""
+        # Arrange, Act & Assert
+        with pytest.raises(ValueError):
+            LatencyModel.parse("gamma:1:2")
+        with pytest.raises(ValueError):
+            LatencyModel.parse("uniform:10")
+
+class TestFakeWaSender:
+    def test_records_deliveries_with_rate_limit_headers(self):
+        """Test a send within the limit and the 429 once the bucket is empty."""
+        # Arrange
+        fake = FakeWaSender(rate_per_minute=60, burst=1)
+        client = fake.app.test_client()
+
+        # Act
+        first = client.post('/send-message', json={'to': '5581', 'messageType': 'text', 'text': 'oi'})
+        second = client.post('/send-message', json={'to': '5581', 'messageType': 'text', 'text': 'oi'})
+
+        # Assert
+        assert first.status_code == 200
+        assert first.get_json()['success'] is True
+        assert first.headers['X-RateLimit-Remaining'] == '0'
+        assert second.status_code == 429
+        assert second.headers['Retry-After'] == '1'
+        assert fake.stats() == {'delivered': 1, 'rate_limited': 1}
+        assert [text for _, text in fake.deliveries('5581')] == ['oi']
+
+    def test_injects_429s(self):
+        """Test that reject_rate=1 rejects every send."""
+        # Arrange
+        fake = FakeWaSender(reject_rate=1.0)
+
+        # Act
+        response = fake.app.test_client().post('/send-message', json={'to': '5581', 'text': 'oi'})
+
+        # Assert
+        assert response.status_code == 429
+        assert fake.stats() == {'injected_429': 1}
+
+    def test_wait_for_delivery(self):
+        """Test waiting for a reply sent after a given time."""
+        # Arrange
+        fake = FakeWaSender()
+        client = fake.app.test_client()
+        client.post('/send-message', json={'to': '5581', 'text': 'old'})
+        after = time.monotonic()
+
+        # Act
+        missing = fake.wait_for_delivery('5581', after, timeout=0.05)
+        client.post('/send-message', json={'to': '5581', 'text': 'new'})
+        arrived = fake.wait_for_delivery('5581', after, timeout=0.05)
+
+        # Assert
+        assert missing is None
+        assert arrived >= after
+
+class TestFakeGemini:
+    def test_generate_content_response(self):
+        """Test the generateContent response shape."""
+        # Arrange
+        fake = FakeGemini(reply_sentences=3, rng=random.Random(1))
+
+        # Act
+        response = fake.app.test_client().post('/v1beta/models/gemini-2.0-flash:generateContent',
+                                               json={'contents': [{'role': 'user', 'parts': [{'text': 'oi'}]}]})
+
+        # Assert
+        assert response.status_code == 200
+        text = response.get_json()['candidates'][0]['content']['parts'][0]['text']
+        assert len(text.splitlines()) == 3
+        assert fake.stats() == {'calls': 1}
+
+    def test_injects_errors(self):
+        """Test that error_rate=1 fails every call with RESOURCE_EXHAUSTED."""
+        # Arrange
+        fake = FakeGemini(error_rate=1.0)
+
+        # Act
+        response = fake.app.test_client().post('/v1beta/models/gemini-2.0-flash:generateContent', json={})
+
+        # Assert
+        assert response.status_code == 429
+        assert response.get_json()['error']['status'] == 'RESOURCE_EXHAUSTED'
+
+class TestTraffic:
+    def test_build_payload_matches_webhook_format(self):
+        """Test that generated payloads look like WaSender messages.upsert events."""
+        # Arrange & Act
+        payload = build_payload('5581999990001@s.whatsapp.net', 'oi')
+
+        # Assert
+        message = payload['data']['messages']
+        assert payload['event'] == 'messages.upsert'
+        assert message['key']['remoteJid'] == '5581999990001@s.whatsapp.net'
+        assert message['key']['fromMe'] is False
+        assert message['message']['conversation'] == 'oi'
+
+    def test_turn_mix(self):
+        """Test that only the configured turn kinds are generated."""
+        # Arrange
+        generator = TrafficGenerator(parse_mix('menu=1,burst=1'), rng=random.Random(3))
+
+        # Act
+        turns = [generator.turn() for _ in range(50)]
+
+        # Assert
+        assert {kind for kind, _ in turns} == {'menu', 'burst'}
+        assert all(len(messages) >= 2 for kind, messages in turns if kind == 'burst')
+        with pytest.raises(ValueError):
+            parse_mix('video=1')
+
+class TestLoadRunSummary:
+    def test_summary_percentiles_and_rates(self):
+        """Test throughput, percentiles and timeout rate in the summary."""
+        # Arrange
+        run = LoadRun('http://127.0.0.1:1', FakeWaSender(), TrafficGenerator(), users=2)
+        run.turns = [('menu', 0.01), ('menu', 0.03), ('free_text', 1.0), ('free_text', None)]
+        run.webhook_latencies = [0.01, 0.02]
+        run.counts.update(webhook_requests=4, webhook_errors=1)
+
+        # Act
+        summary = run.summary(elapsed=2.0)
+
+        # Assert
+        assert summary['turns'] == 4
+        assert summary['turns_per_s'] == 2.0
+        assert summary['webhook_error_rate'] == 0.25
+        assert summary['reply_timeouts'] == 1
+        assert summary['reply_ms']['p99'] == 1000.0
+        assert summary['reply_ms_by_kind']['menu'] == {'p50': 10.0, 'p95': 30.0, 'p99': 30.0, 'turns': 2}
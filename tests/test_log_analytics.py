@@ -0,0 +1,105 @@
+"""
+test_log_analytics.py - Tests for the log analytics CLI
+"""
+
+import json
+import pytest
+from unittest.mock import patch
+import log_analytics
+from log_analytics import analyze, summarize, chunk_boundaries, main
+
+SAMPLE_LOG = """2025-10-18 15:59:58,000 - INFO - whatsapp_bot - === WEBHOOK CALLED ===
+2025-10-18 15:59:58,100 - INFO - whatsapp_bot - Sending prompt to Gemini (system persona active): oi...
+2025-10-18 16:00:00,100 - INFO - whatsapp_bot - Sending 1 message chunks to 5581@s.whatsapp.net
+2025-10-18 16:00:00,500 - INFO - whatsapp_bot - Successfully sent chunk 1 to 5581@s.whatsapp.net
+2025-10-18 16:00:01,000 - INFO - whatsapp_bot - === WEBHOOK CALLED ===
+2025-10-18 16:00:01,100 - INFO - whatsapp_bot - Sending prompt to Gemini (system persona active): preço?...
+2025-10-18 16:00:01,900 - INFO - whatsapp_bot - Gemini response received in 800 ms
+2025-10-18 16:00:02,000 - INFO - whatsapp_bot - Sending 2 message chunks to 5581@s.whatsapp.net
+2025-10-18 16:00:02,500 - ERROR - whatsapp_bot - Failed to send message chunk 1 to 5581@s.whatsapp.net
+2025-10-18 16:00:03,000 - INFO - whatsapp_bot - Text message sent to 120363404721021632@g.us.
+2025-10-18 16:00:04,000 - WARNING - whatsapp_bot - Persona file not found at persona.json. Using default persona.
+Traceback (most recent call last):
+  File "script.py", line 1, in <module>
+2025-10-18 16:00:05,000 - ERROR - whatsapp_bot - Failed to send message chunk 2 to 5582@s.whatsapp.net
+"""
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "whatsapp_bot.log"
+    path.write_text(SAMPLE_LOG * 3, encoding='utf-8')
+    return str(path)
+
+class TestLogAnalytics:
+    def test_summary(self, log_file):
+        """Test the aggregates extracted from a log."""
+        # Arrange & Act
+        summary = summarize(analyze(log_file, workers=1))
+        
+        # Assert
+        assert summary['records'] == 36
+        assert summary['levels'] == {'INFO': 27, 'ERROR': 6, 'WARNING': 3}
+        assert summary['webhooks'] == 6
+        assert summary['chunks_sent'] == 3
+        assert summary['chunks_failed'] == 6
+        assert summary['group_ids'] == ['120363404721021632@g.us']
+        assert summary['top_errors'] == [("Failed to send message chunk # to #@s.whatsapp.net", 6)]
+        assert summary['per_hour'][0] == {'hour': '2025-10-18 15', 'records': 6, 'webhooks': 3,
+                                          'errors': 0, 'warnings': 0, 'error_rate': 0.0}
+    
+    def test_gemini_latency(self, log_file):
+        """Test explicit latency lines and prompt-to-reply pairing for older logs."""
+        # Arrange & Act
+        latency = summarize(analyze(log_file, workers=1))['gemini_latency_ms']
+        
+        # Assert
+        assert latency['count'] == 6
+        assert latency['p50'] == pytest.approx(800)
+        assert latency['max'] == pytest.approx(2000)
+    
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_chunked_scan_matches_whole_file_scan(self, log_file, workers):
+        """Test that splitting the file (even mid-burst) doesn't change the result."""
+        # Arrange
+        expected = summarize(analyze(log_file, workers=1))
+        
+        # Act
+        with patch.object(log_analytics, 'MIN_CHUNK_SIZE', 200):
+            assert len(chunk_boundaries(log_file, 16)) > 4
+            result = summarize(analyze(log_file, workers=workers))
+        
+        # Assert
+        assert result == expected
+    
+    def test_chunk_boundaries_follow_lines(self, log_file):
+        """Test that every chunk starts at the beginning of a line."""
+        # Arrange
+        with open(log_file, 'rb') as f:
+            data = f.read()
+        
+        # Act
+        with patch.object(log_analytics, 'MIN_CHUNK_SIZE', 100):
+            boundaries = chunk_boundaries(log_file, 32)
+        
+        # Assert
+        assert boundaries[0][0] == 0 and boundaries[-1][1] == len(data)
+        for (_, end), (start, _) in zip(boundaries, boundaries[1:]):
+            assert end == start
+            assert data[start - 1:start] == b'\n'
+    
+    def test_cli_json(self, log_file, capsys):
+        """Test the JSON output of the command line."""
+        # Arrange & Act
+        exit_code = main([log_file, '--json', '--workers', '1'])
+        
+        # Assert
+        assert exit_code == 0
+        assert json.loads(capsys.readouterr().out)['webhooks'] == 6
+    
+    def test_cli_missing_file(self, tmp_path):
+        """Test that a missing log file is reported."""
+        # Arrange & Act
+        exit_code = main([str(tmp_path / "missing.log")])
+        
+        # Assert
+        assert exit_code == 1
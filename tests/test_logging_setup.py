@@ -0,0 +1,154 @@
+"""
+test_logging_setup.py - Tests for the queue-backed logging pipeline
+"""
+
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import pytest
+from logging_setup import (
+    configure_logging, shutdown_logging, get_category_logger, parse_category_settings,
+    build_file_handler, SamplingFilter, JsonFormatter, CATEGORY_PAYLOAD
+)
+
+@pytest.fixture
+def log_env(tmp_path):
+    env = {'LOG_FILE': str(tmp_path / "bot.log"), 'LOG_LEVEL': 'INFO'}
+    yield env
+    # Restore the default configuration for the rest of the suite
+    configure_logging()
+
+def read_log(env):
+    shutdown_logging()
+    with open(env['LOG_FILE'], encoding='utf-8') as f:
+        return f.read()
+
+class TestConfigureLogging:
+    def test_records_are_written_by_the_listener(self, log_env):
+        """Test that records reach the file through the queue listener."""
+        # Arrange
+        listener = configure_logging(log_env)
+        
+        # Act
+        logging.getLogger("whatsapp_bot").info("hello %s", "world")
+        
+        # Assert
+        assert listener is not None
+        assert " - INFO - whatsapp_bot - hello world" in read_log(log_env)
+    
+    def test_json_format(self, log_env):
+        """Test the JSON line format, including exceptions."""
+        # Arrange
+        configure_logging(dict(log_env, LOG_FORMAT='json'))
+        
+        # Act
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("whatsapp_bot").exception("failed for %s", "5581")
+        
+        # Assert
+        entry = json.loads(read_log(log_env).splitlines()[-1])
+        assert entry['level'] == 'ERROR'
+        assert entry['message'] == "failed for 5581"
+        assert "ValueError: boom" in entry['exception']
+    
+    def test_category_level_silences_payload_dumps(self, log_env):
+        """Test that a category level drops payload logs without formatting them."""
+        # Arrange
+        configure_logging(dict(log_env, LOG_CATEGORY_LEVELS='payload=WARNING'))
+        
+        class Exploding:
+            def __str__(self):
+                raise AssertionError("payload was formatted")
+        
+        # Act
+        get_category_logger(CATEGORY_PAYLOAD).info("Received webhook data: %s", Exploding())
+        logging.getLogger("whatsapp_bot").info("still logged")
+        
+        # Assert
+        content = read_log(log_env)
+        assert "Received webhook data" not in content
+        assert "still logged" in content
+    
+    def test_sampling(self, log_env):
+        """Test that a sample rate of zero drops info records but keeps warnings."""
+        # Arrange
+        configure_logging(dict(log_env, LOG_SAMPLE_RATES='payload=0'))
+        payload_logger = get_category_logger(CATEGORY_PAYLOAD)
+        
+        # Act
+        payload_logger.info("dump")
+        payload_logger.warning("odd payload")
+        
+        # Assert
+        content = read_log(log_env)
+        assert "dump" not in content
+        assert "odd payload" in content
+
+class TestHelpers:
+    def test_parse_category_settings(self):
+        """Test parsing of name=value lists."""
+        # Arrange & Act
+        settings = parse_category_settings("payload=0.1, chunks=0.5,bogus", float)
+        
+        # Assert
+        assert settings == {'payload': 0.1, 'chunks': 0.5}
+    
+    def test_sampling_filter_rate(self):
+        """Test that the sampling filter keeps about the configured fraction."""
+        # Arrange
+        sampling_filter = SamplingFilter(0.25)
+        record = logging.LogRecord("whatsapp_bot.payload", logging.INFO, __file__, 1, "x", None, None)
+        
+        # Act
+        kept = sum(sampling_filter.filter(record) for _ in range(10000))
+        
+        # Assert
+        assert 2000 < kept < 3000
+    
+    def test_rotated_files_are_compressed(self, tmp_path):
+        """Test that size-based rotation gzips the rotated file."""
+        # Arrange
+        path = str(tmp_path / "bot.log")
+        handler = build_file_handler(path, max_bytes=200, backup_count=2)
+        handler.setFormatter(JsonFormatter())
+        test_logger = logging.getLogger("test_rotation")
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        
+        # Act
+        for i in range(20):
+            test_logger.warning("line %d", i)
+        handler.close()
+        test_logger.removeHandler(handler)
+        
+        # Assert
+        assert os.path.exists(f"{path}.1.gz")
+        with gzip.open(f"{path}.1.gz", 'rt', encoding='utf-8') as f:
+            assert '"line ' in f.read()
+        assert not os.path.exists(f"{path}.3.gz")
+
+    def test_rotation_is_off_by_default(self, tmp_path):
+        """Test that without rotation settings the file is reopened after an external rotation instead of rotated here."""
+        # Arrange
+        path = str(tmp_path / "bot.log")
+        handler = build_file_handler(path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        test_logger = logging.getLogger("test_watched")
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        test_logger.warning("before")
+
+        # Act
+        os.rename(path, f"{path}.1")
+        test_logger.warning("after")
+        handler.close()
+        test_logger.removeHandler(handler)
+
+        # Assert
+        assert isinstance(handler, logging.handlers.WatchedFileHandler)
+        with open(path, encoding='utf-8') as f:
+            assert f.read() == "after\n"
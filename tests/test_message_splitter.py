@@ -9,7 +9,7 @@ import os
 # Add the project root directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from message_splitter import split_message
+from message_splitter import split_message, plan_message
 
 class TestImprovedMessageSplitting:
     def test_empty_message(self):
@@ -165,3 +165,110 @@ class TestImprovedMessageSplitting:
         # Assert
         assert "Line 1" in result[0]
         assert "Line 5" in result[-1]  # Should be in last chunk
+    
+    def test_backslash_lines_removed(self):
+        """Test that lines containing only a backslash are dropped."""
+        # Arrange
+        middle = "Line 1\n \\ \nLine 2"
+        edges = "\\\nLine 1\nLine 2\n\\"
+        
+        # Act & Assert
+        assert split_message(middle) == ["Line 1\nLine 2"]
+        assert split_message(edges) == ["Line 1\nLine 2"]
+        assert split_message("a\\b") == ["a\\b"]
+    
+    def test_many_blank_lines(self):
+        """Test that long runs of blank lines are chunked like any other line."""
+        # Arrange
+        message = "start" + "\n" * 10 + "end"
+        
+        # Act
+        result = split_message(message, max_lines=3)
+        
+        # Assert
+        assert result == ["start\n\n", "\n\n", "\n\n", "\nend"]
+    
+    def test_huge_single_word(self):
+        """Test that a 100 KB word is hard-split without losing characters."""
+        # Arrange
+        message = "x" * 100_000
+        
+        # Act
+        result = split_message(message, max_lines=3, max_chars_per_line=100)
+        
+        # Assert
+        assert len(result) == 334  # 1000 lines of 100 chars, 3 per chunk
+        assert all(len(line) <= 100 for chunk in result for line in chunk.split('\n'))
+        assert ''.join(result).replace('\n', '') == message
+    
+    def test_leading_whitespace_long_word(self):
+        """Test that leading whitespace is dropped when a long paragraph is wrapped."""
+        # Arrange
+        message = "   " + "y" * 120
+        
+        # Act
+        result = split_message(message, max_lines=3, max_chars_per_line=100)
+        
+        # Assert
+        assert result == ["y" * 100 + "\n" + "y" * 20]
+
+
+class TestMessagePlanner:
+    def test_empty_message(self):
+        """Test planning an empty message."""
+        assert plan_message("") == []
+    
+    def test_fits_in_one_message(self):
+        """Test that a reply the legacy splitter sends as several chunks becomes one send."""
+        # Arrange
+        message = "Line 1\nLine 2\nLine 3\nLine 4\n\nLine 6"
+        
+        # Act
+        result = plan_message(message, max_message_chars=1000)
+        
+        # Assert
+        assert len(split_message(message)) == 2
+        assert result == ["Line 1\nLine 2\nLine 3\nLine 4\n\nLine 6"]
+    
+    def test_respects_paragraph_boundaries(self):
+        """Test that paragraphs are not cut when each fits in a message."""
+        # Arrange
+        first = "a" * 60
+        second = "b" * 60
+        message = f"{first}\n\n{second}"
+        
+        # Act
+        result = plan_message(message, max_message_chars=100)
+        
+        # Assert
+        assert result == [first, second]
+    
+    def test_balances_chunks(self):
+        """Test that chunks are balanced instead of leaving a short trailing fragment."""
+        # Arrange
+        paragraphs = ["x" * 30] * 5
+        message = "\n\n".join(paragraphs)
+        
+        # Act
+        result = plan_message(message, max_message_chars=130)
+        
+        # Assert
+        assert len(result) == 2
+        assert [chunk.count("x") for chunk in result] == [90, 60]
+    
+    def test_long_paragraph_is_wrapped(self):
+        """Test that a paragraph longer than a message is split without losing words."""
+        # Arrange
+        message = " ".join(f"word{i}" for i in range(100))
+        
+        # Act
+        result = plan_message(message, max_message_chars=80)
+        
+        # Assert
+        assert all(len(chunk) <= 80 for chunk in result)
+        assert " ".join(result).replace("\n", " ").split() == message.split()
+    
+    def test_invalid_max_message_chars(self):
+        """Test that a non-positive message size is rejected."""
+        with pytest.raises(ValueError):
+            plan_message("text", max_message_chars=0)
@@ -0,0 +1,218 @@
+"""
+test_metrics.py - Tests for the metrics registry and the /metrics endpoint
+"""
+
+import json
+import os
+import subprocess
+import sys
+import pytest
+from metrics import Registry, merge_families, render_families, mark_process_dead, read_archive
+from script import app
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+@pytest.fixture
+def client():
+    """Flask test client fixture."""
+    with app.test_client() as client:
+        yield client
+
+class TestRegistry:
+    def test_counter_and_gauge_render(self, registry):
+        """Test the text format of counters and gauges."""
+        # Arrange
+        counter = registry.counter('bot_errors_total', 'Errors', ['stage'])
+        gauge = registry.gauge('bot_queue_depth', 'Queue depth')
+        
+        # Act
+        counter.inc(stage='send')
+        counter.inc(2, stage='send')
+        gauge.set_function(lambda: 7)
+        text = registry.render()
+        
+        # Assert
+        assert '# TYPE bot_errors_total counter' in text
+        assert 'bot_errors_total{stage="send"} 3' in text
+        assert 'bot_queue_depth 7' in text
+    
+    def test_histogram_buckets_are_cumulative(self, registry):
+        """Test histogram bucket, sum and count lines."""
+        # Arrange
+        histogram = registry.histogram('bot_latency_seconds', 'Latency', ['model'], buckets=(0.1, 1.0))
+        
+        # Act
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, model='flash')
+        text = registry.render()
+        
+        # Assert
+        assert 'bot_latency_seconds_bucket{model="flash",le="0.1"} 2' in text
+        assert 'bot_latency_seconds_bucket{model="flash",le="1"} 3' in text
+        assert 'bot_latency_seconds_bucket{model="flash",le="+Inf"} 4' in text
+        assert 'bot_latency_seconds_sum{model="flash"} 3.65' in text
+        assert 'bot_latency_seconds_count{model="flash"} 4' in text
+    
+    def test_time_decorator(self, registry):
+        """Test that Histogram.time() works as a decorator."""
+        # Arrange
+        histogram = registry.histogram('bot_split_seconds', 'Split time')
+        
+        @histogram.time()
+        def work():
+            return 42
+        
+        # Act
+        results = [work(), work()]
+        
+        # Assert
+        assert results == [42, 42]
+        assert 'bot_split_seconds_count 2' in registry.render()
+    
+    def test_wrong_labels_raise(self, registry):
+        """Test that missing labels are rejected."""
+        # Arrange
+        counter = registry.counter('bot_hits_total', 'Hits', ['kind'])
+        
+        # Act & Assert
+        with pytest.raises(ValueError):
+            counter.inc()
+    
+    def test_label_values_are_escaped(self, registry):
+        """Test escaping of quotes and newlines in label values."""
+        # Arrange
+        counter = registry.counter('bot_hits_total', 'Hits', ['kind'])
+        
+        # Act
+        counter.inc(kind='a"b\nc')
+        
+        # Assert
+        assert 'bot_hits_total{kind="a\\"b\\nc"} 1' in registry.render()
+
+class TestMultiprocess:
+    def test_merge_across_workers(self):
+        """Test that counters, gauges and histograms add up across workers."""
+        # Arrange
+        worker = Registry()
+        worker.counter('bot_errors_total', 'Errors').inc(2)
+        worker.gauge('bot_queue_depth', 'Depth').set(5)
+        worker.histogram('bot_latency_seconds', 'Latency', buckets=(1.0,)).observe(0.5)
+        families = worker.collect()
+        
+        # Act
+        text = render_families(merge_families([families, families]))
+        
+        # Assert
+        assert 'bot_errors_total 4' in text
+        assert 'bot_queue_depth 10' in text
+        assert 'bot_latency_seconds_count 2' in text
+    
+    def test_max_gauge(self):
+        """Test gauges that take the maximum across workers."""
+        # Arrange
+        first, second = Registry(), Registry()
+        first.gauge('bot_active', 'Active', multiprocess_mode='max').set(3)
+        second.gauge('bot_active', 'Active', multiprocess_mode='max').set(4)
+        
+        # Act
+        text = render_families(merge_families([first.collect(), second.collect()]))
+        
+        # Assert
+        assert 'bot_active 4' in text
+    
+    def test_render_reads_other_workers_snapshots(self, registry, tmp_path):
+        """Test that render() includes snapshots written by other processes."""
+        # Arrange
+        counter = registry.counter('bot_errors_total', 'Errors')
+        registry.directory = str(tmp_path)
+        counter.inc()
+        # The test runner's parent stands in for another live worker
+        other = {'pid': os.getppid(), 'metrics': registry.collect()}
+        with open(tmp_path / "metrics_other.json", 'w') as f:
+            json.dump(other, f)
+        
+        # Act
+        text = registry.render()
+        
+        # Assert
+        assert 'bot_errors_total 2' in text
+        assert os.path.exists(tmp_path / f"metrics_{os.getpid()}.json")
+
+    def test_dead_workers_snapshots_are_archived(self, registry, tmp_path):
+        """Test that a snapshot left by an exited worker keeps counting from the archive, without its gauges."""
+        # Arrange
+        counter = registry.counter('bot_errors_total', 'Errors')
+        registry.gauge('bot_queue_depth', 'Depth').set(5)
+        registry.directory = str(tmp_path)
+        counter.inc()
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True).stdout.strip()
+        with open(tmp_path / f"metrics_{exited}.json", 'w') as f:
+            json.dump({'pid': int(exited), 'metrics': registry.collect()}, f)
+
+        # Act
+        first = registry.render()
+        second = registry.render()
+
+        # Assert
+        assert 'bot_errors_total 2' in first
+        assert 'bot_queue_depth 5' in first
+        assert first == second
+        assert not os.path.exists(tmp_path / f"metrics_{exited}.json")
+        assert os.path.exists(tmp_path / "archive.json")
+
+    def test_mark_process_dead_archives_counters_once(self, tmp_path):
+        """Test the worker-exit hook: counters and histograms are archived once and gauges are dropped."""
+        # Arrange
+        worker = Registry()
+        worker.counter('bot_errors_total', 'Errors').inc(2)
+        worker.gauge('bot_queue_depth', 'Depth').set(5)
+        worker.histogram('bot_latency_seconds', 'Latency', buckets=(1.0,)).observe(0.5)
+        for pid in (4242, 4243):
+            (tmp_path / f"metrics_{pid}.json").write_text(json.dumps({'pid': pid, 'metrics': worker.collect()}))
+
+        # Act
+        mark_process_dead(str(tmp_path), 4242)
+        mark_process_dead(str(tmp_path), 4242)
+        mark_process_dead(str(tmp_path), 4243)
+        text = render_families(merge_families([read_archive(str(tmp_path))]))
+
+        # Assert
+        assert 'bot_errors_total 4' in text
+        assert 'bot_latency_seconds_count 2' in text
+        assert 'bot_queue_depth' not in text
+        assert not any(name.startswith('metrics_') for name in os.listdir(tmp_path))
+
+class TestMetricsEndpoint:
+    def test_metrics_endpoint(self, client):
+        """Test that /metrics serves the bot's metrics."""
+        # Arrange & Act
+        client.get('/health')
+        response = client.get('/metrics')
+        
+        # Assert
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        text = response.get_data(as_text=True)
+        assert '# TYPE whatsapp_webhook_duration_seconds histogram' in text
+        assert 'whatsapp_queue_depth{queue="llm_admission"} 0' in text
+        assert 'whatsapp_active_conversations' in text
+    
+    def test_webhook_is_timed(self, client):
+        """Test that webhook requests are recorded in the webhook histogram."""
+        # Arrange
+        before = client.get('/metrics').get_data(as_text=True)
+        
+        # Act
+        client.post('/webhook', data=json.dumps({'event': 'unknown'}), content_type='application/json')
+        after = client.get('/metrics').get_data(as_text=True)
+        
+        # Assert
+        def count(text):
+            for line in text.splitlines():
+                if line.startswith('whatsapp_webhook_duration_seconds_count'):
+                    return int(line.split()[-1])
+            return 0
+        assert count(after) == count(before) + 1
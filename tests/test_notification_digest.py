@@ -0,0 +1,144 @@
+"""
+test_notification_digest.py - Tests for group notification digesting and dedup
+"""
+
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from notification_digest import NotificationDigest, format_group_digest
+from script import send_notification_to_group
+
+@pytest.fixture
+def digest():
+    # A long window keeps the timer out of the way; tests flush explicitly
+    return NotificationDigest(MagicMock(return_value=True), window_seconds=60, dedup_seconds=600)
+
+class TestNotificationDigest:
+    def test_burst_from_one_customer_is_one_message(self, digest):
+        """Test that repeated notifications for a customer become one group message."""
+        # Arrange
+        digest.add("5581@s.whatsapp.net", "2", "2 - Agendar exame")
+        digest.add("5581@s.whatsapp.net", "6", "6 - Falar com consultor")
+        digest.add("5581@s.whatsapp.net", "6", "6 - Falar com consultor")
+        
+        # Act
+        customers = digest.flush()
+        
+        # Assert
+        assert customers == 1
+        assert digest.send.call_count == 1
+        text = digest.send.call_args[0][0]
+        assert "2 - Agendar exame, 6 - Falar com consultor" in text
+        assert digest.snapshot()['api_calls_saved'] == 2
+    
+    def test_several_customers_share_one_digest(self, digest):
+        """Test that different customers are listed in a single digest."""
+        # Arrange
+        digest.add("5581@s.whatsapp.net", "orçamento", "3 - Orçamento")
+        digest.add("5582@s.whatsapp.net", "quero falar com alguém")
+        
+        # Act
+        digest.flush()
+        
+        # Assert
+        text = digest.send.call_args[0][0]
+        assert "2 NOVAS SOLICITAÇÕES" in text
+        assert "5581" in text and "5582" in text
+        assert digest.snapshot()['api_calls_saved'] == 1
+    
+    def test_customer_is_deduplicated_after_being_announced(self, digest):
+        """Test that a customer already announced is suppressed within the dedup window."""
+        # Arrange
+        digest.add("5581@s.whatsapp.net", "6", "6 - Falar com consultor")
+        digest.flush()
+        
+        # Act
+        queued = digest.add("5581@s.whatsapp.net", "oi? alguém?")
+        
+        # Assert
+        assert queued is False
+        assert digest.flush() == 0
+        assert digest.send.call_count == 1
+        assert digest.snapshot()['suppressed'] == 1
+    
+    def test_failed_send_does_not_start_dedup(self, digest):
+        """Test that a customer whose digest failed is not suppressed afterwards."""
+        # Arrange
+        digest.send.return_value = False
+        digest.add("5581@s.whatsapp.net", "6")
+        digest.flush()
+        digest.send.return_value = True
+        
+        # Act
+        queued = digest.add("5581@s.whatsapp.net", "6")
+        
+        # Assert
+        assert queued is True
+        assert digest.snapshot()['send_failures'] == 1
+
+    def test_failed_batch_is_kept_and_retried(self, digest):
+        """Test that notifications in a failed digest are merged with newer ones and sent by the next flush."""
+        # Arrange
+        digest.send.return_value = False
+        digest.add("5581@s.whatsapp.net", "orçamento", "3 - Orçamento")
+        digest.add("5582@s.whatsapp.net", "quero falar com alguém")
+        digest.flush()
+        digest.send.return_value = True
+        digest.add("5581@s.whatsapp.net", "alguém?")
+
+        # Act
+        customers = digest.flush()
+
+        # Assert
+        assert customers == 2
+        text = digest.send.call_args[0][0]
+        assert "orçamento" in text and "alguém?" in text and "5582" in text
+        assert text.index("orçamento") < text.index("alguém?")
+        assert digest.snapshot()['pending'] == 0
+
+    def test_timer_flushes_pending_notifications(self):
+        """Test that pending notifications are sent when the window closes."""
+        # Arrange
+        send = MagicMock(return_value=True)
+        digest = NotificationDigest(send, window_seconds=0.05)
+        
+        # Act
+        digest.add("5581@s.whatsapp.net", "6")
+        for _ in range(100):
+            if send.called:
+                break
+            time.sleep(0.01)
+        
+        # Assert
+        assert send.call_count == 1
+        assert digest.snapshot()['pending'] == 0
+
+class TestFormatGroupDigest:
+    def test_single_entry_uses_regular_format(self):
+        """Test that a one-customer digest looks like a normal notification."""
+        # Arrange
+        entries = [{'customer': "5581@s.whatsapp.net", 'messages': ["6"], 'menu_options': [],
+                    'first_at': 0, 'count': 1}]
+        
+        # Act
+        text = format_group_digest(entries)
+        
+        # Assert
+        assert text.startswith("🔔 *NOVA SOLICITAÇÃO DE ATENDIMENTO*")
+        assert "📋" not in text
+
+class TestSendNotificationToGroup:
+    def test_uses_digest_when_enabled(self, digest):
+        """Test that send_notification_to_group queues into the digest."""
+        # Arrange
+        with patch('script.notification_digest', digest), \
+             patch.dict('script.CONFIG', {'NOTIFICATION_GROUP_ID': '123@g.us'}), \
+             patch('script.send_whatsapp_message') as mock_send:
+            
+            # Act
+            result = send_notification_to_group("5581@s.whatsapp.net", "6", "6 - Falar com consultor")
+        
+        # Assert
+        assert result is True
+        assert mock_send.call_count == 0
+        assert digest.snapshot()['pending'] == 1
@@ -0,0 +1,153 @@
+"""
+test_notification_events.py - Tests for the notification event stream
+"""
+
+import os
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from notification_events import EventLog, EventConsumer, EVENT_TURN_PROCESSED, format_group_notification
+from script import process_text_message
+
+@pytest.fixture
+def event_paths(tmp_path):
+    return str(tmp_path / "events.jsonl"), str(tmp_path / "events.offset")
+
+class TestFormatGroupNotification:
+    def test_includes_customer_and_menu_option(self):
+        """Test the group notification text."""
+        # Arrange & Act
+        text = format_group_notification("5581999@s.whatsapp.net", "Quero agendar", "2 - Agendar exame",
+                                         timestamp=datetime(2025, 10, 18, 16, 30))
+        
+        # Assert
+        assert "👤 *Cliente:* 5581999" in text
+        assert "18/10/2025 às 16:30" in text
+        assert "📋 *Opção do menu:* 2 - Agendar exame" in text
+        assert "Quero agendar" in text
+
+class TestEventStream:
+    def test_append_and_consume(self, event_paths):
+        """Test that appended events are read back in order."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        log = EventLog(events_path)
+        consumer = EventConsumer(events_path, checkpoint_path)
+        
+        # Act
+        log.append(EVENT_TURN_PROCESSED, customer="a", message="1")
+        log.append(EVENT_TURN_PROCESSED, customer="b", message="2")
+        events = consumer.poll()
+        
+        # Assert
+        assert [event['customer'] for _, event in events] == ["a", "b"]
+        assert events[-1][0] == os.path.getsize(events_path)
+    
+    def test_checkpoint_resumes_after_restart(self, event_paths):
+        """Test that a restarted consumer only sees uncommitted events."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        log = EventLog(events_path)
+        log.append(EVENT_TURN_PROCESSED, customer="a")
+        log.append(EVENT_TURN_PROCESSED, customer="b")
+        consumer = EventConsumer(events_path, checkpoint_path)
+        first_offset, _ = consumer.poll()[0]
+        consumer.commit(first_offset)
+        
+        # Act
+        restarted = EventConsumer(events_path, checkpoint_path)
+        events = restarted.poll()
+        
+        # Assert
+        assert [event['customer'] for _, event in events] == ["b"]
+    
+    def test_partial_line_is_not_consumed(self, event_paths):
+        """Test that an event still being written is left for the next poll."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        EventLog(events_path).append(EVENT_TURN_PROCESSED, customer="a")
+        with open(events_path, 'a') as f:
+            f.write('{"type": "turn_proc')
+        consumer = EventConsumer(events_path, checkpoint_path)
+        
+        # Act
+        events = consumer.poll()
+        
+        # Assert
+        assert len(events) == 1
+    
+    def test_seek_to_end(self, event_paths):
+        """Test that a new consumer can skip the backlog."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        EventLog(events_path).append(EVENT_TURN_PROCESSED, customer="old")
+        consumer = EventConsumer(events_path, checkpoint_path)
+        
+        # Act
+        consumer.seek_to_end()
+        
+        # Assert
+        assert consumer.has_checkpoint()
+        assert consumer.poll() == []
+
+    def test_event_interrupted_mid_delivery_is_flagged_after_restart(self, event_paths):
+        """Test that an event begun but never committed is reported as interrupted, not redelivered."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        log = EventLog(events_path)
+        log.append(EVENT_TURN_PROCESSED, customer="a")
+        log.append(EVENT_TURN_PROCESSED, customer="b")
+        consumer = EventConsumer(events_path, checkpoint_path)
+        events = consumer.poll()
+        consumer.commit(events[0][0])
+        consumer.begin(events[1][1]['id'])
+        
+        # Act
+        restarted = EventConsumer(events_path, checkpoint_path)
+        replayed = restarted.poll()
+        
+        # Assert
+        assert [event['customer'] for _, event in replayed] == ["b"]
+        assert restarted.interrupted(replayed[0][1])
+    
+    def test_cancelled_event_is_not_flagged(self, event_paths):
+        """Test that an event whose delivery failed is retried after a restart."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        EventLog(events_path).append(EVENT_TURN_PROCESSED, customer="a")
+        consumer = EventConsumer(events_path, checkpoint_path)
+        event = consumer.poll()[0][1]
+        consumer.begin(event['id'])
+        consumer.cancel()
+        
+        # Act
+        restarted = EventConsumer(events_path, checkpoint_path)
+        
+        # Assert
+        assert not restarted.interrupted(restarted.poll()[0][1])
+
+class TestBotEmitsEvents:
+    def test_turn_is_emitted_instead_of_inline_notification(self, event_paths, mock_wasender_client):
+        """Test that with event delivery the bot writes an event and doesn't notify inline."""
+        # Arrange
+        events_path, checkpoint_path = event_paths
+        with patch('script.notification_events', EventLog(events_path)), \
+             patch('script.wasender_client', mock_wasender_client), \
+             patch('script.get_gemini_response', return_value="Vou chamar um consultor para você."), \
+             patch('script.send_notification_to_group') as mock_notify, \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+            
+            # Act
+            process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["quero um orçamento"])
+        
+        # Assert
+        assert mock_notify.call_count == 0
+        events = EventConsumer(events_path, checkpoint_path).poll()
+        assert len(events) == 1
+        event = events[0][1]
+        assert event['type'] == EVENT_TURN_PROCESSED
+        assert event['customer'] == "5581@s.whatsapp.net"
+        assert event['message'] == "quero um orçamento"
+        assert event['notify'] is True
@@ -0,0 +1,249 @@
+"""
+test_outbox.py - Tests for the durable reply outbox and its admin endpoints
+"""
+
+import os
+import subprocess
+import sys
+import pytest
+from unittest.mock import patch, MagicMock
+from outbox import Outbox, STATUS_DELIVERED, STATUS_RETRY, STATUS_DEAD, STATUS_QUEUED
+from script import app, CONFIG, process_text_message, record_delivered_reply
+
+CHUNKS = ["primeira parte", "segunda parte", "terceira parte"]
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app."""
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+# Scripts run in separate processes: fcntl owner locks never conflict within one process
+ENQUEUE = ("import sys, time; from outbox import Outbox; "
+           "entry = Outbox(sys.argv[1]).enqueue(sys.argv[2], ['um', 'dois', 'três']); "
+           "print(entry['id'], flush=True); time.sleep(float(sys.argv[3]))")
+RECOVER = ("import sys; from outbox import Outbox; "
+           "print(' '.join(entry['id'] for entry in Outbox(sys.argv[1]).recover()))")
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_outbox_process(directory, code, *args):
+    return subprocess.run([sys.executable, '-c', code, str(directory), *args],
+                          capture_output=True, text=True, cwd=REPO, check=True)
+
+def start_outbox_process(directory, code, *args):
+    """Start a process that enqueues an entry and keeps running; returns once the entry is written."""
+    process = subprocess.Popen([sys.executable, '-c', code, str(directory), *args],
+                               stdout=subprocess.PIPE, text=True, cwd=REPO)
+    process.entry_id = process.stdout.readline().strip()
+    return process
+
+def failing_at(*failures):
+    """A send callable that fails on the given (0-based) calls and records what it sent."""
+    sent = []
+    calls = []
+
+    def send(index, chunk):
+        calls.append(index)
+        if len(calls) - 1 in failures:
+            return False
+        sent.append(chunk)
+        return True
+    send.sent = sent
+    return send
+
+class TestOutbox:
+    def test_retry_resumes_from_first_unacknowledged_chunk(self, tmp_path):
+        """Test that a failed send leaves the entry pending and the retry skips the chunks already delivered."""
+        # Arrange
+        on_delivered = MagicMock()
+        outbox = Outbox(str(tmp_path), on_delivered=on_delivered)
+        entry = outbox.enqueue("5581@s.whatsapp.net", CHUNKS, response_text="resposta")
+        send = failing_at(1)
+
+        # Act
+        first = outbox.deliver(entry, send)
+        stored = outbox.get(entry['id'])
+        second = outbox.deliver(entry, send)
+
+        # Assert
+        assert first == STATUS_RETRY
+        assert stored['sent'] == 1
+        assert stored['attempts'] == 1
+        assert stored['next_attempt_at'] > stored['created_at']
+        assert second == STATUS_DELIVERED
+        assert send.sent == CHUNKS
+        on_delivered.assert_called_once_with(entry)
+        assert outbox.get(entry['id']) is None
+
+    def test_dead_letter_after_max_attempts_and_requeue(self, tmp_path):
+        """Test that an entry is dead-lettered after max_attempts and a requeue delivers only the rest."""
+        # Arrange
+        outbox = Outbox(str(tmp_path), max_attempts=2, retry_delay=0)
+        entry = outbox.enqueue("5581@s.whatsapp.net", CHUNKS)
+        outbox.deliver(entry, failing_at(1))
+
+        # Act
+        status = outbox.deliver(entry, failing_at(0))
+        dead = outbox.list_entries(dead=True)
+        requeued = outbox.requeue(entry['id'])
+        send = failing_at()
+        retried = outbox.deliver(requeued, send)
+
+        # Assert
+        assert status == STATUS_DEAD
+        assert [item['id'] for item in dead] == [entry['id']]
+        assert dead[0]['attempts'] == 2
+        assert requeued['attempts'] == 0
+        assert retried == STATUS_DELIVERED
+        assert send.sent == CHUNKS[1:]
+        assert outbox.list_entries(dead=True) == []
+
+    def test_later_reply_waits_for_earlier_one_to_same_recipient(self, tmp_path):
+        """Test that replies to one recipient go out in the order they were planned."""
+        # Arrange
+        outbox = Outbox(str(tmp_path))
+        first = outbox.enqueue("5581@s.whatsapp.net", ["primeira"])
+        second = outbox.enqueue("5581@s.whatsapp.net", ["segunda"])
+        other = outbox.enqueue("5582@s.whatsapp.net", ["outra"])
+        send = failing_at()
+
+        # Act
+        queued = outbox.deliver(second, send)
+        other_status = outbox.deliver(other, send)
+        outbox.deliver(first, send)
+        outbox.deliver(second, send)
+
+        # Assert
+        assert queued == STATUS_QUEUED
+        assert other_status == STATUS_DELIVERED
+        assert send.sent == ["outra", "primeira", "segunda"]
+
+    def test_recovers_entries_of_exited_processes_once(self, tmp_path):
+        """Test that entries left by a process that is gone are claimed by exactly one outbox."""
+        # Arrange
+        exited_id = run_outbox_process(tmp_path, ENQUEUE, "5581@s.whatsapp.net", '0').stdout.strip()
+        live_worker = start_outbox_process(tmp_path, ENQUEUE, "5582@s.whatsapp.net", '30')
+
+        # Act
+        try:
+            recovered = Outbox(str(tmp_path)).recover()
+            # Another worker looking for orphans afterwards, while we still own what we recovered
+            recovered_again = run_outbox_process(tmp_path, RECOVER).stdout.split()
+        finally:
+            live_worker.kill()
+            live_worker.wait()
+
+        # Assert
+        assert [item['id'] for item in recovered] == [exited_id]
+        assert recovered[0]['owner'] == os.getpid()
+        assert recovered_again == []
+
+    def test_live_owner_on_another_host_keeps_its_entries(self, tmp_path):
+        """Test that an entry owned on another node is left alone although its pid means nothing here."""
+        # Arrange
+        exited_pid = run_outbox_process(tmp_path, "import os; print(os.getpid())").stdout.strip()
+        other_node = ("import os, outbox; outbox.HOSTNAME = 'other-node'; "
+                      f"os.getpid = lambda: {exited_pid}; " + ENQUEUE)
+        worker = start_outbox_process(tmp_path, other_node, "5581@s.whatsapp.net", '30')
+        local = Outbox(str(tmp_path))
+
+        # Act
+        try:
+            while_running = local.recover()
+        finally:
+            worker.kill()
+            worker.wait()
+        after_exit = local.recover()
+
+        # Assert
+        assert while_running == []
+        assert [item['id'] for item in after_exit] == [worker.entry_id]
+
+    def test_delivered_entry_is_not_recovered_by_its_own_process(self, tmp_path):
+        """Test that recover() running while a delivery finishes doesn't claim the entry again."""
+        # Arrange
+        outbox = Outbox(str(tmp_path))
+        entry = outbox.enqueue("5581@s.whatsapp.net", CHUNKS)
+        recovered = []
+        real_remove = os.remove
+
+        def remove_with_recovery(path):
+            recovered.extend(outbox.recover())
+            real_remove(path)
+
+        # Act
+        with patch('outbox.os.remove', side_effect=remove_with_recovery):
+            status = outbox.deliver(entry, lambda index, chunk: True)
+
+        # Assert
+        assert status == STATUS_DELIVERED
+        assert recovered == []
+        assert outbox.pending == 0
+        assert outbox.list_entries() == []
+
+class TestReplyDelivery:
+    def test_failed_send_is_not_saved_to_history(self, tmp_path, mock_env_vars):
+        """Test that a reply whose send failed stays in the outbox and only reaches the history once delivered."""
+        # Arrange
+        outbox = Outbox(str(tmp_path), on_delivered=record_delivered_reply)
+        route = {'lane': 'fast', 'kind': 'menu', 'option_key': '1', 'response_text': "\n".join(CHUNKS),
+                 'message_chunks': CHUNKS, 'notify_group': False, 'menu_option': None}
+        with patch('script.outbox', outbox), \
+             patch('script.send_whatsapp_message', side_effect=[True, False, True, True]) as mock_send, \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+
+            # Act
+            process_text_message("5581@s.whatsapp.net", "5581_s_whatsapp_net", ["1"], route=route)
+            saved_before_retry = mock_conversation_manager.add_exchange.call_count
+            [entry] = outbox.list_entries(dead=False)
+            for due in outbox.due(now=entry['next_attempt_at']):
+                outbox.deliver(due, lambda index, chunk: mock_send("5581@s.whatsapp.net", chunk))
+
+        # Assert
+        assert saved_before_retry == 0
+        assert entry['sent'] == 1
+        assert [call.args[1] for call in mock_send.call_args_list] == [CHUNKS[0], CHUNKS[1], CHUNKS[1], CHUNKS[2]]
+        mock_conversation_manager.add_exchange.assert_called_once_with("5581_s_whatsapp_net", "1", "\n".join(CHUNKS))
+
+class TestOutboxAdmin:
+    def test_requires_admin_token(self, client):
+        """Test that the outbox endpoints are admin-only."""
+        # Arrange
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+
+            # Act
+            response = client.get('/admin/outbox', headers={'X-Admin-Token': 'wrong'})
+
+        # Assert
+        assert response.status_code == 403
+
+    def test_lists_and_retries_dead_letters(self, client, tmp_path):
+        """Test that a dead-lettered reply can be inspected and requeued for delivery."""
+        # Arrange
+        outbox = Outbox(str(tmp_path), max_attempts=1)
+        entry = outbox.enqueue("5581@s.whatsapp.net", CHUNKS)
+        outbox.deliver(entry, failing_at(0))
+        headers = {'X-Admin-Token': 'secret'}
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}), \
+             patch('script.outbox', outbox), \
+             patch('script.deliver_later') as mock_deliver_later:
+
+            # Act
+            listing = client.get('/admin/outbox', headers=headers)
+            detail = client.get(f"/admin/outbox/{entry['id']}", headers=headers)
+            retry = client.post(f"/admin/outbox/{entry['id']}/retry", headers=headers)
+            missing = client.post(f"/admin/outbox/{entry['id']}/retry", headers=headers)
+
+        # Assert
+        assert listing.status_code == 200
+        assert [item['id'] for item in listing.json['entries']] == [entry['id']]
+        assert detail.json['state'] == 'dead'
+        assert detail.json['last_error'] == "chunk 1/3 was not accepted"
+        assert retry.status_code == 202
+        assert retry.json['remaining_chunks'] == 3
+        mock_deliver_later.assert_called_once()
+        assert missing.status_code == 404
+        assert outbox.pending == 1
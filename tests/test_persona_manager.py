@@ -0,0 +1,226 @@
+"""
+test_persona_manager.py - Tests for persona hot reloading
+"""
+
+import json
+import os
+import pytest
+from unittest.mock import patch, MagicMock
+from message_splitter import split_message
+from persona_manager import PersonaManager, PersonaSnapshot, compile_keyword_matcher
+from script import (app, load_persona, build_few_shot_history, is_greeting,
+                    build_menu_chunks, get_cached_menu_chunks, get_chunking_config)
+
+def write_persona(path, name, greetings=None, responses=None):
+    persona = {
+        "name": name,
+        "description": f"I am {name}.",
+        "menu_enabled": True,
+        "welcome_message": f"Welcome to {name}",
+        "greeting_keywords": greetings or ["oi"],
+        "responses": responses or []
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(persona, f)
+
+@pytest.fixture
+def persona_path(tmp_path):
+    path = tmp_path / "persona.json"
+    write_persona(path, "Bot v1")
+    return str(path)
+
+class TestKeywordMatcher:
+    def test_matches_like_is_greeting(self):
+        """Test that the compiled matcher agrees with the plain keyword scan."""
+        # Arrange
+        keywords = ["Oi", "bom dia", "olá"]
+        matcher = compile_keyword_matcher(keywords)
+        
+        # Act & Assert
+        for text in ["oi", "  BOM DIA pessoal", "Olá!", "preço", "", "quero saber"]:
+            assert is_greeting(text, keywords, matcher=matcher) == is_greeting(text, keywords)
+    
+    def test_no_keywords(self):
+        """Test that an empty keyword list compiles to no matcher."""
+        assert compile_keyword_matcher([]) is None
+
+class TestPersonaManager:
+    def test_initial_load_builds_artifacts(self, persona_path):
+        """Test that derived artifacts are built with the first snapshot."""
+        # Arrange & Act
+        manager = PersonaManager(persona_path, load_persona, artifacts={
+            'welcome_upper': lambda persona: persona.menu_config['welcome_message'].upper()
+        })
+        
+        # Assert
+        assert manager.current.name == "Bot v1"
+        assert manager.current.artifact('welcome_upper') == "WELCOME TO BOT V1"
+        assert manager.current.version != 'default'
+
+    def test_version_matches_parsed_content(self, persona_path):
+        """Test that an edit landing between the hash and the parse can't pair one version with another's content."""
+        # Arrange
+        def load_then_edit(path, raw):
+            write_persona(path, "Bot v2")
+            return load_persona(path, raw)
+        with open(persona_path, 'rb') as f:
+            v1_version = PersonaManager._content_hash(f.read())
+
+        # Act
+        manager = PersonaManager(persona_path, load_then_edit)
+
+        # Assert
+        assert manager.current.name == "Bot v1"
+        assert manager.current.version == v1_version
+
+    def test_reload_swaps_snapshot(self, persona_path):
+        """Test that a content change publishes a new snapshot and notifies subscribers."""
+        # Arrange
+        manager = PersonaManager(persona_path, load_persona)
+        old_snapshot = manager.current
+        received = []
+        manager.subscribe(received.append)
+        
+        # Act
+        write_persona(persona_path, "Bot v2 with a longer name")
+        reloaded = manager.reload()
+        
+        # Assert
+        assert reloaded is True
+        assert manager.current.name == "Bot v2 with a longer name"
+        assert manager.current.version != old_snapshot.version
+        assert old_snapshot.name == "Bot v1"  # Old snapshot is untouched
+        assert received == [manager.current]
+    
+    def test_reload_without_change(self, persona_path):
+        """Test that touching the file without changing it does not rebuild."""
+        # Arrange
+        manager = PersonaManager(persona_path, load_persona)
+        snapshot = manager.current
+        
+        # Act
+        os.utime(persona_path, None)
+        os.utime(persona_path, (0, 0))
+        reloaded = manager.reload()
+        
+        # Assert
+        assert reloaded is False
+        assert manager.current is snapshot
+    
+    def test_reload_keeps_version_on_invalid_json(self, persona_path):
+        """Test that a half-written file doesn't replace the persona with the default."""
+        # Arrange
+        manager = PersonaManager(persona_path, load_persona)
+        
+        # Act
+        with open(persona_path, 'w') as f:
+            f.write('{"name": "Bot')
+        reloaded = manager.reload()
+        
+        # Assert
+        assert reloaded is False
+        assert manager.current.name == "Bot v1"
+    
+    def test_reload_keeps_version_when_file_is_missing(self, persona_path):
+        """Test that a persona file removed mid-replace doesn't swap in the default persona."""
+        # Arrange
+        manager = PersonaManager(persona_path, load_persona)
+        
+        # Act
+        os.remove(persona_path)
+        reloaded = manager.reload()
+        
+        # Assert
+        assert reloaded is False
+        assert manager.current.name == "Bot v1"
+    
+    def test_few_shot_history_artifact(self, persona_path):
+        """Test that the few-shot prefix is prebuilt for the Gemini client."""
+        # Arrange
+        write_persona(persona_path, "Bot", responses=[{"input": "oi", "output": "Olá!"}])
+        
+        # Act
+        manager = PersonaManager(persona_path, load_persona, artifacts={
+            'few_shot_history': lambda persona: tuple(build_few_shot_history(persona.few_shot_examples))
+        })
+        
+        # Assert
+        assert manager.current.artifact('few_shot_history') == (
+            {'role': 'user', 'parts': ["oi"]},
+            {'role': 'model', 'parts': ["Olá!"]}
+        )
+
+class TestMenuChunks:
+    @pytest.fixture
+    def menu_persona(self):
+        menu_config = {
+            "enabled": True,
+            "welcome_message": "Olá!\nEscolha uma opção:\n1 Endereço\n2 Orçamento",
+            "menu_options": {
+                "1": {"title": "Endereço", "response": "Rua A, 1\nSeg a Sex: 9h às 18h"},
+                "2": {"title": "Orçamento", "response": "Um consultor vai te chamar."}
+            },
+            "greeting_keywords": ["oi"]
+        }
+        persona = PersonaSnapshot("v1", "desc", "Bot", [], menu_config)
+        persona.artifacts['menu_chunks'] = build_menu_chunks(persona)
+        return persona
+    
+    def test_chunks_match_split_message(self, menu_persona):
+        """Test that pre-split chunks are identical to splitting on demand."""
+        # Arrange
+        _, max_lines, max_chars, _ = get_chunking_config()
+        
+        # Act
+        welcome = get_cached_menu_chunks(menu_persona)
+        option = get_cached_menu_chunks(menu_persona, "1")
+        
+        # Assert
+        assert welcome == split_message(menu_persona.menu_config['welcome_message'], max_lines, max_chars)
+        assert option == split_message("Rua A, 1\nSeg a Sex: 9h às 18h", max_lines, max_chars)
+        assert get_cached_menu_chunks(menu_persona, "9") is None
+    
+    def test_chunks_ignored_when_config_changes(self, menu_persona):
+        """Test that chunks built for another chunking config are not used."""
+        # Arrange & Act
+        with patch('script.CONFIG', {'MESSAGE_CHUNK_MAX_LINES': 1, 'MESSAGE_CHUNK_MAX_CHARS': 20}):
+            chunks = get_cached_menu_chunks(menu_persona)
+        
+        # Assert
+        assert chunks is None
+    
+    def test_webhook_menu_option_skips_splitting(self, menu_persona, mock_wasender_client):
+        """Test that a menu reply is sent from the pre-split chunks."""
+        # Arrange
+        manager = MagicMock()
+        manager.current = menu_persona
+        webhook_payload = {
+            "event": "messages.upsert",
+            "data": {
+                "messages": {
+                    "key": {"remoteJid": "1234567890@s.whatsapp.net", "fromMe": False, "id": "menu_id"},
+                    "message": {"conversation": "1"}
+                }
+            }
+        }
+        
+        with patch('script.persona_manager', manager), \
+             patch('script.wasender_client', mock_wasender_client), \
+             patch('script.split_message') as mock_split, \
+             patch('script.get_gemini_response') as mock_get_gemini, \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch('time.sleep'):
+            mock_conversation_manager.load.return_value = []
+            
+            # Act
+            with app.test_client() as client:
+                response = client.post('/webhook',
+                                       data=json.dumps(webhook_payload),
+                                       content_type='application/json')
+        
+        # Assert
+        assert response.status_code == 200
+        assert mock_split.call_count == 0
+        assert mock_get_gemini.call_count == 0
+        sent = [call.kwargs['text_body'] for call in mock_wasender_client.send_text.call_args_list]
+        assert sent == get_cached_menu_chunks(menu_persona, "1")
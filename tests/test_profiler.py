@@ -0,0 +1,179 @@
+"""
+test_profiler.py - Tests for the sampling profiler, its watchdog and /debug/profile
+"""
+
+import os
+import threading
+import time
+import pytest
+from unittest.mock import patch
+import profiler
+from profiler import StackSampler, ProfileWatchdog
+from script import app, CONFIG
+
+@pytest.fixture
+def client():
+    """Flask test client fixture."""
+    with app.test_client() as client:
+        yield client
+
+def spin_until(stop):
+    """Busy loop used as a CPU-bound workload."""
+    while not stop.is_set():
+        sum(range(1000))
+
+class TestStackSampler:
+    def test_collapsed_stacks_name_thread_and_frames(self):
+        """Test that collapsed output has 'thread;outer;inner count' lines."""
+        # Arrange
+        stop = threading.Event()
+        worker = threading.Thread(target=spin_until, args=(stop,), name="busy-worker")
+        worker.start()
+
+        # Act
+        try:
+            sampler = StackSampler(interval=0.005).run(0.2)
+        finally:
+            stop.set()
+            worker.join()
+
+        # Assert
+        lines = [line for line in sampler.collapsed('wall').splitlines() if line.startswith('busy-worker;')]
+        assert lines
+        stack, count = lines[0].rsplit(' ', 1)
+        assert 'spin_until (test_profiler.py:' in stack
+        assert int(count) >= 1
+        assert sampler.samples > 0
+
+    def test_cpu_view_drops_idle_threads(self):
+        """Test that a sleeping thread shows up in the wall view only."""
+        # Arrange
+        stop = threading.Event()
+        sleeper = threading.Thread(target=stop.wait, name="idle-worker")
+        spinner = threading.Thread(target=spin_until, args=(stop,), name="busy-worker")
+        sleeper.start()
+        spinner.start()
+
+        # Act
+        try:
+            sampler = StackSampler(interval=0.005).run(0.5)
+        finally:
+            stop.set()
+            sleeper.join()
+            spinner.join()
+
+        # Assert
+        wall, cpu = sampler.collapsed('wall'), sampler.collapsed('cpu')
+        assert 'idle-worker;' in wall
+        assert 'idle-worker;' not in cpu
+        assert 'busy-worker;' in cpu
+
+    def test_only_one_profile_at_a_time(self):
+        """Test that a second concurrent profile is refused."""
+        # Arrange
+        started = threading.Thread(target=profiler.profile, args=(0.3,))
+        started.start()
+        time.sleep(0.05)
+
+        # Act
+        second = profiler.profile(0.01)
+        started.join()
+
+        # Assert
+        assert second is None
+
+class TestProfileWatchdog:
+    def test_disabled_with_zero_threshold(self, tmp_path):
+        """Test that a zero threshold never captures."""
+        # Arrange
+        watchdog = ProfileWatchdog(0, output_dir=str(tmp_path), min_samples=1)
+
+        # Act
+        with patch.object(watchdog, '_capture') as capture:
+            for _ in range(5):
+                watchdog.observe(10.0)
+
+        # Assert
+        capture.assert_not_called()
+        assert watchdog.snapshot()['enabled'] is False
+
+    def test_captures_when_p99_exceeds_threshold(self, tmp_path):
+        """Test that slow requests trigger a capture written to disk, once per cooldown."""
+        # Arrange
+        watchdog = ProfileWatchdog(100, output_dir=str(tmp_path), seconds=0.05, cooldown=60, min_samples=5)
+
+        # Act
+        for _ in range(5):
+            watchdog.observe(0.01)
+        fast_captures = len(os.listdir(tmp_path))
+        for _ in range(10):
+            watchdog.observe(0.5)
+        deadline = time.monotonic() + 5
+        while watchdog.snapshot()['capturing'] or not watchdog.captures:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        # Assert
+        assert fast_captures == 0
+        assert len(watchdog.captures) == 1
+        files = sorted(os.listdir(tmp_path))
+        assert len(files) == 2
+        assert files[0].endswith('_cpu.folded') and files[1].endswith('_wall.folded')
+
+class TestProfileEndpoint:
+    def test_disabled_without_admin_token(self, client):
+        """Test that the profiler is unavailable when no ADMIN_TOKEN is configured."""
+        # Arrange & Act
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': ''}):
+            response = client.get('/debug/profile?seconds=0.1')
+
+        # Assert
+        assert response.status_code == 403
+
+    def test_rejects_wrong_token(self, client):
+        """Test that a wrong admin token is rejected."""
+        # Arrange & Act
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+            response = client.get('/debug/profile?seconds=0.1', headers={'X-Admin-Token': 'nope'})
+
+        # Assert
+        assert response.status_code == 403
+
+    def test_profile_runs_in_background_and_is_polled(self, client, tmp_path):
+        """Test that the capture returns a job id at once and the stacks are served once it finishes."""
+        # Arrange
+        headers = {'Authorization': 'Bearer secret'}
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}), \
+             patch('script.profile_jobs', profiler.ProfileJobs(str(tmp_path))):
+
+            # Act
+            started = client.get('/debug/profile?seconds=0.3&interval_ms=5', headers=headers)
+            job_id = started.get_json()['id']
+            running = client.get(f'/debug/profile/{job_id}', headers=headers)
+            for _ in range(100):
+                time.sleep(0.05)
+                finished = client.get(f'/debug/profile/{job_id}?format=json', headers=headers)
+                if finished.status_code != 202:
+                    break
+            unknown = client.get('/debug/profile/20260101-000000-1-0000abcd', headers=headers)
+
+        # Assert
+        assert started.status_code == 202
+        assert running.status_code == 202
+        assert finished.status_code == 200
+        data = finished.get_json()
+        assert data['samples'] > 0
+        assert set(data) >= {'wall', 'cpu'}
+        assert unknown.status_code == 404
+
+    def test_rejects_invalid_parameters(self, client):
+        """Test validation of seconds and view."""
+        # Arrange & Act
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+            too_long = client.get('/debug/profile?seconds=100000', headers={'X-Admin-Token': 'secret'})
+            bad_view = client.get('/debug/profile/20260101-000000-1-0000abcd?view=gpu',
+                                  headers={'X-Admin-Token': 'secret'})
+
+        # Assert
+        assert too_long.status_code == 400
+        assert bad_view.status_code == 400
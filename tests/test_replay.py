@@ -0,0 +1,104 @@
+"""
+test_replay.py - Tests for webhook traffic replay
+"""
+
+import gzip
+import json
+import time
+import pytest
+from loadtest.fake_wasender import FakeWaSender
+from loadtest.replay import extract_events, event_key, recipient_of, compare_runs, summarize, Replayer
+
+PAYLOAD = {'event': 'messages.upsert', 'data': {'messages': {
+    'key': {'remoteJid': '558199990001@s.whatsapp.net', 'fromMe': False, 'id': 'ABC123'},
+    'message': {'conversation': 'oi'}}}}
+
+@pytest.fixture
+def text_log(tmp_path):
+    path = tmp_path / "whatsapp_bot.log"
+    path.write_text(
+        f"2025-10-06 18:36:33,183 - INFO - whatsapp_bot.payload - Received webhook data: {PAYLOAD!r}\n"
+        "2025-10-06 18:36:33,200 - INFO - whatsapp_bot - === WEBHOOK CALLED ===\n"
+        f"2025-10-06 18:36:30,718 - INFO - whatsapp_bot - Received webhook data: {{'event': 'message.sent'}}\n",
+        encoding='utf-8')
+    return str(path)
+
+class TestExtractEvents:
+    def test_text_log_sorted_by_time(self, text_log):
+        """Test extracting payloads (a Python repr) from text log lines."""
+        # Arrange & Act
+        events = extract_events([text_log])
+
+        # Assert
+        assert [payload['event'] for _, payload in events] == ['message.sent', 'messages.upsert']
+        assert events[1][1] == PAYLOAD
+        assert events[1][0] - events[0][0] == pytest.approx(2.465)
+
+    def test_json_and_gzip_logs_with_event_filter(self, tmp_path):
+        """Test JSON-format, gzip-rotated logs and the event type filter."""
+        # Arrange
+        path = tmp_path / "whatsapp_bot.log.1.gz"
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            for event in ('message.sent', 'messages.upsert'):
+                f.write(json.dumps({'ts': '2025-10-06T18:36:33.183+00:00', 'level': 'INFO',
+                                    'message': f"Received webhook data: {dict(PAYLOAD, event=event)!r}"}) + "\n")
+
+        # Act
+        events = extract_events([str(path)], event_types=['messages.upsert'])
+
+        # Assert
+        assert len(events) == 1
+        assert events[0][1]['event'] == 'messages.upsert'
+
+    def test_keys_and_recipients(self):
+        """Test event identity and reply recipient derivation."""
+        # Arrange, Act & Assert
+        assert event_key(0, PAYLOAD) == 'messages.upsert:ABC123'
+        assert event_key(7, {'event': 'session.status'}) == 'session.status#7'
+        assert recipient_of(PAYLOAD) == '558199990001'
+        assert recipient_of({'event': 'session.status'}) is None
+
+class TestReplayer:
+    def test_replays_on_schedule_and_measures_replies(self):
+        """Test speed-compressed scheduling and reply latency attribution."""
+        # Arrange
+        wasender = FakeWaSender()
+        client = wasender.app.test_client()
+        replayer = Replayer('http://bot', wasender, speed=10)
+
+        def fake_post(record, payload):
+            record['posted_at'] = time.monotonic()
+            record['status'] = 200
+            record['webhook_ms'] = 1.0
+            client.post('/send-message', json={'to': recipient_of(payload), 'text': 'resposta'})
+        replayer._post = fake_post
+
+        # Act
+        started = time.monotonic()
+        records = replayer.replay([(0.0, PAYLOAD), (1.0, PAYLOAD)], drain=0)
+        elapsed = time.monotonic() - started
+
+        # Assert
+        assert 0.1 <= elapsed < 1.0
+        assert [record['offset_s'] for record in records] == [0.0, 0.1]
+        assert all(record['reply_ms'] is not None for record in records)
+        assert replayer.conversations(records) == {'558199990001': ['resposta', 'resposta']}
+
+class TestCompareRuns:
+    def test_reports_latency_change_and_divergence(self):
+        """Test latency deltas and each divergence reason."""
+        # Arrange
+        def run(status, conversations, reply_ms):
+            records = [{'key': 'a', 'status': status, 'webhook_ms': 10.0, 'reply_ms': reply_ms, 'lag_ms': 0.0},
+                       {'key': 'b', 'status': 200, 'webhook_ms': 10.0, 'reply_ms': reply_ms, 'lag_ms': 0.0}]
+            return {'records': records, 'conversations': conversations, 'summary': summarize(records)}
+        previous = run(200, {'1': ['x', 'y'], '2': ['x'], '3': ['x', 'y'], '4': ['z']}, 100.0)
+        current = run(500, {'1': ['x'], '2': ['w'], '3': ['y', 'x'], '4': ['z']}, 150.0)
+
+        # Act
+        comparison = compare_runs(current, previous)
+
+        # Assert
+        assert comparison['diverged'] == {'status': 1, 'reply_count': 1, 'reply_text': 1, 'reply_order': 1,
+                                          'missing': 0, 'new': 0}
+        assert comparison['latency']['reply_ms.p50']['change'] == 0.5
@@ -0,0 +1,40 @@
+"""
+test_run_benchmarks.py - Tests for the benchmark regression gate
+"""
+
+from types import SimpleNamespace
+from run_benchmarks import best_of_runs, compare, discover_suites
+
+class TestCompare:
+    def test_flags_cases_slower_than_tolerance(self):
+        """Test ok, regressed and new statuses."""
+        # Arrange
+        baseline = {'fast': 1.0, 'slow': 1.0}
+        results = {'fast': 1.2, 'slow': 1.3, 'added': 0.5}
+
+        # Act
+        rows = compare(results, baseline, tolerance=0.25)
+
+        # Assert
+        assert {name: status for name, _, _, status in rows} == {'fast': 'ok', 'slow': 'regressed', 'added': 'new'}
+
+    def test_best_of_runs_keeps_each_fastest_time(self):
+        """Test that repeated runs keep each case's minimum."""
+        # Arrange
+        runs = iter([{'a': 2.0, 'b': 1.0}, {'a': 1.0, 'b': 3.0}])
+        module = SimpleNamespace(run=lambda: next(runs))
+
+        # Act
+        results = best_of_runs(module, 2)
+
+        # Assert
+        assert results == {'a': 1.0, 'b': 1.0}
+
+    def test_discovers_suites_with_baselines(self):
+        """Test that only modules with run() and BASELINE_FILE are suites."""
+        # Arrange & Act
+        suites = discover_suites()
+
+        # Assert
+        assert {'hot_paths', 'message_splitter'} <= set(suites)
+        assert 'log_analytics' not in suites
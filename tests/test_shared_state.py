@@ -0,0 +1,98 @@
+"""
+test_shared_state.py - Tests for the memory-mapped tables shared between workers
+"""
+
+import multiprocessing
+import pytest
+from unittest.mock import MagicMock
+from shared_state import SharedTable, SharedCounters
+from admission import AdmissionController
+from notification_digest import NotificationDigest
+
+def count_in_child(path, increments):
+    table = SharedTable(path, slots=256)
+    for _ in range(increments):
+        table.incr('hits')
+
+class TestSharedTable:
+    def test_counters_are_atomic_across_processes(self, tmp_path):
+        """Test that concurrent increments from several processes are all counted."""
+        # Arrange
+        path = str(tmp_path / 'counters.tbl')
+        table = SharedTable(path, slots=256)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=count_in_child, args=(path, 500)) for _ in range(4)]
+
+        # Act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # Assert
+        assert [worker.exitcode for worker in workers] == [0, 0, 0, 0]
+        assert table.get('hits') == (2000.0,)
+
+    def test_full_probe_window_reuses_oldest_slot(self, tmp_path):
+        """Test that a full table evicts the least recently written key instead of failing."""
+        # Arrange
+        table = SharedTable(str(tmp_path / 'small.tbl'), slots=8, stripes=1, probe=8)
+        for i in range(8):
+            table.set(f"customer-{i}", (float(i),))
+
+        # Act
+        table.set("customer-8", (8.0,))
+
+        # Assert
+        assert table.used() == 8
+        assert table.get("customer-0") is None
+        assert table.get("customer-8") == (8.0,)
+        assert table.snapshot()['evictions'] == 1
+
+    def test_layout_mismatch_is_rejected(self, tmp_path):
+        """Test that reopening a table with a different layout raises instead of misreading it."""
+        # Arrange
+        path = str(tmp_path / 'buckets.tbl')
+        SharedTable(path, slots=256, fields=2).set("5581", (1.0, 2.0))
+
+        # Act / Assert
+        assert SharedTable(path, slots=256, fields=2).get("5581") == (1.0, 2.0)
+        with pytest.raises(ValueError):
+            SharedTable(path, slots=256, fields=1)
+
+class TestSharedAdmission:
+    def test_sender_budget_is_shared_between_workers(self, tmp_path):
+        """Test that two workers on one bucket table let a sender through only burst times in total."""
+        # Arrange
+        path = str(tmp_path / 'sender_buckets.tbl')
+        counters = SharedCounters(SharedTable(str(tmp_path / 'counters.tbl'), slots=64), prefix='admission.')
+        workers = [AdmissionController(sender_rate_per_min=1, sender_burst=3,
+                                       shared_buckets=SharedTable(path, slots=256, fields=2),
+                                       shared_counters=counters)
+                   for _ in range(2)]
+
+        # Act
+        results = [workers[i % 2].allow_sender("5581_s_whatsapp_net") for i in range(6)]
+
+        # Assert
+        assert results == [True, True, True, False, False, False]
+        assert workers[0].snapshot()['host'] == {'admitted': 3, 'throttled': 3}
+
+class TestSharedDedup:
+    def test_customer_announced_by_one_worker_is_suppressed_by_another(self, tmp_path):
+        """Test that the dedup index is visible to every digest sharing the table."""
+        # Arrange
+        path = str(tmp_path / 'notification_dedup.tbl')
+        first = NotificationDigest(MagicMock(return_value=True), dedup_table=SharedTable(path, slots=256))
+        second = NotificationDigest(MagicMock(return_value=True), dedup_table=SharedTable(path, slots=256))
+        first.add("5581@s.whatsapp.net", "Quero falar com um consultor")
+        first.flush()
+
+        # Act
+        queued = second.add("5581@s.whatsapp.net", "Alguém pode me ajudar?")
+        other = second.add("5582@s.whatsapp.net", "Oi")
+
+        # Assert
+        assert queued is False
+        assert other is True
+        assert second.stats['suppressed'] == 1
@@ -0,0 +1,196 @@
+"""
+test_tracing.py - Tests for request tracing and /debug/traces
+"""
+
+import json
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from tracing import Tracer, STATUS_ERROR
+from script import app, CONFIG, deliver_later
+
+ADMIN_HEADERS = {'X-Admin-Token': 'secret'}
+
+@pytest.fixture
+def tracer():
+    return Tracer(capacity=3)
+
+@pytest.fixture
+def client():
+    """Flask test client fixture."""
+    with app.test_client() as client:
+        yield client
+
+class TestTracer:
+    def test_spans_nest_under_the_current_span(self, tracer):
+        """Test parent/child relations between spans."""
+        # Arrange & Act
+        with tracer.trace('webhook', sender='5581'):
+            with tracer.span('route') as route:
+                with tracer.span('history_load') as load:
+                    pass
+        
+        # Assert
+        trace = tracer.recent()[0]
+        spans = {span['name']: span for span in trace['spans']}
+        assert set(spans) == {'webhook', 'route', 'history_load'}
+        assert spans['route']['parent_id'] == spans['webhook']['span_id']
+        assert load.parent_id == route.span_id
+        assert trace['attributes'] == {'sender': '5581'}
+    
+    def test_span_outside_trace_is_noop(self, tracer):
+        """Test that spans without a trace record nothing."""
+        # Arrange & Act
+        with tracer.span('orphan') as span:
+            pass
+        
+        # Assert
+        assert span is None
+        assert tracer.recent() == []
+    
+    def test_errors_mark_the_span(self, tracer):
+        """Test that an exception marks the span and the trace as failed."""
+        # Arrange & Act
+        with pytest.raises(RuntimeError):
+            with tracer.trace('webhook'):
+                with tracer.span('gemini'):
+                    raise RuntimeError("boom")
+        
+        # Assert
+        assert tracer.recent()[0]['status'] == STATUS_ERROR
+    
+    def test_bound_work_keeps_the_trace_open(self, tracer):
+        """Test that a trace finishes only after work handed to another thread has run."""
+        # Arrange
+        started = threading.Event()
+        proceed = threading.Event()
+        
+        def work():
+            started.set()
+            proceed.wait(5)
+            with tracer.span('gemini'):
+                pass
+        
+        # Act
+        with tracer.trace('webhook'):
+            worker = threading.Thread(target=tracer.bind(work))
+            worker.start()
+        started.wait(5)
+        finished_before = len(tracer.recent())
+        proceed.set()
+        worker.join(5)
+        
+        # Assert
+        assert finished_before == 0
+        names = [span['name'] for span in tracer.recent()[0]['spans']]
+        assert names == ['webhook', 'gemini']
+    
+    def test_background_delivery_stays_in_the_turn_trace(self, tracer):
+        """Test that chunk sends handed to the outbox lane are recorded in the turn's trace."""
+        # Arrange
+        sent = threading.Event()
+
+        def deliver(entry):
+            with tracer.span('send'):
+                sent.set()
+
+        with patch('script.tracer', tracer), \
+             patch('script.outbox_lane', None), \
+             patch('script.deliver_tracked', side_effect=deliver):
+
+            # Act
+            with tracer.trace('webhook'):
+                deliver_later({'recipient': '5581@s.whatsapp.net', 'meta': {}})
+            sent.wait(5)
+            for _ in range(100):
+                if tracer.recent():
+                    break
+                time.sleep(0.01)
+
+        # Assert
+        names = [span['name'] for span in tracer.recent()[0]['spans']]
+        assert names == ['webhook', 'send']
+    
+    def test_ring_buffer_and_filters(self, tracer):
+        """Test capacity and the sender/duration filters."""
+        # Arrange & Act
+        for sender in ('a', 'b', 'c', 'd'):
+            with tracer.trace('webhook', sender=sender):
+                pass
+        
+        # Assert
+        assert [trace['attributes']['sender'] for trace in tracer.recent()] == ['d', 'c', 'b']
+        assert [trace['attributes']['sender'] for trace in tracer.recent(sender='c')] == ['c']
+        assert tracer.recent(min_duration_ms=60000) == []
+        assert len(tracer.recent(limit=1)) == 1
+    
+    def test_otlp_export(self, tmp_path):
+        """Test that finished traces are appended to the export file as OTLP/JSON."""
+        # Arrange
+        path = tmp_path / "traces.jsonl"
+        tracer = Tracer(export_path=str(path))
+        
+        # Act
+        with tracer.trace('webhook', sender='5581', messages=2):
+            with tracer.span('send', chunk=1):
+                pass
+        
+        # Assert
+        request = json.loads(path.read_text().splitlines()[0])
+        spans = request['resourceSpans'][0]['scopeSpans'][0]['spans']
+        assert [span['name'] for span in spans] == ['webhook', 'send']
+        assert len(spans[0]['traceId']) == 32 and len(spans[0]['spanId']) == 16
+        assert spans[1]['parentSpanId'] == spans[0]['spanId']
+        assert {'key': 'messages', 'value': {'intValue': '2'}} in spans[0]['attributes']
+        assert int(spans[1]['endTimeUnixNano']) >= int(spans[1]['startTimeUnixNano'])
+
+class TestDebugTracesEndpoint:
+    def test_webhook_trace_covers_the_pipeline(self, client, mock_wasender_client):
+        """Test that a processed message shows up with its pipeline spans."""
+        # Arrange
+        payload = {
+            "event": "messages.upsert",
+            "data": {"messages": {
+                "key": {"remoteJid": "5581777@s.whatsapp.net", "fromMe": False, "id": "trace_test"},
+                "message": {"conversation": "qual o preço das lentes?"}
+            }}
+        }
+        with patch('script.wasender_client', mock_wasender_client), \
+             patch('script.get_gemini_response', return_value="As lentes custam a partir de R$ 200."), \
+             patch('script.conversation_manager') as mock_conversation_manager, \
+             patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+            mock_conversation_manager.load.return_value = []
+            
+            # Act
+            client.post('/webhook', data=json.dumps(payload), content_type='application/json')
+            response = client.get('/debug/traces?sender=5581777', headers=ADMIN_HEADERS)
+        
+        # Assert
+        assert response.status_code == 200
+        trace = response.get_json()['traces'][0]
+        names = [span['name'] for span in trace['spans']]
+        for name in ('webhook', 'admission', 'route', 'history_load', 'gemini', 'split', 'send', 'history_save'):
+            assert name in names
+    
+    def test_invalid_filter(self, client):
+        """Test that a non-numeric filter is rejected."""
+        # Arrange & Act
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+            response = client.get('/debug/traces?min_ms=slow', headers=ADMIN_HEADERS)
+        
+        # Assert
+        assert response.status_code == 400
+
+    def test_requires_admin_token(self, client):
+        """Test that traces, which carry customer numbers, are admin-only."""
+        # Arrange
+        with patch.dict(CONFIG, {'ADMIN_TOKEN': 'secret'}):
+
+            # Act
+            without_token = client.get('/debug/traces')
+            wrong_token = client.get('/debug/traces', headers={'X-Admin-Token': 'wrong'})
+
+        # Assert
+        assert without_token.status_code == 403
+        assert wrong_token.status_code == 403
@@ -0,0 +1,66 @@
+"""
+test_user_locks.py - Tests for the per-user advisory locks shared between processes
+"""
+
+import multiprocessing
+import time
+from user_locks import UserLocks
+
+def hold_lock(path, key, locked, release):
+    locks = UserLocks(path)
+    with locks.locked(key):
+        locked.set()
+        release.wait(10)
+
+class TestUserLocks:
+    def test_lock_held_by_another_process_times_out(self, tmp_path):
+        """Test that a waiter gives up after the timeout and the timeout is counted."""
+        # Arrange
+        path = str(tmp_path / '.locks')
+        context = multiprocessing.get_context('fork')
+        locked, release = context.Event(), context.Event()
+        holder = context.Process(target=hold_lock, args=(path, "5581_s_whatsapp_net", locked, release))
+        holder.start()
+        locked.wait(10)
+        locks = UserLocks(path, timeout=0.2)
+
+        # Act
+        try:
+            started = time.monotonic()
+            with locks.locked("5581_s_whatsapp_net") as held:
+                waited = time.monotonic() - started
+            with locks.locked("5582_s_whatsapp_net") as other_held:
+                pass
+        finally:
+            release.set()
+            holder.join()
+
+        # Assert
+        assert held is False
+        assert 0.2 <= waited < 1.0
+        assert other_held is True
+        assert locks.snapshot()['timeouts'] == 1
+        assert locks.snapshot()['acquired'] == 1
+
+    def test_lock_is_acquired_once_the_holder_releases(self, tmp_path):
+        """Test that a waiter gets the lock as soon as the other process lets go, and counts the contention."""
+        # Arrange
+        path = str(tmp_path / '.locks')
+        context = multiprocessing.get_context('fork')
+        locked, release = context.Event(), context.Event()
+        holder = context.Process(target=hold_lock, args=(path, "5581_s_whatsapp_net", locked, release))
+        holder.start()
+        locked.wait(10)
+        locks = UserLocks(path, timeout=5.0)
+
+        # Act
+        context.Process(target=lambda: (time.sleep(0.1), release.set())).start()
+        with locks.locked("5581_s_whatsapp_net") as held:
+            pass
+        holder.join()
+
+        # Assert
+        assert held is True
+        snapshot = locks.snapshot()
+        assert snapshot['contended'] == 1
+        assert 0.05 < snapshot['max_wait_seconds'] < 2.0
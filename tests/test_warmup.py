@@ -0,0 +1,127 @@
+"""
+test_warmup.py - Tests for the warm-up stage and the liveness/readiness probes
+"""
+
+import pytest
+from unittest.mock import patch, MagicMock
+from warmup import WarmUp
+from script import app
+
+@pytest.fixture
+def client():
+    """Create a test client for the Flask app."""
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+class TestWarmUp:
+    def test_runs_steps_in_order_and_becomes_ready(self):
+        """Test that steps run in registration order and readiness follows the run."""
+        # Arrange
+        warmup = WarmUp()
+        calls = []
+        warmup.step('first')(lambda: calls.append('first'))
+        warmup.step('second')(lambda: calls.append('second') or 3)
+        ready_before = warmup.ready
+
+        # Act
+        warmup.run()
+
+        # Assert
+        assert ready_before is False
+        assert warmup.ready is True
+        assert calls == ['first', 'second']
+        snapshot = warmup.snapshot()
+        assert snapshot['state'] == 'done'
+        assert [step['step'] for step in snapshot['steps']] == ['first', 'second']
+        assert snapshot['steps'][1]['detail'] == 3
+
+    def test_failed_step_is_recorded_without_blocking_readiness(self):
+        """Test that an exception in one step is reported and the next steps still run."""
+        # Arrange
+        warmup = WarmUp()
+        later = MagicMock(return_value=None)
+        warmup.step('broken')(MagicMock(side_effect=RuntimeError("no network")))
+        warmup.step('later')(later)
+
+        # Act
+        warmup.start()
+        finished = warmup.wait(timeout=5)
+
+        # Assert
+        assert finished is True
+        later.assert_called_once()
+        broken = warmup.snapshot()['steps'][0]
+        assert broken['status'] == 'error'
+        assert broken['error'] == "no network"
+
+    def test_disabled_is_ready_immediately(self):
+        """Test that a disabled warm-up never runs its steps."""
+        # Arrange
+        warmup = WarmUp(enabled=False)
+        step = MagicMock()
+        warmup.step('never')(step)
+
+        # Act
+        started = warmup.start()
+
+        # Assert
+        assert started is False
+        assert warmup.ready is True
+        step.assert_not_called()
+
+class TestHealthProbes:
+    def test_readiness_follows_warmup(self, client):
+        """Test that /health/ready is 503 while warming up and 200 afterwards, while /health/live is always 200."""
+        # Arrange
+        warmup = WarmUp()
+        with patch('script.warmup', warmup), patch.object(warmup, 'start'):
+
+            # Act
+            cold = client.get('/health/ready')
+            live = client.get('/health/live')
+            warmup.run()
+            warm = client.get('/health/ready')
+
+        # Assert
+        assert cold.status_code == 503
+        assert cold.json['status'] == 'warming_up'
+        assert live.status_code == 200
+        assert warm.status_code == 200
+        assert warm.json['warmup']['state'] == 'done'
+
+    def test_first_request_starts_warmup(self, client):
+        """Test that the serving process starts its warm-up on its first request."""
+        # Arrange
+        warmup = WarmUp()
+        with patch('script.warmup', warmup), patch.object(warmup, 'start') as mock_start:
+
+            # Act
+            client.get('/health/live')
+
+        # Assert
+        mock_start.assert_called_once()
+
+    def test_warmup_steps_build_clients_and_preload(self):
+        """Test the bot's warm-up steps against mocked clients."""
+        # Arrange
+        import script
+        mock_gemini = MagicMock()
+        mock_manager = MagicMock(cache_size=8)
+        mock_manager.recent_user_ids.return_value = ['5581']
+        mock_manager.preload.return_value = 1
+        with patch('script.gemini_client', mock_gemini), \
+             patch('script.conversation_manager', mock_manager), \
+             patch('script.wasender_client', MagicMock()), \
+             patch('script.CONFIG', dict(script.CONFIG, WARMUP_GEMINI_PROBE=False)):
+
+            # Act
+            script.warm_gemini_model()
+            preloaded = script.warm_conversations()
+            probe = script.warm_gemini_probe()
+
+        # Assert
+        mock_gemini.get_model.assert_called_once_with()
+        mock_manager.preload.assert_called_once_with(['5581'])
+        assert preloaded == 1
+        assert probe == 'skipped'
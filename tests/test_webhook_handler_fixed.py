@@ -181,6 +181,23 @@ class TestFlaskRoutes:
             assert response.json['gemini_client'] is False
             assert 'issues' in response.json
     
+    def test_missing_wasender_token_is_degraded(self, client):
+        """Test that the lazy WaSender client counts as missing when no token is configured."""
+        # Arrange
+        with patch.dict('script.CONFIG', {'WASENDER_API_TOKEN': '', 'GEMINI_API_KEY': 'test_key'}):
+
+            # Act
+            health = client.get('/health')
+            services = client.get('/status').json['services']
+            webhook_response = client.post('/webhook', data=json.dumps({'event': 'messages.upsert'}),
+                                           content_type='application/json')
+
+            # Assert
+            assert health.status_code == 503
+            assert health.json['wasender_client'] is False
+            assert services['wasender'] is False
+            assert webhook_response.status_code == 500
+
     def test_status_endpoint(self, client):
         """Test status endpoint."""
         # Arrange
@@ -0,0 +1,299 @@
+"""
+tracing.py - Lightweight request tracing with an in-memory ring buffer
+
+Each inbound message gets a trace; spans record where its time went
+(admission, routing, history I/O, Gemini, splitting, each send, pacing,
+history save). Finished traces are kept in a bounded ring buffer for
+/debug/traces and can also be appended to a file in the OTLP/JSON format
+(one ExportTraceServiceRequest per line, as written by the OpenTelemetry
+collector's file exporter).
+
+The current trace and span live in context variables, so span() is a no-op
+outside a trace. Work handed to another thread must be wrapped with
+Tracer.bind() to keep its spans in the same trace; the trace is only
+finished once every bound callable has run.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger("whatsapp_bot")
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """One timed operation inside a trace."""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'attributes', 'start_ns', 'end_ns', 'status', '_started')
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+
+    def end(self):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._started)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class Trace:
+    """All spans recorded for one inbound message."""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = _new_id(128)
+        self.root = Span(name, attributes=attributes)
+        self.spans = [self.root]
+        self._pending = 1
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.root.name
+
+    @property
+    def attributes(self):
+        return self.root.attributes
+
+    @property
+    def duration_ms(self):
+        end_ns = max((span.end_ns or span.start_ns) for span in self.spans)
+        return (end_ns - self.root.start_ns) / 1e6
+
+    def set_attribute(self, key, value):
+        self.root.set_attribute(key, value)
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def hold(self):
+        with self._lock:
+            self._pending += 1
+
+    def release(self):
+        """Returns True when the last holder released the trace."""
+        with self._lock:
+            self._pending -= 1
+            return self._pending == 0
+
+    def to_dict(self):
+        """Summary used by /debug/traces."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start_ns)
+        start_ns = self.root.start_ns
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'attributes': dict(self.attributes),
+            'start': datetime.fromtimestamp(start_ns / 1e9, timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(self.duration_ms, 3),
+            'status': STATUS_ERROR if any(span.status == STATUS_ERROR for span in spans) else STATUS_OK,
+            'spans': [{
+                'name': span.name,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'offset_ms': round((span.start_ns - start_ns) / 1e6, 3),
+                'duration_ms': round(((span.end_ns or span.start_ns) - span.start_ns) / 1e6, 3),
+                'status': span.status,
+                'attributes': dict(span.attributes),
+            } for span in spans],
+        }
+
+    def to_otlp(self, service_name):
+        """Return the trace as an OTLP/JSON ExportTraceServiceRequest."""
+        def attributes(values):
+            encoded = []
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    encoded_value = {'boolValue': value}
+                elif isinstance(value, int):
+                    encoded_value = {'intValue': str(value)}
+                elif isinstance(value, float):
+                    encoded_value = {'doubleValue': value}
+                else:
+                    encoded_value = {'stringValue': str(value)}
+                encoded.append({'key': key, 'value': encoded_value})
+            return encoded
+
+        with self._lock:
+            spans = list(self.spans)
+        return {'resourceSpans': [{
+            'resource': {'attributes': attributes({'service.name': service_name})},
+            'scopeSpans': [{
+                'scope': {'name': 'whatsapp_bot.tracing'},
+                'spans': [{
+                    'traceId': self.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 2 if span is self.root else 1,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                    'attributes': attributes(span.attributes),
+                    'status': {'code': 2 if span.status == STATUS_ERROR else 1},
+                } for span in spans],
+            }],
+        }]}
+
+
+class Tracer:
+    """Creates traces and keeps the most recent finished ones."""
+
+    def __init__(self, capacity=200, export_path=None, service_name='whatsapp_bot', enabled=True):
+        """
+        Initialize the tracer.
+
+        Args:
+            capacity: Number of finished traces kept in memory
+            export_path: Optional file to append finished traces to (OTLP/JSON lines)
+            service_name: service.name resource attribute in exported traces
+            enabled: When False, trace() and span() do nothing
+        """
+        self.enabled = enabled
+        self.export_path = export_path
+        self.service_name = service_name
+        self._finished = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def current(self):
+        """Return the trace of the calling context (or None)."""
+        return _current_trace.get()
+
+    def annotate(self, **attributes):
+        """Set attributes on the current trace (no-op outside a trace)."""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.root.attributes.update(attributes)
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """Start a new trace whose root span covers the with-block."""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(name, attributes)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(trace.root)
+        try:
+            yield trace
+        except BaseException:
+            trace.root.status = STATUS_ERROR
+            raise
+        finally:
+            trace.root.end()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._release(trace)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Record a child span of the current span (no-op outside a trace)."""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+        parent = _current_span.get()
+        span = Span(name, parent.span_id if parent else trace.root.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException:
+            span.status = STATUS_ERROR
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            trace.add_span(span)
+
+    def bind(self, fn):
+        """
+        Wrap fn so it runs inside the current trace, from any thread.
+
+        The trace is held open until the wrapper has run.
+        """
+        trace = _current_trace.get()
+        if trace is None:
+            return fn
+        parent = _current_span.get()
+        trace.hold()
+
+        def traced(*args, **kwargs):
+            trace_token = _current_trace.set(trace)
+            span_token = _current_span.set(parent)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _current_span.reset(span_token)
+                _current_trace.reset(trace_token)
+                self._release(trace)
+        return traced
+
+    def _release(self, trace):
+        if not trace.release():
+            return
+        with self._lock:
+            self._finished.append(trace)
+        if self.export_path:
+            self._export(trace)
+
+    def _export(self, trace):
+        line = (json.dumps(trace.to_otlp(self.service_name), ensure_ascii=False) + '\n').encode('utf-8')
+        try:
+            with self._export_lock:
+                fd = os.open(self.export_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            logger.error(f"Error exporting trace {trace.trace_id}: {e}")
+
+    def recent(self, sender=None, min_duration_ms=None, limit=50):
+        """
+        Return finished traces, newest first.
+
+        Args:
+            sender: Only traces whose 'sender' attribute contains this value
+            min_duration_ms: Only traces at least this slow
+            limit: Maximum number of traces returned
+
+        Returns:
+            List of trace dicts (see Trace.to_dict)
+        """
+        with self._lock:
+            traces = list(self._finished)
+        results = []
+        for trace in reversed(traces):
+            if sender and sender not in str(trace.attributes.get('sender', '')):
+                continue
+            if min_duration_ms is not None and trace.duration_ms < min_duration_ms:
+                continue
+            results.append(trace.to_dict())
+            if len(results) >= limit:
+                break
+        return results
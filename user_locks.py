@@ -0,0 +1,122 @@
+"""
+user_locks.py - Per-user advisory locks shared by every process using a directory
+
+A conversation update is a read-modify-write of the user's history file;
+two workers (or two nodes on shared storage) answering the same customer at
+once would otherwise both read the old history and the last save would
+drop the other's exchange.
+
+Locks are fcntl range locks on single bytes of one lock file, one byte per
+stripe of a hash of the key, each paired with a thread lock for the threads
+of one process. The kernel releases a dead process's locks, so a crashed
+worker never leaves a user locked. Waiting is bounded: after the timeout
+the caller carries on without the lock, and the timeout is counted.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("whatsapp_bot")
+
+
+class UserLocks:
+    """Striped host-wide (or shared-storage-wide) locks keyed by user id."""
+
+    def __init__(self, path, stripes=4096, timeout=5.0):
+        """
+        Args:
+            path: Lock file; every process locking through the same path excludes the others.
+                Use one instance per process: fcntl locks don't exclude each other within a process.
+            stripes: Number of lock bytes; users hashing to the same stripe share a lock
+            timeout: Maximum seconds to wait for a lock
+        """
+        self.path = path
+        self.stripes = stripes
+        self.timeout = timeout
+        self._fd = None
+        self._open_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'acquired': 0, 'contended': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        self._reset_locks()
+        # Thread locks held by other threads at fork time would never be released in the child
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+
+    def _file(self):
+        # Opened on first use: the directory may not exist yet when the owner is created
+        with self._open_lock:
+            if self._fd is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            return self._fd
+
+    def stripe(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') % self.stripes
+
+    def _acquire_file_lock(self, offset, deadline):
+        """Poll for the byte lock with a short backoff; fcntl itself has no timeout."""
+        fd = self._file()
+        pause = 0.001
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+                return True
+            except OSError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(pause, remaining))
+                pause = min(pause * 2, 0.05)
+
+    @contextmanager
+    def locked(self, key):
+        """
+        Hold key's lock for the duration of the block.
+
+        Yields:
+            True if the lock is held, False if the wait timed out (the block
+            still runs, unprotected)
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        stripe = self.stripe(key)
+        thread_lock = self._locks[stripe]
+        held_thread = thread_lock.acquire(timeout=self.timeout)
+        held = False
+        if held_thread:
+            try:
+                held = self._acquire_file_lock(stripe, deadline)
+            except OSError as e:
+                logger.error(f"Cannot use lock file {self.path}: {e}")
+        waited = time.monotonic() - started
+        self._record(held, waited)
+        if not held:
+            logger.warning(f"Gave up waiting for the lock on {key} after {waited:.1f}s; continuing without it")
+        try:
+            yield held
+        finally:
+            if held:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+            if held_thread:
+                thread_lock.release()
+
+    def _record(self, acquired, waited):
+        with self._stats_lock:
+            self.stats['acquired' if acquired else 'timeouts'] += 1
+            # Anything beyond an uncontended acquire (a few microseconds) means we queued behind a holder
+            if waited > 0.001:
+                self.stats['contended'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+
+    def snapshot(self):
+        """Lock counters, for /status."""
+        with self._stats_lock:
+            return dict(self.stats, path=self.path, timeout=self.timeout)
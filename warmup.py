@@ -0,0 +1,120 @@
+"""
+warmup.py - Per-process warm-up stage gating readiness
+
+A worker runs its warm-up steps (client construction, model construction,
+cache preloading, ...) in a background thread after it starts. Until every
+step has been attempted the worker is live but not ready, so a load balancer
+probing the readiness endpoint only routes customers to warm workers.
+
+A failing step is recorded and logged but does not keep the worker out of
+rotation: it would only serve cold, not fail.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("whatsapp_bot")
+
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_DISABLED = 'disabled'
+
+
+class WarmUp:
+    """Ordered warm-up steps with a readiness flag."""
+
+    def __init__(self, enabled=True):
+        """
+        Args:
+            enabled: When False the process is ready immediately and no step runs
+        """
+        self.enabled = enabled
+        self._steps = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def step(self, name):
+        """
+        Decorator registering func as the next warm-up step.
+
+        The step's return value is reported as its detail (e.g. a count).
+        """
+        def decorator(func):
+            self._steps.append((name, func))
+            return func
+        return decorator
+
+    def reset(self):
+        """Forget any previous run (a forked worker warms itself up again)."""
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._state = STATE_PENDING if self.enabled else STATE_DISABLED
+        self._results = []
+        self._started_at = None
+        self._finished_at = None
+        if not self.enabled:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def pending(self):
+        return self._state == STATE_PENDING
+
+    def wait(self, timeout=None):
+        """Block until ready; returns False on timeout."""
+        return self._ready.wait(timeout)
+
+    def start(self):
+        """
+        Run the steps in a daemon thread unless a run already started.
+
+        Returns:
+            True if this call started the run
+        """
+        with self._lock:
+            if self._state != STATE_PENDING:
+                return False
+            self._state = STATE_RUNNING
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        return True
+
+    def run(self):
+        """Run the steps in the calling thread (no-op if a run already started)."""
+        with self._lock:
+            if self._state != STATE_PENDING:
+                return
+            self._state = STATE_RUNNING
+        self._run()
+
+    def _run(self):
+        self._started_at = time.time()
+        for name, func in self._steps:
+            started = time.monotonic()
+            try:
+                detail = func()
+                result = {'step': name, 'status': 'ok', 'ms': round((time.monotonic() - started) * 1000, 1)}
+                if detail is not None:
+                    result['detail'] = detail
+            except Exception as e:
+                result = {'step': name, 'status': 'error', 'ms': round((time.monotonic() - started) * 1000, 1),
+                          'error': str(e)}
+                logger.warning(f"Warm-up step '{name}' failed: {e}")
+            self._results.append(result)
+        self._finished_at = time.time()
+        self._state = STATE_DONE
+        self._ready.set()
+        failed = sum(1 for result in self._results if result['status'] != 'ok')
+        logger.info(f"Warm-up finished in {(self._finished_at - self._started_at) * 1000:.0f} ms "
+                    f"({len(self._results)} steps, {failed} failed)")
+
+    def snapshot(self):
+        """State, duration and per-step results, for the health endpoints."""
+        snapshot = {'state': self._state, 'ready': self.ready, 'steps': list(self._results)}
+        if self._started_at and self._finished_at:
+            snapshot['duration_ms'] = round((self._finished_at - self._started_at) * 1000, 1)
+        return snapshot